@@ -0,0 +1,53 @@
+"""Spatial index (SQLite R*Tree) over waypoints and legs
+
+Revision ID: 3c8e51d0a7b4
+Revises: efe2d973dc62
+Create Date: 2026-10-19 09:12:40.118224
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e51d0a7b4'
+down_revision = 'efe2d973dc62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # R*Tree virtual tables only exist on SQLite; other databases use plain
+    # range queries (see src/afpd/utils/spatial_index.py)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS waypoint_rtree USING rtree("
+        "id, min_lat, max_lat, min_lon, max_lon, +procedure_id INTEGER)"
+    )
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS leg_rtree USING rtree("
+        "id, min_lat, max_lat, min_lon, max_lon, +procedure_id INTEGER, "
+        "+lat1 REAL, +lon1 REAL, +lat2 REAL, +lon2 REAL)"
+    )
+    op.execute(
+        "INSERT INTO waypoint_rtree (id, min_lat, max_lat, min_lon, max_lon, procedure_id) "
+        "SELECT id, latitude, latitude, longitude, longitude, procedure_id FROM waypoints"
+    )
+    op.execute(
+        "INSERT INTO leg_rtree (id, min_lat, max_lat, min_lon, max_lon, procedure_id, lat1, lon1, lat2, lon2) "
+        "SELECT id, min(lat1, lat2), max(lat1, lat2), min(lon1, lon2), max(lon1, lon2), "
+        "procedure_id, lat1, lon1, lat2, lon2 FROM ("
+        "  SELECT id, procedure_id, latitude AS lat1, longitude AS lon1,"
+        "         lead(latitude) OVER w AS lat2, lead(longitude) OVER w AS lon2"
+        "  FROM waypoints WINDOW w AS (PARTITION BY procedure_id ORDER BY sequence, id)"
+        ") WHERE lat2 IS NOT NULL"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE IF EXISTS leg_rtree")
+    op.execute("DROP TABLE IF EXISTS waypoint_rtree")
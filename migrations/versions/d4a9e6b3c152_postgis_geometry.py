@@ -0,0 +1,57 @@
+"""PostGIS waypoint geometry column and leg table with GiST indexes
+
+Revision ID: d4a9e6b3c152
+Revises: b71e4c2a9f58
+Create Date: 2026-10-19 17:20:11.604538
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a9e6b3c152'
+down_revision = 'b71e4c2a9f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL only; SQLite uses the R*Tree tables (see
+    # src/afpd/utils/spatial_index.py). Creating the extension needs a
+    # role allowed to do so, or a database where it already exists.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+    op.execute(
+        "ALTER TABLE waypoints ADD COLUMN IF NOT EXISTS geom geometry(Point, 4326) "
+        "GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)) STORED"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_waypoints_geom ON waypoints USING gist (geom)")
+    op.execute(
+        "CREATE TABLE IF NOT EXISTS leg_geoms ("
+        "id INTEGER PRIMARY KEY, procedure_id INTEGER NOT NULL, "
+        "lat1 DOUBLE PRECISION NOT NULL, lon1 DOUBLE PRECISION NOT NULL, "
+        "lat2 DOUBLE PRECISION NOT NULL, lon2 DOUBLE PRECISION NOT NULL, "
+        "geom geometry(LineString, 4326) NOT NULL)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_leg_geoms_geom ON leg_geoms USING gist (geom)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_leg_geoms_procedure_id ON leg_geoms (procedure_id)")
+    op.execute(
+        "INSERT INTO leg_geoms (id, procedure_id, lat1, lon1, lat2, lon2, geom) "
+        "SELECT id, procedure_id, lat1, lon1, lat2, lon2, "
+        "ST_SetSRID(ST_MakeLine(ST_MakePoint(lon1, lat1), ST_MakePoint(lon2, lat2)), 4326) FROM ("
+        "  SELECT id, procedure_id, latitude AS lat1, longitude AS lon1,"
+        "         lead(latitude) OVER w AS lat2, lead(longitude) OVER w AS lon2"
+        "  FROM waypoints WINDOW w AS (PARTITION BY procedure_id ORDER BY sequence, id)"
+        ") legs WHERE lat2 IS NOT NULL"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("DROP TABLE IF EXISTS leg_geoms")
+    op.execute("DROP INDEX IF EXISTS ix_waypoints_geom")
+    op.execute("ALTER TABLE waypoints DROP COLUMN IF EXISTS geom")
@@ -15,14 +15,40 @@ login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
-def create_app():
-    """Initialize the core application."""
+def create_app(config=None):
+    """Initialize the core application.
+
+    ``config`` is an optional mapping applied on top of the environment
+    defaults, used by the benchmark harness and other embedded apps.
+    """
     app = Flask(__name__)
     
     # Configuration
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///flight_procedures.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PRELOAD_SHARED_DATA'] = os.getenv('AFPD_PRELOAD', '').lower() in ('1', 'true', 'yes')
+    app.config['MONTE_CARLO_WORKERS'] = int(os.getenv('AFPD_MONTE_CARLO_WORKERS', '0'))
+    # Threads of the ASGI app (``asgi.py``) for database queries and Flask views
+    app.config['ASGI_THREADS'] = int(os.getenv('AFPD_ASGI_THREADS', '8'))
+    if config:
+        app.config.update(config)
+    
+    # SQLAlchemy needs the ``postgresql`` scheme; hosting providers often
+    # hand out ``postgres://`` URLs
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('postgres://'):
+        app.config['SQLALCHEMY_DATABASE_URI'] = uri = 'postgresql://' + uri[len('postgres://'):]
+    # Connection pool of each worker process for server databases; SQLite
+    # keeps SQLAlchemy's defaults
+    if not uri.startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': int(os.getenv('AFPD_DB_POOL_SIZE', '5')),
+            'max_overflow': int(os.getenv('AFPD_DB_MAX_OVERFLOW', '10')),
+            'pool_timeout': float(os.getenv('AFPD_DB_POOL_TIMEOUT', '10')),  # seconds
+            'pool_recycle': int(os.getenv('AFPD_DB_POOL_RECYCLE', '1800')),  # seconds
+            'pool_pre_ping': True
+        })
     
     # Initialize plugins
     db.init_app(app)
@@ -34,6 +60,16 @@ def create_app():
         from .core import routes as core_routes
         from .api import routes as api_routes
         from .auth import routes as auth_routes
+        from .tiles import routes as tile_routes
+        from .cli import afpd_cli
+        from .utils import metrics
+        from .utils.profiler import profiler
+        from .utils.route_optimizer import grid_cache
+        from .utils.analysis import services
+        from .utils.admission import admission
+        from .utils.request_log import request_log
+        from .utils.terrain_tiles import terrain_tiles
+        from .utils.procedure_tiles import procedure_tiles
         from .models.user import User
         
         @login_manager.user_loader
@@ -44,5 +80,38 @@ def create_app():
         app.register_blueprint(core_routes.bp)
         app.register_blueprint(api_routes.bp, url_prefix='/api')
         app.register_blueprint(auth_routes.bp, url_prefix='/auth')
+        app.register_blueprint(tile_routes.bp, url_prefix='/tiles')
+        
+        # Request timing, Server-Timing headers and /metrics
+        metrics.init_app(app)
+        
+        # Optional JSON lines log of requests, for load test replays
+        request_log.init_app(app)
+        
+        # Opt-in per-request sampling profiler
+        profiler.init_app(app)
+        
+        # On-disk cache of route search cost grids
+        grid_cache.init_app(app)
+        
+        # Terrain analyzer and ICAO validator, configured from app.config
+        services.init_app(app)
+        
+        # Concurrency limit and priority queue of the analysis endpoints
+        admission.init_app(app)
+        
+        # Hillshade / elevation tint map tiles and their on-disk cache
+        terrain_tiles.init_app(app)
+        
+        # Vector tiles of all procedures, invalidated when procedures change
+        procedure_tiles.init_app(app)
+        
+        # Register CLI commands (``flask afpd ...``)
+        app.cli.add_command(afpd_cli)
+        
+        # Load DEM indexes etc. once, before a pre-fork server forks workers
+        if app.config['PRELOAD_SHARED_DATA']:
+            from .preload import preload_shared_data
+            preload_shared_data(app)
         
         return app 
\ No newline at end of file
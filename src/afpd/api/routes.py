@@ -1,28 +1,101 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, abort
 from flask_login import login_required, current_user
-from ..models.flight_procedure import FlightProcedure, Waypoint, ProcedureType, NavigationType
-from ..validation.icao_validator import ICAOValidator
-from ..utils.terrain_analysis import TerrainAnalyzer
+from werkzeug.exceptions import HTTPException
+from ..models.flight_procedure import FlightProcedure, Waypoint, ProcedureType, NavigationType, ProcedureSummary
+from ..models.snapshot import ProcedureSnapshot
+from ..utils.admission import admission
+from ..utils.analysis import services
+from ..utils.circuit_breaker import breaker_states
+from ..utils import spatial_index, summaries
+from ..utils.impact import ImpactEngine, tile_bounds
+from ..utils.route_optimizer import RouteOptimizer
+from ..utils.terrain_tiles import terrain_tiles
+from ..utils.metrics import span
+from ..utils.profiler import profiler
 from .. import db
+from sqlalchemy import select
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 bp = Blueprint('api', __name__)
-validator = ICAOValidator()
-terrain_analyzer = TerrainAnalyzer()
 
 @bp.route('/procedures', methods=['GET'])
 @login_required
 def get_procedures():
-    """Get all flight procedures"""
-    procedures = FlightProcedure.query.all()
-    return jsonify([{
-        'id': p.id,
-        'name': p.name,
-        'airport_icao': p.airport_icao,
-        'procedure_type': p.procedure_type.value,
-        'navigation_type': p.navigation_type.value,
-        'waypoint_count': len(p.waypoints)
-    } for p in procedures])
+    """Get flight procedures, filtered and sorted on their stored summaries"""
+    try:
+        statement = _listing_query(request.args)
+    except KeyError as e:
+        return jsonify({'error': f'Invalid {e.args[0]}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with span('query'):
+        rows = db.session.execute(statement).all()
+    
+    with span('serialization'):
+        return jsonify([{
+            'id': row.id,
+            'name': row.name,
+            'airport_icao': row.airport_icao,
+            'procedure_type': row.procedure_type.value,
+            'navigation_type': row.navigation_type.value,
+            'waypoint_count': row.waypoint_count,
+            'leg_count': row.leg_count,
+            'total_distance': row.total_distance,
+            'max_msa': row.max_msa,
+            'validation_status': row.validation_status
+        } for row in rows])
+
+_LISTING_SORT = {
+    'id': FlightProcedure.id,
+    'name': FlightProcedure.name,
+    'airport': FlightProcedure.airport_icao,
+    'distance': ProcedureSummary.total_distance,
+    'msa': ProcedureSummary.max_msa,
+    'status': ProcedureSummary.validation_status,
+    'waypoints': ProcedureSummary.waypoint_count
+}
+
+def _listing_query(args):
+    """SELECT for the procedure listing from query arguments, in one indexed query"""
+    statement = (
+        select(FlightProcedure.id, FlightProcedure.name, FlightProcedure.airport_icao,
+               FlightProcedure.procedure_type, FlightProcedure.navigation_type,
+               ProcedureSummary.waypoint_count, ProcedureSummary.leg_count, ProcedureSummary.total_distance,
+               ProcedureSummary.max_msa, ProcedureSummary.validation_status)
+        .outerjoin(ProcedureSummary, ProcedureSummary.procedure_id == FlightProcedure.id)
+    )
+    
+    if 'airport_icao' in args:
+        statement = statement.where(FlightProcedure.airport_icao == args['airport_icao'].upper())
+    if 'procedure_type' in args:
+        statement = statement.where(FlightProcedure.procedure_type == ProcedureType[args['procedure_type']])
+    if 'navigation_type' in args:
+        statement = statement.where(FlightProcedure.navigation_type == NavigationType[args['navigation_type']])
+    if 'status' in args:
+        statement = statement.where(ProcedureSummary.validation_status.in_(args['status'].split(',')))
+    for name, column, compare in (('min_distance', ProcedureSummary.total_distance, '__ge__'),
+                                  ('max_distance', ProcedureSummary.total_distance, '__le__'),
+                                  ('min_msa', ProcedureSummary.max_msa, '__ge__'),
+                                  ('max_msa', ProcedureSummary.max_msa, '__le__')):
+        value = args.get(name, type=float)
+        if value is not None:
+            statement = statement.where(getattr(column, compare)(value))
+    
+    column = _LISTING_SORT.get(args.get('sort', 'id'))
+    if column is None:
+        raise ValueError(f"sort must be one of {', '.join(_LISTING_SORT)}")
+    descending = args.get('order', 'asc') == 'desc'
+    statement = statement.order_by((column.desc() if descending else column.asc()).nulls_last(),
+                                   FlightProcedure.id)
+    
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement.offset(args.get('offset', 0, type=int))
 
 @bp.route('/procedures/<int:id>', methods=['GET'])
 @login_required
@@ -44,7 +117,8 @@ def get_procedure(id):
             'longitude': w.longitude,
             'sequence': w.sequence,
             'altitude_constraint': w.altitude_constraint,
-            'speed_constraint': w.speed_constraint
+            'speed_constraint': w.speed_constraint,
+            'fly_over': w.fly_over
         } for w in procedure.waypoints]
     })
 
@@ -72,12 +146,13 @@ def create_procedure():
             longitude=wp_data['longitude'],
             sequence=wp_data['sequence'],
             altitude_constraint=wp_data.get('altitude_constraint'),
-            speed_constraint=wp_data.get('speed_constraint')
+            speed_constraint=wp_data.get('speed_constraint'),
+            fly_over=bool(wp_data.get('fly_over', False))
         )
         procedure.waypoints.append(waypoint)
     
     # Validate procedure
-    violations = validator.validate_procedure(procedure)
+    violations = services.validator.validate_procedure(procedure)
     if violations['critical']:
         return jsonify({
             'error': 'Validation failed',
@@ -114,7 +189,8 @@ def update_procedure(id):
     # Update waypoints if provided
     if 'waypoints' in data:
         # Remove existing waypoints
-        for waypoint in procedure.waypoints:
+        for waypoint in list(procedure.waypoints):
+            procedure.waypoints.remove(waypoint)
             db.session.delete(waypoint)
         
         # Add new waypoints
@@ -125,12 +201,13 @@ def update_procedure(id):
                 longitude=wp_data['longitude'],
                 sequence=wp_data['sequence'],
                 altitude_constraint=wp_data.get('altitude_constraint'),
-                speed_constraint=wp_data.get('speed_constraint')
+                speed_constraint=wp_data.get('speed_constraint'),
+                fly_over=bool(wp_data.get('fly_over', False))
             )
             procedure.waypoints.append(waypoint)
     
     # Validate procedure
-    violations = validator.validate_procedure(procedure)
+    violations = services.validator.validate_procedure(procedure)
     if violations['critical']:
         return jsonify({
             'error': 'Validation failed',
@@ -165,8 +242,10 @@ def delete_procedure(id):
 @login_required
 def validate_procedure(id):
     """Validate an existing flight procedure"""
-    procedure = FlightProcedure.query.get_or_404(id)
-    violations = validator.validate_procedure(procedure)
+    with span('query'):
+        procedure = ProcedureSnapshot.load(id) or abort(404)
+    with span('validation'):
+        violations = services.validator.validate_procedure(procedure)
     
     return jsonify({
         'procedure_id': id,
@@ -175,10 +254,13 @@ def validate_procedure(id):
 
 @bp.route('/procedures/<int:id>/terrain', methods=['GET'])
 @login_required
+@admission.limited('interactive')
+@profiler.profiled
 def analyze_terrain(id):
     """Analyze terrain for a specific procedure"""
     try:
-        procedure = FlightProcedure.query.get_or_404(id)
+        with span('query'):
+            procedure = ProcedureSnapshot.load(id) or abort(404)
         
         # Validate procedure has waypoints
         if len(procedure.waypoints) < 2:
@@ -187,25 +269,70 @@ def analyze_terrain(id):
             }), 400
         
         # Perform terrain analysis
-        analysis = terrain_analyzer.analyze_procedure(procedure)
+        analysis = services.analyzer.analyze_procedure(procedure)
         
         if analysis['status'] == 'error':
             return jsonify({
                 'error': analysis['message']
             }), 400
         
-        # Add estimated flag if using fallback data
-        analysis['using_estimated_data'] = analysis.get('using_estimated_data', False)
+        # Degraded elevation providers, so clients can explain estimated data
+        if analysis['using_estimated_data']:
+            analysis['elevation_providers'] = breaker_states()
+        else:
+            _record_msa([(procedure, analysis)])
         
-        return jsonify(analysis)
+        with span('serialization'):
+            return jsonify(analysis)
     
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception("Error analyzing terrain for procedure %s", id)
         return jsonify({
             'error': f'Error analyzing terrain: {str(e)}'
         }), 500
 
+def _record_msa(analyses):
+    """Store the highest minimum safe altitude of analysed procedures in their summaries"""
+    connection = db.session.connection()
+    for procedure, analysis in analyses:
+        minimum_altitudes = analysis['terrain_profile']['minimum_altitudes']
+        if minimum_altitudes:
+            summaries.record_msa(connection, procedure, max(minimum_altitudes))
+    db.session.commit()
+
+@bp.route('/airports/<icao>/bundle', methods=['GET'])
+@login_required
+@admission.limited('batch')
+@profiler.profiled
+def analyze_airport_bundle(icao):
+    """Terrain analysis and validation of every procedure at an airport, with shared elevation lookups"""
+    icao = icao.upper()
+    with span('query'):
+        procedures = ProcedureSnapshot.load_many(FlightProcedure.airport_icao == icao)
+    if not procedures:
+        abort(404)
+    
+    bundle = services.analyzer.analyze_bundle(procedures)
+    if bundle['status'] == 'error':
+        return jsonify({'error': bundle['message']}), 400
+    
+    with span('validation'):
+        for procedure, result in zip(procedures, bundle['procedures']):
+            result['name'] = procedure.name
+            result['procedure_type'] = procedure.procedure_type.value
+            result['violations'] = services.validator.validate_procedure(procedure)
+    _record_msa([(p, r) for p, r in zip(procedures, bundle['procedures'])
+                 if r['status'] == 'success' and not r['using_estimated_data']])
+    
+    with span('serialization'):
+        return jsonify(dict(bundle, airport_icao=icao))
+
 @bp.route('/chain', methods=['GET'])
 @login_required
+@admission.limited('interactive')
+@profiler.profiled
 def chain_waypoints():
     """Chain waypoints and analyze terrain for a procedure"""
     try:
@@ -215,23 +342,24 @@ def chain_waypoints():
                 'error': 'Missing procedure_id parameter'
             }), 400
         
-        procedure = FlightProcedure.query.get_or_404(int(procedure_id))
+        with span('query'):
+            procedure = ProcedureSnapshot.load(int(procedure_id)) or abort(404)
+            # Sort waypoints by sequence
+            waypoints = sorted(procedure.waypoints, key=lambda w: w.sequence)
         
         # Validate procedure has waypoints
-        if not procedure.waypoints:
+        if not waypoints:
             return jsonify({
                 'error': 'Procedure has no waypoints'
             }), 400
             
-        if len(procedure.waypoints) < 2:
+        if len(waypoints) < 2:
             return jsonify({
                 'error': 'Procedure must have at least 2 waypoints'
             }), 400
         
-        # Sort waypoints by sequence
-        waypoints = sorted(procedure.waypoints, key=lambda w: w.sequence)
-        
-        # Calculate distances and bearings between waypoints
+        # Calculate distances and bearings between waypoints, along the flown track
+        track = services.analyzer.track_generator.build(procedure)
         segments = []
         total_distance = 0
         
@@ -241,62 +369,304 @@ def chain_waypoints():
             
             try:
                 # Calculate distance using terrain analyzer
-                segment_analysis = terrain_analyzer.analyze_segment(wp1, wp2)
+                segment_analysis = services.analyzer.analyze_segment(wp1, wp2, track, i)
                 
                 if isinstance(segment_analysis, dict) and segment_analysis.get('status') == 'error':
                     return jsonify({
                         'error': segment_analysis.get('message', 'Error analyzing segment')
                     }), 400
                 
-                segments.append({
-                    'start_waypoint': {
-                        'name': wp1.name,
-                        'latitude': wp1.latitude,
-                        'longitude': wp1.longitude,
-                        'altitude_constraint': wp1.altitude_constraint,
-                        'speed_constraint': wp1.speed_constraint
-                    },
-                    'end_waypoint': {
-                        'name': wp2.name,
-                        'latitude': wp2.latitude,
-                        'longitude': wp2.longitude,
-                        'altitude_constraint': wp2.altitude_constraint,
-                        'speed_constraint': wp2.speed_constraint
-                    },
-                    'distance': segment_analysis.get('distance', 0),
-                    'bearing': segment_analysis.get('bearing', 0),
-                    'terrain_profile': segment_analysis.get('terrain_profile', {
-                        'distances': [],
-                        'elevations': []
-                    }),
-                    'minimum_safe_altitude': segment_analysis.get('minimum_safe_altitude', 0),
-                    'terrain_violations': segment_analysis.get('violations', [])
-                })
+                segments.append(_chain_segment(wp1, wp2, segment_analysis))
                 total_distance += segment_analysis.get('distance', 0)
                 
             except Exception as e:
-                print(f"Error analyzing segment {i}: {str(e)}")
+                logger.exception("Error analyzing segment %d of procedure %s", i, procedure.id)
                 return jsonify({
                     'error': f'Error analyzing segment between {wp1.name} and {wp2.name}: {str(e)}'
                 }), 500
         
         # Validate the entire procedure
         try:
-            violations = validator.validate_procedure(procedure)
-        except Exception as e:
-            print(f"Error validating procedure: {str(e)}")
+            with span('validation'):
+                violations = services.validator.validate_procedure(procedure)
+        except Exception:
+            logger.exception("Error validating procedure %s", procedure.id)
             violations = {'critical': [], 'warnings': []}
         
-        return jsonify({
-            'procedure_id': procedure.id,
-            'total_distance': total_distance,
-            'segments': segments,
-            'violations': violations,
-            'using_estimated_data': any(s.get('using_estimated_data', False) for s in segments)
-        })
+        with span('serialization'):
+            return jsonify({
+                'procedure_id': procedure.id,
+                'total_distance': total_distance,
+                'segments': segments,
+                'violations': violations,
+                'using_estimated_data': any(s.get('using_estimated_data', False) for s in segments)
+            })
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in chain_waypoints: {str(e)}")
+        logger.exception("Error in chain_waypoints")
         return jsonify({
             'error': f'Error analyzing chain: {str(e)}'
-        }), 500 
\ No newline at end of file
+        }), 500
+
+def _chain_segment(wp1, wp2, segment_analysis):
+    """One segment of the ``/chain`` response"""
+    return {
+        'start_waypoint': {
+            'name': wp1.name,
+            'latitude': wp1.latitude,
+            'longitude': wp1.longitude,
+            'altitude_constraint': wp1.altitude_constraint,
+            'speed_constraint': wp1.speed_constraint
+        },
+        'end_waypoint': {
+            'name': wp2.name,
+            'latitude': wp2.latitude,
+            'longitude': wp2.longitude,
+            'altitude_constraint': wp2.altitude_constraint,
+            'speed_constraint': wp2.speed_constraint
+        },
+        'distance': segment_analysis.get('distance', 0),
+        'bearing': segment_analysis.get('bearing', 0),
+        'terrain_profile': segment_analysis.get('terrain_profile', {
+            'distances': [],
+            'elevations': []
+        }),
+        'minimum_safe_altitude': segment_analysis.get('minimum_safe_altitude', 0),
+        'terrain_violations': segment_analysis.get('violations', []),
+        'using_estimated_data': segment_analysis.get('using_estimated_data', False)
+    }
+
+@bp.route('/elevation/status', methods=['GET'])
+@login_required
+def elevation_status():
+    """Report circuit breaker state for each elevation provider"""
+    return jsonify({'providers': breaker_states()})
+
+def _coordinate(value, name, limit):
+    """Parse a latitude/longitude-like value, raising ValueError with a message"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid or missing {name}')
+    if not -limit <= value <= limit:
+        raise ValueError(f'{name} must be between -{limit} and {limit}')
+    return value
+
+def _spatial_limit(value) -> int:
+    """Maximum number of procedures a spatial query returns, 1000 by default"""
+    limit = 1000 if value is None else int(value)
+    if not 1 <= limit <= 10000:
+        raise ValueError('limit must be between 1 and 10000')
+    return limit
+
+@bp.route('/spatial/bbox', methods=['GET'])
+@login_required
+def spatial_bbox():
+    """Find procedures with waypoints or legs inside a bounding box"""
+    try:
+        min_lat = _coordinate(request.args.get('min_lat'), 'min_lat', 90)
+        max_lat = _coordinate(request.args.get('max_lat'), 'max_lat', 90)
+        min_lon = _coordinate(request.args.get('min_lon'), 'min_lon', 180)
+        max_lon = _coordinate(request.args.get('max_lon'), 'max_lon', 180)
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError('Minimum bounds must not exceed maximum bounds')
+        limit = _spatial_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with span('query'):
+        procedures = spatial_index.query_bbox(min_lat, min_lon, max_lat, max_lon, limit=limit)
+    
+    return jsonify({'count': len(procedures), 'procedures': procedures})
+
+@bp.route('/spatial/radius', methods=['GET'])
+@login_required
+def spatial_radius():
+    """Find procedures passing within a radius (NM) of a point, nearest first"""
+    try:
+        latitude = _coordinate(request.args.get('lat'), 'lat', 90)
+        longitude = _coordinate(request.args.get('lon'), 'lon', 180)
+        radius_nm = float(request.args.get('radius_nm', 10))
+        if not 0 < radius_nm <= 500:
+            raise ValueError('radius_nm must be between 0 and 500')
+        limit = _spatial_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with span('query'):
+        procedures = spatial_index.query_radius(latitude, longitude, radius_nm, limit=limit)
+    
+    return jsonify({'count': len(procedures), 'procedures': procedures})
+
+@bp.route('/spatial/corridor', methods=['POST'])
+@login_required
+def spatial_corridor():
+    """Find procedures with legs inside a corridor around a path"""
+    data = request.get_json(silent=True) or {}
+    try:
+        path = [
+            (_coordinate(point.get('latitude'), 'latitude', 90),
+             _coordinate(point.get('longitude'), 'longitude', 180))
+            for point in data.get('path', [])
+        ]
+        if len(path) < 2:
+            raise ValueError('path must have at least 2 points')
+        half_width_nm = float(data.get('half_width_nm', 5))
+        if not 0 <= half_width_nm <= 100:
+            raise ValueError('half_width_nm must be between 0 and 100')
+        limit = _spatial_limit(data.get('limit'))
+    except AttributeError:
+        return jsonify({'error': 'path must be a list of {latitude, longitude} objects'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with span('query'):
+        procedures = spatial_index.query_corridor(path, half_width_nm, limit=limit)
+    
+    return jsonify({'count': len(procedures), 'procedures': procedures})
+
+@bp.route('/impact', methods=['POST'])
+@login_required
+@admission.limited('batch')
+def obstacle_impact():
+    """Find and re-assess procedures affected by changed obstacles or DEM tiles"""
+    data = request.get_json(silent=True) or {}
+    try:
+        obstacles = [{
+            'name': o.get('name'),
+            'latitude': _coordinate(o.get('latitude'), 'latitude', 90),
+            'longitude': _coordinate(o.get('longitude'), 'longitude', 180),
+            'height': float(o.get('height', 0))
+        } for o in data.get('obstacles', [])]
+        tile_degrees = float(data.get('tile_degrees', 1.0))
+        tiles = [tile_bounds(key, tile_degrees) for key in data.get('tiles', [])]
+        removed = [str(name) for name in data.get('removed', [])]
+    except AttributeError:
+        return jsonify({'error': 'obstacles must be a list of objects'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not (obstacles or tiles or removed):
+        return jsonify({'error': 'Nothing changed: give obstacles, tiles or removed'}), 400
+    
+    # Map tiles shaded from the old DEM data
+    for bounds in tiles:
+        terrain_tiles.invalidate_bbox(*bounds)
+    
+    engine = ImpactEngine(services.analyzer)
+    return jsonify(engine.run(obstacles, tiles, removed, apply=bool(data.get('apply', False))))
+
+@bp.route('/procedures/<int:id>/altitude-suggestions', methods=['GET'])
+@login_required
+@admission.limited('interactive')
+def altitude_suggestions(id):
+    """Lowest altitude constraints clearing terrain within the gradient limits"""
+    from ..utils.vertical_profile import VerticalProfileOptimizer
+    
+    with span('query'):
+        procedure = ProcedureSnapshot.load(id) or abort(404)
+    
+    round_to = request.args.get('round_to', 100, type=float)
+    if not 0 < round_to <= 1000:
+        return jsonify({'error': 'round_to must be between 0 and 1000 ft'}), 400
+    result = VerticalProfileOptimizer(services.analyzer, services.validator).suggest(procedure, round_to=round_to)
+    if result['status'] == 'error':
+        return jsonify({'error': result['message']}), 400
+    
+    with span('serialization'):
+        return jsonify(result)
+
+@bp.route('/procedures/<int:id>/categories', methods=['GET'])
+@login_required
+@admission.limited('interactive')
+def category_compliance(id):
+    """Compliance matrix for aircraft categories A-E from one terrain analysis"""
+    from ..utils.category_sweep import CATEGORIES, CategorySweep
+    
+    with span('query'):
+        procedure = ProcedureSnapshot.load(id) or abort(404)
+    
+    categories = [c.strip().upper() for c in request.args.get('categories', ','.join(CATEGORIES)).split(',') if c.strip()]
+    # e.g. ?climb_gradient=4.0&climb_gradient_D=5.0&max_gradient_A=6.5
+    climb_gradients, max_gradients = {}, {}
+    for name, gradients in (('climb_gradient', climb_gradients), ('max_gradient', max_gradients)):
+        for category in categories:
+            value = request.args.get(f'{name}_{category}', type=float)
+            if value is None:
+                value = request.args.get(name, type=float)
+            if value is None:
+                continue
+            if not 0 < value <= 30:
+                return jsonify({'error': f'{name} must be between 0 and 30 %'}), 400
+            gradients[category] = value
+    
+    result = CategorySweep(services.analyzer, services.validator).evaluate(
+        procedure, categories, climb_gradients=climb_gradients, max_gradients=max_gradients
+    )
+    if result['status'] == 'error':
+        return jsonify({'error': result['message']}), 400
+    
+    with span('serialization'):
+        return jsonify(result)
+
+@bp.route('/procedures/<int:id>/containment', methods=['GET'])
+@login_required
+@admission.limited('interactive')
+@profiler.profiled
+def containment_risk(id):
+    """Monte Carlo probability of terrain clearance violations within the navigation containment"""
+    from ..utils.containment import ContainmentAnalyzer
+    
+    with span('query'):
+        procedure = ProcedureSnapshot.load(id) or abort(404)
+    
+    samples = request.args.get('samples', 2000, type=int)
+    if not 100 <= samples <= 20000:
+        return jsonify({'error': 'samples must be between 100 and 20000'}), 400
+    cell_nm = request.args.get('cell_nm', 0.25, type=float)
+    if not 0.05 <= cell_nm <= 1:
+        return jsonify({'error': 'cell_nm must be between 0.05 and 1'}), 400
+    
+    analyzer = ContainmentAnalyzer(services.analyzer, samples=samples, grid_cell_nm=cell_nm,
+                                   workers=current_app.config['MONTE_CARLO_WORKERS'])
+    result = analyzer.analyze(procedure, seed=request.args.get('seed', type=int))
+    if result['status'] == 'error':
+        return jsonify({'error': result['message']}), 400
+    
+    with span('serialization'):
+        return jsonify(result)
+
+@bp.route('/route/optimize', methods=['POST'])
+@login_required
+@admission.limited('batch')
+def optimize_route():
+    """Propose waypoint sequences between two points that keep the MSA low"""
+    data = request.get_json(silent=True) or {}
+    try:
+        start = (_coordinate(data['start'].get('latitude'), 'start latitude', 90),
+                 _coordinate(data['start'].get('longitude'), 'start longitude', 180))
+        end = (_coordinate(data['end'].get('latitude'), 'end latitude', 90),
+               _coordinate(data['end'].get('longitude'), 'end longitude', 180))
+        procedure_type = ProcedureType[data.get('procedure_type', 'SID')]
+        initial_heading = data.get('initial_heading')
+        if initial_heading is not None:
+            initial_heading = float(initial_heading) % 360
+        cell_nm = float(data.get('cell_nm', 1.0))
+        if not 0.25 <= cell_nm <= 5:
+            raise ValueError('cell_nm must be between 0.25 and 5')
+    except KeyError as e:
+        return jsonify({'error': f'Missing or invalid {e.args[0]}'}), 400
+    except AttributeError:
+        return jsonify({'error': 'start and end must be {latitude, longitude} objects'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    optimizer = RouteOptimizer(services.analyzer, services.validator, cell_nm=cell_nm)
+    result = optimizer.optimize(start, end, procedure_type, initial_heading=initial_heading)
+    if result['status'] == 'error':
+        return jsonify({'error': result['message']}), 400
+    
+    with span('serialization'):
+        return jsonify(result)
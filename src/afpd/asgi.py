@@ -0,0 +1,370 @@
+import asyncio
+import io
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+
+from . import create_app
+from .models.snapshot import ProcedureSnapshot
+from .models.user import User
+from .utils.admission import PRIORITY_HEADER, AdmissionRejected, admission, request_priority
+from .utils.analysis import services
+from .utils.circuit_breaker import breaker_states
+from .utils.metrics import observe_request, span, start_async_request
+
+logger = logging.getLogger(__name__)
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _Request:
+    def __init__(self, scope: Dict, match: 're.Match', user_id: int):
+        self.scope = scope
+        self.path_params = match.groupdict()
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.user_id = user_id
+
+
+class AsyncAPI:
+    """ASGI application serving the elevation-bound analysis endpoints asynchronously.
+
+    ``/api/chain`` and ``/api/procedures/<id>/terrain`` are served on the
+    event loop: the elevation lookups of every request are awaited (see
+    ``ElevationResolver.resolve_async``), so thousands of requests waiting
+    on the elevation API are held by a few processes instead of one worker
+    thread each. Database queries, which are short, run in a small thread
+    pool. ``/api/chain?stream=1`` streams the segments as NDJSON, one line
+    per segment as soon as its terrain is known, then a summary line. Both
+    endpoints wait on the event loop for a slot of the app's admission
+    controller (see ``utils.admission``), as interactive requests.
+
+    Every other request is passed to the Flask application in the same
+    thread pool, so the same process serves the whole site. Both share the
+    models and the app's analyzer and validator (see ``utils.analysis``),
+    and users are authenticated from the Flask session cookie.
+    """
+
+    def __init__(self, flask_app, analyzer=None, validator=None, threads: Optional[int] = None):
+        self.flask_app = flask_app
+        self._analyzer = analyzer
+        self._validator = validator
+        self.executor = ThreadPoolExecutor(max_workers=threads or flask_app.config['ASGI_THREADS'],
+                                           thread_name_prefix='afpd-asgi')
+        self.routes: List[Tuple['re.Pattern', str, Callable]] = [
+            (re.compile(r'/api/chain'), 'api.chain_waypoints', self.chain),
+            (re.compile(r'/api/procedures/(?P<id>\d+)/terrain'), 'api.analyze_terrain', self.terrain),
+        ]
+
+    @property
+    def analyzer(self):
+        return self._analyzer or services.for_app(self.flask_app).analyzer
+
+    @property
+    def validator(self):
+        return self._validator or services.for_app(self.flask_app).validator
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['method'] == 'GET':
+            for pattern, endpoint, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await self._dispatch(scope, send, match, endpoint, handler)
+                    return
+        await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.aclose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def aclose(self):
+        """Close the elevation API connections of the running event loop"""
+        resolver = self.analyzer._elevation_resolver
+        for provider in resolver.providers if resolver is not None else ():
+            for remote in getattr(provider, 'providers', [provider]):
+                if hasattr(remote, 'aclose'):
+                    await remote.aclose()
+
+    async def run_sync(self, fn: Callable, *args):
+        """Run ``fn`` in the thread pool, inside an application context"""
+        def call():
+            with self.flask_app.app_context():
+                return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def _session_user_id(self, scope) -> Optional[int]:
+        """User id stored by Flask-Login in the signed session cookie"""
+        cookie = SimpleCookie()
+        for name, value in scope['headers']:
+            if name == b'cookie':
+                cookie.load(value.decode('latin-1'))
+        morsel = cookie.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        if morsel is None:
+            return None
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        try:
+            session = serializer.loads(
+                morsel.value, max_age=int(self.flask_app.permanent_session_lifetime.total_seconds())
+            )
+        except BadSignature:
+            return None
+        user_id = session.get('_user_id')
+        return int(user_id) if user_id is not None else None
+
+    @staticmethod
+    def _load(user_id: int, procedure_id: int) -> ProcedureSnapshot:
+        from . import db
+
+        if db.session.get(User, user_id) is None:
+            raise _HTTPError(401, 'Authentication required')
+        procedure = ProcedureSnapshot.load(procedure_id)
+        if procedure is None:
+            raise _HTTPError(404, 'Procedure not found')
+        return procedure
+
+    async def _dispatch(self, scope, send, match, endpoint: str, handler: Callable):
+        started = time.perf_counter()
+        timings = start_async_request(endpoint)
+        controller = admission.for_app(self.flask_app)
+        admitted = None
+        headers = []
+        try:
+            user_id = self._session_user_id(scope)
+            if user_id is None:
+                raise _HTTPError(401, 'Authentication required')
+            if controller is not None:
+                requested = dict(scope['headers']).get(PRIORITY_HEADER.lower().encode(), b'')
+                priority = request_priority('interactive', requested.decode('latin-1'))
+                with span('queue', priority=priority):
+                    await controller.acquire_async(str(user_id), priority)
+                admitted = time.perf_counter()
+            status, body = await handler(_Request(scope, match, user_id))
+        except AdmissionRejected as e:
+            status, body = e.status, {'error': e.message}
+            headers.append((b'retry-after', str(e.retry_after).encode()))
+        except _HTTPError as e:
+            status, body = e.status, {'error': e.message}
+        except Exception as e:
+            logger.exception("Error in %s", endpoint)
+            status, body = 500, {'error': f'Error in {endpoint}: {str(e)}'}
+
+        try:
+            await self._respond(send, endpoint, started, timings, status, body, headers)
+        finally:
+            # A streamed chain holds its slot until the last line is sent
+            if admitted is not None:
+                controller.release(str(user_id), time.perf_counter() - admitted)
+
+    async def _respond(self, send, endpoint: str, started: float, timings: Dict[str, float], status: int,
+                       body, headers: List[Tuple[bytes, bytes]]):
+        if isinstance(body, dict):
+            with span('serialization'):
+                payload = self.flask_app.json.dumps(body).encode()
+            server_timing = observe_request(endpoint, 'GET', status, time.perf_counter() - started, timings)
+            await send({'type': 'http.response.start', 'status': status, 'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+                (b'server-timing', server_timing.encode()),
+                *headers
+            ]})
+            await send({'type': 'http.response.body', 'body': payload})
+            return
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/x-ndjson')
+        ]})
+        async for line in body:
+            await send({'type': 'http.response.body',
+                        'body': self.flask_app.json.dumps(line).encode() + b'\n', 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+        observe_request(endpoint, 'GET', status, time.perf_counter() - started, timings)
+
+    async def chain(self, request: _Request):
+        """Asynchronous ``GET /api/chain``"""
+        from .api.routes import _chain_segment
+
+        procedure_id = request.args.get('procedure_id')
+        if not procedure_id:
+            raise _HTTPError(400, 'Missing procedure_id parameter')
+        if not procedure_id.isdigit():
+            raise _HTTPError(400, 'Invalid procedure_id parameter')
+
+        with span('query'):
+            procedure = await self.run_sync(self._load, request.user_id, int(procedure_id))
+        waypoints = sorted(procedure.waypoints, key=lambda w: w.sequence)
+        if not waypoints:
+            raise _HTTPError(400, 'Procedure has no waypoints')
+        if len(waypoints) < 2:
+            raise _HTTPError(400, 'Procedure must have at least 2 waypoints')
+
+        # Every segment's elevations are requested at once, along the flown track
+        track = self.analyzer.track_generator.build(procedure)
+        pairs = list(zip(waypoints, waypoints[1:]))
+        tasks = [asyncio.ensure_future(self.analyzer.analyze_segment_async(wp1, wp2, track, leg))
+                 for leg, (wp1, wp2) in enumerate(pairs)]
+        if request.args.get('stream'):
+            return 200, self._stream_chain(procedure, pairs, tasks)
+
+        try:
+            analyses = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        segments = []
+        for (wp1, wp2), analysis in zip(pairs, analyses):
+            if analysis.get('status') == 'error':
+                raise _HTTPError(400, analysis.get('message', 'Error analyzing segment'))
+            segments.append(_chain_segment(wp1, wp2, analysis))
+
+        return 200, {
+            'procedure_id': procedure.id,
+            'total_distance': sum(s['distance'] for s in segments),
+            'segments': segments,
+            'violations': self._validate(procedure),
+            'using_estimated_data': any(s['using_estimated_data'] for s in segments)
+        }
+
+    async def _stream_chain(self, procedure: ProcedureSnapshot, pairs, tasks) -> AsyncIterator[Dict]:
+        from .api.routes import _chain_segment
+
+        total_distance = 0
+        using_estimated_data = False
+        try:
+            for (wp1, wp2), task in zip(pairs, tasks):
+                analysis = await task
+                if analysis.get('status') == 'error':
+                    yield {'error': analysis.get('message', 'Error analyzing segment')}
+                    return
+                segment = _chain_segment(wp1, wp2, analysis)
+                total_distance += segment['distance']
+                using_estimated_data = using_estimated_data or segment['using_estimated_data']
+                yield {'segment': segment}
+        finally:
+            # The client went away or a segment failed
+            for task in tasks:
+                task.cancel()
+
+        yield {
+            'procedure_id': procedure.id,
+            'total_distance': total_distance,
+            'violations': self._validate(procedure),
+            'using_estimated_data': using_estimated_data
+        }
+
+    def _validate(self, procedure: ProcedureSnapshot) -> Dict:
+        try:
+            with span('validation'):
+                return self.validator.validate_procedure(procedure)
+        except Exception:
+            logger.exception("Error validating procedure %s", procedure.id)
+            return {'critical': [], 'warnings': []}
+
+    async def terrain(self, request: _Request):
+        """Asynchronous ``GET /api/procedures/<id>/terrain``"""
+        from .api.routes import _record_msa
+
+        with span('query'):
+            procedure = await self.run_sync(self._load, request.user_id, int(request.path_params['id']))
+        if len(procedure.waypoints) < 2:
+            raise _HTTPError(400, 'Procedure must have at least 2 waypoints')
+
+        analysis = await self.analyzer.analyze_procedure_async(procedure)
+        if analysis['status'] == 'error':
+            raise _HTTPError(400, analysis['message'])
+
+        # Degraded elevation providers, so clients can explain estimated data
+        if analysis['using_estimated_data']:
+            analysis['elevation_providers'] = breaker_states()
+        else:
+            await self.run_sync(_record_msa, [(procedure, analysis)])
+        return 200, analysis
+
+    async def _wsgi(self, scope, receive, send):
+        """Serve any other request with the Flask application"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        status, headers, payload = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._call_wsgi, self._environ(scope, bytes(body))
+        )
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    def _call_wsgi(self, environ: Dict) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        result = self.flask_app(environ, start_response)
+        try:
+            payload = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started['status'], started['headers'], payload
+
+    @staticmethod
+    def _environ(scope, body: bytes) -> Dict:
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+
+def create_asgi_app(config=None) -> AsyncAPI:
+    """ASGI entry point, e.g. ``uvicorn --factory src.afpd.asgi:create_asgi_app``"""
+    return AsyncAPI(create_app(config))
@@ -0,0 +1,459 @@
+import click
+from flask.cli import AppGroup
+
+afpd_cli = AppGroup('afpd', help='Advanced Flight Procedure Designer maintenance tools.')
+
+
+@afpd_cli.command('bench')
+@click.option('--output', '-o', default='bench_results.json', show_default=True,
+              help='Where to write the machine-readable results.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Previous results file to check for regressions.')
+@click.option('--threshold', default=0.2, show_default=True,
+              help='Allowed relative slowdown of the median before failing.')
+@click.option('--procedures', default=10000, show_default=True,
+              help='Number of synthetic procedures in the benchmark database.')
+@click.option('--repeat', default=20, show_default=True, help='Rounds per in-process case.')
+@click.option('--api-repeat', default=5, show_default=True, help='Rounds per HTTP case.')
+@click.option('--database-url', default='sqlite://', show_default=True,
+              help='Database used for the API cases (defaults to in-memory SQLite).')
+@click.option('--only', multiple=True, help='Only run cases whose name starts with this prefix.')
+def bench(output, baseline_path, threshold, procedures, repeat, api_repeat, database_url, only):
+    """Benchmark terrain analysis, validation and API hot paths."""
+    from .utils.benchmark import compare_results, load_results, run_benchmarks, write_results
+
+    results = run_benchmarks(
+        repeat=repeat,
+        api_repeat=api_repeat,
+        procedure_count=procedures,
+        database_url=database_url,
+        only=list(only),
+        echo=click.echo
+    )
+    write_results(results, output)
+    click.echo(f'Results written to {output}')
+
+    if baseline_path:
+        regressions = compare_results(load_results(baseline_path), results, threshold)
+        for r in regressions:
+            click.echo(
+                f"REGRESSION {r['name']}: {r['baseline_ms']:.3f} ms -> "
+                f"{r['current_ms']:.3f} ms (+{r['change'] * 100:.0f}%)",
+                err=True
+            )
+        if regressions:
+            raise SystemExit(1)
+
+
+@afpd_cli.command('stub-elevation')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8081, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help='Fixed delay per request (s).')
+@click.option('--jitter', default=0.0, show_default=True, help='Extra uniform random delay (s).')
+@click.option('--failure-rate', default=0.0, show_default=True, help='Share of requests answered 503.')
+def stub_elevation(host, port, latency, jitter, failure_rate):
+    """Serve a local Open-Elevation compatible stub for testing."""
+    from .utils.stub_elevation_server import StubElevationServer
+
+    server = StubElevationServer(host, port, latency=latency, jitter=jitter, failure_rate=failure_rate)
+    click.echo(f'Stub elevation API listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@afpd_cli.command('importtime')
+@click.option('--module', default='src.afpd.app', show_default=True, help='Module to import.')
+@click.option('--top', default=20, show_default=True, help='Number of slowest imports to show.')
+def importtime(module, top):
+    """Profile cold import time of the application (python -X importtime)."""
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    if result.returncode != 0:
+        click.echo(result.stderr, err=True)
+        raise SystemExit(result.returncode)
+
+    total = max((r[0] for r in rows), default=0)
+    click.echo(f'Importing {module} took {total / 1000:.1f} ms')
+    click.echo(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        click.echo(f'{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}')
+
+
+@afpd_cli.command('spatial-index')
+def spatial_index_command():
+    """Create (if needed) and rebuild the waypoint/leg spatial index."""
+    import time
+
+    from . import db
+    from .utils import spatial_index
+
+    connection = db.session.connection()
+    started = time.perf_counter()
+    spatial_index.ensure_schema(connection)
+    if not (spatial_index.has_rtree(connection) or spatial_index.has_postgis(connection)):
+        click.echo(f'No spatial index for {connection.dialect.name} (PostgreSQL needs PostGIS); '
+                   'range queries are used instead.')
+        return
+    spatial_index.rebuild(connection)
+    db.session.commit()
+    click.echo(f'Spatial index rebuilt in {(time.perf_counter() - started) * 1000:.0f} ms')
+
+
+@afpd_cli.command('summaries')
+@click.option('--msa', is_flag=True,
+              help='Also analyze terrain, one airport at a time, for summaries without an MSA.')
+def summaries_command(msa):
+    """Recompute every procedure summary (listing data) from the procedures."""
+    import time
+
+    from sqlalchemy import select
+
+    from . import db
+    from .models.flight_procedure import FlightProcedure, ProcedureSummary
+    from .models.snapshot import ProcedureSnapshot
+    from .utils import summaries
+
+    started = time.perf_counter()
+    count = summaries.refresh(db.session.connection())
+    db.session.commit()
+    click.echo(f'{count} summaries rebuilt in {time.perf_counter() - started:.1f} s')
+    if not msa:
+        return
+
+    from .utils.analysis import services
+
+    missing = select(ProcedureSummary.procedure_id).where(ProcedureSummary.max_msa.is_(None))
+    airports = db.session.execute(
+        select(FlightProcedure.airport_icao).where(FlightProcedure.id.in_(missing)).distinct()
+    ).scalars().all()
+    for icao in airports:
+        started = time.perf_counter()
+        procedures = ProcedureSnapshot.load_many(FlightProcedure.airport_icao == icao,
+                                                 FlightProcedure.id.in_(missing))
+        bundle = services.analyzer.analyze_bundle(procedures)
+        if bundle['status'] == 'error':
+            click.echo(f"{icao}: {bundle['message']}", err=True)
+            continue
+        recorded = 0
+        for procedure, result in zip(procedures, bundle['procedures']):
+            if result['status'] != 'success' or result['using_estimated_data']:
+                continue
+            minimum_altitudes = result['terrain_profile']['minimum_altitudes']
+            recorded += summaries.record_msa(db.session.connection(), procedure, max(minimum_altitudes))
+        db.session.commit()
+        click.echo(f'{icao}: MSA of {recorded}/{len(procedures)} procedures in '
+                   f'{time.perf_counter() - started:.1f} s')
+
+
+@afpd_cli.command('route-grid')
+@click.argument('airports', nargs=-1, required=True)
+@click.option('--cell-nm', default=1.0, show_default=True, help='Grid cell size in NM.')
+@click.option('--margin-nm', default=30.0, show_default=True,
+              help='Distance around the airport\'s waypoints to cover.')
+@click.option('--max-cells', type=int,
+              help='Largest grid to build. Defaults to the route search limit; searches skip bigger grids.')
+def route_grid(airports, cell_nm, margin_nm, max_cells):
+    """Precompute route search cost grids around AIRPORTS (ICAO codes)."""
+    import time
+
+    from .utils.analysis import services
+    from .utils.route_optimizer import MAX_SEARCH_CELLS, CostGrid, airport_region, grid_cache
+
+    max_cells = max_cells or MAX_SEARCH_CELLS
+    for icao in airports:
+        bounds = airport_region(icao.upper(), margin_nm)
+        if bounds is None:
+            click.echo(f'{icao}: no stored waypoints, skipped', err=True)
+            continue
+        rows, cols = CostGrid.dimensions(grid_cache.snap(bounds), cell_nm)
+        if rows * cols > max_cells:
+            click.echo(f'{icao}: {rows}x{cols} grid exceeds {max_cells} cells, skipped; '
+                       f'use a larger --cell-nm or a smaller --margin-nm', err=True)
+            continue
+        started = time.perf_counter()
+        grid, cached = grid_cache.get(bounds, cell_nm, services.analyzer.elevation_resolver, max_cells=max_cells)
+        click.echo(f"{icao}: {grid.shape[0]}x{grid.shape[1]} grid "
+                   f"{'already cached' if cached else 'computed'} in {time.perf_counter() - started:.1f} s"
+                   f"{' (estimated elevations, not stored)' if grid.estimated else ''}")
+
+
+@afpd_cli.command('terrain-tiles')
+@click.argument('airports', nargs=-1, required=True)
+@click.option('--zoom', default='8-13', show_default=True, help='Zoom level or range, e.g. 10 or 8-13.')
+@click.option('--margin-nm', default=30.0, show_default=True,
+              help='Distance around the airport\'s waypoints to cover.')
+@click.option('--style', 'styles', type=click.Choice(['hillshade', 'tint']), multiple=True,
+              default=['hillshade'], show_default=True)
+def terrain_tiles_command(airports, zoom, margin_nm, styles):
+    """Pre-render terrain map tiles around AIRPORTS (ICAO codes) into the tile cache."""
+    import time
+
+    from flask import current_app
+
+    from .utils.map_tiles import tiles_for_bounds
+    from .utils.route_optimizer import airport_region
+    from .utils.terrain_tiles import terrain_tiles
+
+    first, _, last = zoom.partition('-')
+    zooms = range(int(first), int(last or first) + 1)
+    if not terrain_tiles.stores(current_app):
+        raise click.ClickException('No local DEM configured (DEM_HIGHRES_DIR / DEM_GLOBAL_DIR)')
+
+    for icao in airports:
+        bounds = airport_region(icao.upper(), margin_nm)
+        if bounds is None:
+            click.echo(f'{icao}: no stored waypoints, skipped', err=True)
+            continue
+        started = time.perf_counter()
+        rendered = cached = 0
+        for style in styles:
+            for z in zooms:
+                for x, y in tiles_for_bounds(bounds, z):
+                    _, hit = terrain_tiles.tile(z, x, y, style)
+                    cached += hit
+                    rendered += not hit
+        click.echo(f'{icao}: {rendered} tiles rendered, {cached} already cached in '
+                   f'{time.perf_counter() - started:.1f} s')
+
+
+@afpd_cli.group('dem')
+def dem_cli():
+    """Build and inspect local DEM tile directories."""
+
+
+@dem_cli.command('ingest')
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--output', '-o', help='Tile directory (defaults to DEM_HIGHRES_DIR).')
+@click.option('--tile-degrees', default=1, show_default=True, type=click.IntRange(1, 10),
+              help='Extent of each tile.')
+@click.option('--resolution', type=float, help='Cell size in arc seconds (defaults to the finest source).')
+@click.option('--dtype', type=click.Choice(['int16', 'float32']), default='int16', show_default=True)
+@click.option('--scale', default=1.0, show_default=True,
+              help='Elevation units per stored int16 step, e.g. 0.1 for decimetres.')
+@click.option('--offset', default=0.0, show_default=True, help='Elevation stored as 0.')
+@click.option('--units', type=click.Choice(['m', 'ft']), default='m', show_default=True,
+              help='Vertical units of the sources.')
+@click.option('--overview-cells', default=60, show_default=True,
+              help='Cells per side of each max-elevation overview block.')
+@click.option('--workers', '-j', default=0, help='Worker processes (defaults to the CPU count).')
+@click.option('--force', is_flag=True, help='Rewrite tiles that are already up to date.')
+def dem_ingest(sources, output, tile_degrees, resolution, dtype, scale, offset, units, overview_cells,
+               workers, force):
+    """Convert raw DEM files (.hgt, .hgt.zip, .asc, .tif) or directories of them into tiles."""
+    import json
+
+    from flask import current_app
+
+    from .utils.dem_ingest import find_sources, ingest
+
+    output = output or current_app.config.get('DEM_HIGHRES_DIR')
+    if not output:
+        raise click.ClickException('Give --output or set DEM_HIGHRES_DIR')
+    try:
+        result = ingest(find_sources(sources), output, tile_degrees=tile_degrees, resolution=resolution,
+                        dtype=dtype, scale=scale, offset=offset, units=units,
+                        overview_cells=overview_cells, workers=workers, force=force, echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{len(result['written'])} tiles written, {result['up_to_date']} up to date, "
+               f"{result['empty']} without data in {result['seconds']:.1f} s")
+    if result['clipped']:
+        click.echo(f"{result['clipped']} values were out of the int16 range and clipped: "
+                   'use a larger --scale or --dtype float32', err=True)
+    if result['written']:
+        # Running servers keep the old tiles open until told
+        click.echo('Reload running servers with POST /api/impact {"tiles": %s}' % json.dumps(result['written']))
+
+
+@dem_cli.command('info')
+@click.argument('directory', required=False)
+@click.option('--bbox', help='min_lat,min_lon,max_lat,max_lon: also show the highest terrain inside.')
+def dem_info(directory, bbox):
+    """Summarize a DEM tile directory (defaults to DEM_HIGHRES_DIR)."""
+    from flask import current_app
+
+    from .utils.elevation import DEMTileStore
+
+    directory = directory or current_app.config.get('DEM_HIGHRES_DIR')
+    if not directory:
+        raise click.ClickException('Give a directory or set DEM_HIGHRES_DIR')
+    try:
+        store = DEMTileStore(directory)
+    except FileNotFoundError:
+        raise click.ClickException(f'{directory} has no manifest.json')
+
+    manifest = store.manifest
+    tiles = manifest.get('tiles', {})
+    if not tiles:
+        raise click.ClickException(f'{directory} holds no tiles')
+    tile = store.tile(next(iter(tiles)))
+    click.echo(f"{len(tiles)} tiles of {store.tile_degrees:g} degrees, {tile.shape[0]}x{tile.shape[1]} {tile.dtype}, "
+               f"scale {store.scale:g}, offset {store.offset:g} {manifest.get('units', 'm')}")
+    highest = [(entry['max'], key) for key, entry in tiles.items() if 'max' in entry]
+    if highest:
+        top, key = max(highest)
+        click.echo(f"Highest terrain {top:.0f} {manifest.get('units', 'm')} in {key}")
+    if bbox:
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox.split(','))
+        except ValueError:
+            raise click.ClickException('--bbox takes min_lat,min_lon,max_lat,max_lon')
+        click.echo(f'Highest terrain in the box: {store.max_elevation(min_lat, min_lon, max_lat, max_lon):.0f} ft')
+
+
+@afpd_cli.command('concurrency-test')
+@click.option('--levels', default='1,10,100,1000', show_default=True,
+              help='Comma separated numbers of concurrent clients.')
+@click.option('--latency', default=0.2, show_default=True, help='Stub elevation API delay per request (s).')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds per concurrency level.')
+@click.option('--threads', default=8, show_default=True, help='Threads of the Flask worker.')
+@click.option('--procedures', default=500, show_default=True, help='Number of synthetic procedures.')
+@click.option('--endpoint', type=click.Choice(['chain', 'terrain']), default='chain', show_default=True)
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def concurrency_test(levels, latency, duration, threads, procedures, endpoint, output):
+    """Compare Flask and ASGI throughput against a stub elevation API."""
+    import json
+
+    from .utils.load_test import run_concurrency_test
+
+    results = run_concurrency_test(
+        levels=[int(level) for level in levels.split(',')],
+        latency=latency,
+        duration=duration,
+        threads=threads,
+        procedure_count=procedures,
+        endpoint=endpoint,
+        echo=click.echo
+    )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f'Results written to {output}')
+
+
+@afpd_cli.command('admission-test')
+@click.option('--duration', default=20.0, show_default=True, help='Seconds per run.')
+@click.option('--latency', default=0.5, show_default=True, help='Stub elevation API delay per request (s).')
+@click.option('--threads', default=8, show_default=True, help='Threads of the Flask worker.')
+@click.option('--procedures', default=100, show_default=True, help='Number of synthetic procedures.')
+@click.option('--heavy-users', default=2, show_default=True, help='Users flooding terrain analyses.')
+@click.option('--clients-per-user', default=6, show_default=True)
+@click.option('--batch-clients', default=2, show_default=True, help='Clients requesting airport bundles.')
+@click.option('--crud-clients', default=4, show_default=True, help='Clients reading single procedures.')
+@click.option('--set', 'overrides', multiple=True, metavar='KEY=VALUE',
+              help='ADMISSION_* setting of the admission-on run, e.g. --set ADMISSION_MAX_CONCURRENT=2.')
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def admission_test(duration, latency, threads, procedures, heavy_users, clients_per_user, batch_clients,
+                   crud_clients, overrides, output):
+    """CRUD latency under an analysis flood, without and with admission control."""
+    import json
+
+    from .utils.load_test import run_admission_test
+
+    admission = {}
+    for override in overrides:
+        key, _, value = override.partition('=')
+        try:
+            if not key.startswith('ADMISSION_'):
+                raise ValueError
+            admission[key] = float(value) if key == 'ADMISSION_QUEUE_TIMEOUT' else int(value)
+        except ValueError:
+            raise click.BadParameter(f'expected ADMISSION_<NAME>=<number>, got {override}', param_hint='--set')
+
+    results = run_admission_test(
+        duration=duration,
+        latency=latency,
+        threads=threads,
+        procedure_count=procedures,
+        heavy_users=heavy_users,
+        clients_per_user=clients_per_user,
+        batch_clients=batch_clients,
+        crud_clients=crud_clients,
+        admission=admission,
+        echo=click.echo
+    )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f'Results written to {output}')
+
+
+@afpd_cli.command('load-test')
+@click.option('--url', help='Base URL of a running app; by default a local app with a stub elevation API is started.')
+@click.option('--username', help='Account used by every client with --url.')
+@click.option('--password', help='Password of --username.')
+@click.option('--clients', default=8, show_default=True, help='Concurrent clients (sessions).')
+@click.option('--mix', help='Operation weights; default index=2,list=4,view=4,chain=2,terrain=1,create=1,update=1.')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds of mixed traffic.')
+@click.option('--think-time', default=0.0, show_default=True, help='Mean pause between requests of a client (s).')
+@click.option('--replay', 'replay_log', type=click.Path(exists=True, dir_okay=False),
+              help='Replay a REQUEST_LOG file or access log instead of the mix.')
+@click.option('--speed', default=1.0, show_default=True, help='Replay speed multiplier.')
+@click.option('--latency', default=0.2, show_default=True, help='Stub elevation API delay per request (s), local app.')
+@click.option('--procedures', default=200, show_default=True, help='Synthetic procedures of the local app.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def load_test(url, username, password, clients, mix, duration, think_time, replay_log, speed, latency,
+              procedures, seed, output):
+    """Drive a realistic request mix, or replay recorded traffic, and report latency per endpoint."""
+    import contextlib
+    import json
+
+    from .utils import load_test as harness
+
+    try:
+        weights = harness.parse_mix(mix) if mix else dict(harness.DEFAULT_MIX)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--mix')
+    if speed <= 0:
+        raise click.BadParameter('must be positive', param_hint='--speed')
+    entries = harness.read_request_log(replay_log) if replay_log else None
+
+    with contextlib.ExitStack() as stack:
+        if url is None:
+            # One account per client, as separate users
+            server = stack.enter_context(harness.LocalServer(procedure_count=procedures, users=clients,
+                                                             latency=latency))
+            url = server.url
+            accounts = [(user['username'], user['password']) for user in server.users]
+            click.echo(f'Local app at {url}, stub elevation latency {latency:g} s')
+        elif username and password:
+            url = url.rstrip('/')
+            accounts = [(username, password)] * clients
+        else:
+            raise click.UsageError('--url needs --username and --password')
+        try:
+            sessions = [harness.login(url, *account) for account in accounts]
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+
+        if entries is not None:
+            click.echo(f'Replaying {len(entries)} requests at {speed:g}x')
+            result = harness.replay(url, sessions, entries, speed=speed)
+            if result['skipped']:
+                click.echo(f"Skipped writes without a recorded body: {result['skipped']}")
+        else:
+            click.echo(f'{clients} clients for {duration:g} s: '
+                       + ', '.join(f'{k}={v:g}' for k, v in weights.items()))
+            result = harness.drive_mix(url, sessions, weights, duration, think_time=think_time, seed=seed)
+
+    for line in harness.format_report(result):
+        click.echo(line)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(dict(result, url=url, clients=clients), f, indent=2)
+        click.echo(f'Results written to {output}')
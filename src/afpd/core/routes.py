@@ -1,5 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, json
 from flask_login import login_required, current_user
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
 from ..models.flight_procedure import FlightProcedure, ProcedureType, NavigationType, Waypoint
 from .. import db
 
@@ -13,8 +15,14 @@ def format_procedure_type(value):
 @bp.route('/')
 def index():
     """Home page with list of procedures"""
-    procedures = FlightProcedure.query.all()
-    return render_template('index.html', procedures=procedures)
+    procedures = FlightProcedure.query.options(joinedload(FlightProcedure.summary)).all()
+    # Initial extent of the overview map, drawn from vector tiles
+    bounds = db.session.execute(
+        select(func.min(Waypoint.longitude), func.min(Waypoint.latitude),
+               func.max(Waypoint.longitude), func.max(Waypoint.latitude))
+    ).one()
+    return render_template('index.html', procedures=procedures,
+                           map_bounds=list(bounds) if bounds[0] is not None else None)
 
 @bp.route('/procedures/new', methods=['GET', 'POST'])
 @login_required
@@ -51,7 +59,8 @@ def new_procedure():
                         longitude=wp_data['longitude'],
                         sequence=wp_data['sequence'],
                         altitude_constraint=wp_data.get('altitude_constraint'),
-                        speed_constraint=wp_data.get('speed_constraint')
+                        speed_constraint=wp_data.get('speed_constraint'),
+                        fly_over=bool(wp_data.get('fly_over', False))
                     )
                     procedure.waypoints.append(waypoint)
 
@@ -113,7 +122,8 @@ def edit_procedure(id):
                         longitude=wp_data['longitude'],
                         sequence=wp_data['sequence'],
                         altitude_constraint=wp_data.get('altitude_constraint'),
-                        speed_constraint=wp_data.get('speed_constraint')
+                        speed_constraint=wp_data.get('speed_constraint'),
+                        fly_over=bool(wp_data.get('fly_over', False))
                     )
                     procedure.waypoints.append(waypoint)
 
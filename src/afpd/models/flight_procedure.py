@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Boolean, false
 from sqlalchemy.orm import relationship
 import enum
 from .. import db
@@ -31,6 +31,8 @@ class FlightProcedure(db.Model):
     
     # Relationships
     waypoints = relationship("Waypoint", back_populates="procedure", order_by="Waypoint.sequence")
+    # Maintained on every flush by ``utils.summaries``
+    summary = relationship("ProcedureSummary", uselist=False, viewonly=True)
     
     def __repr__(self):
         return f"<FlightProcedure {self.name} ({self.airport_icao})>"
@@ -39,13 +41,14 @@ class Waypoint(db.Model):
     __tablename__ = 'waypoints'
     
     id = Column(Integer, primary_key=True)
-    procedure_id = Column(Integer, ForeignKey('flight_procedures.id'), nullable=False)
+    procedure_id = Column(Integer, ForeignKey('flight_procedures.id'), nullable=False, index=True)
     name = Column(String(10), nullable=False)  # ICAO waypoint identifier
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     sequence = Column(Integer, nullable=False)  # Order in the procedure
     altitude_constraint = Column(Float)  # In feet, nullable for no constraint
     speed_constraint = Column(Float)  # In knots, nullable for no constraint
+    fly_over = Column(Boolean, nullable=False, default=False, server_default=false())  # Fly-over rather than fly-by turn
     
     # Relationships
     procedure = relationship("FlightProcedure", back_populates="waypoints")
@@ -57,8 +60,8 @@ class ObstacleAssessment(db.Model):
     __tablename__ = 'obstacle_assessments'
     
     id = Column(Integer, primary_key=True)
-    procedure_id = Column(Integer, ForeignKey('flight_procedures.id'), nullable=False)
-    obstacle_name = Column(String(100))
+    procedure_id = Column(Integer, ForeignKey('flight_procedures.id'), nullable=False, index=True)
+    obstacle_name = Column(String(100), index=True)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     height = Column(Float, nullable=False)  # In feet
@@ -69,4 +72,22 @@ class ObstacleAssessment(db.Model):
     procedure = relationship("FlightProcedure")
     
     def __repr__(self):
-        return f"<ObstacleAssessment {self.obstacle_name} - {self.clearance}ft clearance>" 
\ No newline at end of file
+        return f"<ObstacleAssessment {self.obstacle_name} - {self.clearance}ft clearance>"
+
+class ProcedureSummary(db.Model):
+    __tablename__ = 'procedure_summaries'
+    
+    procedure_id = Column(Integer, ForeignKey('flight_procedures.id', ondelete='CASCADE'), primary_key=True)
+    waypoint_count = Column(Integer, nullable=False)
+    leg_count = Column(Integer, nullable=False)
+    total_distance = Column(Float, nullable=False, index=True)  # Flown distance in NM
+    validation_status = Column(String(10), nullable=False, index=True)  # valid, warnings or invalid
+    critical_count = Column(Integer, nullable=False)
+    warning_count = Column(Integer, nullable=False)
+    max_msa = Column(Float, index=True)  # In feet, from the last terrain analysis of this geometry
+    digest = Column(String(40), nullable=False)  # ProcedureSnapshot.digest the row was computed from
+    updated_at = Column(DateTime, nullable=False)
+    msa_updated_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<ProcedureSummary {self.procedure_id} - {self.validation_status}>"
@@ -0,0 +1,200 @@
+import hashlib
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from .flight_procedure import FlightProcedure, Waypoint, ProcedureType, NavigationType
+from .. import db
+
+_WAYPOINT_FIELDS = ('id', 'name', 'latitude', 'longitude', 'sequence',
+                    'altitude_constraint', 'speed_constraint', 'fly_over')
+_PROCEDURE_FIELDS = ('id', 'name', 'airport_icao', 'procedure_type', 'navigation_type',
+                     'minimum_altitude', 'maximum_altitude')
+
+
+class _Frozen:
+    """Base for immutable ``__slots__`` value objects"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+
+class WaypointSnapshot(_Frozen):
+    """Plain, immutable copy of a ``Waypoint`` row"""
+
+    __slots__ = _WAYPOINT_FIELDS
+
+    def __init__(self, id, name, latitude, longitude, sequence,
+                 altitude_constraint=None, speed_constraint=None, fly_over=False):
+        for field, value in zip(_WAYPOINT_FIELDS, (id, name, float(latitude), float(longitude), sequence,
+                                                   altitude_constraint, speed_constraint, bool(fly_over))):
+            object.__setattr__(self, field, value)
+
+    def as_tuple(self) -> Tuple:
+        return tuple(getattr(self, field) for field in _WAYPOINT_FIELDS)
+
+    def __reduce__(self):
+        return (WaypointSnapshot, self.as_tuple())
+
+    def __repr__(self):
+        return f"<WaypointSnapshot {self.name} ({self.latitude}, {self.longitude})>"
+
+
+class ProcedureSnapshot(_Frozen):
+    """Immutable, detached view of a procedure and its waypoints.
+
+    Snapshots hold no ORM state, so they can be analysed off the request
+    thread or in another process, pickle as plain tuples, and hash by
+    content for caching. Coordinates are also kept in flat ``array('d')``
+    buffers; ``coordinates()`` exposes them to NumPy without copying.
+    """
+
+    __slots__ = _PROCEDURE_FIELDS + ('waypoints', 'latitudes', 'longitudes', 'altitudes', '_digest')
+
+    def __init__(self, id, name, airport_icao, procedure_type, navigation_type,
+                 minimum_altitude=None, maximum_altitude=None, waypoints=()):
+        values = (id, name, airport_icao, procedure_type, navigation_type, minimum_altitude, maximum_altitude)
+        for field, value in zip(_PROCEDURE_FIELDS, values):
+            object.__setattr__(self, field, value)
+
+        waypoints = tuple(
+            w if isinstance(w, WaypointSnapshot) else WaypointSnapshot(*w)
+            for w in waypoints
+        )
+        object.__setattr__(self, 'waypoints', waypoints)
+        object.__setattr__(self, 'latitudes', array('d', (w.latitude for w in waypoints)))
+        object.__setattr__(self, 'longitudes', array('d', (w.longitude for w in waypoints)))
+        object.__setattr__(self, 'altitudes', array('d', (
+            math.nan if w.altitude_constraint is None else w.altitude_constraint for w in waypoints
+        )))
+        object.__setattr__(self, '_digest', None)
+
+    # Construction
+
+    @classmethod
+    def from_procedure(cls, procedure: FlightProcedure) -> 'ProcedureSnapshot':
+        """Copy a (possibly transient) ORM procedure, keeping its waypoint order"""
+        return cls(
+            procedure.id, procedure.name, procedure.airport_icao,
+            procedure.procedure_type, procedure.navigation_type,
+            procedure.minimum_altitude, procedure.maximum_altitude,
+            [
+                WaypointSnapshot(w.id, w.name, w.latitude, w.longitude, w.sequence,
+                                 w.altitude_constraint, w.speed_constraint, w.fly_over)
+                for w in procedure.waypoints
+            ]
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict, id: Optional[int] = None) -> 'ProcedureSnapshot':
+        """Build from the JSON body accepted by ``POST /api/procedures``"""
+        return cls(
+            id, data.get('name'), data.get('airport_icao'),
+            ProcedureType[data['procedure_type']], NavigationType[data['navigation_type']],
+            data.get('minimum_altitude'), data.get('maximum_altitude'),
+            [
+                WaypointSnapshot(wp.get('id'), wp['name'], wp['latitude'], wp['longitude'], wp['sequence'],
+                                 wp.get('altitude_constraint'), wp.get('speed_constraint'),
+                                 wp.get('fly_over', False))
+                for wp in data.get('waypoints', [])
+            ]
+        )
+
+    @classmethod
+    def coerce(cls, procedure) -> 'ProcedureSnapshot':
+        """Return ``procedure`` as a snapshot, converting ORM instances"""
+        if isinstance(procedure, cls):
+            return procedure
+        return cls.from_procedure(procedure)
+
+    @classmethod
+    def load_many(cls, *criteria, order_by=None, connection=None) -> List['ProcedureSnapshot']:
+        """Load procedures matching ``criteria`` with one SELECT and no ORM objects.
+
+        Reads through ``connection`` when given, e.g. that of a flush or a
+        migration, instead of the current session.
+        """
+        statement = (
+            select(*(getattr(FlightProcedure, f) for f in _PROCEDURE_FIELDS),
+                   *(getattr(Waypoint, f) for f in _WAYPOINT_FIELDS))
+            .outerjoin(Waypoint, Waypoint.procedure_id == FlightProcedure.id)
+            .where(*criteria)
+            .order_by(order_by if order_by is not None else FlightProcedure.id, Waypoint.sequence)
+        )
+
+        procedures = {}
+        waypoints: Dict[int, List[Tuple]] = {}
+        split = len(_PROCEDURE_FIELDS)
+        for row in (connection or db.session).execute(statement):
+            procedure_fields = tuple(row[:split])
+            if procedure_fields[0] not in procedures:
+                procedures[procedure_fields[0]] = procedure_fields
+                waypoints[procedure_fields[0]] = []
+            if row[split] is not None:
+                waypoints[procedure_fields[0]].append(tuple(row[split:]))
+
+        return [cls(*fields, waypoints=waypoints[pid]) for pid, fields in procedures.items()]
+
+    @classmethod
+    def load(cls, procedure_id: int) -> Optional['ProcedureSnapshot']:
+        snapshots = cls.load_many(FlightProcedure.id == procedure_id)
+        return snapshots[0] if snapshots else None
+
+    # Views
+
+    def coordinates(self):
+        """Read-only NumPy views of the waypoint latitudes, longitudes and altitudes"""
+        import numpy as np
+
+        views = []
+        for buffer in (self.latitudes, self.longitudes, self.altitudes):
+            view = np.frombuffer(buffer, dtype=np.float64) if len(buffer) else np.zeros(0)
+            view.flags.writeable = False
+            views.append(view)
+        return tuple(views)
+
+    def as_tuple(self) -> Tuple:
+        return (tuple(getattr(self, f) for f in _PROCEDURE_FIELDS),
+                tuple(w.as_tuple() for w in self.waypoints))
+
+    @property
+    def digest(self) -> str:
+        """Stable hash of the analysis inputs, usable as a cache key across processes.
+
+        Database ids, the procedure name and airport do not affect analysis
+        results and are left out.
+        """
+        if self._digest is None:
+            content = repr((
+                self.procedure_type.name, self.navigation_type.name,
+                self.minimum_altitude, self.maximum_altitude,
+                tuple(w.as_tuple()[1:] for w in self.waypoints)
+            ))
+            object.__setattr__(self, '_digest', hashlib.sha1(content.encode()).hexdigest())
+        return self._digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        if not isinstance(other, ProcedureSnapshot):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def __reduce__(self):
+        fields, waypoints = self.as_tuple()
+        return (_rebuild_snapshot, (fields, waypoints))
+
+    def __repr__(self):
+        return f"<ProcedureSnapshot {self.name} ({self.airport_icao}), {len(self.waypoints)} waypoints>"
+
+
+def _rebuild_snapshot(fields: Tuple, waypoints: Tuple) -> ProcedureSnapshot:
+    return ProcedureSnapshot(*fields, waypoints=waypoints)
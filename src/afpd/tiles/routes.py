@@ -0,0 +1,49 @@
+from flask import Blueprint, current_app, request, jsonify, make_response
+from flask_login import login_required
+from ..utils.metrics import span
+from ..utils.procedure_tiles import FORMATS, procedure_tiles
+from ..utils.terrain_tiles import STYLES, terrain_tiles
+
+bp = Blueprint('tiles', __name__)
+
+@bp.route('/terrain/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+@login_required
+def terrain_tile(z, x, y):
+    """Hillshade (default) or ``?style=tint`` elevation tint map tile from the local DEMs"""
+    style = request.args.get('style', 'hillshade')
+    if style not in STYLES:
+        return jsonify({'error': f"style must be one of {', '.join(STYLES)}"}), 400
+    if not (0 <= z <= current_app.config['TERRAIN_TILE_MAX_ZOOM'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 404
+    
+    with span('render'):
+        data, cached = terrain_tiles.tile(z, x, y, style)
+    if data is None:
+        return jsonify({'error': 'No local DEM configured'}), 404
+    
+    response = make_response(data)
+    response.mimetype = 'image/png'
+    response.headers['X-Tile-Cache'] = 'hit' if cached else 'miss'
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['TERRAIN_TILE_MAX_AGE']
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/procedures/<int:z>/<int:x>/<int:y>.<any(mvt, geojson):fmt>', methods=['GET'])
+@login_required
+def procedure_tile(z, x, y, fmt):
+    """Legs and waypoints of every stored procedure as a vector tile (MVT or GeoJSON)"""
+    if not (0 <= z <= current_app.config['PROCEDURE_TILE_MAX_ZOOM'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 404
+    
+    with span('render'):
+        data, cached = procedure_tiles.tile(z, x, y, fmt)
+    
+    response = make_response(data)
+    response.mimetype = FORMATS[fmt]
+    response.headers['X-Tile-Cache'] = 'hit' if cached else 'miss'
+    # Procedures change: browsers revalidate every time, mostly getting a 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
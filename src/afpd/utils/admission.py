@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+from .metrics import metrics, span
+
+PRIORITIES = ('interactive', 'batch')
+PRIORITY_HEADER = 'X-Request-Priority'
+
+
+class AdmissionRejected(Exception):
+    """A request refused by ``AdmissionController``: 429 over the user's quota, 503 when the queue is full"""
+
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ('rank', 'user', 'priority', 'granted', 'abandoned', 'wake')
+
+    def __init__(self, rank, user, priority: str, wake):
+        self.rank = rank
+        self.user = user
+        self.priority = priority
+        self.granted = False
+        self.abandoned = False
+        self.wake = wake
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        return self.rank < other.rank
+
+
+class AdmissionController:
+    """Concurrency limit for expensive analysis requests, with a priority queue.
+
+    At most ``max_concurrent`` requests run at once. Others wait in one
+    queue where interactive requests always go ahead of batch ones, first
+    come first served within a priority. A request is rejected straight
+    away with 429 when its user already has ``user_quota`` requests running
+    or queued, and with 503 when ``max_queue`` requests are queued (batch
+    requests already at ``batch_queue``) or when it waited longer than
+    ``queue_timeout`` seconds. Rejections carry a Retry-After estimate from
+    the recent run time of admitted requests.
+
+    Flask views wait on a ``threading.Event`` and ASGI handlers on a future
+    of their event loop, so both share the same slots.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16, batch_queue: int = 4,
+                 user_quota: int = 3, queue_timeout: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.batch_queue = batch_queue
+        self.user_quota = user_quota
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._queue = []
+        self._order = itertools.count()
+        self._running = 0
+        self._queued = dict.fromkeys(PRIORITIES, 0)
+        self._per_user: Dict[object, int] = {}
+        # Moving average of the time requests hold a slot, for Retry-After
+        self._hold_seconds = 1.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'running': self._running, 'queued': dict(self._queued)}
+
+    def acquire(self, user, priority: str = 'interactive') -> float:
+        """Wait for a slot in this thread; returns the seconds spent queued"""
+        event = threading.Event()
+        ticket = self._enter(user, priority, event.set)
+        if ticket.granted:
+            return 0.0
+        started = time.perf_counter()
+        event.wait(self.queue_timeout)
+        self._leave_queue(ticket)
+        return time.perf_counter() - started
+
+    async def acquire_async(self, user, priority: str = 'interactive') -> float:
+        """Wait for a slot on the running event loop; returns the seconds spent queued"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._enter(user, priority, wake)
+        if ticket.granted:
+            return 0.0
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away; give back a slot granted meanwhile
+            if not self._abandon(ticket):
+                self.release(user, 0.0)
+            raise
+        self._leave_queue(ticket)
+        return time.perf_counter() - started
+
+    def release(self, user, held: float):
+        """Free the slot of an admitted request that ran for ``held`` seconds"""
+        with self._lock:
+            self._running -= 1
+            self._forget_user(user)
+            self._hold_seconds += 0.2 * (held - self._hold_seconds)
+            self._grant()
+
+    def _enter(self, user, priority: str, wake) -> _Ticket:
+        if priority not in PRIORITIES:
+            raise ValueError(f'priority must be one of {", ".join(PRIORITIES)}')
+        with self._lock:
+            if self._per_user.get(user, 0) >= self.user_quota:
+                raise self._rejected(429, priority, 'quota',
+                                     f'Too many analysis requests in progress (at most {self.user_quota} per user)')
+            queued = sum(self._queued.values())
+            limit = self.max_queue if priority == 'interactive' else min(self.batch_queue, self.max_queue)
+            if self._running >= self.max_concurrent and queued >= limit:
+                raise self._rejected(503, priority, 'queue_full', 'Analysis queue is full, try again later')
+
+            ticket = _Ticket((PRIORITIES.index(priority), next(self._order)), user, priority, wake)
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+            heapq.heappush(self._queue, ticket)
+            self._queued[priority] += 1
+            self._grant()
+            return ticket
+
+    def _leave_queue(self, ticket: _Ticket):
+        """After waiting: raise 503 unless the ticket was granted a slot"""
+        if self._abandon(ticket):
+            with self._lock:
+                raise self._rejected(503, ticket.priority, 'timeout',
+                                     f'Waited {self.queue_timeout:g} s for an analysis slot, try again later')
+
+    def _abandon(self, ticket: _Ticket) -> bool:
+        """Drop a waiting ticket from the queue; False if it was granted a slot meanwhile"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            ticket.abandoned = True
+            self._queued[ticket.priority] -= 1
+            self._forget_user(ticket.user)
+            return True
+
+    def _grant(self):
+        """Hand free slots to the front of the queue (lock held)"""
+        while self._queue and self._running < self.max_concurrent:
+            ticket = heapq.heappop(self._queue)
+            if ticket.abandoned:
+                continue
+            ticket.granted = True
+            self._queued[ticket.priority] -= 1
+            self._running += 1
+            ticket.wake()
+
+    def _forget_user(self, user):
+        count = self._per_user.get(user, 0) - 1
+        if count > 0:
+            self._per_user[user] = count
+        else:
+            self._per_user.pop(user, None)
+
+    def _rejected(self, status: int, priority: str, reason: str, message: str) -> AdmissionRejected:
+        """Count a rejection (lock held)"""
+        metrics.inc('afpd_admission_rejected_total', priority=priority, reason=reason)
+        backlog = sum(self._queued.values()) + 1
+        retry_after = math.ceil(self._hold_seconds * backlog / max(self.max_concurrent, 1))
+        return AdmissionRejected(status, message, min(max(retry_after, 1), 60))
+
+
+class Admission:
+    """Flask extension limiting the views decorated with ``limited``.
+
+    Each app has one ``AdmissionController`` configured from ``app.config``
+    (defaulting to environment variables of the same name); the ASGI app
+    uses the controller of the Flask app it wraps. ``ADMISSION_MAX_CONCURRENT
+    = 0`` turns admission control off.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_MAX_CONCURRENT', int(os.getenv('ADMISSION_MAX_CONCURRENT', '4')))
+        app.config.setdefault('ADMISSION_MAX_QUEUE', int(os.getenv('ADMISSION_MAX_QUEUE', '16')))
+        app.config.setdefault('ADMISSION_BATCH_QUEUE', int(os.getenv('ADMISSION_BATCH_QUEUE', '4')))
+        app.config.setdefault('ADMISSION_USER_QUOTA', int(os.getenv('ADMISSION_USER_QUOTA', '3')))
+        app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '10')))  # seconds
+        controller = None
+        if app.config['ADMISSION_MAX_CONCURRENT'] > 0:
+            controller = AdmissionController(
+                max_concurrent=app.config['ADMISSION_MAX_CONCURRENT'],
+                max_queue=app.config['ADMISSION_MAX_QUEUE'],
+                batch_queue=app.config['ADMISSION_BATCH_QUEUE'],
+                user_quota=app.config['ADMISSION_USER_QUOTA'],
+                queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT']
+            )
+        app.extensions['afpd_admission'] = controller
+
+    @staticmethod
+    def for_app(app) -> Optional[AdmissionController]:
+        return app.extensions.get('afpd_admission')
+
+    def limited(self, priority: str):
+        """Decorator admitting a view through the app's controller as ``priority``.
+
+        Clients can ask for ``X-Request-Priority: batch`` on an interactive
+        view, so scripts do not compete with people; a view is never
+        upgraded. The time spent queued is the ``queue`` stage of the
+        response's Server-Timing header.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                controller = self.for_app(current_app)
+                if controller is None:
+                    return view(*args, **kwargs)
+
+                effective = request_priority(priority, request.headers.get(PRIORITY_HEADER))
+                user = current_user.get_id()
+                try:
+                    with span('queue', priority=effective):
+                        controller.acquire(user, effective)
+                except AdmissionRejected as e:
+                    return jsonify({'error': e.message}), e.status, {'Retry-After': str(e.retry_after)}
+
+                started = time.perf_counter()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    controller.release(user, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+
+def request_priority(priority: str, requested: Optional[str]) -> str:
+    """The view's priority, lowered to batch when the client asks for it"""
+    return 'batch' if (requested or '').strip().lower() == 'batch' else priority
+
+
+admission = Admission()
+
+
+def _queue_collector(registry):
+    from flask import has_app_context
+
+    if not has_app_context():
+        return
+    controller = admission.for_app(current_app)
+    if controller is not None:
+        stats = controller.stats()
+        registry.set_gauge('afpd_admission_running', stats['running'])
+        for priority, count in stats['queued'].items():
+            registry.set_gauge('afpd_admission_queued', count, priority=priority)
+
+
+metrics.register_collector(_queue_collector)
+metrics.describe('afpd_admission_running', 'gauge', 'Analysis requests holding an admission slot.')
+metrics.describe('afpd_admission_queued', 'gauge', 'Analysis requests waiting for an admission slot.')
+metrics.describe('afpd_admission_rejected_total', 'counter', 'Analysis requests refused by admission control.')
@@ -0,0 +1,106 @@
+import os
+
+from flask import current_app
+
+from ..preload import preload_hook
+from ..validation.icao_validator import ICAOValidator
+from .terrain_analysis import TerrainAnalyzer
+from .track import TrackGenerator
+
+
+class AnalysisServices:
+    """The terrain analyzer and ICAO validator of one application.
+
+    Both share a ``TrackGenerator``, so a track built by one is found in
+    the cache by the other. Every shared cache (tracks, elevations, DEM
+    tiles) is guarded by a lock, and remote elevation providers keep one
+    HTTP session per thread, so one instance serves every request thread.
+    """
+
+    def __init__(self, analyzer: TerrainAnalyzer, validator: ICAOValidator):
+        self.analyzer = analyzer
+        self.validator = validator
+
+    @classmethod
+    def from_config(cls, config) -> 'AnalysisServices':
+        tracks = TrackGenerator(max_cached=config['TRACK_CACHE_SIZE'])
+        analyzer = TerrainAnalyzer(
+            resolver_options={
+                'api_url': config['ELEVATION_API_URL'],
+                'backup_urls': config['ELEVATION_BACKUP_URLS'],
+                'high_res_dem': config['DEM_HIGHRES_DIR'],
+                'global_dem': config['DEM_GLOBAL_DIR'],
+                'timeout': config['ELEVATION_TIMEOUT'],
+                'chunk_size': config['ELEVATION_CHUNK_SIZE'],
+                'max_retries': config['ELEVATION_MAX_RETRIES'],
+                'retry_delay': config['ELEVATION_RETRY_DELAY'],
+                'hedge_percentile': config['ELEVATION_HEDGE_PERCENTILE'],
+                'max_connections': config['ELEVATION_MAX_CONNECTIONS']
+            },
+            samples_between_waypoints=config['TERRAIN_SAMPLES_BETWEEN_WAYPOINTS'],
+            elevation_cache_size=config['ELEVATION_CACHE_SIZE'],
+            track_generator=tracks
+        )
+        validator = ICAOValidator(track_generator=tracks, disabled_rules=config['ICAO_DISABLED_RULES'],
+                                  rule_severity=config['ICAO_RULE_SEVERITY'])
+        return cls(analyzer, validator)
+
+
+class Analysis:
+    """Flask extension providing ``analyzer`` and ``validator`` for the current app.
+
+    Settings come from ``app.config``, defaulting to environment variables
+    of the same name. The elevation provider chain is built on first use.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backup_urls = os.getenv('ELEVATION_BACKUP_URLS', '')
+        app.config.setdefault('ELEVATION_API_URL',
+                              os.getenv('ELEVATION_API_URL', 'https://api.open-elevation.com/api/v1/lookup'))
+        # Backup URLs must speak the Open-Elevation lookup protocol
+        app.config.setdefault('ELEVATION_BACKUP_URLS', [u for u in backup_urls.split(',') if u])
+        app.config.setdefault('DEM_HIGHRES_DIR', os.getenv('DEM_HIGHRES_DIR'))
+        app.config.setdefault('DEM_GLOBAL_DIR', os.getenv('DEM_GLOBAL_DIR'))
+        app.config.setdefault('ELEVATION_TIMEOUT', float(os.getenv('ELEVATION_TIMEOUT', '5')))  # seconds
+        app.config.setdefault('ELEVATION_CHUNK_SIZE', int(os.getenv('ELEVATION_CHUNK_SIZE', '50')))  # points
+        app.config.setdefault('ELEVATION_MAX_RETRIES', int(os.getenv('ELEVATION_MAX_RETRIES', '3')))
+        app.config.setdefault('ELEVATION_RETRY_DELAY', float(os.getenv('ELEVATION_RETRY_DELAY', '1')))  # seconds
+        app.config.setdefault('ELEVATION_HEDGE_PERCENTILE', float(os.getenv('ELEVATION_HEDGE_PERCENTILE', '0.95')))
+        app.config.setdefault('ELEVATION_MAX_CONNECTIONS', int(os.getenv('ELEVATION_MAX_CONNECTIONS', '100')))
+        app.config.setdefault('ELEVATION_CACHE_SIZE', int(os.getenv('ELEVATION_CACHE_SIZE', '200000')))  # 0 disables
+        app.config.setdefault('TERRAIN_SAMPLES_BETWEEN_WAYPOINTS',
+                              int(os.getenv('TERRAIN_SAMPLES_BETWEEN_WAYPOINTS', '20')))
+        app.config.setdefault('TRACK_CACHE_SIZE', int(os.getenv('TRACK_CACHE_SIZE', '256')))
+        # Rule names, and rule=severity pairs, as in validation.rules.RULES
+        disabled_rules = os.getenv('ICAO_DISABLED_RULES', '')
+        rule_severity = os.getenv('ICAO_RULE_SEVERITY', '')
+        app.config.setdefault('ICAO_DISABLED_RULES', [r.strip() for r in disabled_rules.split(',') if r.strip()])
+        app.config.setdefault('ICAO_RULE_SEVERITY', dict(
+            (name.strip(), severity.strip()) for name, _, severity in
+            (pair.partition('=') for pair in rule_severity.split(',') if pair.strip())
+        ))
+        app.extensions['afpd_analysis'] = AnalysisServices.from_config(app.config)
+
+    @staticmethod
+    def for_app(app) -> AnalysisServices:
+        return app.extensions['afpd_analysis']
+
+    @property
+    def analyzer(self) -> TerrainAnalyzer:
+        return current_app.extensions['afpd_analysis'].analyzer
+
+    @property
+    def validator(self) -> ICAOValidator:
+        return current_app.extensions['afpd_analysis'].validator
+
+
+services = Analysis()
+
+
+@preload_hook
+def _preload_elevation_data(app):
+    services.for_app(app).analyzer.preload()
@@ -0,0 +1,194 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from ..models.user import User
+from ..validation.icao_validator import ICAOValidator
+from .analysis import services
+from .synthetic import (StubTerrainAnalyzer, first_procedure_id, make_procedure,
+                        populate_database)
+from .. import create_app, db
+
+BENCH_USER = {'username': 'bench', 'email': 'bench@example.invalid', 'password': 'bench'}
+
+
+def time_call(fn: Callable, repeat: int = 20, warmup: int = 2) -> Dict:
+    """Run ``fn`` repeatedly and return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+
+    samples.sort()
+    return {
+        'rounds': repeat,
+        'min_ms': samples[0],
+        'max_ms': samples[-1],
+        'mean_ms': statistics.fmean(samples),
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        'stdev_ms': statistics.stdev(samples) if len(samples) > 1 else 0.0
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _analysis_cases() -> Dict[str, Callable]:
+    """In-process cases that exercise the analyzer and validator directly"""
+    analyzer = StubTerrainAnalyzer()
+    validator = ICAOValidator()
+    approach = make_procedure('short_approach')
+    star = make_procedure('star_50')
+
+    return {
+        'terrain.analyze_procedure[short_approach]': lambda: analyzer.analyze_procedure(approach),
+        'terrain.analyze_procedure[star_50]': lambda: analyzer.analyze_procedure(star),
+        'terrain.analyze_segment': lambda: analyzer.analyze_segment(
+            approach.waypoints[0], approach.waypoints[1]
+        ),
+        'validator.validate_procedure[short_approach]': lambda: validator.validate_procedure(approach),
+        'validator.validate_procedure[star_50]': lambda: validator.validate_procedure(star),
+    }
+
+
+def _build_bench_app(database_url: str, procedure_count: int):
+    """Create an isolated app with a populated database and a logged-in client"""
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False
+    })
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username=BENCH_USER['username'], email=BENCH_USER['email'])
+        user.set_password(BENCH_USER['password'])
+        db.session.add(user)
+        db.session.commit()
+
+        star_procedure = make_procedure('star_50')
+        db.session.add(star_procedure)
+        db.session.commit()
+        star_id = star_procedure.id
+
+        populate_database(procedure_count)
+
+    client = app.test_client()
+    client.post('/auth/login', data={
+        'username': BENCH_USER['username'],
+        'password': BENCH_USER['password']
+    })
+    return app, client, star_id
+
+
+def _api_cases(app, client, star_id: int) -> Dict[str, Callable]:
+    """Cases that go through the full Flask request/response cycle"""
+    with app.app_context():
+        procedure_id = first_procedure_id()
+
+    def get(url):
+        def call():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+        return call
+
+    def post(url, body):
+        def call():
+            response = client.post(url, json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f'POST {url} returned {response.status_code}')
+        return call
+
+    return {
+        'api.chain[star_50]': get(f'/api/chain?procedure_id={star_id}'),
+        'api.terrain[star_50]': get(f'/api/procedures/{star_id}/terrain'),
+        'api.get_procedure': get(f'/api/procedures/{procedure_id}'),
+        'api.get_procedures': get('/api/procedures'),
+        'api.spatial_radius': get('/api/spatial/radius?lat=45.0&lon=7.0&radius_nm=10'),
+        'api.spatial_bbox': get('/api/spatial/bbox?min_lat=44.9&min_lon=6.9&max_lat=45.1&max_lon=7.1'),
+        'api.spatial_corridor': post('/api/spatial/corridor', {
+            'path': [{'latitude': 44.5, 'longitude': 5.5}, {'latitude': 46.0, 'longitude': 8.0}],
+            'half_width_nm': 5
+        }),
+        'core.index': get('/'),
+    }
+
+
+def run_benchmarks(repeat: int = 20, api_repeat: int = 5, procedure_count: int = 10000,
+                   database_url: str = 'sqlite://', only: Optional[List[str]] = None,
+                   echo: Callable[[str], None] = print) -> Dict:
+    """Run the benchmark suite and return a JSON-serialisable result document"""
+    def selected(name):
+        return not only or any(name.startswith(prefix) for prefix in only)
+
+    results = {}
+
+    for name, fn in _analysis_cases().items():
+        if selected(name):
+            results[name] = time_call(fn, repeat=repeat)
+            echo(f"{name:50s} {results[name]['median_ms']:10.3f} ms")
+
+    if not only or any(prefix.split('.')[0] in ('api', 'core') for prefix in only):
+        app, client, star_id = _build_bench_app(database_url, procedure_count)
+        services.for_app(app).analyzer = StubTerrainAnalyzer()
+        for name, fn in _api_cases(app, client, star_id).items():
+            if selected(name):
+                results[name] = time_call(fn, repeat=api_repeat, warmup=1)
+                echo(f"{name:50s} {results[name]['median_ms']:10.3f} ms")
+
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'procedure_count': procedure_count,
+            'database': database_url.split(':', 1)[0]
+        },
+        'results': results
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.2) -> List[Dict]:
+    """Return the benchmarks whose median slowed down by more than ``threshold``"""
+    regressions = []
+    for name, stats in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous['median_ms']:
+            continue
+        change = stats['median_ms'] / previous['median_ms'] - 1.0
+        if change > threshold:
+            regressions.append({
+                'name': name,
+                'baseline_ms': previous['median_ms'],
+                'current_ms': stats['median_ms'],
+                'change': change
+            })
+    return regressions
+
+
+def write_results(results: Dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
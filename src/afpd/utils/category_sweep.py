@@ -0,0 +1,180 @@
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+from ..models.flight_procedure import FlightProcedure, ProcedureType
+from ..models.snapshot import ProcedureSnapshot
+from ..validation.rules import FEET_PER_NM
+from .elevation_cache import ESTIMATED
+from .metrics import span
+
+CATEGORIES = ('A', 'B', 'C', 'D', 'E')
+
+
+class CategorySweep:
+    """ICAO compliance of a procedure for several aircraft categories at once.
+
+    The terrain along the nominal track is sampled and assessed once. The
+    category dependent checks then run as arrays with one row per
+    category:
+
+    - turns: each category flies at the lower of its PANS-OPS maximum
+      speed and the waypoint speed constraints, which sets its turn radii,
+      fly-over feasibility and the leg length its turns need;
+    - gradient: the climb/descent gradient between altitude constraints
+      against the category's maximum gradient;
+    - climb (SIDs only): the climb gradient needed from the first waypoint
+      to clear terrain and reach every altitude constraint, against the
+      gradient the category is assumed to achieve.
+
+    Gradients default to the validator's values and can be overridden per
+    category. Distances are measured along the procedure's nominal track
+    for every category.
+    """
+
+    def __init__(self, analyzer, validator):
+        self.analyzer = analyzer
+        self.validator = validator
+
+    def evaluate(self, procedure: Union[FlightProcedure, ProcedureSnapshot],
+                 categories: Sequence[str] = CATEGORIES,
+                 climb_gradients: Optional[Mapping[str, float]] = None,
+                 max_gradients: Optional[Mapping[str, float]] = None) -> Dict:
+        """Compliance matrix of ``procedure``, one entry per category"""
+        import numpy as np
+
+        procedure = ProcedureSnapshot.coerce(procedure)
+        waypoints = procedure.waypoints
+        if len(waypoints) < 2:
+            return {
+                'status': 'error',
+                'message': 'Procedure must have at least 2 waypoints'
+            }
+
+        procedure_type = procedure.procedure_type
+        category_speed = self.validator.category_speed[procedure_type]
+        unknown = [c for c in categories if c not in category_speed]
+        if unknown:
+            return {
+                'status': 'error',
+                'message': f"Unknown aircraft categories: {', '.join(unknown)}"
+            }
+
+        # Shared by every category: terrain along the nominal track
+        points, elevations = self.analyzer.sample_terrain(procedure)
+        if not elevations:
+            return {
+                'status': 'error',
+                'message': 'Failed to get elevation data'
+            }
+        with span('clearance'):
+            clearance = self.analyzer.analyze_clearance(procedure_type.name, points, elevations, waypoints)
+
+        with span('categories'):
+            climb_gradients = climb_gradients or {}
+            max_gradients = max_gradients or {}
+            speed_limit = np.array([category_speed[c] for c in categories], dtype=float)
+            climb = np.array([climb_gradients.get(c, self.validator.climb_gradient) for c in categories])
+            max_gradient = np.array([max_gradients.get(c, self.validator.max_gradient[procedure_type])
+                                     for c in categories])
+
+            # Speed constraints hold until the next one; each category flies
+            # no faster than its maximum speed
+            constraint = np.array([w.speed_constraint or np.nan for w in waypoints], dtype=float)
+            index = np.maximum.accumulate(np.where(np.isnan(constraint), -1, np.arange(len(waypoints))))
+            constraint = np.where(index >= 0, constraint[np.maximum(index, 0)], np.inf)
+            speeds = np.minimum(constraint[None, :], speed_limit[:, None])
+
+            turns = self.validator.track_generator.turn_requirements(procedure, speeds)
+            short_legs = turns['leg_required'] > turns['leg_lengths']
+            infeasible = ~turns['feasible']
+
+            # The gradient the validator's ``gradient`` rule checks
+            features = self.validator.features(procedure, 'gradient', 'flown_distance')
+            leg_gradient = features['gradient']
+            legs = features['flown_distance']
+            steep = np.nan_to_num(leg_gradient, nan=0.0)[None, :] > max_gradient[:, None]
+
+            required_climb = None
+            if procedure_type == ProcedureType.SID:
+                required_climb = self._required_climb(procedure, points, elevations, legs)
+
+        non_compliant = []
+        matrix = []
+        for k, category in enumerate(categories):
+            critical, warnings = [], []
+            for i in np.flatnonzero(steep[k]).tolist():
+                critical.append(
+                    f"Gradient between {waypoints[i].name} and {waypoints[i + 1].name} "
+                    f"exceeds maximum ({leg_gradient[i]:.1f}% > {max_gradient[k]:g}%)"
+                )
+            for i in np.flatnonzero(infeasible[k]).tolist():
+                critical.append(
+                    f"Fly-over turn at {waypoints[i + 1].name} cannot reach the next waypoint "
+                    f"(turn radius {turns['radius'][k, i]:.1f} NM)"
+                )
+            for i in np.flatnonzero(short_legs[k]).tolist():
+                warnings.append(
+                    f"Leg {waypoints[i].name}-{waypoints[i + 1].name} ({turns['leg_lengths'][i]:.1f} NM) "
+                    f"is shorter than the turns at its ends need ({turns['leg_required'][k, i]:.1f} NM)"
+                )
+            climb_ok = None
+            if required_climb is not None:
+                climb_ok = bool(climb[k] >= required_climb)
+                if not climb_ok:
+                    critical.append(
+                        f"Climb gradient required ({required_climb:.1f}%) exceeds "
+                        f"the category's climb gradient ({climb[k]:g}%)"
+                    )
+
+            checks = {
+                'terrain': not clearance['violations'],
+                'gradient': not steep[k].any(),
+                'turns': not infeasible[k].any(),
+                'climb': climb_ok
+            }
+            compliant = all(v is not False for v in checks.values())
+            if not compliant:
+                non_compliant.append(category)
+            matrix.append({
+                'category': category,
+                'maximum_speed': float(speed_limit[k]),
+                'max_gradient': float(max_gradient[k]),
+                'climb_gradient': float(climb[k]) if required_climb is not None else None,
+                'compliant': compliant,
+                'checks': checks,
+                'critical': critical,
+                'warnings': warnings
+            })
+
+        return {
+            'status': 'success',
+            'procedure_id': procedure.id,
+            'procedure_type': procedure_type.value,
+            'minimum_obstacle_clearance': self.analyzer.minimum_obstacle_clearance[procedure_type.name],
+            'required_climb_gradient': required_climb,
+            'terrain': {
+                'violations': len(clearance['violations']),
+                'warnings': len(clearance['warnings'])
+            },
+            'compliant_categories': [c for c in categories if c not in non_compliant],
+            'categories': matrix,
+            'using_estimated_data': any(p.get('elevation_source') == ESTIMATED for p in points)
+        }
+
+    def _required_climb(self, procedure: ProcedureSnapshot, points, elevations, legs) -> float:
+        """Climb gradient (%) from the first waypoint that clears terrain and reaches every constraint"""
+        import numpy as np
+
+        waypoints = procedure.waypoints
+        start = self.analyzer.altitude_profile(points, waypoints)[0]
+        clearance = self.analyzer.minimum_obstacle_clearance[procedure.procedure_type.name]
+
+        distance = np.array([p['distance'] for p in points])
+        targets = np.asarray(elevations, dtype=float) + clearance
+        waypoint_distance = np.cumsum(legs)
+        constraints = np.array([w.altitude_constraint or np.nan for w in waypoints[1:]], dtype=float)
+
+        distance = np.concatenate([distance, waypoint_distance])
+        targets = np.concatenate([targets, np.nan_to_num(constraints, nan=-np.inf)])
+        ahead = distance > 0
+        gradient = (targets[ahead] - start) / (distance[ahead] * FEET_PER_NM) * 100
+        return max(float(gradient.max(initial=0.0)), 0.0)
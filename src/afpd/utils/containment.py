@@ -0,0 +1,205 @@
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from ..models.flight_procedure import FlightProcedure
+from ..models.snapshot import ProcedureSnapshot
+from .metrics import span
+from .route_optimizer import CostGrid, CostGridCache, grid_cache
+from .spatial_index import expand_bbox
+
+logger = logging.getLogger(__name__)
+
+# Per worker process: the scenario shared by every chunk it evaluates
+_worker_scenario: Optional['_Scenario'] = None
+
+
+class _Scenario:
+    """Everything needed to simulate tracks of one procedure, picklable for worker processes"""
+
+    def __init__(self, track, distances, altitudes, leg_starts, sigma: float, correlation_nm: float,
+                 grid: CostGrid):
+        import numpy as np
+
+        self.track = track
+        self.distances = distances
+        self.altitudes = altitudes
+        self.leg_starts = leg_starts
+        self.sigma = sigma
+        self.grid = grid
+        # AR(1) correlation between consecutive samples: a first-order
+        # Gauss-Markov cross-track error with the given correlation distance
+        self.correlation = np.exp(-np.diff(distances) / correlation_nm)
+
+    def simulate(self, seed, count: int):
+        """Lowest clearance on every leg for ``count`` perturbed tracks, shape ``(count, legs)``"""
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        # Cross-track offsets need no more than single precision
+        noise = rng.standard_normal((count, len(self.distances)), dtype=np.float32)
+        offsets = np.empty_like(noise)
+        offsets[:, 0] = self.sigma * noise[:, 0]
+        innovation = self.sigma * np.sqrt(1 - self.correlation ** 2)
+        for k, (rho, scale) in enumerate(zip(self.correlation.tolist(), innovation.tolist()), start=1):
+            offsets[:, k] = rho * offsets[:, k - 1] + scale * noise[:, k]
+
+        latitudes, longitudes = self.track.offset_positions(self.distances, offsets)
+        clearance = self.altitudes - self.grid.elevation_at(latitudes, longitudes)
+        return np.minimum.reduceat(clearance, self.leg_starts, axis=1).astype(np.float32)
+
+
+def _init_worker(scenario: _Scenario):
+    global _worker_scenario
+    _worker_scenario = scenario
+
+
+def _simulate_in_worker(task):
+    seed, count = task
+    return _worker_scenario.simulate(seed, count)
+
+
+class ContainmentAnalyzer:
+    """Monte Carlo terrain risk within the navigation containment of a procedure.
+
+    Thousands of tracks are generated around the nominal track (see
+    ``TrackGenerator``) with a correlated cross-track error whose 95% bound
+    is the lateral navigation accuracy for the navigation and procedure
+    type, e.g. RNP 0.3 on approaches. Terrain comes from a cached elevation
+    grid around the containment, so all tracks are sampled with one
+    vectorized lookup per chunk. A leg is violated on a track when its
+    clearance drops below the minimum obstacle clearance anywhere on that
+    leg.
+
+    Tracks are evaluated ``chunk_size`` at a time, which bounds memory; with
+    ``workers`` the chunks run in a process pool. Chunks draw from
+    independent child seeds, so results do not depend on ``workers``.
+    Procedures whose grid would exceed ``max_cells`` are refused, since
+    every cell is one elevation lookup.
+    """
+
+    def __init__(self, analyzer, cache: CostGridCache = grid_cache, samples: int = 2000,
+                 chunk_size: int = 500, workers: int = 0, spacing_nm: float = 0.1,
+                 grid_cell_nm: float = 0.25, correlation_nm: float = 5.0, max_cells: int = 400000):
+        self.analyzer = analyzer
+        self.cache = cache
+        self.samples = samples
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.spacing_nm = spacing_nm
+        self.grid_cell_nm = grid_cell_nm
+        self.correlation_nm = correlation_nm
+        self.max_cells = max_cells
+        # 95% lateral navigation error (NM) by navigation and procedure type
+        self.lateral_error = {
+            'RNP': {'SID': 1.0, 'STAR': 1.0, 'APPROACH': 0.3},
+            'RNAV': {'SID': 1.0, 'STAR': 1.0, 'APPROACH': 0.3},
+            'ILS': {'SID': 1.0, 'STAR': 1.0, 'APPROACH': 0.1},
+            'VOR': {'SID': 2.0, 'STAR': 2.0, 'APPROACH': 1.0},
+            'NDB': {'SID': 2.5, 'STAR': 2.5, 'APPROACH': 1.25}
+        }
+
+    def _grid_bounds(self, track, error_95: float) -> Tuple[float, float, float, float]:
+        """Region of the terrain grid covering every simulated track (5 sigma either side)"""
+        latitudes, longitudes = track.positions(track.distances)
+        reach = 5 * error_95 / 1.96 + self.grid_cell_nm
+        low = expand_bbox(float(latitudes.min()), float(longitudes.min()), reach)
+        high = expand_bbox(float(latitudes.max()), float(longitudes.max()), reach)
+        return low[0], low[1], high[2], high[3]
+
+    def _scenario(self, procedure: ProcedureSnapshot, track, bounds, error_95: float) -> Tuple[_Scenario, bool]:
+        import numpy as np
+
+        waypoint_distances = track.waypoint_distances
+        distances = np.unique(np.concatenate([
+            np.arange(0.0, track.length, self.spacing_nm), waypoint_distances
+        ]))
+
+        # Nominal altitude profile, interpolated as in the terrain analysis
+        waypoint_points = [{'distance': d, 'is_waypoint': True, 'waypoint': w}
+                           for d, w in zip(waypoint_distances.tolist(), procedure.waypoints)]
+        waypoint_altitudes = self.analyzer.altitude_profile(waypoint_points, procedure.waypoints)
+        altitudes = np.interp(distances, waypoint_distances, waypoint_altitudes)
+        leg_starts = np.searchsorted(distances, waypoint_distances[:-1])
+
+        grid, cached = self.cache.get(bounds, self.grid_cell_nm, self.analyzer.elevation_resolver,
+                                      max_cells=self.max_cells)
+
+        scenario = _Scenario(track, distances, altitudes, leg_starts, error_95 / 1.96,
+                             self.correlation_nm, grid)
+        return scenario, cached
+
+    def _chunks(self, seed: Optional[int]) -> List[Tuple]:
+        import numpy as np
+
+        counts = [min(self.chunk_size, self.samples - start) for start in range(0, self.samples, self.chunk_size)]
+        return list(zip(np.random.SeedSequence(seed).spawn(len(counts)), counts))
+
+    def analyze(self, procedure: Union[FlightProcedure, ProcedureSnapshot], seed: Optional[int] = None) -> Dict:
+        """Probability of a terrain clearance violation on each leg"""
+        import numpy as np
+
+        procedure = ProcedureSnapshot.coerce(procedure)
+        waypoints = procedure.waypoints
+        if len(waypoints) < 2:
+            return {
+                'status': 'error',
+                'message': 'Procedure must have at least 2 waypoints'
+            }
+
+        procedure_type = procedure.procedure_type.name
+        error_95 = self.lateral_error[procedure.navigation_type.name][procedure_type]
+        required = self.analyzer.minimum_obstacle_clearance[procedure_type]
+
+        with span('sampling'):
+            track = self.analyzer.track_generator.build(procedure)
+            bounds = self._grid_bounds(track, error_95)
+            # The cache builds missing grids over the snapped region
+            rows, cols = CostGrid.dimensions(self.cache.snap(bounds), self.grid_cell_nm)
+            if rows * cols > self.max_cells:
+                return {
+                    'status': 'error',
+                    'message': f'Containment grid exceeds {self.max_cells} cells; use a larger cell_nm'
+                }
+            scenario, cached = self._scenario(procedure, track, bounds, error_95)
+
+        with span('monte_carlo'):
+            chunks = self._chunks(seed)
+            if self.workers > 1 and len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(scenario,)) as pool:
+                    results = list(pool.map(_simulate_in_worker, chunks))
+            else:
+                results = [scenario.simulate(child, count) for child, count in chunks]
+            leg_clearance = np.concatenate(results)
+
+        violated = leg_clearance < required
+        probability = violated.mean(axis=0)
+        any_violation = float(violated.any(axis=1).mean())
+        lowest = np.percentile(leg_clearance, [5, 50], axis=0)
+
+        legs = [{
+            'from_waypoint': waypoints[i].name,
+            'to_waypoint': waypoints[i + 1].name,
+            'violation_probability': float(probability[i]),
+            'standard_error': math.sqrt(probability[i] * (1 - probability[i]) / self.samples),
+            'minimum_clearance_p05': float(lowest[0, i]),
+            'minimum_clearance_median': float(lowest[1, i])
+        } for i in range(len(waypoints) - 1)]
+
+        return {
+            'status': 'success',
+            'procedure_id': procedure.id,
+            'samples': self.samples,
+            'lateral_error_95': error_95,
+            'correlation_nm': self.correlation_nm,
+            'required_clearance': required,
+            'violation_probability': any_violation,
+            'legs': legs,
+            'grid': {
+                'cell_nm': scenario.grid.cell_nm,
+                'cached': cached
+            },
+            'using_estimated_data': scenario.grid.estimated
+        }
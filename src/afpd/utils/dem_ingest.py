@@ -0,0 +1,561 @@
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .elevation import tile_key
+
+INT16_NODATA = -32768
+INT16_MAX = 32767
+# Output cells interpolated per step, and source cells read per window:
+# what bounds the memory of each worker, whatever the resolution
+BAND_CELLS = 1 << 22
+WINDOW_CELLS = 1 << 22
+
+# What ``DEMTileStore`` assumes when a manifest leaves a setting out
+_READER_DEFAULTS = {'tile_degrees': 1, 'scale': 1.0, 'offset': 0.0, 'units': 'm', 'nodata': None}
+
+# Tiles finished by the current run, one JSON line each, until it updates the manifest
+JOURNAL = 'ingest.journal'
+
+_HGT_NAME = re.compile(r'([NS])(\d{2})([EW])(\d{3})', re.IGNORECASE)
+
+# Per worker process: the ingest every tile job belongs to
+_worker_ingest: Optional['_Ingest'] = None
+
+
+class RasterSource:
+    """A raw DEM on a regular latitude/longitude grid, read by windows.
+
+    ``north``/``west`` are the coordinates of the centre of cell (0, 0) and
+    ``dy``/``dx`` the cell size in degrees, rows running south. Windows are
+    float32 arrays in the source units with NaN in voids. Sources are
+    pickled to worker processes, each of which opens the file itself.
+    """
+
+    def __init__(self, path: str, width: int, height: int, north: float, west: float,
+                 dx: float, dy: float, nodata: Optional[float] = None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.north = north
+        self.west = west
+        self.dx = dx
+        self.dy = dy
+        self.nodata = nodata
+        self._handle = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handle'] = None
+        return state
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """``(min_lat, min_lon, max_lat, max_lon)`` of the cell centres"""
+        return (self.north - (self.height - 1) * self.dy, self.west,
+                self.north, self.west + (self.width - 1) * self.dx)
+
+    def signature(self) -> str:
+        """Changes whenever the file is replaced"""
+        stat = os.stat(self.path)
+        return f'{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def window(self, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def _voids(self, values: np.ndarray) -> np.ndarray:
+        values = values.astype(np.float32)
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+
+class HGTSource(RasterSource):
+    """SRTM ``.hgt`` tile, optionally zipped: a square big-endian int16 grid in metres, edges included"""
+
+    def __init__(self, path: str):
+        match = _HGT_NAME.search(os.path.basename(path))
+        if not match:
+            raise ValueError(f'{path}: no tile name such as N45E006 in the file name')
+        lat = int(match[2]) * (1 if match[1].upper() == 'N' else -1)
+        lon = int(match[4]) * (1 if match[3].upper() == 'E' else -1)
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                size = archive.getinfo(self._member(archive)).file_size
+        else:
+            size = os.path.getsize(path)
+        side = math.isqrt(size // 2)
+        if side < 2 or side * side * 2 != size:
+            raise ValueError(f'{path}: {size} bytes is not a square int16 grid')
+        step = 1 / (side - 1)
+        super().__init__(path, side, side, lat + 1, lon, step, step, nodata=INT16_NODATA)
+
+    @staticmethod
+    def _member(archive: zipfile.ZipFile) -> str:
+        names = [name for name in archive.namelist() if name.lower().endswith('.hgt')]
+        if len(names) != 1:
+            raise ValueError(f'{archive.filename}: expected one .hgt file in the archive')
+        return names[0]
+
+    def window(self, r0, r1, c0, c1):
+        if self._handle is None:
+            if self.path.lower().endswith('.zip'):
+                # A zipped tile is read whole: at most 26 MB for 1" data
+                with zipfile.ZipFile(self.path) as archive:
+                    data = archive.read(self._member(archive))
+                self._handle = np.frombuffer(data, dtype='>i2').reshape(self.height, self.width)
+            else:
+                self._handle = np.memmap(self.path, dtype='>i2', mode='r', shape=(self.height, self.width))
+        return self._voids(self._handle[r0:r1, c0:c1])
+
+
+class AsciiGridSource(RasterSource):
+    """ESRI ASCII grid (``.asc``): a short header, then one line of values per row, north first.
+
+    Opening the source scans the file once for the byte offset of every
+    row, so windows of a large region only parse the lines they need.
+    """
+
+    def __init__(self, path: str):
+        header = {}
+        with open(path, 'rb') as f:
+            while True:
+                position = f.tell()
+                line = f.readline()
+                parts = line.split()
+                if len(parts) != 2 or not parts[0][:1].isalpha():
+                    break
+                header[parts[0].decode().lower()] = float(parts[1])
+            offsets = []
+            while line:
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+                line = f.readline()
+
+        try:
+            width, height = int(header['ncols']), int(header['nrows'])
+            dx = header.get('dx', header.get('cellsize'))
+            dy = header.get('dy', header.get('cellsize'))
+            if 'xllcenter' in header:
+                west = header['xllcenter']
+            else:
+                west = header['xllcorner'] + dx / 2
+            if 'yllcenter' in header:
+                south = header['yllcenter']
+            else:
+                south = header['yllcorner'] + dy / 2
+        except (KeyError, TypeError):
+            raise ValueError(f'{path}: incomplete ASCII grid header') from None
+        if len(offsets) != height:
+            raise ValueError(f'{path}: {len(offsets)} rows of values, header says {height}')
+        super().__init__(path, width, height, south + (height - 1) * dy, west, dx, dy,
+                         nodata=header.get('nodata_value'))
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+    def window(self, r0, r1, c0, c1):
+        values = np.empty((r1 - r0, c1 - c0), dtype=np.float32)
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.offsets[r0]))
+            for i in range(r1 - r0):
+                values[i] = np.array(f.readline().split()[c0:c1], dtype=np.float32)
+        return self._voids(values)
+
+
+class GeoTIFFSource(RasterSource):
+    """GeoTIFF in latitude/longitude, read by windows through rasterio (an optional dependency)"""
+
+    def __init__(self, path: str):
+        try:
+            import rasterio
+        except ImportError:
+            raise ValueError(f'{path}: reading GeoTIFF needs rasterio (pip install rasterio)') from None
+
+        with rasterio.open(path) as dataset:
+            if dataset.crs is not None and not dataset.crs.is_geographic:
+                raise ValueError(f'{path}: not in latitude/longitude coordinates')
+            transform = dataset.transform
+            if transform.b or transform.d:
+                raise ValueError(f'{path}: rotated rasters are not supported')
+            dx, dy = transform.a, -transform.e
+            # GDAL gives the outer corner of the first cell
+            super().__init__(path, dataset.width, dataset.height, transform.f - dy / 2,
+                             transform.c + dx / 2, dx, dy, nodata=dataset.nodata)
+
+    def window(self, r0, r1, c0, c1):
+        import rasterio
+        from rasterio.windows import Window
+
+        if self._handle is None:
+            self._handle = rasterio.open(self.path)
+        return self._voids(self._handle.read(1, window=Window(c0, r0, c1 - c0, r1 - r0)))
+
+
+def open_source(path: str) -> RasterSource:
+    """The raster source for a file, by extension"""
+    name = path.lower()
+    if name.endswith('.hgt') or name.endswith('.hgt.zip'):
+        return HGTSource(path)
+    if name.endswith('.asc'):
+        return AsciiGridSource(path)
+    if name.endswith('.tif') or name.endswith('.tiff'):
+        return GeoTIFFSource(path)
+    raise ValueError(f'{path}: unsupported DEM format (.hgt, .hgt.zip, .asc, .tif)')
+
+
+def find_sources(paths: Sequence[str]) -> List[str]:
+    """Files to ingest: the given files, plus supported files anywhere under given directories"""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            found.extend(os.path.join(root, name) for name in sorted(files)
+                         if name.lower().endswith(('.hgt', '.hgt.zip', '.asc', '.tif', '.tiff')))
+    return found
+
+
+def _fractions(offsets: np.ndarray) -> np.ndarray:
+    """Interpolation weights, snapped to 0 or 1 on (almost) coinciding grids"""
+    fractions = offsets.astype(np.float32)
+    fractions[np.abs(fractions) < 1e-5] = 0
+    fractions[np.abs(fractions - 1) < 1e-5] = 1
+    return fractions
+
+
+def _lerp(a: np.ndarray, b: np.ndarray, fraction: np.ndarray) -> np.ndarray:
+    """``a + (b - a) * fraction``, exact at 0 and 1 even next to a void"""
+    return np.where(fraction == 0, a, np.where(fraction == 1, b, a + (b - a) * fraction))
+
+
+def resample(source: RasterSource, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Bilinear values of ``source`` on the grid ``lats`` (descending) x ``lons`` (ascending).
+
+    Returns float32 with NaN off the source and next to voids. The source is
+    read in windows of at most ``WINDOW_CELLS`` cells.
+    """
+    result = np.full((len(lats), len(lons)), np.nan, dtype=np.float32)
+    y = (source.north - lats) / source.dy
+    x = (lons - source.west) / source.dx
+    rows_in = np.flatnonzero((y > -1e-6) & (y < source.height - 1 + 1e-6))
+    cols_in = np.flatnonzero((x > -1e-6) & (x < source.width - 1 + 1e-6))
+    if not len(rows_in) or not len(cols_in):
+        return result
+
+    y = np.clip(y[rows_in], 0, source.height - 1)
+    x = np.clip(x[cols_in], 0, source.width - 1)
+    r0 = np.minimum(y.astype(np.int64), source.height - 2)
+    c0 = np.minimum(x.astype(np.int64), source.width - 2)
+    fy = _fractions(y - r0)
+    fx = _fractions(x - c0)[None, :]
+    left, right = int(c0[0]), int(c0[-1]) + 2
+    c0 -= left
+
+    span = max(2, WINDOW_CELLS // (right - left))
+    start = 0
+    while start < len(rows_in):
+        top = int(r0[start])
+        stop = int(np.searchsorted(r0, top + span - 2, side='right'))
+        window = source.window(top, int(r0[stop - 1]) + 2, left, right)
+        rows = r0[start:stop] - top
+        upper, lower = window[rows], window[rows + 1]
+        north = _lerp(upper[:, c0], upper[:, c0 + 1], fx)
+        south = _lerp(lower[:, c0], lower[:, c0 + 1], fx)
+        result[rows_in[start]:rows_in[stop - 1] + 1, cols_in[0]:cols_in[-1] + 1] = (
+            _lerp(north, south, fy[start:stop, None])
+        )
+        start = stop
+    return result
+
+
+def block_max(values: np.ndarray, cells: int) -> np.ndarray:
+    """Highest value of each ``cells`` x ``cells`` block of grid nodes, shared edges included, NaN-skipping"""
+    for axis in (0, 1):
+        starts = np.arange(0, values.shape[axis] - 1, cells)
+        blocks = np.fmax.reduceat(values, starts, axis=axis)
+        # Each block also reaches the first node of the next one
+        edges = np.take(values, starts[1:], axis=axis)
+        if axis == 0:
+            blocks[:-1] = np.fmax(blocks[:-1], edges)
+        else:
+            blocks[:, :-1] = np.fmax(blocks[:, :-1], edges)
+        values = blocks
+    return values
+
+
+class TileLayout:
+    """How tiles are written: extent, grid, value encoding and overview block size"""
+
+    def __init__(self, tile_degrees: int = 1, cells: int = 3600, dtype: str = 'int16',
+                 scale: float = 1.0, offset: float = 0.0, units: str = 'm', overview_cells: int = 60):
+        if dtype not in ('int16', 'float32'):
+            raise ValueError('dtype must be int16 or float32')
+        self.tile_degrees = tile_degrees
+        self.cells = cells
+        self.dtype = dtype
+        self.scale = scale
+        self.offset = offset
+        self.units = units
+        self.overview_cells = max(1, min(overview_cells, cells))
+
+    @property
+    def nodata(self) -> Optional[int]:
+        return INT16_NODATA if self.dtype == 'int16' else None
+
+    def manifest(self) -> Dict:
+        return {
+            'tile_degrees': self.tile_degrees,
+            'cells': self.cells,
+            'dtype': self.dtype,
+            'scale': self.scale,
+            'offset': self.offset,
+            'units': self.units,
+            'nodata': self.nodata,
+            'overview_cells': self.overview_cells
+        }
+
+    def encode(self, values: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Stored values, and how many were out of the int16 range and clipped"""
+        if self.dtype == 'float32':
+            return ((values - self.offset) / self.scale).astype(np.float32), 0
+        stored = np.rint((values - self.offset) / self.scale)
+        with np.errstate(invalid='ignore'):
+            clipped = int(np.count_nonzero(np.abs(stored) > INT16_MAX))
+        np.clip(stored, -INT16_MAX, INT16_MAX, out=stored)
+        stored[np.isnan(values)] = INT16_NODATA
+        return stored.astype(np.int16), clipped
+
+
+class _Ingest:
+    """One ingest run, picklable for worker processes"""
+
+    def __init__(self, sources: List[RasterSource], layout: TileLayout, output: str):
+        self.sources = sources
+        self.layout = layout
+        self.output = output
+
+    def tile(self, lat_index: int, lon_index: int, source_ids: Sequence[int]) -> Optional[Dict]:
+        """Write one tile and its overview, in bands of rows; the manifest entry, or None without data"""
+        layout = self.layout
+        key = tile_key(lat_index, lon_index, layout.tile_degrees)
+        nodes = layout.cells + 1
+        step = layout.tile_degrees / layout.cells
+        north = (lat_index + 1) * layout.tile_degrees
+        lons = lon_index * layout.tile_degrees + np.arange(nodes) * step
+        b = layout.overview_cells
+        band = max(b, BAND_CELLS // nodes // b * b)
+
+        path = os.path.join(self.output, f'{key}.npy')
+        temp = f'{path}.{os.getpid()}.tmp'
+        tile = np.lib.format.open_memmap(temp, mode='w+', dtype=layout.dtype, shape=(nodes, nodes))
+        overview = []
+        low, high, voids, clipped = math.inf, -math.inf, 0, 0
+        try:
+            # Bands share their edge row, so that overview blocks never straddle two bands
+            for i0 in range(0, nodes - 1, band):
+                i1 = min(i0 + band, nodes - 1)
+                lats = north - np.arange(i0, i1 + 1) * step
+                values = np.full((len(lats), nodes), np.nan, dtype=np.float32)
+                for source_id in source_ids:
+                    missing = np.isnan(values)
+                    if not missing.any():
+                        break
+                    values[missing] = resample(self.sources[source_id], lats, lons)[missing]
+                stored, band_clipped = layout.encode(values)
+                tile[i0:i1 + 1] = stored
+                overview.append(block_max(values, b))
+
+                finite = values[:-1] if i1 < nodes - 1 else values
+                count = int(np.count_nonzero(~np.isnan(finite)))
+                voids += finite.size - count
+                clipped += band_clipped
+                if count:
+                    low = min(low, float(np.nanmin(finite)))
+                    high = max(high, float(np.nanmax(finite)))
+            tile.flush()
+            del tile
+            if high == -math.inf:
+                os.remove(temp)
+                return None
+
+            os.makedirs(os.path.join(self.output, 'overviews'), exist_ok=True)
+            overview_path = os.path.join(self.output, 'overviews', f'{key}.npy')
+            with open(f'{overview_path}.{os.getpid()}.tmp', 'wb') as f:
+                np.save(f, np.concatenate(overview).astype(np.float32))
+            os.replace(f'{overview_path}.{os.getpid()}.tmp', overview_path)
+            os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        entry = {
+            'shape': [nodes, nodes],
+            'min': round(low, 2),
+            'max': round(high, 2),
+            'voids': round(voids / nodes ** 2, 6)
+        }
+        if clipped:
+            entry['clipped'] = clipped
+        return entry
+
+
+def _init_worker(ingest: _Ingest):
+    global _worker_ingest
+    _worker_ingest = ingest
+
+
+def _ingest_in_worker(job):
+    key, lat_index, lon_index, source_ids, signature = job
+    started = time.perf_counter()
+    entry = _worker_ingest.tile(lat_index, lon_index, source_ids)
+    return key, signature, entry, time.perf_counter() - started
+
+
+def _write_manifest(output: str, manifest: Dict):
+    path = os.path.join(output, 'manifest.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def _record(manifest: Dict, key: str, signature: str, entry: Optional[Dict]):
+    """Enter a finished tile (or a tile without data, ``entry`` None) in the manifest"""
+    if entry is None:
+        manifest['tiles'].pop(key, None)
+        manifest['empty'][key] = signature
+    else:
+        manifest['tiles'][key] = {**entry, 'source': signature}
+        manifest['empty'].pop(key, None)
+
+
+def _load_manifest(output: str, layout: TileLayout) -> Dict:
+    """The manifest of ``output`` with the tiles of an interrupted run, checked against ``layout``"""
+    manifest = {**layout.manifest(), 'tiles': {}, 'empty': {}}
+    path = os.path.join(output, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+        for name, value in layout.manifest().items():
+            current = existing.get(name, _READER_DEFAULTS.get(name, value))
+            if current != value:
+                raise ValueError(f'{output} holds tiles with {name}={current!r}, not {value!r}: '
+                                 'ingest into another directory')
+        manifest['tiles'] = existing.get('tiles', {})
+        manifest['empty'] = existing.get('empty', {})
+
+    journal = os.path.join(output, JOURNAL)
+    if os.path.exists(journal):
+        with open(journal) as f:
+            for line in f:
+                try:
+                    _record(manifest, *json.loads(line))
+                except ValueError:
+                    break  # the line being written when the run was killed
+    for directory in (output, os.path.join(output, 'overviews')):
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.tmp'):
+                    os.remove(os.path.join(directory, name))
+    return manifest
+
+
+def ingest(paths: Sequence[str], output: str, tile_degrees: int = 1, resolution: Optional[float] = None,
+           dtype: str = 'int16', scale: float = 1.0, offset: float = 0.0, units: str = 'm',
+           overview_cells: int = 60, workers: Optional[int] = None, force: bool = False,
+           echo: Callable[[str], None] = print) -> Dict:
+    """Convert raw DEM files into the tile directory ``output`` (see ``DEMTileStore``).
+
+    Every output tile is resampled from the sources overlapping it (earlier
+    sources win where they overlap), in worker processes that each hold
+    one band of one tile at a time. Tiles are written atomically and
+    logged to a journal as they complete, with a signature of their
+    sources and layout; the journal is folded into ``manifest.json`` at the
+    end. A later run, e.g. after the process was killed or with more
+    sources, skips the tiles whose signature is unchanged. ``resolution``
+    is in arc seconds and defaults to the finest source. Only one ingest
+    may write to a directory at a time.
+    """
+    sources = [open_source(path) for path in paths]
+    if not sources:
+        raise ValueError('No DEM files to ingest')
+    if resolution is None:
+        cells = round(tile_degrees / min(min(s.dx, s.dy) for s in sources))
+    else:
+        cells = round(tile_degrees * 3600 / resolution)
+    layout = TileLayout(tile_degrees, cells, dtype, scale, offset, units, overview_cells)
+    os.makedirs(output, exist_ok=True)
+    manifest = _load_manifest(output, layout)
+
+    # Tiles to write, each with the sources overlapping it
+    overlapping: Dict[Tuple[int, int], List[int]] = {}
+    for source_id, source in enumerate(sources):
+        min_lat, min_lon, max_lat, max_lon = source.bounds
+        for lat_index in range(math.floor(min_lat / tile_degrees), math.ceil(max_lat / tile_degrees)):
+            for lon_index in range(math.floor(min_lon / tile_degrees), math.ceil(max_lon / tile_degrees)):
+                overlapping.setdefault((lat_index, lon_index), []).append(source_id)
+    signatures = [source.signature() for source in sources]
+    layout_signature = json.dumps(layout.manifest(), sort_keys=True)
+
+    jobs, current = [], 0
+    for (lat_index, lon_index), source_ids in sorted(overlapping.items()):
+        key = tile_key(lat_index, lon_index, tile_degrees)
+        signature = hashlib.sha1('\n'.join(
+            [layout_signature] + [signatures[i] for i in source_ids]).encode()).hexdigest()[:16]
+        done = (manifest['tiles'].get(key, {}).get('source') == signature
+                and os.path.exists(os.path.join(output, f'{key}.npy'))) or manifest['empty'].get(key) == signature
+        if done and not force:
+            current += 1
+        else:
+            jobs.append((key, lat_index, lon_index, source_ids, signature))
+    echo(f'{len(sources)} source files, {len(overlapping)} tiles of {cells + 1}x{cells + 1} {dtype}: '
+         f'{len(jobs)} to write, {current} up to date')
+
+    run = _Ingest(sources, layout, output)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(run,))
+        results = pool.map(_ingest_in_worker, jobs)
+    else:
+        pool = None
+        _init_worker(run)
+        results = map(_ingest_in_worker, jobs)
+
+    written, empty, clipped = [], 0, 0
+    started = time.perf_counter()
+    journal_path = os.path.join(output, JOURNAL)
+    try:
+        with open(journal_path, 'a') as journal:
+            for key, signature, entry, seconds in results:
+                journal.write(json.dumps([key, signature, entry]) + '\n')
+                journal.flush()
+                _record(manifest, key, signature, entry)
+                if entry is None:
+                    empty += 1
+                    continue
+                written.append(key)
+                clipped += entry.get('clipped', 0)
+                echo(f"{key}: {entry['min']:.0f} to {entry['max']:.0f} {units}, "
+                     f"{entry['voids'] * 100:.1f}% voids, {seconds:.1f} s")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        _write_manifest(output, manifest)
+        os.remove(journal_path)
+
+    return {
+        'written': written,
+        'up_to_date': current,
+        'empty': empty,
+        'clipped': clipped,
+        'seconds': time.perf_counter() - started
+    }
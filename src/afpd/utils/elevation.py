@@ -0,0 +1,730 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .circuit_breaker import get_breaker
+from .elevation_cache import ESTIMATED
+from .metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+FEET_PER_METER = 3.28084
+
+
+class ElevationProvider:
+    """A source of terrain elevations.
+
+    Providers work on whole batches: ``coverage`` says which points they can
+    serve and ``fetch`` returns elevations in feet, NaN where it failed.
+    """
+
+    name = 'provider'
+
+    def coverage(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        return np.ones(lats.shape, dtype=bool)
+
+    def fetch(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    async def fetch_async(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """``fetch`` for the asynchronous API.
+
+        Local providers answer from memory-mapped tiles or formulas quickly
+        enough to run on the event loop; remote ones override this.
+        """
+        return self.fetch(lats, lons)
+
+
+def tile_origin(lats: np.ndarray, lons: np.ndarray, tile_degrees: float) -> Tuple[np.ndarray, np.ndarray]:
+    """South-west corner indices of the tiles containing each point"""
+    return (np.floor(lats / tile_degrees).astype(np.int64),
+            np.floor(lons / tile_degrees).astype(np.int64))
+
+
+def tile_key(lat_index: int, lon_index: int, tile_degrees: float = 1.0) -> str:
+    """SRTM-style name of a tile from its south-west corner, e.g. ``N45E006``"""
+    lat0 = int(round(lat_index * tile_degrees))
+    lon0 = int(round(lon_index * tile_degrees))
+    return (f"{'N' if lat0 >= 0 else 'S'}{abs(lat0):02d}"
+            f"{'E' if lon0 >= 0 else 'W'}{abs(lon0):03d}")
+
+
+class DEMTileStore:
+    """Read access to a directory of DEM tiles.
+
+    Layout: ``manifest.json`` plus one ``<key>.npy`` array per tile. Each
+    array covers ``tile_degrees`` x ``tile_degrees`` starting at the south-west
+    corner named by its key, row 0 being the northern edge and both edges
+    included (as in SRTM ``.hgt`` files). Stored values are converted to feet
+    with ``value * scale + offset`` (in ``units``); ``nodata`` marks voids.
+    Tiles are memory-mapped on first use and shared by all threads.
+    ``flask afpd dem ingest`` also writes ``overviews/<key>.npy``: the highest
+    elevation (in ``units``) of each block of ``overview_cells`` cells.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._read_manifest()
+
+    def _read_manifest(self):
+        with open(os.path.join(self.root, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.tile_degrees = float(self.manifest.get('tile_degrees', 1.0))
+        self.scale = float(self.manifest.get('scale', 1.0))
+        self.offset = float(self.manifest.get('offset', 0.0))
+        self.nodata = self.manifest.get('nodata')
+        self.to_feet = FEET_PER_METER if self.manifest.get('units', 'm') == 'm' else 1.0
+        self.tile_keys = frozenset(self.manifest.get('tiles', {}))
+        self.overview_cells = self.manifest.get('overview_cells')
+        self._tiles: Dict[str, np.ndarray] = {}
+        self._overviews: Dict[str, Optional[np.ndarray]] = {}
+
+    def open_all(self):
+        """Memory-map every tile now, e.g. in a pre-fork master process"""
+        for key in self.tile_keys:
+            self.tile(key)
+
+    def reload(self):
+        """Re-read the manifest and drop open tiles, after tiles were added or replaced"""
+        with self._lock:
+            self._read_manifest()
+
+    def tile(self, key: str) -> np.ndarray:
+        array = self._tiles.get(key)
+        if array is None:
+            with self._lock:
+                array = self._tiles.get(key)
+                if array is None:
+                    array = np.load(os.path.join(self.root, f'{key}.npy'), mmap_mode='r')
+                    self._tiles[key] = array
+        return array
+
+    def overview(self, key: str) -> Optional[np.ndarray]:
+        """Max-elevation overview of a tile, None if it was stored without one"""
+        if key not in self._overviews:
+            path = os.path.join(self.root, 'overviews', f'{key}.npy')
+            array = np.load(path, mmap_mode='r') if self.overview_cells and os.path.exists(path) else None
+            with self._lock:
+                self._overviews[key] = array
+        return self._overviews[key]
+
+    def max_elevation(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> float:
+        """Highest terrain in feet inside a box, NaN without coverage.
+
+        Read from the overviews where available, so the result may be that
+        of the terrain up to one overview block outside the box, never lower
+        than any elevation ``sample`` returns inside it.
+        """
+        degrees = self.tile_degrees
+        highest = np.nan
+        for lat_i in range(math.floor(min_lat / degrees), math.floor(max_lat / degrees) + 1):
+            for lon_i in range(math.floor(min_lon / degrees), math.floor(max_lon / degrees) + 1):
+                key = tile_key(lat_i, lon_i, degrees)
+                if key not in self.tile_keys:
+                    continue
+                tile = self.tile(key)
+                rows, cols = tile.shape
+                north, west = (lat_i + 1) * degrees, lon_i * degrees
+                y0 = (north - min(max_lat, north)) / degrees * (rows - 1)
+                y1 = (north - max(min_lat, north - degrees)) / degrees * (rows - 1)
+                x0 = (max(min_lon, west) - west) / degrees * (cols - 1)
+                x1 = (min(max_lon, west + degrees) - west) / degrees * (cols - 1)
+
+                overview = self.overview(key)
+                if overview is not None:
+                    b = self.overview_cells
+                    values = overview[int(min(y0, rows - 2) // b):int(min(y1, rows - 2) // b) + 1,
+                                      int(min(x0, cols - 2) // b):int(min(x1, cols - 2) // b) + 1]
+                    values = np.asarray(values, dtype=float) * self.to_feet
+                else:
+                    values = np.asarray(tile[math.floor(y0):math.ceil(y1) + 1,
+                                             math.floor(x0):math.ceil(x1) + 1], dtype=float)
+                    if self.nodata is not None:
+                        values[values == self.nodata] = np.nan
+                    values = (values * self.scale + self.offset) * self.to_feet
+                if np.isfinite(values).any():
+                    highest = np.fmax(highest, np.nanmax(values))
+        return float(highest)
+
+    def keys_for(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+        """Group points by tile: returns per-point group index and group keys"""
+        lat_idx, lon_idx = tile_origin(lats, lons, self.tile_degrees)
+        unique, inverse = np.unique(np.stack([lat_idx, lon_idx], axis=1), axis=0, return_inverse=True)
+        keys = [tile_key(int(lat_i), int(lon_i), self.tile_degrees) for lat_i, lon_i in unique]
+        return inverse.reshape(-1), keys
+
+    def covers(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        if not len(lats):
+            return np.zeros(0, dtype=bool)
+        inverse, keys = self.keys_for(lats, lons)
+        present = np.array([key in self.tile_keys for key in keys])
+        return present[inverse]
+
+    def sample(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Bilinearly interpolated elevations in feet, NaN outside coverage or in voids"""
+        result = np.full(lats.shape, np.nan)
+        if not len(lats):
+            return result
+        inverse, keys = self.keys_for(lats, lons)
+        for group, key in enumerate(keys):
+            if key not in self.tile_keys:
+                continue
+            idx = np.flatnonzero(inverse == group)
+            result[idx] = self._sample_tile(self.tile(key), lats[idx], lons[idx])
+        return result
+
+    def sample_grid(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """``sample`` on the grid ``lats`` x ``lons``, as a ``(len(lats), len(lons))`` array.
+
+        Both axes must be sorted (as in a map tile), so that each DEM tile
+        covers a block of the grid. Only the rows needed are read and the
+        interpolation runs in single precision, which makes a 256 x 256 map
+        tile cost about a millisecond.
+        """
+        result = np.full((len(lats), len(lons)), np.nan)
+        lat_idx = np.floor(lats / self.tile_degrees).astype(np.int64)
+        lon_idx = np.floor(lons / self.tile_degrees).astype(np.int64)
+        for lat_i in np.unique(lat_idx):
+            rows_in = np.flatnonzero(lat_idx == lat_i)
+            for lon_i in np.unique(lon_idx):
+                key = tile_key(int(lat_i), int(lon_i), self.tile_degrees)
+                if key not in self.tile_keys:
+                    continue
+                cols_in = np.flatnonzero(lon_idx == lon_i)
+                tile = self.tile(key)
+                rows, cols = tile.shape
+                y = (lat_i * self.tile_degrees + self.tile_degrees - lats[rows_in]) / self.tile_degrees * (rows - 1)
+                x = (lons[cols_in] - lon_i * self.tile_degrees) / self.tile_degrees * (cols - 1)
+                r0 = np.clip(np.floor(y).astype(np.int64), 0, rows - 2)
+                c0 = np.clip(np.floor(x).astype(np.int64), 0, cols - 2)
+                fy = (y - r0).astype(np.float32)[:, None]
+                fx = (x - c0).astype(np.float32)[None, :]
+
+                # Slice the rows needed, then pick the corner cells as stored
+                left = c0.min()
+                upper = tile[r0, left:c0.max() + 2]
+                lower = tile[r0 + 1, left:c0.max() + 2]
+                c0 = c0 - left
+                corners = [cells.astype(np.float32)
+                           for cells in (upper[:, c0], upper[:, c0 + 1], lower[:, c0], lower[:, c0 + 1])]
+                if self.nodata is not None:
+                    for cells in corners:
+                        cells[cells == self.nodata] = np.nan
+                north = corners[0] + (corners[1] - corners[0]) * fx
+                south = corners[2] + (corners[3] - corners[2]) * fx
+                values = north + (south - north) * fy
+                result[rows_in[0]:rows_in[-1] + 1, cols_in[0]:cols_in[-1] + 1] = (
+                    (values * self.scale + self.offset) * self.to_feet
+                )
+        return result
+
+    def _sample_tile(self, tile: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        rows, cols = tile.shape
+        lat0 = np.floor(lats / self.tile_degrees) * self.tile_degrees
+        lon0 = np.floor(lons / self.tile_degrees) * self.tile_degrees
+        y = (lat0 + self.tile_degrees - lats) / self.tile_degrees * (rows - 1)
+        x = (lons - lon0) / self.tile_degrees * (cols - 1)
+        r0 = np.clip(np.floor(y).astype(np.int64), 0, rows - 2)
+        c0 = np.clip(np.floor(x).astype(np.int64), 0, cols - 2)
+        fy = y - r0
+        fx = x - c0
+
+        corners = np.stack([tile[r0, c0], tile[r0, c0 + 1], tile[r0 + 1, c0], tile[r0 + 1, c0 + 1]]).astype(float)
+        if self.nodata is not None:
+            corners[corners == self.nodata] = np.nan
+        values = (corners[0] * (1 - fx) * (1 - fy) + corners[1] * fx * (1 - fy)
+                  + corners[2] * (1 - fx) * fy + corners[3] * fx * fy)
+        return (values * self.scale + self.offset) * self.to_feet
+
+
+class LocalDEMProvider(ElevationProvider):
+    """Elevations from an on-disk DEM tile store (see ``DEMTileStore``)"""
+
+    def __init__(self, root: str, name: str = 'dem'):
+        self.name = name
+        self.store = DEMTileStore(root)
+
+    def coverage(self, lats, lons):
+        return self.store.covers(lats, lons)
+
+    def fetch(self, lats, lons):
+        return self.store.sample(lats, lons)
+
+
+class RemoteElevationProvider(ElevationProvider):
+    """Open-Elevation compatible HTTP service, guarded by a circuit breaker.
+
+    ``fetch`` uses a ``requests`` session per thread, so connections are
+    reused without sharing a session between threads; ``fetch_async`` uses
+    ``aiohttp`` with one connection pool of at most ``max_connections`` per
+    event loop.
+    """
+
+    def __init__(self, url: str, name: Optional[str] = None, timeout: float = 5.0,
+                 chunk_size: int = 50, max_retries: int = 3, retry_delay: float = 1.0,
+                 max_connections: int = 100):
+        self.url = url
+        self.name = name or url
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_connections = max_connections
+        self.breaker = get_breaker(self.name)
+        self._latencies = deque(maxlen=200)
+        self._latency_lock = threading.Lock()
+        self._local = threading.local()
+        self._async_sessions = weakref.WeakKeyDictionary()
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Recent successful request latency at ``percentile`` (0-1), in seconds"""
+        with self._latency_lock:
+            samples = sorted(self._latencies)
+        if len(samples) < 10:
+            return None
+        return samples[min(len(samples) - 1, int(percentile * len(samples)))]
+
+    @staticmethod
+    def _payload(lats: np.ndarray, lons: np.ndarray) -> Dict:
+        return {'locations': [
+            {'latitude': float(lat), 'longitude': float(lon)} for lat, lon in zip(lats, lons)
+        ]}
+
+    @staticmethod
+    def _parse(payload: Dict, count: int) -> np.ndarray:
+        results = payload['results']
+        if len(results) != count:
+            raise ValueError(f'Expected {count} results, got {len(results)}')
+        return np.array([r['elevation'] for r in results], dtype=float) * FEET_PER_METER
+
+    def _record_latency(self, started: float):
+        self.breaker.record_success()
+        with self._latency_lock:
+            self._latencies.append(time.perf_counter() - started)
+
+    def _session(self):
+        """The ``requests`` session of the calling thread"""
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def fetch_chunk(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Single attempt for one chunk; raises on any failure"""
+        import requests
+
+        if not self.breaker.allow_request():
+            raise ConnectionError(f'{self.name} circuit breaker is open')
+        started = time.perf_counter()
+        try:
+            response = self._session().post(self.url, json=self._payload(lats, lons), timeout=self.timeout)
+            response.raise_for_status()
+            elevations = self._parse(response.json(), len(lats))
+        except (requests.RequestException, KeyError, TypeError, ValueError):
+            self.breaker.record_failure()
+            raise
+        self._record_latency(started)
+        return elevations
+
+    def fetch(self, lats, lons):
+        import requests
+
+        result = np.full(lats.shape, np.nan)
+        for start in range(0, len(lats), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            for attempt in range(self.max_retries):
+                try:
+                    result[chunk] = self.fetch_chunk(lats[chunk], lons[chunk])
+                    break
+                except (ConnectionError, requests.RequestException, KeyError, TypeError, ValueError) as e:
+                    if not self._should_retry(attempt, e):
+                        break
+                    if attempt + 1 < self.max_retries:
+                        time.sleep(self.retry_delay)
+        return result
+
+    def _should_retry(self, attempt: int, error: Exception) -> bool:
+        logger.warning("%s request failed (attempt %d): %s", self.name, attempt + 1, error)
+        if self.breaker.state != self.breaker.CLOSED:
+            return False
+        metrics.inc('afpd_elevation_retries_total', provider=self.name)
+        return True
+
+    def _async_session(self):
+        """The ``aiohttp`` session of the running event loop, created on first use"""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None:
+            # ``timeout`` bounds connecting and each read, not the wait for
+            # a free connection: the pool is the back-pressure under load
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+            )
+            self._async_sessions[loop] = session
+        return session
+
+    async def aclose(self):
+        """Close the connection pool of the running event loop"""
+        session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def fetch_chunk_async(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """``fetch_chunk`` without blocking the event loop"""
+        import aiohttp
+
+        if not self.breaker.allow_request():
+            raise ConnectionError(f'{self.name} circuit breaker is open')
+        started = time.perf_counter()
+        try:
+            async with self._async_session().post(self.url, json=self._payload(lats, lons)) as response:
+                response.raise_for_status()
+                elevations = self._parse(await response.json(content_type=None), len(lats))
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError, ValueError):
+            self.breaker.record_failure()
+            raise
+        self._record_latency(started)
+        return elevations
+
+    async def _fetch_chunk_with_retries(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        import aiohttp
+
+        for attempt in range(self.max_retries):
+            try:
+                return await self.fetch_chunk_async(lats, lons)
+            except (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError,
+                    ValueError) as e:
+                if not self._should_retry(attempt, e):
+                    break
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(self.retry_delay)
+        return np.full(lats.shape, np.nan)
+
+    async def fetch_async(self, lats, lons):
+        # Chunks are requested concurrently rather than one after another
+        chunks = [slice(start, start + self.chunk_size) for start in range(0, len(lats), self.chunk_size)]
+        values = await asyncio.gather(*(self._fetch_chunk_with_retries(lats[c], lons[c]) for c in chunks))
+        result = np.full(lats.shape, np.nan)
+        for chunk, value in zip(chunks, values):
+            result[chunk] = value
+        return result
+
+
+class HedgedRemoteProvider(ElevationProvider):
+    """Fan a chunk out to several remote providers to cut tail latency.
+
+    Each chunk goes to the first healthy provider. If no answer arrives within
+    that provider's recent ``hedge_percentile`` latency (or it fails), the
+    next provider is asked as well and the first good answer wins.
+
+    Requests run on at most ``max_threads`` executor threads (4 per provider
+    by default), one thread per request, so none waits in the executor
+    queue. A losing request cannot be interrupted once sent and holds its
+    thread until it ends or times out. When every thread is busy, the
+    remaining providers are asked in the calling thread instead, one after
+    the other.
+    """
+
+    name = 'remote'
+
+    def __init__(self, providers: List[RemoteElevationProvider], hedge_percentile: float = 0.95,
+                 default_hedge_delay: float = 1.0, min_hedge_delay: float = 0.02,
+                 max_threads: Optional[int] = None):
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.chunk_size = min(p.chunk_size for p in providers)
+        max_threads = max_threads or 4 * len(providers)
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='afpd-hedge')
+        self._threads = threading.BoundedSemaphore(max_threads)
+
+    def _hedge_delay(self, provider: RemoteElevationProvider) -> float:
+        latency = provider.latency_percentile(self.hedge_percentile)
+        return max(self.min_hedge_delay, latency if latency is not None else self.default_hedge_delay)
+
+    def close(self):
+        """Stop the executor threads once their requests end"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, provider: RemoteElevationProvider, lats: np.ndarray, lons: np.ndarray):
+        """Start ``provider.fetch_chunk`` on a free executor thread, or return None if all are busy"""
+        if not self._threads.acquire(blocking=False):
+            return None
+        future = self._executor.submit(provider.fetch_chunk, lats, lons)
+        future.add_done_callback(lambda _: self._threads.release())
+        return future
+
+    def _fetch_chunk(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, Optional[str]]:
+        candidates = [p for p in self.providers if p.breaker.state != p.breaker.OPEN]
+        pending = {}
+        deadline = time.perf_counter() + max(p.timeout for p in self.providers)
+
+        try:
+            while candidates or pending:
+                if candidates:
+                    provider = candidates[0]
+                    if pending:
+                        metrics.inc('afpd_elevation_hedged_requests_total', provider=provider.name)
+                    future = self._submit(provider, lats, lons)
+                    if future is None:
+                        # Every thread is busy: go on in this one
+                        values, name = self._fetch_chunk_inline(candidates, lats, lons)
+                        if name is not None or not pending:
+                            return values, name
+                        candidates = []
+                    else:
+                        pending[future] = candidates.pop(0)
+                    timeout = self._hedge_delay(provider) if candidates else None
+                else:
+                    timeout = None
+
+                remaining = deadline - time.perf_counter()
+                timeout = remaining if timeout is None else min(timeout, remaining)
+                done, _ = wait(pending, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        return future.result(), provider.name
+                    except Exception as e:
+                        logger.warning("%s request failed: %s", provider.name, e)
+                if not done and time.perf_counter() >= deadline:
+                    break
+        finally:
+            # Slower duplicates of an answered chunk are not needed any more;
+            # those already sent run to the end on their thread
+            for future in pending:
+                future.cancel()
+
+        return np.full(lats.shape, np.nan), None
+
+    @staticmethod
+    def _fetch_chunk_inline(candidates: List[RemoteElevationProvider], lats: np.ndarray,
+                            lons: np.ndarray) -> Tuple[np.ndarray, Optional[str]]:
+        for provider in candidates:
+            try:
+                return provider.fetch_chunk(lats, lons), provider.name
+            except Exception as e:
+                logger.warning("%s request failed: %s", provider.name, e)
+        return np.full(lats.shape, np.nan), None
+
+    def fetch(self, lats, lons):
+        values, _ = self.fetch_with_sources(lats, lons)
+        return values
+
+    def fetch_with_sources(self, lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+        result = np.full(lats.shape, np.nan)
+        sources = np.full(lats.shape, None, dtype=object)
+        for start in range(0, len(lats), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            result[chunk], sources[chunk] = self._fetch_chunk(lats[chunk], lons[chunk])
+        return result, sources
+
+    async def _fetch_chunk_async(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, Optional[str]]:
+        """``_fetch_chunk`` with tasks on the event loop instead of executor threads"""
+        candidates = [p for p in self.providers if p.breaker.state != p.breaker.OPEN]
+        pending = {}
+        deadline = time.perf_counter() + max(p.timeout for p in self.providers)
+
+        try:
+            while candidates or pending:
+                if candidates:
+                    provider = candidates.pop(0)
+                    if pending:
+                        metrics.inc('afpd_elevation_hedged_requests_total', provider=provider.name)
+                    pending[asyncio.ensure_future(provider.fetch_chunk_async(lats, lons))] = provider
+                    timeout = self._hedge_delay(provider) if candidates else None
+                else:
+                    timeout = None
+
+                remaining = deadline - time.perf_counter()
+                timeout = remaining if timeout is None else min(timeout, remaining)
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, timeout),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        return future.result(), provider.name
+                    except Exception as e:
+                        logger.warning("%s request failed: %s", provider.name, e)
+                if not done and time.perf_counter() >= deadline:
+                    break
+        finally:
+            # Slower duplicates of an answered chunk are not needed any more
+            for future in pending:
+                future.cancel()
+
+        return np.full(lats.shape, np.nan), None
+
+    async def fetch_async(self, lats, lons):
+        values, _ = await self.fetch_with_sources_async(lats, lons)
+        return values
+
+    async def fetch_with_sources_async(self, lats, lons) -> Tuple[np.ndarray, np.ndarray]:
+        chunks = [slice(start, start + self.chunk_size) for start in range(0, len(lats), self.chunk_size)]
+        answers = await asyncio.gather(*(self._fetch_chunk_async(lats[c], lons[c]) for c in chunks))
+        result = np.full(lats.shape, np.nan)
+        sources = np.full(lats.shape, None, dtype=object)
+        for chunk, (values, name) in zip(chunks, answers):
+            result[chunk], sources[chunk] = values, name
+        return result, sources
+
+
+class EstimatedElevationProvider(ElevationProvider):
+    """Last-resort latitude/longitude terrain model, used when nothing else answers"""
+
+    name = ESTIMATED
+
+    def fetch(self, lats, lons):
+        # - Higher elevations near mountains (typically between 30-50 degrees latitude)
+        # - Lower elevations near equator and poles
+        lat = np.abs(lats)
+        base = np.where(
+            lat < 30, lat * 33.33,                               # Lower latitudes: 0-1000 feet
+            np.where(lat <= 50, 1000 + (lat - 30) * 200,          # Mountain regions: 1000-5000 feet
+                     1000 - (lat - 50) * 10)                      # Higher latitudes: 500-1000 feet
+        )
+        # Add some variation
+        return np.maximum(0, base + np.sin(lons / 10) * 500)
+
+
+class ElevationResolver:
+    """Resolve elevations through an ordered chain of providers.
+
+    Each provider is offered only the still-unresolved points it covers
+    (decided per tile by the provider), so a batch is split into at most one
+    request per tier. Whatever is left is estimated and labelled as such.
+    """
+
+    def __init__(self, providers: List[ElevationProvider],
+                 fallback: Optional[ElevationProvider] = None):
+        self.providers = providers
+        self.fallback = fallback or EstimatedElevationProvider()
+
+    def resolve(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return elevations (feet) and the name of the source of each one"""
+        batch = _Resolution(lats, lons)
+        for provider in self.providers:
+            idx = batch.pending(provider)
+            if idx is None:
+                break
+            if not idx.size:
+                continue
+            with span('elevation_fetch', provider=provider.name):
+                if isinstance(provider, HedgedRemoteProvider):
+                    values, names = provider.fetch_with_sources(batch.lats[idx], batch.lons[idx])
+                else:
+                    values = provider.fetch(batch.lats[idx], batch.lons[idx])
+                    names = np.full(idx.shape, provider.name, dtype=object)
+            batch.store(idx, values, names)
+        return self._estimate_rest(batch)
+
+    async def resolve_async(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """``resolve`` for the asynchronous API: remote lookups are awaited"""
+        batch = _Resolution(lats, lons)
+        for provider in self.providers:
+            idx = batch.pending(provider)
+            if idx is None:
+                break
+            if not idx.size:
+                continue
+            with span('elevation_fetch', provider=provider.name):
+                if isinstance(provider, HedgedRemoteProvider):
+                    values, names = await provider.fetch_with_sources_async(batch.lats[idx], batch.lons[idx])
+                else:
+                    values = await provider.fetch_async(batch.lats[idx], batch.lons[idx])
+                    names = np.full(idx.shape, provider.name, dtype=object)
+            batch.store(idx, values, names)
+        return self._estimate_rest(batch)
+
+    def _estimate_rest(self, batch: '_Resolution') -> Tuple[np.ndarray, np.ndarray]:
+        if batch.unresolved.any():
+            idx = np.flatnonzero(batch.unresolved)
+            logger.warning("Estimating %d of %d elevations", idx.size, batch.lats.size)
+            metrics.inc('afpd_elevation_fallback_total')
+            batch.elevations[idx] = self.fallback.fetch(batch.lats[idx], batch.lons[idx])
+            batch.sources[idx] = self.fallback.name
+
+        return batch.elevations, batch.sources
+
+
+class _Resolution:
+    """Progress of one batch through the provider chain"""
+
+    def __init__(self, lats, lons):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.elevations = np.full(self.lats.shape, np.nan)
+        self.sources = np.full(self.lats.shape, None, dtype=object)
+        self.unresolved = np.ones(self.lats.shape, dtype=bool)
+
+    def pending(self, provider: ElevationProvider) -> Optional[np.ndarray]:
+        """Unresolved points ``provider`` covers, or ``None`` once all are resolved"""
+        idx = np.flatnonzero(self.unresolved)
+        if not idx.size:
+            return None
+        return idx[provider.coverage(self.lats[idx], self.lons[idx])]
+
+    def store(self, idx: np.ndarray, values: np.ndarray, names: np.ndarray):
+        ok = ~np.isnan(values)
+        self.elevations[idx[ok]] = values[ok]
+        self.sources[idx[ok]] = names[ok]
+        self.unresolved[idx[ok]] = False
+
+
+def build_elevation_resolver(
+    api_url: str = 'https://api.open-elevation.com/api/v1/lookup',
+    backup_urls: Sequence[str] = (),
+    high_res_dem: Optional[str] = None,
+    global_dem: Optional[str] = None,
+    timeout: float = 5.0,
+    chunk_size: int = 50,
+    hedge_percentile: float = 0.95,
+    max_connections: int = 100,
+    max_retries: int = 3,
+    retry_delay: float = 1.0
+) -> ElevationResolver:
+    """Assemble the standard provider chain.
+
+    Local high-resolution DEM, local coarse global DEM, remote service(s),
+    then the estimate. Missing DEM directories are skipped.
+    """
+    providers: List[ElevationProvider] = []
+    for name, root in (('dem-highres', high_res_dem), ('dem-global', global_dem)):
+        if root and os.path.exists(os.path.join(root, 'manifest.json')):
+            providers.append(LocalDEMProvider(root, name=name))
+        elif root:
+            logger.warning("DEM directory %s has no manifest.json, skipping", root)
+
+    remotes = [
+        RemoteElevationProvider(url, name='open-elevation' if i == 0 else f'backup-{i}',
+                                timeout=timeout, chunk_size=chunk_size, max_retries=max_retries,
+                                retry_delay=retry_delay, max_connections=max_connections)
+        for i, url in enumerate([api_url, *backup_urls]) if url
+    ]
+    if len(remotes) > 1:
+        providers.append(HedgedRemoteProvider(remotes, hedge_percentile=hedge_percentile))
+    else:
+        providers.extend(remotes)
+
+    return ElevationResolver(providers)
+
+
+metrics.describe('afpd_elevation_hedged_requests_total', 'counter',
+                 'Backup elevation requests fired because the primary was slow or failed.')
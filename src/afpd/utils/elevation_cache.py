@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .metrics import metrics
+
+# Source label of elevations that were estimated rather than measured
+ESTIMATED = 'estimated'
+
+class ElevationCache:
+    """Thread-safe LRU cache of terrain elevations (feet) keyed by position.
+
+    Coordinates are rounded to ``precision`` decimal places (~1 m at 5) so
+    that the same fix analysed by different procedures shares an entry.
+    Entries are ``(elevation, source)`` pairs so provenance survives caching.
+    """
+
+    def __init__(self, max_entries: int = 200000, precision: int = 5):
+        self.max_entries = max_entries
+        self.precision = precision
+        self._entries: 'OrderedDict[Tuple[float, float], Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, point: Dict) -> Tuple[float, float]:
+        return (round(point['latitude'], self.precision), round(point['longitude'], self.precision))
+
+    def get_many(self, points: List[Dict]) -> List[Optional[Tuple[float, str]]]:
+        """Return cached ``(elevation, source)`` pairs, with ``None`` for every miss"""
+        found = []
+        hits = 0
+        with self._lock:
+            for point in points:
+                key = self._key(point)
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    hits += 1
+                found.append(value)
+
+        metrics.inc('afpd_elevation_cache_hits_total', hits)
+        metrics.inc('afpd_elevation_cache_misses_total', len(points) - hits)
+        return found
+
+    def put_many(self, points: List[Dict], elevations: Sequence[float], sources: Sequence[str]):
+        with self._lock:
+            for point, elevation, source in zip(points, elevations, sources):
+                key = self._key(point)
+                self._entries[key] = (float(elevation), source)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> int:
+        """Drop entries inside a box (e.g. an updated DEM tile); returns how many"""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if min_lat <= key[0] <= max_lat and min_lon <= key[1] <= max_lon]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
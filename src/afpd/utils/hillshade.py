@@ -0,0 +1,135 @@
+import math
+import struct
+import zlib
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from .spatial_index import NM_PER_DEGREE
+
+TILE_SIZE = 256  # pixels
+FEET_PER_DEGREE = NM_PER_DEGREE * 6076
+
+# Stepped hypsometric tint: 1000 ft bands, coloured along these stops (feet -> RGB)
+TINT_STOPS = np.array([-1000.0, 0.0, 1000.0, 3000.0, 5000.0, 8000.0, 12000.0, 16000.0])
+TINT_COLORS = np.array([
+    [84, 130, 84], [112, 153, 89], [168, 192, 112], [222, 214, 146],
+    [203, 167, 113], [160, 120, 88], [200, 196, 190], [255, 255, 255]
+], dtype=float)
+TINT_BAND_EDGES = np.arange(0.0, 15000.0, 1000.0)
+LIGHT_LEVELS = 15
+LIGHT_RANGE = (0.45, 1.3)  # tint brightness, relative to flat ground
+SUN_ALTITUDE = 45.0  # degrees
+FLAT = math.sin(math.radians(SUN_ALTITUDE))
+
+
+def _palettes():
+    """Palette (RGB) and alpha of each style; entry 0 is transparent, for voids.
+
+    Tiles are 8-bit palette images: a quarter of the data of RGBA, which
+    is what keeps PNG compression within a couple of milliseconds.
+    """
+    # Hillshade: 254 shade levels, black shadows and white highlights over the base map
+    shade = np.linspace(0.0, 1.0, 254)
+    shadow = shade < FLAT
+    gray = np.where(shadow, 0, 255)
+    hillshade_palette = np.zeros((255, 3), dtype=np.uint8)
+    hillshade_palette[1:] = gray[:, None]
+    hillshade_alpha = np.zeros(255, dtype=np.uint8)
+    hillshade_alpha[1:] = np.where(shadow, (FLAT - shade) / FLAT * 200, (shade - FLAT) / (1 - FLAT) * 100)
+
+    # Tint: every band at every light level
+    mids = np.concatenate([[TINT_BAND_EDGES[0] - 500], TINT_BAND_EDGES + 500])
+    band_colors = np.stack([np.interp(mids, TINT_STOPS, TINT_COLORS[:, c]) for c in range(3)], axis=1)
+    lights = np.linspace(*LIGHT_RANGE, LIGHT_LEVELS)
+    tint_palette = np.zeros((1 + len(mids) * LIGHT_LEVELS, 3), dtype=np.uint8)
+    tint_palette[1:] = np.clip(band_colors[:, None, :] * lights[None, :, None], 0, 255).reshape(-1, 3)
+    tint_alpha = np.full(len(tint_palette), 255, dtype=np.uint8)
+    tint_alpha[0] = 0
+    return {'hillshade': (hillshade_palette, hillshade_alpha), 'tint': (tint_palette, tint_alpha)}
+
+
+PALETTES = _palettes()
+
+
+def _mercator_lat(y: np.ndarray) -> np.ndarray:
+    """``terrain_tiles.mercator_lat`` for arrays"""
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+
+
+def pixel_grid(z: int, x: int, y: int, size: int = TILE_SIZE, border: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitudes (rows, north first) and longitudes (columns) of a tile's pixel
+    centres, extended by ``border`` pixels on every side"""
+    n = 2 ** z * size
+    offsets = np.arange(-border, size + border) + 0.5
+    return _mercator_lat((y * size + offsets) / n), (x * size + offsets) / n * 360 - 180
+
+
+def hillshade(elevations: np.ndarray, lats: np.ndarray, lon_step: float, azimuth: float = 315.0,
+              altitude: float = 45.0, exaggeration: float = 1.0) -> np.ndarray:
+    """Illumination (0-1) of the inner cells of an elevation grid (feet) with a
+    one cell border, lit from ``azimuth`` degrees true at ``altitude`` degrees.
+
+    ``lats`` are the row latitudes, north first, and ``lon_step`` the column
+    spacing in degrees. Flat ground gets ``sin(altitude)``; voids stay NaN.
+    """
+    dx = (2 * lon_step * FEET_PER_DEGREE * np.cos(np.radians(lats[1:-1])))[:, None]
+    dy = ((lats[:-2] - lats[2:]) * FEET_PER_DEGREE)[:, None]
+    dzdx = (elevations[1:-1, 2:] - elevations[1:-1, :-2]) * (exaggeration / dx)
+    dzdy = (elevations[:-2, 1:-1] - elevations[2:, 1:-1]) * (exaggeration / dy)
+
+    azimuth, altitude = math.radians(azimuth), math.radians(altitude)
+    light_x = math.sin(azimuth) * math.cos(altitude)
+    light_y = math.cos(azimuth) * math.cos(altitude)
+    shade = (math.sin(altitude) - dzdx * light_x - dzdy * light_y) / np.sqrt(1 + dzdx * dzdx + dzdy * dzdy)
+    return np.clip(shade, 0.0, 1.0)
+
+
+def encode_png(indices: np.ndarray, palette: np.ndarray, alpha: Optional[np.ndarray] = None,
+               level: int = 1) -> bytes:
+    """PNG of an 8-bit palette image: ``indices`` ``(height, width)`` into ``palette``
+    ``(n, 3)`` RGB entries, with optional per-entry ``alpha``"""
+    height, width = indices.shape
+    filtered = np.empty((height, width + 1), dtype=np.uint8)
+    filtered[:, 0] = 0  # no filter, as recommended for palette images
+    filtered[:, 1:] = indices
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+            + chunk(b'PLTE', np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+            + (chunk(b'tRNS', np.ascontiguousarray(alpha, dtype=np.uint8).tobytes()) if alpha is not None else b'')
+            + chunk(b'IDAT', zlib.compress(filtered.tobytes(), level))
+            + chunk(b'IEND', b''))
+
+
+def render_tile(stores: Sequence, z: int, x: int, y: int, style: str = 'hillshade',
+                exaggeration: float = 2.0, size: int = TILE_SIZE) -> bytes:
+    """PNG map tile from DEM tile stores (``DEMTileStore``), the first covering a pixel wins.
+
+    ``hillshade`` is a transparent overlay darkening slopes facing away from
+    a north-west light and lightening those facing it; ``tint`` colours
+    ground in 1000 ft bands, shaded the same way. Pixels without DEM data
+    are transparent.
+    """
+    lats, lons = pixel_grid(z, x, y, size)
+    elevations = None
+    for store in stores:
+        values = store.sample_grid(lats, lons)
+        elevations = values if elevations is None else np.where(np.isnan(elevations), values, elevations)
+        if not np.isnan(elevations).any():
+            break
+
+    shade = hillshade(elevations, lats, lons[1] - lons[0], altitude=SUN_ALTITUDE, exaggeration=exaggeration)
+    known = ~np.isnan(shade)
+    if style == 'tint':
+        low, high = LIGHT_RANGE
+        light = np.rint((np.clip(shade / FLAT, low, high) - low) / (high - low) * (LIGHT_LEVELS - 1))
+        band = np.digitize(elevations[1:-1, 1:-1], TINT_BAND_EDGES)
+        indices = 1 + band * LIGHT_LEVELS + np.nan_to_num(light).astype(np.intp)
+    else:
+        indices = 1 + np.rint(np.nan_to_num(shade) * 253).astype(np.intp)
+    indices = np.where(known, indices, 0).astype(np.uint8)
+    return encode_png(indices, *PALETTES[style])
@@ -0,0 +1,284 @@
+import logging
+import math
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, func, or_, select
+
+from ..models.flight_procedure import FlightProcedure, ObstacleAssessment, ProcedureType, Waypoint
+from ..models.snapshot import ProcedureSnapshot
+from . import spatial_index
+from .metrics import span
+from .route_optimizer import grid_cache
+from .. import db
+
+logger = logging.getLogger(__name__)
+
+# Unnamed obstacles are matched by position, this many per query
+POSITIONS_PER_QUERY = 100
+
+_TILE_KEY = re.compile(r'^([NS])(\d{1,2})([EW])(\d{1,3})$')
+
+
+def tile_bounds(key: str, tile_degrees: float = 1.0) -> Tuple[float, float, float, float]:
+    """``(min_lat, min_lon, max_lat, max_lon)`` of an SRTM-style tile key such as ``N45E006``"""
+    match = _TILE_KEY.match(key.strip().upper())
+    if not match:
+        raise ValueError(f'Invalid tile key: {key}')
+    lat = int(match.group(2)) * (1 if match.group(1) == 'N' else -1)
+    lon = int(match.group(4)) * (1 if match.group(3) == 'E' else -1)
+    return lat, lon, lat + tile_degrees, lon + tile_degrees
+
+
+def obstacle_key(name: Optional[str], latitude: float, longitude: float) -> str:
+    """Identity of an obstacle across assessments: its name, else its position"""
+    return name or f'{latitude:.5f},{longitude:.5f}'
+
+
+class ImpactEngine:
+    """Work out which stored procedures an obstacle or DEM change affects.
+
+    Candidates come from the spatial index: procedures with a leg within
+    the widest obstacle corridor of a changed obstacle, or crossing a
+    changed tile, widened by the diameter of the widest turn since the
+    flown track leaves the legs in turns. Procedures found only thanks to
+    that margin are kept if the obstacle is within the corridor of their
+    flown track. Only those are re-assessed, in parallel on snapshots, and
+    the results are compared with their stored ``ObstacleAssessment`` rows.
+    """
+
+    def __init__(self, analyzer, max_workers: int = 4):
+        self.analyzer = analyzer
+        self.max_workers = max_workers
+
+    def _reach(self) -> float:
+        return max(self.analyzer.obstacle_corridor_half_width.values())
+
+    def _turn_margin(self) -> float:
+        """How far the flown track can stray from the straight legs: the diameter of the widest turn"""
+        generator = self.analyzer.track_generator
+        fastest = db.session.execute(select(func.max(Waypoint.speed_constraint))).scalar() or 0
+        speed = max(fastest, *generator.default_speed.values())
+        return 2 * float(generator.turn_radius(speed, min(generator.bank_angle.values())))
+
+    def affected_procedures(self, obstacles: Sequence[Dict] = (), tiles: Sequence[Tuple] = (),
+                            removed: Iterable[str] = ()) -> Dict[int, Set[str]]:
+        """Procedure ids mapped to the reasons (``obstacle:<key>``, ``tile:<bounds>``) they are affected"""
+        affected = defaultdict(set)
+        # Turns leave the legs, so candidates come from a wider search
+        margin = self._turn_margin() if obstacles or tiles else 0.0
+        reach = self._reach() + margin
+
+        near_turns = defaultdict(list)
+        for obstacle in obstacles:
+            key = obstacle_key(obstacle.get('name'), obstacle['latitude'], obstacle['longitude'])
+            for match in spatial_index.query_radius(obstacle['latitude'], obstacle['longitude'], reach):
+                width = self.analyzer.obstacle_corridor_half_width[ProcedureType(match['procedure_type']).name]
+                if match['distance_nm'] <= width:
+                    affected[match['id']].add(f'obstacle:{key}')
+                elif match['distance_nm'] <= width + margin:
+                    near_turns[match['id']].append((obstacle, key, width))
+
+        # Outside the corridor of the legs: affected if within that of the flown track
+        if near_turns:
+            for snapshot in ProcedureSnapshot.load_many(FlightProcedure.id.in_(list(near_turns))):
+                candidates = near_turns[snapshot.id]
+                track = self.analyzer.track_generator.build(snapshot)
+                _, offsets = track.locate([o['latitude'] for o, _, _ in candidates],
+                                          [o['longitude'] for o, _, _ in candidates])
+                for (_, key, width), offset in zip(candidates, offsets.tolist()):
+                    if offset <= width:
+                        affected[snapshot.id].add(f'obstacle:{key}')
+
+        for bounds in tiles:
+            min_lat, min_lon, max_lat, max_lon = bounds
+            low = spatial_index.expand_bbox(min_lat, min_lon, reach)
+            high = spatial_index.expand_bbox(max_lat, max_lon, reach)
+            for match in spatial_index.query_bbox(low[0], low[1], high[2], high[3]):
+                affected[match['id']].add('tile:{:g},{:g},{:g},{:g}'.format(*bounds))
+
+        # Obstacles that are gone (or moved away) still have stored rows
+        changed_keys = set(removed) | {
+            obstacle_key(o.get('name'), o['latitude'], o['longitude']) for o in obstacles
+        }
+        if changed_keys:
+            for row in self._rows_for_keys(changed_keys):
+                key = obstacle_key(row.obstacle_name, row.latitude, row.longitude)
+                affected[row.procedure_id].add(f'obstacle:{key}')
+
+        return affected
+
+    @staticmethod
+    def _stored_rows(*criteria) -> List[ObstacleAssessment]:
+        return ObstacleAssessment.query.filter(*criteria).all()
+
+    def _rows_for_keys(self, keys: Set[str]) -> List[ObstacleAssessment]:
+        """Stored assessments whose ``obstacle_key`` is in ``keys``: by name, or by position when unnamed"""
+        rows = self._stored_rows(ObstacleAssessment.obstacle_name.in_(keys))
+
+        positions = []
+        for key in keys:
+            try:
+                latitude, longitude = (float(value) for value in key.split(','))
+            except ValueError:
+                continue
+            positions.append((latitude, longitude))
+        unnamed = or_(ObstacleAssessment.obstacle_name.is_(None), ObstacleAssessment.obstacle_name == '')
+        tolerance = 1e-5  # keys are rounded to 5 decimals
+        for start in range(0, len(positions), POSITIONS_PER_QUERY):
+            near = [and_(ObstacleAssessment.latitude.between(lat - tolerance, lat + tolerance),
+                         ObstacleAssessment.longitude.between(lon - tolerance, lon + tolerance))
+                    for lat, lon in positions[start:start + POSITIONS_PER_QUERY]]
+            rows.extend(row for row in self._stored_rows(unnamed, or_(*near))
+                        if obstacle_key(row.obstacle_name, row.latitude, row.longitude) in keys)
+        return rows
+
+    def _evaluate(self, snapshot: ProcedureSnapshot, obstacles: List[Dict], terrain: bool) -> Dict:
+        try:
+            result = {'assessments': self.analyzer.assess_obstacles(snapshot, obstacles)}
+            if terrain:
+                analysis = self.analyzer.analyze_procedure(snapshot)
+                if analysis['status'] == 'success':
+                    result['terrain_violations'] = analysis['analysis']['violations']
+                    result['using_estimated_data'] = analysis['using_estimated_data']
+            return result
+        except Exception as e:
+            logger.exception("Impact re-analysis failed for procedure %s", snapshot.id)
+            return {'error': str(e)}
+
+    def run(self, obstacles: Sequence[Dict] = (), tiles: Sequence[Tuple] = (),
+            removed: Iterable[str] = (), apply: bool = False) -> Dict:
+        """Re-assess affected procedures and diff against stored assessments.
+
+        ``obstacles`` are new or updated obstacles (see
+        ``TerrainAnalyzer.assess_obstacles``), ``tiles`` the bounds of
+        updated DEM tiles and ``removed`` the keys of deleted obstacles. With
+        ``apply`` the stored assessments are replaced by the new results.
+        """
+        removed = set(removed)
+        changed = {obstacle_key(o.get('name'), o['latitude'], o['longitude']): o for o in obstacles}
+
+        for bounds in tiles:
+            self.analyzer.invalidate_region(*bounds)
+            # After the elevation cache, so that grids are not rebuilt from stale values
+            grid_cache.invalidate_bbox(*bounds)
+
+        with span('impact_query'):
+            affected = self.affected_procedures(obstacles, tiles, removed)
+            snapshots = ProcedureSnapshot.load_many(FlightProcedure.id.in_(list(affected)))
+            stored = defaultdict(dict)
+            if affected:
+                for row in self._stored_rows(ObstacleAssessment.procedure_id.in_(list(affected))):
+                    stored[row.procedure_id][obstacle_key(row.obstacle_name, row.latitude, row.longitude)] = row
+
+        # Re-assess every obstacle already on record for the procedure (ground
+        # may have changed) plus the changed ones, minus the removed ones
+        jobs = []
+        for snapshot in snapshots:
+            obstacles_for = {
+                key: {'name': row.obstacle_name, 'latitude': row.latitude,
+                      'longitude': row.longitude, 'height': row.height}
+                for key, row in stored[snapshot.id].items() if key not in removed
+            }
+            obstacles_for.update((key, o) for key, o in changed.items() if key not in removed)
+            terrain = any(reason.startswith('tile:') for reason in affected[snapshot.id])
+            jobs.append((snapshot, list(obstacles_for.values()), terrain))
+
+        with span('impact_analysis'):
+            if self.max_workers > 1 and len(jobs) > 1:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                    results = list(pool.map(lambda job: self._evaluate(*job), jobs))
+            else:
+                results = [self._evaluate(*job) for job in jobs]
+
+        procedures = []
+        for (snapshot, _, _), result in zip(jobs, results):
+            procedures.append(self._diff(snapshot, stored[snapshot.id], result, sorted(affected[snapshot.id])))
+
+        if apply:
+            with span('impact_apply'):
+                self._apply(jobs, results, stored)
+
+        return {
+            'affected_procedure_ids': sorted(affected),
+            'procedures': procedures,
+            'summary': {
+                'affected': len(affected),
+                'new_violations': sum(len(p['new_violations']) for p in procedures),
+                'resolved_violations': sum(len(p['resolved_violations']) for p in procedures),
+                'errors': sum(1 for p in procedures if 'error' in p)
+            },
+            'applied': apply
+        }
+
+    def _diff(self, snapshot: ProcedureSnapshot, stored: Dict[str, ObstacleAssessment],
+              result: Dict, reasons: List[str]) -> Dict:
+        diff = {
+            'procedure_id': snapshot.id,
+            'name': snapshot.name,
+            'airport_icao': snapshot.airport_icao,
+            'reasons': reasons,
+            'new_violations': [],
+            'resolved_violations': [],
+            'clearance_changes': []
+        }
+        if 'error' in result:
+            diff['error'] = result['error']
+            return diff
+
+        required = self.analyzer.minimum_obstacle_clearance[snapshot.procedure_type.name]
+        current = {
+            obstacle_key(a['obstacle_name'], a['latitude'], a['longitude']): a
+            for a in result['assessments']
+        }
+
+        for key, assessment in current.items():
+            row = stored.get(key)
+            was_violation = row is not None and row.clearance < required
+            if assessment['violation'] and not was_violation:
+                diff['new_violations'].append(dict(assessment, obstacle=key))
+            elif was_violation and not assessment['violation']:
+                diff['resolved_violations'].append(dict(assessment, obstacle=key))
+            if row is not None and not math.isclose(row.clearance, assessment['clearance'], abs_tol=1.0):
+                diff['clearance_changes'].append({
+                    'obstacle': key,
+                    'previous_clearance': row.clearance,
+                    'clearance': assessment['clearance']
+                })
+
+        # Stored violations for obstacles no longer inside the corridor
+        for key, row in stored.items():
+            if key not in current and row.clearance < required:
+                diff['resolved_violations'].append({
+                    'obstacle': key,
+                    'obstacle_name': row.obstacle_name,
+                    'latitude': row.latitude,
+                    'longitude': row.longitude,
+                    'previous_clearance': row.clearance
+                })
+
+        if 'terrain_violations' in result:
+            diff['terrain_violations'] = result['terrain_violations']
+            diff['using_estimated_data'] = result['using_estimated_data']
+        return diff
+
+    @staticmethod
+    def _apply(jobs, results, stored):
+        """Replace each re-assessed procedure's stored assessments"""
+        for (snapshot, _, _), result in zip(jobs, results):
+            if 'error' in result:
+                continue
+            for row in stored[snapshot.id].values():
+                db.session.delete(row)
+            for assessment in result['assessments']:
+                db.session.add(ObstacleAssessment(
+                    procedure_id=snapshot.id,
+                    obstacle_name=assessment['obstacle_name'],
+                    latitude=assessment['latitude'],
+                    longitude=assessment['longitude'],
+                    height=assessment['height'],
+                    clearance=assessment['clearance']
+                ))
+        db.session.commit()
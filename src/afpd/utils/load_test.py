@@ -0,0 +1,666 @@
+import asyncio
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from ..models.user import User
+from .analysis import services
+from .elevation import build_elevation_resolver
+from .stub_elevation_server import StubElevationServer
+from .synthetic import PROCEDURE_SHAPES, populate_database, procedure_payload
+from .terrain_analysis import TerrainAnalyzer
+from .. import create_app, db
+
+MODES = ('flask', 'asgi')
+LOAD_USER = {'username': 'load', 'email': 'load@example.invalid', 'password': 'load'}
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    return samples[min(len(samples) - 1, int(round(percentile * (len(samples) - 1))))]
+
+
+def _summary(mode: str, concurrency: int, latencies: List[float], errors: int, unfinished: int,
+             duration: float) -> Dict:
+    latencies = sorted(latencies)
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'completed': len(latencies),
+        'errors': errors,
+        'unfinished': unfinished,
+        'throughput_rps': len(latencies) / duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': _percentile(latencies, 0.95) * 1000 if latencies else None
+    }
+
+
+async def _drive(call: Callable, urls: Sequence[str], concurrency: int, duration: float):
+    """``concurrency`` clients sending requests back to back for ``duration`` seconds.
+
+    Requests still running at the end are cancelled and only counted as
+    unfinished, so a saturated server shows up as low throughput rather than
+    a long run.
+    """
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(offset: int):
+        nonlocal errors
+        n = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status = await call(urls[n % len(urls)])
+            n += concurrency
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    clients = [asyncio.ensure_future(client(i)) for i in range(concurrency)]
+    _, running = await asyncio.wait(clients, timeout=duration)
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    return latencies, errors, len(running)
+
+
+async def _asgi_request(asgi_app, method: str, url: str, headers=(), body: bytes = b''):
+    """Call an ASGI app in-process; returns the status and response headers"""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'load-test'), *headers], 'server': ('load-test', 80), 'client': ('127.0.0.1', 0)
+    }
+    request = {'type': 'http.request', 'body': body, 'more_body': False}
+    response = {}
+
+    async def receive():
+        nonlocal request
+        message, request = request, {'type': 'http.disconnect'}
+        return message
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = message['headers']
+
+    await asgi_app(scope, receive, send)
+    return response['status'], response['headers']
+
+
+async def _run_async(asgi_app, urls, concurrency: int, duration: float):
+    from urllib.parse import urlencode
+
+    _, headers = await _asgi_request(
+        asgi_app, 'POST', '/auth/login',
+        headers=[(b'content-type', b'application/x-www-form-urlencoded')],
+        body=urlencode({'username': LOAD_USER['username'], 'password': LOAD_USER['password']}).encode()
+    )
+    cookies = [(b'cookie', value.split(b';', 1)[0]) for name, value in headers if name == b'set-cookie']
+
+    async def call(url):
+        status, _ = await _asgi_request(asgi_app, 'GET', url, headers=cookies)
+        return status
+
+    try:
+        return await _drive(call, urls, concurrency, duration)
+    finally:
+        await asgi_app.aclose()
+
+
+async def _run_sync(app, urls, concurrency: int, duration: float, threads: int):
+    local = threading.local()
+
+    def get(url):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+            client.post('/auth/login', data={
+                'username': LOAD_USER['username'], 'password': LOAD_USER['password']
+            })
+        return client.get(url).status_code
+
+    # A threaded WSGI worker: requests beyond ``threads`` wait for a thread
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='afpd-load')
+    loop = asyncio.get_running_loop()
+    try:
+        return await _drive(lambda url: loop.run_in_executor(executor, get, url), urls, concurrency, duration)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _load_app(workdir: str, procedure_count: int, users: Sequence[Dict], config: Optional[Dict] = None):
+    """App on a temporary SQLite database with ``users`` and ``procedure_count`` synthetic procedures"""
+    app = create_app(dict({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'load.db'),
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False
+    }, **(config or {})))
+    with app.app_context():
+        db.create_all()
+        for credentials in users:
+            user = User(username=credentials['username'], email=credentials['email'])
+            user.set_password(credentials['password'])
+            db.session.add(user)
+        db.session.commit()
+        procedure_ids = populate_database(procedure_count)
+    return app, procedure_ids
+
+
+def run_concurrency_test(levels: Sequence[int] = (1, 10, 100, 1000), latency: float = 0.2,
+                         duration: float = 10.0, threads: int = 8, procedure_count: int = 500,
+                         connections: int = 200, endpoint: str = 'chain',
+                         echo: Callable[[str], None] = print) -> Dict:
+    """Throughput of an analysis endpoint as concurrency grows, Flask vs the ASGI app.
+
+    Both serve ``procedure_count`` synthetic procedures from a temporary
+    SQLite database. Elevations come from a local stub elevation server
+    answering after ``latency`` seconds, with the elevation cache disabled.
+    The Flask app runs as one threaded worker with ``threads`` threads; the
+    ASGI app runs on a single event loop with at most ``connections``
+    connections to the elevation server.
+    """
+    from ..asgi import AsyncAPI
+
+    workdir = tempfile.mkdtemp(prefix='afpd-load-')
+    results = []
+    with StubElevationServer(latency=latency) as server:
+        app, procedure_ids = _load_app(workdir, procedure_count, [LOAD_USER])
+        if endpoint == 'chain':
+            urls = [f'/api/chain?procedure_id={i}' for i in procedure_ids]
+        else:
+            urls = [f'/api/procedures/{i}/terrain' for i in procedure_ids]
+
+        analyzer = TerrainAnalyzer(build_elevation_resolver(api_url=server.url, max_connections=connections),
+                                   elevation_cache_size=0)
+        services.for_app(app).analyzer = analyzer
+        try:
+            for mode in MODES:
+                asgi_app = AsyncAPI(app, threads=threads)
+                for concurrency in levels:
+                    if mode == 'flask':
+                        run = _run_sync(app, urls, concurrency, duration, threads)
+                    else:
+                        run = _run_async(asgi_app, urls, concurrency, duration)
+                    results.append(_summary(mode, concurrency, *asyncio.run(run), duration))
+                    r = results[-1]
+                    echo(f"{mode:6s} {concurrency:6d} clients {r['throughput_rps']:9.1f} req/s"
+                         + (f"  p50 {r['p50_ms']:8.0f} ms  p95 {r['p95_ms']:8.0f} ms" if r['completed'] else '')
+                         + f"  {r['unfinished']} unfinished"
+                         + (f"  {r['errors']} errors" if r['errors'] else ''))
+                asgi_app.executor.shutdown()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'endpoint': endpoint,
+            'elevation_latency_s': latency,
+            'duration_s': duration,
+            'threads': threads,
+            'procedure_count': procedure_count,
+            'elevation_requests': server.request_count
+        },
+        'results': results
+    }
+
+
+def _queue_wait(server_timing: str) -> float:
+    """Seconds of the ``queue`` stage in a Server-Timing header"""
+    for entry in server_timing.split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if name == 'queue':
+            return float(duration) / 1000
+    return 0.0
+
+
+def run_admission_test(duration: float = 20.0, latency: float = 0.5, threads: int = 8,
+                       procedure_count: int = 100, heavy_users: int = 2, clients_per_user: int = 6,
+                       batch_clients: int = 2, crud_clients: int = 4, admission: Optional[Dict] = None,
+                       echo: Callable[[str], None] = print) -> Dict:
+    """Cheap CRUD calls next to a flood of analysis requests, without and with admission control.
+
+    ``heavy_users`` users each run ``clients_per_user`` clients requesting
+    terrain analyses back to back, ``batch_clients`` clients request
+    airport bundles and ``crud_clients`` clients read single procedures,
+    all logged in as different users. The Flask app runs as one threaded
+    worker with ``threads`` threads against a stub elevation server
+    answering after ``latency`` seconds, with the elevation cache off.
+
+    Clients wait for the Retry-After of a rejected request before the next
+    one. Per class of client the run reports throughput, latency
+    percentiles of successful requests, status counts and the mean queue
+    wait reported in Server-Timing. ``admission`` overrides the
+    ``ADMISSION_*`` settings of the second run; by default a quarter of
+    the threads run analyses and half of them may queue, which leaves
+    threads for the CRUD calls.
+    """
+    admission = dict({
+        'ADMISSION_MAX_CONCURRENT': max(1, threads // 4),
+        'ADMISSION_MAX_QUEUE': max(1, threads // 2),
+        'ADMISSION_BATCH_QUEUE': max(1, threads // 8),
+        'ADMISSION_USER_QUOTA': max(1, threads // 4)
+    }, **(admission or {}))
+    classes = [('interactive', heavy_users * clients_per_user), ('batch', batch_clients), ('crud', crud_clients)]
+    users = [{'username': f'load{n}', 'email': f'load{n}@example.invalid', 'password': 'load'}
+             for n in range(heavy_users + batch_clients + crud_clients)]
+
+    workdir = tempfile.mkdtemp(prefix='afpd-admission-')
+    runs = []
+    with StubElevationServer(latency=latency) as server:
+        try:
+            for label, config in (('off', {'ADMISSION_MAX_CONCURRENT': 0}), ('on', admission)):
+                os.makedirs(os.path.join(workdir, label))
+                app, procedure_ids = _load_app(os.path.join(workdir, label), procedure_count, users, config)
+                services.for_app(app).analyzer = TerrainAnalyzer(build_elevation_resolver(api_url=server.url),
+                                                                 elevation_cache_size=0)
+                urls = {
+                    'interactive': [f'/api/procedures/{i}/terrain' for i in procedure_ids],
+                    'batch': ['/api/airports/LFLL/bundle', '/api/airports/LSGG/bundle'],
+                    'crud': [f'/api/procedures/{i}' for i in procedure_ids]
+                }
+                results = asyncio.run(_run_admission(app, classes, users, urls, heavy_users, duration, threads))
+                for name, r in results.items():
+                    r['admission'] = label
+                    echo(f"admission {label:3s} {name:11s} {r['throughput_rps']:7.1f} req/s"
+                         + (f"  p50 {r['p50_ms']:7.0f} ms  p95 {r['p95_ms']:7.0f} ms" if r['completed'] else '')
+                         + f"  queue {r['mean_queue_wait_ms']:6.0f} ms"
+                         + '  ' + ' '.join(f'{status}:{n}' for status, n in sorted(r['statuses'].items())))
+                runs.extend(results.values())
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'elevation_latency_s': latency,
+            'duration_s': duration,
+            'threads': threads,
+            'procedure_count': procedure_count,
+            'clients': dict(classes),
+            'admission': admission
+        },
+        'results': runs
+    }
+
+
+async def _run_admission(app, classes, users, urls: Dict[str, List[str]], heavy_users: int,
+                         duration: float, threads: int) -> Dict[str, Dict]:
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='afpd-load')
+    loop = asyncio.get_running_loop()
+    deadline = time.perf_counter() + duration
+
+    def client_for(credentials):
+        client = app.test_client()
+        client.post('/auth/login', data={'username': credentials['username'], 'password': credentials['password']})
+        return client
+
+    def caller(credentials, statuses: Counter, waits: List[float]):
+        state = {}
+
+        def get(url):
+            client = state.get('client') or state.setdefault('client', client_for(credentials))
+            return client.get(url)
+
+        async def call(url):
+            response = await loop.run_in_executor(executor, get, url)
+            statuses[response.status_code] += 1
+            waits.append(_queue_wait(response.headers.get('Server-Timing', '')))
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                await asyncio.sleep(min(float(retry_after), max(0.0, deadline - time.perf_counter())))
+            return response.status_code
+        return call
+
+    # Interactive clients share their users' quotas, other clients have a user each
+    owners = {'interactive': [users[n % heavy_users] for n in range(dict(classes)['interactive'])]}
+    spare = iter(users[heavy_users:])
+    for name, count in classes[1:]:
+        owners[name] = [next(spare) for _ in range(count)]
+
+    runs = []
+    for name, _ in classes:
+        statuses, waits = Counter(), []
+        drives = [_drive(caller(credentials, statuses, waits), urls[name][n:] + urls[name][:n], 1, duration)
+                  for n, credentials in enumerate(owners[name])]
+        runs.append((name, statuses, waits, drives))
+    try:
+        outcomes = await asyncio.gather(*[asyncio.gather(*drives) for _, _, _, drives in runs])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    results = {}
+    for (name, statuses, waits, _), outcome in zip(runs, outcomes):
+        latencies = [latency for client_latencies, _, _ in outcome for latency in client_latencies]
+        errors = sum(client_errors for _, client_errors, _ in outcome)
+        unfinished = sum(client_unfinished for _, _, client_unfinished in outcome)
+        summary = _summary(name, len(outcome), latencies, errors, unfinished, duration)
+        summary['client_class'] = summary.pop('mode')
+        summary['clients'] = summary.pop('concurrency')
+        results[name] = dict(summary,
+                             statuses={str(status): n for status, n in statuses.items()},
+                             mean_queue_wait_ms=statistics.fmean(waits) * 1000 if waits else 0.0)
+    return results
+
+
+# Relative frequency of each operation of the mixed workload
+DEFAULT_MIX = {'index': 2, 'list': 4, 'view': 4, 'chain': 2, 'terrain': 1, 'create': 1, 'update': 1}
+_NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+_ACCESS_LOG_LINE = re.compile(r'\[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3})')
+# Sessions are the harness' own: recorded logins and logouts are not replayed
+_SKIPPED_PATHS = ('/auth/',)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """``index=2,list=4,...`` as weights of the operations of ``DEFAULT_MIX``"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation {name}: use {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight')
+    return mix
+
+
+def endpoint_key(method: str, path: str) -> str:
+    """``GET /api/procedures/<id>/terrain`` for ``GET /api/procedures/42/terrain?x=1``"""
+    return f"{method} {_NUMERIC_SEGMENT.sub('/<id>', path.split('?', 1)[0])}"
+
+
+class LatencyRecorder:
+    """Latencies and failures of requests, per endpoint, from any number of threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.failures: Counter = Counter()
+        self.statuses: Dict[str, Counter] = {}
+
+    def add(self, endpoint: str, seconds: float, status: int):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.statuses.setdefault(endpoint, Counter())[status] += 1
+            if not 200 <= status < 400:
+                self.failures[endpoint] += 1
+
+    def report(self, elapsed: float) -> List[Dict]:
+        """p50/p95/p99 latency, throughput and failures of each endpoint, then of all requests"""
+        with self._lock:
+            series = sorted(self.latencies.items())
+            series.append(('total', [s for _, samples in series for s in samples]))
+            rows = []
+            for endpoint, samples in series:
+                samples = sorted(samples)
+                failures = sum(self.failures.values()) if endpoint == 'total' else self.failures[endpoint]
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': len(samples),
+                    'failures': failures,
+                    'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+                    'p50_ms': _percentile(samples, 0.50) * 1000 if samples else None,
+                    'p95_ms': _percentile(samples, 0.95) * 1000 if samples else None,
+                    'p99_ms': _percentile(samples, 0.99) * 1000 if samples else None,
+                    'statuses': ({str(k): v for k, v in sorted(self.statuses[endpoint].items())}
+                                 if endpoint != 'total' else None)
+                })
+            return rows
+
+
+def login(base_url: str, username: str, password: str):
+    """``requests`` session logged in through the ``auth.login`` form"""
+    import requests
+
+    session = requests.Session()
+    try:
+        response = session.post(f'{base_url}/auth/login', data={'username': username, 'password': password},
+                                allow_redirects=False, timeout=30)
+    except requests.RequestException as e:
+        raise RuntimeError(f'Could not reach {base_url}: {e}')
+    location = response.headers.get('Location', '')
+    if response.status_code != 302 or urlparse(location).path.rstrip('/').endswith('/auth/login'):
+        raise RuntimeError(f'Could not log in to {base_url} as {username}')
+    return session
+
+
+def _timed(session, recorder: LatencyRecorder, base_url: str, method: str, path: str, body=None,
+           timeout: float = 120.0, started: Optional[float] = None):
+    """Send one request and record it; ``started`` backdates it to its scheduled time"""
+    import requests
+
+    started = time.perf_counter() if started is None else started
+    try:
+        response = session.request(method, base_url + path, json=body, allow_redirects=False, timeout=timeout)
+        status = response.status_code
+    except requests.RequestException:
+        response, status = None, 0
+    recorder.add(endpoint_key(method, path), time.perf_counter() - started, status)
+    return response
+
+
+def _mix_request(operation: str, rng: random.Random, procedure_ids: List[int], created: List[int],
+                 serial: int):
+    """Method, path and JSON body of one operation of the mixed workload"""
+    if operation == 'update' and not created:
+        operation = 'create'
+    if operation in ('view', 'chain', 'terrain') and not procedure_ids:
+        operation = 'list'
+
+    if operation == 'index':
+        return 'GET', '/', None
+    if operation == 'list':
+        return 'GET', f"/api/procedures?limit=50&offset={rng.randrange(0, max(1, len(procedure_ids)), 50)}", None
+    if operation == 'create':
+        shape = rng.choice(list(PROCEDURE_SHAPES))
+        return 'POST', '/api/procedures', dict(procedure_payload(shape, seed=serial), name=f'LOAD {serial}')
+    if operation == 'update':
+        # Only procedures the load test created itself are changed
+        return 'PUT', f'/api/procedures/{rng.choice(created)}', {'name': f'LOAD {serial} v2'}
+    procedure_id = rng.choice(procedure_ids)
+    if operation == 'view':
+        return 'GET', f'/procedures/{procedure_id}', None
+    if operation == 'chain':
+        return 'GET', f'/api/chain?procedure_id={procedure_id}', None
+    return 'GET', f'/api/procedures/{procedure_id}/terrain', None
+
+
+def drive_mix(base_url: str, sessions: Sequence, mix: Dict[str, float], duration: float,
+              think_time: float = 0.0, seed: int = 0) -> Dict:
+    """One client per session sending ``mix`` operations back to back for ``duration`` seconds.
+
+    Procedures created by the run are deleted at the end; only they are
+    updated, so the harness can be pointed at a shared database.
+    """
+    listing = sessions[0].get(f'{base_url}/api/procedures', params={'limit': 1000}, timeout=60)
+    listing.raise_for_status()
+    procedure_ids = [p['id'] for p in listing.json()]
+    names, weights = zip(*[(name, weight) for name, weight in mix.items() if weight > 0])
+
+    recorder = LatencyRecorder()
+    created: List[int] = []
+    serials = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def client(n: int, session):
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            serial = next(serials)
+            method, path, body = _mix_request(rng.choices(names, weights)[0], rng, procedure_ids, created, serial)
+            response = _timed(session, recorder, base_url, method, path, body)
+            if response is not None and response.status_code == 201:
+                created.append(response.json()['id'])
+            # Rejected by admission control: wait as a well-behaved client would
+            if response is not None and 'Retry-After' in response.headers:
+                time.sleep(min(float(response.headers['Retry-After']), max(0.0, deadline - time.perf_counter())))
+            elif think_time:
+                time.sleep(rng.expovariate(1 / think_time))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n, session), name=f'afpd-load-{n}')
+               for n, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for procedure_id in created:
+        sessions[0].delete(f'{base_url}/api/procedures/{procedure_id}', timeout=60)
+    return {'elapsed_s': elapsed, 'created': len(created), 'endpoints': recorder.report(elapsed)}
+
+
+def read_request_log(path: str) -> List[Dict]:
+    """Requests of a ``REQUEST_LOG`` file or of a common/combined format access log, in time order"""
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+            else:
+                match = _ACCESS_LOG_LINE.search(line)
+                if match is None:
+                    continue
+                entry = {
+                    't': datetime.strptime(match['time'], '%d/%b/%Y:%H:%M:%S %z').timestamp(),
+                    'method': match['method'],
+                    'path': match['path'],
+                    'status': int(match['status'])
+                }
+            if not entry['path'].startswith(_SKIPPED_PATHS):
+                entries.append(entry)
+    entries.sort(key=lambda e: e['t'])
+    return entries
+
+
+def replay(base_url: str, sessions: Sequence, entries: List[Dict], speed: float = 1.0,
+           timeout: float = 120.0) -> Dict:
+    """Send recorded requests at their recorded pace divided by ``speed``.
+
+    The replay is open loop: requests start on schedule whether or not
+    earlier ones have finished, each over whichever session is free, with
+    at most one request in flight per session. Latency is measured from
+    the scheduled start, so time spent waiting for a free session counts.
+    Writes are sent with their recorded body, and a create without one
+    gets a synthetic procedure. Other POST, PUT or PATCH requests without
+    a body are skipped.
+    """
+    pool = ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix='afpd-replay')
+    free = queue.SimpleQueue()
+    for session in sessions:
+        free.put(session)
+    recorder = LatencyRecorder()
+    skipped = Counter()
+    late = 0
+
+    def send(method, path, body, scheduled):
+        session = free.get()
+        try:
+            _timed(session, recorder, base_url, method, path, body, timeout=timeout, started=scheduled)
+        finally:
+            free.put(session)
+
+    started = time.perf_counter()
+    first = entries[0]['t'] if entries else 0.0
+    for n, entry in enumerate(entries):
+        method, path, body = entry['method'], entry['path'], entry.get('body')
+        if method in ('POST', 'PUT', 'PATCH') and body is None:
+            if method == 'POST' and path == '/api/procedures':
+                body = procedure_payload(seed=n)
+            else:
+                skipped[endpoint_key(method, path)] += 1
+                continue
+        scheduled = started + (entry['t'] - first) / speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -0.1:
+            late += 1
+        pool.submit(send, method, path, body, scheduled)
+    pool.shutdown(wait=True)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'elapsed_s': elapsed,
+        'recorded_s': (entries[-1]['t'] - first) if entries else 0.0,
+        'speed': speed,
+        'late_starts': late,
+        'skipped': dict(skipped),
+        'endpoints': recorder.report(elapsed)
+    }
+
+
+class LocalServer:
+    """A fresh app on a temporary SQLite database, served over HTTP with its elevations from a stub.
+
+    The app runs in a threaded Werkzeug server on a free local port, with
+    ``users`` load test accounts (``load0``... password ``load``) and
+    ``procedure_count`` synthetic procedures.
+    """
+
+    class _QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    def __init__(self, procedure_count: int = 200, users: int = 1, latency: float = 0.2,
+                 elevation_cache_size: int = 0, config: Optional[Dict] = None):
+        self.procedure_count = procedure_count
+        self.users = [{'username': f'load{n}', 'email': f'load{n}@example.invalid', 'password': 'load'}
+                      for n in range(users)]
+        self.latency = latency
+        self.config = dict({'ELEVATION_CACHE_SIZE': elevation_cache_size}, **(config or {}))
+        self.elevation = None
+        self._workdir = None
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self) -> 'LocalServer':
+        self._workdir = tempfile.mkdtemp(prefix='afpd-load-')
+        self.elevation = StubElevationServer(latency=self.latency).start()
+        app, _ = _load_app(self._workdir, self.procedure_count, self.users,
+                           dict(self.config, ELEVATION_API_URL=self.elevation.url))
+        self._server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=self._QuietHandler)
+        threading.Thread(target=self._server.serve_forever, name='afpd-load-server', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self.elevation.stop()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+
+def format_report(result: Dict) -> List[str]:
+    lines = [f"{'endpoint':48s} {'requests':>8s} {'fail':>5s} {'req/s':>8s} "
+             f"{'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}"]
+    for row in result['endpoints']:
+        if row['requests']:
+            percentiles = ' '.join(f"{row[key]:8.1f}" for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        else:
+            percentiles = ''
+        lines.append(f"{row['endpoint'][:48]:48s} {row['requests']:8d} {row['failures']:5d} "
+                     f"{row['throughput_rps']:8.1f} {percentiles}")
+    return lines
@@ -0,0 +1,166 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+
+def mercator_lat(y: float) -> float:
+    """Latitude of a Web Mercator y coordinate given as a fraction of the world (0 = north edge)"""
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """``(min_lat, min_lon, max_lat, max_lon)`` of an XYZ map tile"""
+    n = 2 ** z
+    return mercator_lat((y + 1) / n), x / n * 360 - 180, mercator_lat(y / n), (x + 1) / n * 360 - 180
+
+
+def tile_at(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """XYZ tile containing a point"""
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bounds(bounds, z: int) -> Iterator[Tuple[int, int]]:
+    """XYZ tiles at zoom ``z`` covering ``(min_lat, min_lon, max_lat, max_lon)``"""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    x0, y0 = tile_at(max_lat, min_lon, z)
+    x1, y1 = tile_at(min_lat, max_lon, z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+class TileCache:
+    """On-disk LRU of rendered map tiles, stored as ``<layer>/<z>/<x>/<y><extension>``.
+
+    Recency is kept in memory and in the files' modification times, so the
+    order survives restarts. Tiles written by other worker processes are
+    picked up on first read; each process evicts until the tiles it knows
+    about fit in ``max_bytes``.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, extension: str = '.png'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._entries: 'OrderedDict[Tuple, int]' = OrderedDict()
+        self._bytes = 0
+        self._scanned = False
+        self._lock = threading.Lock()
+
+    def _path(self, key: Tuple) -> str:
+        layer, z, x, y = key
+        return os.path.join(self.directory, layer, str(z), str(x), f'{y}{self.extension}')
+
+    def _scan(self):
+        """Index the tiles already on disk, least recently used first"""
+        found = []
+        for root, _, names in os.walk(self.directory):
+            parts = os.path.relpath(root, self.directory).split(os.sep)
+            if len(parts) != 3:
+                continue
+            for name in names:
+                if not name.endswith(self.extension):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                    key = (parts[0], int(parts[1]), int(parts[2]), int(name[:-len(self.extension)]))
+                except (OSError, ValueError):
+                    continue
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self._scanned = True
+
+    def _add(self, key: Tuple, size: int) -> list:
+        """Record a tile; returns the keys evicted to stay within ``max_bytes``"""
+        if not self._scanned:
+            self._scan()
+        self._bytes += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old, old_size = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            evicted.append(old)
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                evicted = []
+            else:
+                evicted = self._add(key, len(data))
+        self._remove_files(evicted)
+        return data
+
+    def put(self, key: Tuple, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self._lock:
+            evicted = self._add(key, len(data))
+        self._remove_files(evicted)
+
+    def invalidate_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> int:
+        """Delete tiles intersecting a box, e.g. after DEM tiles were replaced; returns the count"""
+        removed = []
+        if not os.path.isdir(self.directory):
+            return 0
+        for layer in os.listdir(self.directory):
+            layer_dir = os.path.join(self.directory, layer)
+            if not os.path.isdir(layer_dir):
+                continue
+            for zoom in os.listdir(layer_dir):
+                if not zoom.isdigit():
+                    continue
+                z = int(zoom)
+                # Tiles read a little beyond their edges (shading, line clipping)
+                x0, y0 = tile_at(max_lat, min_lon, z)
+                x1, y1 = tile_at(min_lat, max_lon, z)
+                for column in os.listdir(os.path.join(layer_dir, zoom)):
+                    if not (column.isdigit() and x0 - 1 <= int(column) <= x1 + 1):
+                        continue
+                    for name in os.listdir(os.path.join(layer_dir, zoom, column)):
+                        row = name[:-len(self.extension)]
+                        if name.endswith(self.extension) and row.isdigit() and y0 - 1 <= int(row) <= y1 + 1:
+                            removed.append((layer, z, int(column), int(row)))
+        self._remove_files(removed)
+        with self._lock:
+            for key in removed:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)
+        return len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            if not self._scanned:
+                self._scan()
+            return {'tiles': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
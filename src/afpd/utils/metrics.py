@@ -0,0 +1,196 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Response, g, has_request_context, request
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Endpoint and stage timings of the current asynchronous API request, which
+# has no Flask request context
+_async_request: ContextVar[Optional[Tuple[str, Dict[str, float]]]] = ContextVar('afpd_async_request', default=None)
+
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe in-process store of counters, gauges and histograms.
+
+    Rendered in the Prometheus text exposition format by ``render``.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._gauges: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}
+        self._collectors: List[Callable[['MetricsRegistry'], None]] = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                # One slot per bucket, then sum and count
+                state = series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def register_collector(self, collector: Callable[['MetricsRegistry'], None]):
+        """Register a callback that refreshes gauges right before rendering"""
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector(self)
+
+        lines = []
+        with self._lock:
+            for kind, store in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted(store):
+                    lines.extend(self._header(name, kind))
+                    for key, value in sorted(store[name].items()):
+                        lines.append(f'{name}{_format_labels(key)} {value:g}')
+
+            for name in sorted(self._histograms):
+                lines.extend(self._header(name, 'histogram'))
+                for key, state in sorted(self._histograms[name].items()):
+                    for bound, count in zip(self.buckets, state):
+                        lines.append(f'{name}_bucket{_format_labels(key, (("le", f"{bound:g}"),))} {count:g}')
+                    lines.append(f'{name}_bucket{_format_labels(key, (("le", "+Inf"),))} {state[-1]:g}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {state[-2]:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {state[-1]:g}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name: str, kind: str) -> List[str]:
+        help_text = self._help.get(name, (kind, ''))[1]
+        return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+
+
+metrics = MetricsRegistry()
+metrics.describe('afpd_request_duration_seconds', 'histogram', 'HTTP request latency by endpoint.')
+metrics.describe('afpd_stage_duration_seconds', 'histogram', 'Time spent per analysis pipeline stage.')
+metrics.describe('afpd_elevation_cache_hits_total', 'counter', 'Elevation lookups served from cache.')
+metrics.describe('afpd_elevation_cache_misses_total', 'counter', 'Elevation lookups not found in cache.')
+metrics.describe('afpd_elevation_cache_hit_ratio', 'gauge', 'Share of elevation lookups served from cache.')
+metrics.describe('afpd_elevation_retries_total', 'counter', 'Elevation provider request retries.')
+metrics.describe('afpd_elevation_fallback_total', 'counter', 'Requests that fell back to estimated elevations.')
+
+
+def _cache_ratio_collector(registry: MetricsRegistry):
+    hits = registry.counter_value('afpd_elevation_cache_hits_total')
+    misses = registry.counter_value('afpd_elevation_cache_misses_total')
+    if hits + misses:
+        registry.set_gauge('afpd_elevation_cache_hit_ratio', hits / (hits + misses))
+
+
+metrics.register_collector(_cache_ratio_collector)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time a pipeline stage.
+
+    The duration is recorded in the ``afpd_stage_duration_seconds``
+    histogram and, inside a request, added to its ``Server-Timing`` header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if has_request_context():
+            endpoint = request.endpoint
+            timings = g.setdefault('_afpd_timings', {})
+        else:
+            endpoint, timings = _async_request.get() or (None, None)
+        metrics.observe('afpd_stage_duration_seconds', duration, stage=stage, endpoint=endpoint, **labels)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + duration
+
+
+def observe_request(endpoint: str, method: str, status: int, duration: float,
+                    timings: Dict[str, float]) -> str:
+    """Record a finished request and return its ``Server-Timing`` header value"""
+    metrics.observe('afpd_request_duration_seconds', duration, endpoint=endpoint, method=method, status=status)
+    entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in timings.items()]
+    entries.append(f'total;dur={duration * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def start_async_request(endpoint: str) -> Dict[str, float]:
+    """Collect stage timings of the asynchronous API request running in this context"""
+    timings = {}
+    _async_request.set((endpoint, timings))
+    return timings
+
+
+def _start_request_timer():
+    g._afpd_request_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('_afpd_request_start', None)
+    if start is None:
+        return response
+
+    response.headers['Server-Timing'] = observe_request(
+        request.endpoint or 'unknown', request.method, response.status_code,
+        time.perf_counter() - start, g.pop('_afpd_timings', {})
+    )
+    return response
+
+
+def metrics_view():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Install request timing hooks and the ``/metrics`` endpoint"""
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
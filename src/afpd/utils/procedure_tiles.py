@@ -0,0 +1,376 @@
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from ..models.flight_procedure import FlightProcedure, Waypoint
+from . import spatial_index
+from .map_tiles import TileCache, tile_bounds
+from .. import db
+
+FORMATS = {'mvt': 'application/vnd.mapbox-vector-tile', 'geojson': 'application/geo+json'}
+EXTENT = 4096  # tile coordinate units
+BUFFER = 64  # units drawn beyond the tile edges, so that lines join across tiles
+SIMPLIFY_TOLERANCE = 8  # units (half a pixel of a 256 px tile), so simplification follows the zoom
+WAYPOINT_MIN_ZOOM = 9  # below this only the legs are drawn
+
+Point = Tuple[float, float]
+
+
+# Geometry, in tile units: x east and y south from the tile's north-west corner
+
+def _project(lat: float, lon: float, z: int, x: int, y: int) -> Point:
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    world_y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2
+    return ((lon + 180) / 360 * n - x) * EXTENT, (world_y * n - y) * EXTENT
+
+
+def _unproject(px: float, py: float, z: int, x: int, y: int) -> Point:
+    n = 2 ** z
+    lon = (x + px / EXTENT) / n * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + py / EXTENT) / n))))
+    return lat, lon
+
+
+def simplify(points: Sequence[Point], tolerance: float) -> List[Point]:
+    """Douglas-Peucker simplification of a polyline"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length:
+                d = abs(dy * (px - x1) - dx * (py - y1)) / length
+            else:
+                d = math.hypot(px - x1, py - y1)
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [p for p, kept in zip(points, keep) if kept]
+
+
+def _clip_segment(a: Point, b: Point, low: float, high: float) -> Optional[Tuple[Point, Point]]:
+    """Liang-Barsky clipping of a segment to the square [low, high]^2"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    for p, q in ((-dx, a[0] - low), (dx, high - a[0]), (-dy, a[1] - low), (dy, high - a[1])):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return None
+    return (a[0] + t0 * dx, a[1] + t0 * dy), (a[0] + t1 * dx, a[1] + t1 * dy)
+
+
+def clip_line(points: Sequence[Point], low: float, high: float) -> List[List[Tuple[int, int]]]:
+    """Parts of a polyline inside the square [low, high]^2, rounded to whole units"""
+    parts: List[List[Tuple[int, int]]] = []
+    current: List[Tuple[int, int]] = []
+    for a, b in zip(points, points[1:]):
+        clipped = _clip_segment(a, b, low, high)
+        if clipped is None:
+            continue
+        start, end = [(int(round(px)), int(round(py))) for px, py in clipped]
+        if current and current[-1] != start:
+            parts.append(current)
+            current = []
+        if not current:
+            current = [start]
+        if end != current[-1]:
+            current.append(end)
+    parts.append(current)
+    return [part for part in parts if len(part) >= 2]
+
+
+def tile_features(z: int, x: int, y: int, connection=None) -> Dict[str, List[Dict]]:
+    """Features of a map tile: one ``procedures`` feature (the legs) per
+    procedure crossing it and, from ``WAYPOINT_MIN_ZOOM``, its ``waypoints``.
+
+    Procedures come from the spatial index. Their legs are simplified in
+    tile units before clipping, so a procedure loses detail as the map zooms
+    out and is simplified the same way in every tile it crosses.
+    """
+    connection = connection or db.session.connection()
+    min_lat, min_lon, max_lat, max_lon = tile_bounds(z, x, y)
+    margin = BUFFER / EXTENT
+    lat_margin, lon_margin = (max_lat - min_lat) * margin, (max_lon - min_lon) * margin
+    procedure_ids = spatial_index.procedure_ids_in_bbox(min_lat - lat_margin, min_lon - lon_margin,
+                                                        max_lat + lat_margin, max_lon + lon_margin, connection)
+    layers = {'procedures': [], 'waypoints': []}
+    if not procedure_ids:
+        return layers
+
+    procedures = {
+        row.id: row for row in connection.execute(
+            select(FlightProcedure.id, FlightProcedure.name, FlightProcedure.airport_icao,
+                   FlightProcedure.procedure_type, FlightProcedure.navigation_type)
+            .where(FlightProcedure.id.in_(procedure_ids))
+        )
+    }
+    waypoints = defaultdict(list)
+    for row in connection.execute(
+        select(Waypoint.id, Waypoint.procedure_id, Waypoint.name, Waypoint.latitude, Waypoint.longitude,
+               Waypoint.sequence)
+        .where(Waypoint.procedure_id.in_(procedure_ids))
+        .order_by(Waypoint.procedure_id, Waypoint.sequence, Waypoint.id)
+    ):
+        waypoints[row.procedure_id].append(row)
+
+    for procedure_id in sorted(procedures):
+        procedure = procedures[procedure_id]
+        points = [_project(w.latitude, w.longitude, z, x, y) for w in waypoints[procedure_id]]
+        parts = clip_line(simplify(points, SIMPLIFY_TOLERANCE), -BUFFER, EXTENT + BUFFER)
+        if parts:
+            layers['procedures'].append({
+                'id': procedure_id,
+                'properties': {
+                    'name': procedure.name,
+                    'airport_icao': procedure.airport_icao,
+                    'procedure_type': procedure.procedure_type.value,
+                    'navigation_type': procedure.navigation_type.value
+                },
+                'lines': parts
+            })
+        if z < WAYPOINT_MIN_ZOOM:
+            continue
+        for waypoint, (px, py) in zip(waypoints[procedure_id], points):
+            if 0 <= px < EXTENT and 0 <= py < EXTENT:
+                layers['waypoints'].append({
+                    'id': waypoint.id,
+                    'properties': {'name': waypoint.name, 'procedure_id': procedure_id,
+                                   'sequence': waypoint.sequence},
+                    'point': (int(px), int(py))
+                })
+    return layers
+
+
+# Encodings
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, data: bytes) -> bytes:
+    """A length-delimited protobuf field"""
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 31)
+
+
+def _geometry(feature: Dict) -> Tuple[int, List[int]]:
+    """MVT geometry type and command stream of a feature"""
+    cursor = (0, 0)
+    commands = []
+
+    def move(point):
+        nonlocal cursor
+        commands.extend((_zigzag(point[0] - cursor[0]), _zigzag(point[1] - cursor[1])))
+        cursor = point
+
+    if 'point' in feature:
+        commands.append(1 << 3 | 1)  # MoveTo, one point
+        move(feature['point'])
+        return 1, commands
+    for part in feature['lines']:
+        commands.append(1 << 3 | 1)
+        move(part[0])
+        commands.append((len(part) - 1) << 3 | 2)  # LineTo
+        for point in part[1:]:
+            move(point)
+    return 2, commands
+
+
+def encode_mvt(layers: Dict[str, List[Dict]]) -> bytes:
+    """Mapbox Vector Tile (version 2) of ``tile_features`` output"""
+    tile = bytearray()
+    for name, features in layers.items():
+        if not features:
+            continue
+        keys: Dict[str, int] = {}
+        values: Dict[object, int] = {}
+        layer = bytearray(_varint(15 << 3) + _varint(2) + _field(1, name.encode()))
+        for feature in features:
+            tags = []
+            for key, value in feature['properties'].items():
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault(value, len(values)))
+            geometry_type, commands = _geometry(feature)
+            body = (_varint(1 << 3) + _varint(feature['id'])
+                    + _field(2, b''.join(_varint(t) for t in tags))
+                    + _varint(3 << 3) + _varint(geometry_type)
+                    + _field(4, b''.join(_varint(c) for c in commands)))
+            layer += _field(2, body)
+        for key in keys:
+            layer += _field(3, key.encode())
+        for value in values:
+            if isinstance(value, int):
+                layer += _field(4, _varint(4 << 3) + _varint(value))  # int_value
+            else:
+                layer += _field(4, _field(1, str(value).encode()))  # string_value
+        layer += _varint(5 << 3) + _varint(EXTENT)
+        tile += _field(3, bytes(layer))
+    return bytes(tile)
+
+
+def encode_geojson(layers: Dict[str, List[Dict]], z: int, x: int, y: int) -> bytes:
+    """GeoJSON FeatureCollection of ``tile_features`` output, with a ``layer`` property"""
+
+    def position(point):
+        lat, lon = _unproject(point[0], point[1], z, x, y)
+        return [round(lon, 6), round(lat, 6)]
+
+    features = []
+    for name, layer in layers.items():
+        for feature in layer:
+            if 'point' in feature:
+                geometry = {'type': 'Point', 'coordinates': position(feature['point'])}
+            elif len(feature['lines']) == 1:
+                geometry = {'type': 'LineString', 'coordinates': [position(p) for p in feature['lines'][0]]}
+            else:
+                geometry = {'type': 'MultiLineString',
+                            'coordinates': [[position(p) for p in part] for part in feature['lines']]}
+            features.append({'type': 'Feature', 'id': f"{name}.{feature['id']}", 'geometry': geometry,
+                             'properties': dict(feature['properties'], layer=name)})
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':')).encode()
+
+
+class ProcedureTiles:
+    """Flask extension serving every stored procedure as vector map tiles.
+
+    Encoded tiles are kept in a ``TileCache``. Tiles over a procedure are
+    deleted when a session that changed it commits; Core/bulk statements
+    bypass the ORM and must call ``invalidate_bbox`` or ``clear`` themselves.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROCEDURE_TILE_DIR',
+                              os.getenv('PROCEDURE_TILE_DIR', os.path.join(app.instance_path, 'procedure_tiles')))
+        app.config.setdefault('PROCEDURE_TILE_CACHE_MB', int(os.getenv('PROCEDURE_TILE_CACHE_MB', '256')))
+        app.config.setdefault('PROCEDURE_TILE_MAX_ZOOM', int(os.getenv('PROCEDURE_TILE_MAX_ZOOM', '18')))
+        app.extensions['afpd_procedure_tiles'] = TileCache(
+            app.config['PROCEDURE_TILE_DIR'], app.config['PROCEDURE_TILE_CACHE_MB'] * 1024 * 1024, '.tile'
+        )
+
+    @staticmethod
+    def cache_for(app) -> TileCache:
+        return app.extensions['afpd_procedure_tiles']
+
+    def tile(self, z: int, x: int, y: int, fmt: str = 'mvt', app=None) -> Tuple[bytes, bool]:
+        """A tile in ``fmt`` (see ``FORMATS``) and whether it came from the cache"""
+        cache = self.cache_for(app or current_app)
+        key = (fmt, z, x, y)
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+        layers = tile_features(z, x, y)
+        data = encode_mvt(layers) if fmt == 'mvt' else encode_geojson(layers, z, x, y)
+        cache.put(key, data)
+        return data, False
+
+    def invalidate_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, app=None) -> int:
+        return self.cache_for(app or current_app).invalidate_bbox(min_lat, min_lon, max_lat, max_lon)
+
+    def clear(self, app=None) -> int:
+        return self.invalidate_bbox(-90.0, -180.0, 90.0, 180.0, app)
+
+
+procedure_tiles = ProcedureTiles()
+
+
+# Invalidate cached tiles when procedures change
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_areas(session, flush_context):
+    """Remember the area of every procedure changed by the flush, old and new geometry.
+
+    The new geometry is in the database by now; moved and deleted
+    waypoints add their old positions, which covers every old leg.
+    """
+    points: Dict[int, List[Point]] = defaultdict(list)  # known positions by procedure
+
+    for obj in session.new:
+        if isinstance(obj, FlightProcedure):
+            points.setdefault(obj.id, [])
+        elif isinstance(obj, Waypoint):
+            points[obj.procedure_id].append((obj.latitude, obj.longitude))
+    for obj in session.dirty:
+        if isinstance(obj, FlightProcedure) and session.is_modified(obj):
+            points.setdefault(obj.id, [])
+        elif isinstance(obj, Waypoint) and session.is_modified(obj):
+            state = inspect(obj).attrs
+            old_lat = (state.latitude.history.deleted or [obj.latitude])[0]
+            old_lon = (state.longitude.history.deleted or [obj.longitude])[0]
+            for procedure_id in [obj.procedure_id, *(state.procedure_id.history.deleted or ())]:
+                points[procedure_id].extend([(old_lat, old_lon), (obj.latitude, obj.longitude)])
+    for obj in session.deleted:
+        if isinstance(obj, FlightProcedure):
+            points.setdefault(obj.id, [])
+        elif isinstance(obj, Waypoint):
+            points[obj.procedure_id].append((obj.latitude, obj.longitude))
+
+    points.pop(None, None)
+    if not points:
+        return
+    rows = session.connection().execute(
+        select(Waypoint.procedure_id, func.min(Waypoint.latitude), func.min(Waypoint.longitude),
+               func.max(Waypoint.latitude), func.max(Waypoint.longitude))
+        .where(Waypoint.procedure_id.in_(list(points)))
+        .group_by(Waypoint.procedure_id)
+    )
+    for procedure_id, min_lat, min_lon, max_lat, max_lon in rows:
+        points[procedure_id].extend([(min_lat, min_lon), (max_lat, max_lon)])
+
+    areas = session.info.setdefault('afpd_changed_areas', [])
+    for known in points.values():
+        known = [p for p in known if p[0] is not None and p[1] is not None]
+        if known:
+            lats, lons = zip(*known)
+            areas.append((min(lats), min(lons), max(lats), max(lons)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_areas(session):
+    areas = session.info.pop('afpd_changed_areas', None)
+    if not areas or not has_app_context() or 'afpd_procedure_tiles' not in current_app.extensions:
+        return
+    for area in areas:
+        procedure_tiles.invalidate_bbox(*area)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_areas(session):
+    session.info.pop('afpd_changed_areas', None)
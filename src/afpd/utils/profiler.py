@@ -0,0 +1,184 @@
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-AFPD-Profile'
+PROFILE_QUERY_ARG = 'profile'
+
+
+class SamplingProfiler:
+    """Low-overhead wall-clock sampler for a single thread.
+
+    A daemon thread periodically snapshots the target thread's stack via
+    ``sys._current_frames`` and counts identical stacks, producing the
+    "collapsed stack" format understood by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='afpd-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own_frame_files = {__file__}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename not in own_frame_files:
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+class RequestProfiler:
+    """Opt-in, rate-limited per-request profiling for selected views.
+
+    A request is profiled when it carries the ``PROFILER_TOKEN`` in the
+    ``X-AFPD-Profile`` header or the ``profile`` query argument. Output is
+    written to ``PROFILER_DIR/<endpoint>/<procedure id>/`` and the directory
+    is rotated to stay within ``PROFILER_MAX_FILES`` and ``PROFILER_MAX_BYTES``.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._active = False
+        self._last_started = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_TOKEN', os.getenv('PROFILER_TOKEN'))
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER_INTERVAL', 0.005)  # seconds between samples
+        app.config.setdefault('PROFILER_MIN_INTERVAL', 10.0)  # seconds between profiled requests
+        app.config.setdefault('PROFILER_MAX_FILES', 200)
+        app.config.setdefault('PROFILER_MAX_BYTES', 50 * 1024 * 1024)
+        app.extensions['afpd_profiler'] = self
+
+    def _requested(self) -> bool:
+        token = current_app.config.get('PROFILER_TOKEN')
+        if not token:
+            return False
+        supplied = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_ARG)
+        # Compared as bytes: compare_digest refuses non-ASCII str
+        return bool(supplied) and hmac.compare_digest(supplied.encode(), token.encode())
+
+    def _acquire(self) -> bool:
+        """Allow one profiled request at a time, at most once per interval"""
+        min_interval = current_app.config['PROFILER_MIN_INTERVAL']
+        with self._lock:
+            now = time.monotonic()
+            if self._active or now - self._last_started < min_interval:
+                return False
+            self._active = True
+            self._last_started = now
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._active = False
+
+    def profiled(self, view):
+        """Decorator enabling on-demand profiling of a view function"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._requested():
+                return view(*args, **kwargs)
+            if not self._acquire():
+                response = make_response(view(*args, **kwargs))
+                response.headers[PROFILE_HEADER] = 'rate-limited'
+                return response
+
+            sampler = SamplingProfiler(threading.get_ident(), current_app.config['PROFILER_INTERVAL'])
+            started = time.perf_counter()
+            sampler.start()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                sampler.stop()
+                self._release()
+
+            try:
+                path = self._save(sampler, time.perf_counter() - started)
+                response.headers[PROFILE_HEADER] = os.path.relpath(path, current_app.config['PROFILER_DIR'])
+            except OSError:
+                logger.exception("Could not save request profile")
+            return response
+        return wrapper
+
+    def _save(self, sampler: SamplingProfiler, duration: float) -> str:
+        config = current_app.config
+        # Only integer ids go into the path; anything else is filed under 'none'
+        procedure_id = (request.view_args or {}).get('id') or request.args.get('procedure_id', type=int)
+        directory = os.path.join(
+            config['PROFILER_DIR'],
+            request.endpoint or 'unknown',
+            str(procedure_id) if isinstance(procedure_id, int) else 'none'
+        )
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(directory, f'{timestamp}-{duration * 1000:.0f}ms.collapsed')
+        with open(path, 'w') as f:
+            f.write(sampler.collapsed())
+
+        self._rotate(config['PROFILER_DIR'], config['PROFILER_MAX_FILES'], config['PROFILER_MAX_BYTES'])
+        return path
+
+    @staticmethod
+    def _rotate(root: str, max_files: int, max_bytes: int):
+        """Delete the oldest profiles until the directory is within bounds"""
+        files = []
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total_bytes = sum(size for _, size, _ in files)
+        while files and (len(files) > max_files or total_bytes > max_bytes):
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            parent = os.path.dirname(path)
+            if parent != root and not os.listdir(parent):
+                os.rmdir(parent)
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+import time
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+# Larger JSON bodies are logged without their body
+MAX_LOGGED_BODY = 64 * 1024
+
+
+class RequestLog:
+    """JSON lines log of served requests, replayable with ``flask afpd load-test --replay``.
+
+    Enabled by setting ``REQUEST_LOG`` to a file path. Each line holds the
+    start time, method, path with query string, status, duration and user
+    id of one request. The JSON bodies of API writes are kept too, so that
+    creates and updates replay as sent. Form posts, including logins, are
+    logged without their body.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REQUEST_LOG', os.getenv('REQUEST_LOG'))
+        if not app.config['REQUEST_LOG']:
+            return
+        app.extensions['afpd_request_log'] = open(app.config['REQUEST_LOG'], 'a', buffering=1)
+        app.before_request(self._start)
+        app.after_request(self._record)
+
+    @staticmethod
+    def _start():
+        g._afpd_log_start = (time.time(), time.perf_counter())
+
+    def _record(self, response):
+        started = g.pop('_afpd_log_start', None)
+        if started is None:
+            return response
+
+        entry = {
+            't': round(started[0], 6),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started[1]) * 1000, 3),
+            'user': current_user.get_id() if current_user.is_authenticated else None
+        }
+        if (request.method in ('POST', 'PUT', 'PATCH') and request.is_json
+                and (request.content_length or 0) <= MAX_LOGGED_BODY):
+            entry['body'] = request.get_json(silent=True)
+
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            current_app.extensions['afpd_request_log'].write(line)
+        return response
+
+
+request_log = RequestLog()
@@ -0,0 +1,533 @@
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from ..models.flight_procedure import FlightProcedure, NavigationType, ProcedureType, Waypoint
+from ..models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from .elevation_cache import ESTIMATED
+from .metrics import span
+from .spatial_index import NM_PER_DEGREE
+from ..preload import preload_hook
+from .. import db
+
+logger = logging.getLogger(__name__)
+
+# Lattice moves (rows north, cols east): 16 headings, the knight moves
+# giving intermediate angles between the 8 compass directions
+MOVES = ((1, 0), (2, 1), (1, 1), (1, 2), (0, 1), (-1, 2), (-1, 1), (-2, 1),
+         (-1, 0), (-2, -1), (-1, -1), (-1, -2), (0, -1), (1, -2), (1, -1), (2, -1))
+HEADINGS = tuple(math.degrees(math.atan2(dc, dr)) % 360 for dr, dc in MOVES)
+
+# Largest grid a route search runs over
+MAX_SEARCH_CELLS = 40000
+
+
+def _turn_angle(h1: float, h2: float) -> float:
+    angle = abs(h2 - h1) % 360
+    return min(angle, 360 - angle)
+
+
+class CostGrid:
+    """Terrain elevations (feet) sampled at the centres of a regular grid.
+
+    Cells are ``cell_nm`` square in a local projection of the region
+    ``(min_lat, min_lon, max_lat, max_lon)``; row 0 is the southern edge.
+    """
+
+    def __init__(self, bounds: Tuple[float, float, float, float], cell_nm: float, elevations,
+                 estimated: bool = False):
+        self.bounds = bounds
+        self.cell_nm = cell_nm
+        self.elevations = elevations
+        self.estimated = estimated
+        min_lat, min_lon, max_lat, max_lon = bounds
+        self.dlat = cell_nm / NM_PER_DEGREE
+        self.dlon = cell_nm / (NM_PER_DEGREE * math.cos(math.radians((min_lat + max_lat) / 2)))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.elevations.shape
+
+    @staticmethod
+    def dimensions(bounds, cell_nm: float) -> Tuple[int, int]:
+        min_lat, min_lon, max_lat, max_lon = bounds
+        mid_lat = math.radians((min_lat + max_lat) / 2)
+        rows = max(1, math.ceil((max_lat - min_lat) * NM_PER_DEGREE / cell_nm))
+        cols = max(1, math.ceil((max_lon - min_lon) * NM_PER_DEGREE * math.cos(mid_lat) / cell_nm))
+        return rows, cols
+
+    @classmethod
+    def build(cls, bounds, cell_nm: float, resolver) -> 'CostGrid':
+        """Sample the elevation backend once per cell centre"""
+        import numpy as np
+
+        rows, cols = cls.dimensions(bounds, cell_nm)
+        grid = cls(bounds, cell_nm, np.zeros((rows, cols)))
+        r, c = np.mgrid[0:rows, 0:cols]
+        lats, lons = grid.cell_centre(r.ravel(), c.ravel())
+        elevations, sources = resolver.resolve(lats, lons)
+        grid.elevations = np.asarray(elevations, dtype=float).reshape(rows, cols)
+        grid.estimated = bool((np.asarray(sources) == ESTIMATED).any())
+        return grid
+
+    def cell_centre(self, row, col):
+        return (self.bounds[0] + (row + 0.5) * self.dlat,
+                self.bounds[1] + (col + 0.5) * self.dlon)
+
+    def cell_of(self, latitude: float, longitude: float) -> Optional[Tuple[int, int]]:
+        row = int((latitude - self.bounds[0]) / self.dlat)
+        col = int((longitude - self.bounds[1]) / self.dlon)
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row, col
+        return None
+
+    def elevation_at(self, latitudes, longitudes):
+        """Bilinear interpolation between cell centres; positions off the grid take the edge value"""
+        import numpy as np
+
+        rows, cols = self.shape
+        # One extra row and column, so that every cell has four corners
+        padded = np.pad(self.elevations, ((0, 1), (0, 1)), mode='edge').ravel()
+        r = (np.asarray(latitudes) - self.bounds[0]) / self.dlat - 0.5
+        c = (np.asarray(longitudes) - self.bounds[1]) / self.dlon - 0.5
+        np.clip(r, 0, rows - 1, out=r)
+        np.clip(c, 0, cols - 1, out=c)
+        r0, c0 = r.astype(np.intp), c.astype(np.intp)
+        r -= r0
+        c -= c0
+        index = r0 * (cols + 1) + c0
+        top = padded.take(index) * (1 - c) + padded.take(index + 1) * c
+        index += cols + 1
+        bottom = padded.take(index) * (1 - c) + padded.take(index + 1) * c
+        return top + (bottom - top) * r
+
+    def minimum_safe_altitudes(self, clearance: float, radius_cells: int):
+        """Highest terrain within ``radius_cells`` of each cell plus ``clearance``.
+
+        With a radius of at least one cell this also covers the cells a
+        knight move jumps over.
+        """
+        import numpy as np
+
+        result = self.elevations.copy()
+        padded_rows = np.pad(result, ((radius_cells, radius_cells), (0, 0)), mode='edge')
+        result = np.max([padded_rows[i:i + self.shape[0]] for i in range(2 * radius_cells + 1)], axis=0)
+        padded_cols = np.pad(result, ((0, 0), (radius_cells, radius_cells)), mode='edge')
+        result = np.max([padded_cols[:, i:i + self.shape[1]] for i in range(2 * radius_cells + 1)], axis=0)
+        return result + clearance
+
+
+class CostGridCache:
+    """Process-wide LRU of cost grids, backed by ``.npz`` files.
+
+    Regions are snapped outward to ``snap_degrees`` so that searches around
+    the same airport reuse one grid. Grids containing estimated elevations
+    are kept in memory only.
+    """
+
+    def __init__(self, max_grids: int = 16, snap_degrees: float = 0.25):
+        self.max_grids = max_grids
+        self.snap_degrees = snap_degrees
+        self.directory: Optional[str] = None
+        self._grids: 'OrderedDict[Tuple, CostGrid]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('ROUTE_GRID_DIR', os.path.join(app.instance_path, 'route_grids'))
+        self.directory = app.config['ROUTE_GRID_DIR']
+
+    def snap(self, bounds) -> Tuple[float, float, float, float]:
+        step = self.snap_degrees
+        min_lat, min_lon, max_lat, max_lon = bounds
+        return (math.floor(min_lat / step) * step, math.floor(min_lon / step) * step,
+                math.ceil(max_lat / step) * step, math.ceil(max_lon / step) * step)
+
+    def _path(self, key) -> Optional[str]:
+        if not self.directory:
+            return None
+        name = '_'.join(f'{value:g}' for value in key)
+        return os.path.join(self.directory, f'{name}.npz')
+
+    @staticmethod
+    def _contains(outer, inner) -> bool:
+        return (outer[0] <= inner[0] and outer[1] <= inner[1]
+                and outer[2] >= inner[2] and outer[3] >= inner[3])
+
+    @staticmethod
+    def _intersects(a, b) -> bool:
+        return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+    def _stored_keys(self) -> List[Tuple]:
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        keys = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    keys.append(tuple(float(value) for value in name[:-4].split('_')))
+                except ValueError:
+                    continue
+        return keys
+
+    def _load(self, key) -> CostGrid:
+        import numpy as np
+
+        with np.load(self._path(key)) as data:
+            return CostGrid(key[:4], key[4], data['elevations'])
+
+    def _remember(self, key, grid: CostGrid):
+        with self._lock:
+            self._grids[key] = grid
+            while len(self._grids) > self.max_grids:
+                self._grids.popitem(last=False)
+
+    def get(self, bounds, cell_nm: float, resolver, max_cells: Optional[int] = None) -> Tuple[CostGrid, bool]:
+        """Return a grid covering ``bounds`` and whether it was already computed.
+
+        Any cached grid (in memory, then on disk) containing the region is
+        reused, e.g. one precomputed for the whole airport area, unless it
+        has more than ``max_cells`` cells; a grid over the snapped region
+        is built then.
+        """
+        import numpy as np
+
+        def usable(key) -> bool:
+            if key[4] != cell_nm or not self._contains(key[:4], bounds):
+                return False
+            rows, cols = CostGrid.dimensions(key[:4], cell_nm)
+            return max_cells is None or rows * cols <= max_cells
+
+        with self._lock:
+            for key, grid in reversed(self._grids.items()):
+                if usable(key):
+                    self._grids.move_to_end(key)
+                    return grid, True
+
+        for key in self._stored_keys():
+            if usable(key):
+                grid = self._load(key)
+                self._remember(key, grid)
+                return grid, True
+
+        bounds = self.snap(bounds)
+        key = bounds + (cell_nm,)
+        grid = CostGrid.build(bounds, cell_nm, resolver)
+        path = self._path(key)
+        if path and not grid.estimated:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez_compressed(path, elevations=grid.elevations)
+        self._remember(key, grid)
+        return grid, False
+
+    def load_all(self):
+        """Load every stored grid into memory, e.g. before workers fork"""
+        for key in self._stored_keys()[:self.max_grids]:
+            self._remember(key, self._load(key))
+
+    def invalidate_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> int:
+        """Drop grids intersecting a box, in memory and on disk, e.g. after DEM tiles were replaced; returns how many"""
+        box = (min_lat, min_lon, max_lat, max_lon)
+        with self._lock:
+            stale = {key for key in self._grids if self._intersects(key[:4], box)}
+            for key in stale:
+                del self._grids[key]
+        for key in self._stored_keys():
+            if self._intersects(key[:4], box):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                stale.add(key)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+
+
+grid_cache = CostGridCache()
+
+
+@preload_hook
+def _preload_route_grids(app):
+    grid_cache.load_all()
+
+
+def airport_region(airport_icao: str, margin_nm: float = 15.0) -> Optional[Tuple[float, float, float, float]]:
+    """Bounds of an airport's stored waypoints plus a margin, or None if it has none"""
+    row = db.session.execute(
+        select(func.min(Waypoint.latitude), func.min(Waypoint.longitude),
+               func.max(Waypoint.latitude), func.max(Waypoint.longitude))
+        .join(FlightProcedure, FlightProcedure.id == Waypoint.procedure_id)
+        .where(FlightProcedure.airport_icao == airport_icao)
+    ).one()
+    if row[0] is None:
+        return None
+    margin_lat = margin_nm / NM_PER_DEGREE
+    margin_lon = margin_nm / (NM_PER_DEGREE * math.cos(math.radians((row[0] + row[2]) / 2)))
+    return row[0] - margin_lat, row[1] - margin_lon, row[2] + margin_lat, row[3] + margin_lon
+
+
+class RouteOptimizer:
+    """Propose waypoint sequences between two points that keep the MSA low.
+
+    A* runs over (cell, heading, straight-run) states of a cached cost grid.
+    A heading change creates a waypoint and is only allowed after a
+    straight leg of at least ``min_leg_nm``, and by at most the validator's
+    ``max_turn_angle`` for the procedure type. A move costs its length
+    times ``1 + terrain_weight * (MSA above the region's lowest MSA, in
+    thousands of feet)``, and each turn adds ``turn_penalty_nm``.
+    Searching with several terrain weights gives alternative candidates,
+    from shortest to lowest.
+    """
+
+    def __init__(self, analyzer, validator, cache: CostGridCache = grid_cache,
+                 cell_nm: float = 1.0, margin_nm: float = 15.0, min_leg_nm: float = 2.0,
+                 turn_penalty_nm: float = 1.0, max_region_degrees: float = 3.0,
+                 max_cells: int = MAX_SEARCH_CELLS):
+        self.analyzer = analyzer
+        self.validator = validator
+        self.cache = cache
+        self.cell_nm = cell_nm
+        self.margin_nm = margin_nm
+        self.min_leg_nm = min_leg_nm
+        self.turn_penalty_nm = turn_penalty_nm
+        self.max_region_degrees = max_region_degrees
+        self.max_cells = max_cells
+
+    def region(self, start: Tuple[float, float], end: Tuple[float, float]) -> Tuple[float, float, float, float]:
+        margin_lat = self.margin_nm / NM_PER_DEGREE
+        mid_lat = math.radians((start[0] + end[0]) / 2)
+        margin_lon = self.margin_nm / (NM_PER_DEGREE * math.cos(mid_lat))
+        return (min(start[0], end[0]) - margin_lat, min(start[1], end[1]) - margin_lon,
+                max(start[0], end[0]) + margin_lat, max(start[1], end[1]) + margin_lon)
+
+    def optimize(self, start: Tuple[float, float], end: Tuple[float, float],
+                 procedure_type: ProcedureType, initial_heading: Optional[float] = None,
+                 terrain_weights=(0.0, 1.0, 4.0)) -> Dict:
+        """Candidate routes from ``start`` to ``end`` as (latitude, longitude) pairs"""
+        bounds = self.region(start, end)
+        if (bounds[2] - bounds[0] > self.max_region_degrees
+                or bounds[3] - bounds[1] > self.max_region_degrees):
+            return {
+                'status': 'error',
+                'message': f'Start and end are too far apart (region limited to {self.max_region_degrees:g}°)'
+            }
+        # The cache builds missing grids over the snapped region
+        rows, cols = CostGrid.dimensions(self.cache.snap(bounds), self.cell_nm)
+        if rows * cols > self.max_cells:
+            return self._too_many_cells()
+
+        with span('route_grid'):
+            grid, cached = self.cache.get(bounds, self.cell_nm, self.analyzer.elevation_resolver,
+                                          max_cells=self.max_cells)
+            clearance = self.analyzer.minimum_obstacle_clearance[procedure_type.name]
+            msa = grid.minimum_safe_altitudes(clearance, radius_cells=1)
+
+        start_cell, end_cell = grid.cell_of(*start), grid.cell_of(*end)
+        max_turn = self.validator.max_turn_angle[procedure_type]
+
+        candidates = []
+        seen = set()
+        started = time.perf_counter()
+        with span('route_search'):
+            for weight in terrain_weights:
+                cells = self._search(grid, msa, start_cell, end_cell, max_turn, weight, initial_heading)
+                if cells is None or tuple(cells) in seen:
+                    continue
+                seen.add(tuple(cells))
+                candidates.append(self._candidate(grid, msa, cells, start, end, procedure_type, weight))
+        search_ms = (time.perf_counter() - started) * 1000
+
+        return {
+            'status': 'success' if candidates else 'error',
+            'message': None if candidates else 'No route satisfies the turn and leg length limits',
+            'candidates': sorted(candidates, key=lambda c: (c['minimum_safe_altitude'], c['total_distance'])),
+            'grid': {
+                'bounds': grid.bounds,
+                'cell_nm': grid.cell_nm,
+                'shape': grid.shape,
+                'cached': cached,
+                'using_estimated_data': grid.estimated
+            },
+            'search_ms': round(search_ms, 1)
+        }
+
+    def _too_many_cells(self) -> Dict:
+        return {
+            'status': 'error',
+            'message': f'Search region exceeds {self.max_cells} cells; use a larger cell_nm'
+        }
+
+    def _search(self, grid: CostGrid, msa, start, goal, max_turn: float, weight: float,
+                initial_heading: Optional[float]) -> Optional[List[Tuple[int, int]]]:
+        """A* over (cell, heading, run) states; returns the turn points, start and goal included"""
+        rows, cols = grid.shape
+        cell = grid.cell_nm
+        headings = len(MOVES)
+        floor = float(msa.min())
+        excess = ((msa - floor) / 1000.0 * weight).ravel().tolist()
+        lengths = [cell * math.hypot(dr, dc) for dr, dc in MOVES]
+        # Moves along a heading needed for a leg of at least min_leg_nm. The
+        # first and last legs need one more: the route's ends are snapped
+        # from their cell centres back onto the requested points.
+        min_run = [max(1, math.ceil(self.min_leg_nm / length - 1e-9)) for length in lengths]
+        runs = max(min_run) + 2
+        # Per heading: the straight move, and the straight move plus turns
+        straight = [[(h, 0.0)] for h in range(headings)]
+        turning = [[(h1, 0.0)] + [(h2, self.turn_penalty_nm) for h2 in range(headings)
+                                  if h2 != h1 and _turn_angle(HEADINGS[h1], HEADINGS[h2]) <= max_turn]
+                   for h1 in range(headings)]
+        if initial_heading is None:
+            first = list(range(headings))
+        else:
+            first = [min(range(headings), key=lambda h: _turn_angle(HEADINGS[h], initial_heading))]
+
+        # Flat lookup table: neighbour of each cell along each heading, -1
+        # off the grid
+        goal_r, goal_c = goal
+        goal_index = goal_r * cols + goal_c
+        neighbour = []
+        for r in range(rows):
+            for c in range(cols):
+                for dr, dc in MOVES:
+                    r2, c2 = r + dr, c + dc
+                    neighbour.append(r2 * cols + c2 if 0 <= r2 < rows and 0 <= c2 < cols else -1)
+
+        # Heuristic: the straight-line distance, or with terrain weighting the
+        # exact cost to the goal ignoring turns and leg lengths. Both are
+        # lower bounds, so the search stays optimal.
+        if weight:
+            heuristic = self._cost_to_goal(goal_index, neighbour, lengths, excess)
+        else:
+            heuristic = [cell * math.hypot(r - goal_r, c - goal_c) for r in range(rows) for c in range(cols)]
+
+        # State index: (cell * headings + heading) * runs + run. The run
+        # counts moves since the last turn, capped one past the heading's
+        # min_run; a route's first move has run 0.
+        best = [math.inf] * (rows * cols * headings * runs)
+        parent = {}
+        open_heap = []
+        push = heapq.heappush
+        pop = heapq.heappop
+
+        start_index = start[0] * cols + start[1]
+        for h in first:
+            target = neighbour[start_index * headings + h]
+            if target >= 0:
+                state = (target * headings + h) * runs
+                cost = lengths[h] * (1 + excess[target])
+                best[state] = cost
+                parent[state] = None
+                push(open_heap, (cost + heuristic[target], -cost, state))
+
+        # Ties on f go to the deeper state, which keeps A* from flooding the
+        # many equally good lattice paths
+        while open_heap:
+            _, cost, state = pop(open_heap)
+            cost = -cost
+            if cost > best[state]:
+                continue
+            index, run = divmod(state, runs)
+            cell_index, h = divmod(index, headings)
+            if cell_index == goal_index and run > min_run[h]:
+                return self._turn_points(state, parent, start, cols, headings, runs)
+
+            straight_run = min(run + 1, min_run[h] + 1)
+            base = cell_index * headings
+            for h2, penalty in (turning[h] if run >= min_run[h] else straight[h]):
+                target = neighbour[base + h2]
+                if target < 0:
+                    continue
+                next_state = (target * headings + h2) * runs + (1 if penalty else straight_run)
+                next_cost = cost + penalty + lengths[h2] * (1 + excess[target])
+                if next_cost < best[next_state]:
+                    best[next_state] = next_cost
+                    parent[next_state] = state
+                    push(open_heap, (next_cost + heuristic[target], -next_cost, next_state))
+        return None
+
+    @staticmethod
+    def _cost_to_goal(goal_index: int, neighbour: List[int], lengths: List[float],
+                      excess: List[float]) -> List[float]:
+        """Dijkstra from the goal over cells, every move allowed from every cell"""
+        headings = len(MOVES)
+        opposite = [MOVES.index((-dr, -dc)) for dr, dc in MOVES]
+        cost = [math.inf] * len(excess)
+        cost[goal_index] = 0.0
+        open_heap = [(0.0, goal_index)]
+        while open_heap:
+            current, index = heapq.heappop(open_heap)
+            if current > cost[index]:
+                continue
+            # Entering ``index`` costs the same from any predecessor heading h
+            step = 1 + excess[index]
+            base = index * headings
+            for h in range(headings):
+                previous = neighbour[base + opposite[h]]
+                if previous < 0:
+                    continue
+                candidate = current + lengths[h] * step
+                if candidate < cost[previous]:
+                    cost[previous] = candidate
+                    heapq.heappush(open_heap, (candidate, previous))
+        return cost
+
+    @staticmethod
+    def _turn_points(state, parent, start, cols, headings, runs) -> List[Tuple[int, int]]:
+        path = []
+        while state is not None:
+            cell_index, h = divmod(state // runs, headings)
+            path.append((*divmod(cell_index, cols), h))
+            state = parent[state]
+        path.reverse()
+        points = [start]
+        for previous, current in zip(path, path[1:]):
+            if current[2] != previous[2]:
+                points.append(previous[:2])
+        points.append(path[-1][:2])
+        return points
+
+    def _candidate(self, grid: CostGrid, msa, cells, start, end, procedure_type, weight) -> Dict:
+        # Snap the first and last points back to the requested positions
+        positions = [start] + [tuple(float(v) for v in grid.cell_centre(*cell)) for cell in cells[1:-1]] + [end]
+        waypoints = [{
+            'name': f'RT{i:03d}',
+            'latitude': round(lat, 6),
+            'longitude': round(lon, 6),
+            'sequence': i + 1
+        } for i, (lat, lon) in enumerate(positions)]
+
+        legs = [self.analyzer._calculate_distance(*a, *b) for a, b in zip(positions, positions[1:])]
+        route_msa = max(float(msa[cell]) for cell in self._cells_along(cells))
+        turn_angles = [
+            _turn_angle(self.analyzer._calculate_bearing(*a, *b), self.analyzer._calculate_bearing(*b, *c))
+            for a, b, c in zip(positions, positions[1:], positions[2:])
+        ]
+        snapshot = ProcedureSnapshot(None, 'candidate', None, procedure_type, NavigationType.RNAV, waypoints=[
+            WaypointSnapshot(None, w['name'], w['latitude'], w['longitude'], w['sequence']) for w in waypoints
+        ])
+        return {
+            'terrain_weight': weight,
+            'waypoints': waypoints,
+            'violations': self.validator.validate_procedure(snapshot),
+            'total_distance': sum(legs),
+            'leg_distances': legs,
+            'turn_angles': turn_angles,
+            'minimum_safe_altitude': route_msa
+        }
+
+    @staticmethod
+    def _cells_along(cells):
+        """Grid cells visited by straight lines between consecutive turn points"""
+        for (r1, c1), (r2, c2) in zip(cells, cells[1:]):
+            steps = max(abs(r2 - r1), abs(c2 - c1), 1)
+            for i in range(steps + 1):
+                yield (round(r1 + (r2 - r1) * i / steps), round(c1 + (c2 - c1) * i / steps))
@@ -0,0 +1,586 @@
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+
+from ..models.flight_procedure import FlightProcedure, Waypoint
+from .. import db
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_NM = 3440.065
+NM_PER_DEGREE = EARTH_RADIUS_NM * math.pi / 180
+CORRIDOR_PIECE_NM = 10.0
+
+# SQLite R*Tree virtual tables. Each waypoint is a degenerate box; each leg
+# (waypoint -> next waypoint by sequence) is keyed by its start waypoint id
+# and keeps its exact end points in auxiliary columns, because the R*Tree
+# itself only stores 32-bit float bounds.
+RTREE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS waypoint_rtree USING rtree("
+    "id, min_lat, max_lat, min_lon, max_lon, +procedure_id INTEGER)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS leg_rtree USING rtree("
+    "id, min_lat, max_lat, min_lon, max_lon, +procedure_id INTEGER, "
+    "+lat1 REAL, +lon1 REAL, +lat2 REAL, +lon2 REAL)",
+)
+
+_INSERT_WAYPOINTS = """
+    INSERT INTO waypoint_rtree (id, min_lat, max_lat, min_lon, max_lon, procedure_id)
+    SELECT id, latitude, latitude, longitude, longitude, procedure_id FROM waypoints {where}
+"""
+
+_INSERT_LEGS = """
+    INSERT INTO leg_rtree (id, min_lat, max_lat, min_lon, max_lon, procedure_id, lat1, lon1, lat2, lon2)
+    SELECT id, min(lat1, lat2), max(lat1, lat2), min(lon1, lon2), max(lon1, lon2),
+           procedure_id, lat1, lon1, lat2, lon2
+    FROM (
+        SELECT id, procedure_id, latitude AS lat1, longitude AS lon1,
+               lead(latitude) OVER w AS lat2, lead(longitude) OVER w AS lon2
+        FROM waypoints {where}
+        WINDOW w AS (PARTITION BY procedure_id ORDER BY sequence, id)
+    )
+    WHERE lat2 IS NOT NULL
+"""
+
+
+# PostGIS: a generated point column on waypoints and a leg table (same keys
+# as leg_rtree) with a LineString per leg, both with GiST indexes.
+# Coordinates stay in the Float columns; geometries are derived from them.
+POSTGIS_DDL = (
+    "ALTER TABLE waypoints ADD COLUMN IF NOT EXISTS geom geometry(Point, 4326) "
+    "GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_waypoints_geom ON waypoints USING gist (geom)",
+    "CREATE TABLE IF NOT EXISTS leg_geoms ("
+    "id INTEGER PRIMARY KEY, procedure_id INTEGER NOT NULL, "
+    "lat1 DOUBLE PRECISION NOT NULL, lon1 DOUBLE PRECISION NOT NULL, "
+    "lat2 DOUBLE PRECISION NOT NULL, lon2 DOUBLE PRECISION NOT NULL, "
+    "geom geometry(LineString, 4326) NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_leg_geoms_geom ON leg_geoms USING gist (geom)",
+    "CREATE INDEX IF NOT EXISTS ix_leg_geoms_procedure_id ON leg_geoms (procedure_id)",
+)
+
+_INSERT_LEG_GEOMS = """
+    INSERT INTO leg_geoms (id, procedure_id, lat1, lon1, lat2, lon2, geom)
+    SELECT id, procedure_id, lat1, lon1, lat2, lon2,
+           ST_SetSRID(ST_MakeLine(ST_MakePoint(lon1, lat1), ST_MakePoint(lon2, lat2)), 4326)
+    FROM (
+        SELECT id, procedure_id, latitude AS lat1, longitude AS lon1,
+               lead(latitude) OVER w AS lat2, lead(longitude) OVER w AS lon2
+        FROM waypoints {where}
+        WINDOW w AS (PARTITION BY procedure_id ORDER BY sequence, id)
+    ) legs
+    WHERE lat2 IS NOT NULL
+"""
+
+METRES_PER_NM = 1852.0
+
+
+def _id_list(ids: Iterable[int]) -> str:
+    return ','.join(str(int(i)) for i in ids)
+
+
+def has_rtree(connection) -> bool:
+    if connection.dialect.name != 'sqlite':
+        return False
+    return connection.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE name IN ('waypoint_rtree', 'leg_rtree')"
+    )).scalar() == 2
+
+
+def has_postgis(connection) -> bool:
+    """Whether the PostGIS leg table (and so the waypoint geometry column) exists"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text("SELECT to_regclass('leg_geoms') IS NOT NULL")).scalar()
+
+
+def _postgis_installed(connection) -> bool:
+    return connection.execute(text("SELECT count(*) FROM pg_extension WHERE extname = 'postgis'")).scalar() > 0
+
+
+def ensure_schema(connection) -> bool:
+    """Create the spatial index if missing; returns whether it was created.
+
+    SQLite gets R*Tree tables. PostgreSQL gets a geometry column, a leg
+    table and GiST indexes when the PostGIS extension is installed
+    (``CREATE EXTENSION postgis``, run by ``flask db upgrade``). Other
+    databases have no index.
+    """
+    if connection.dialect.name == 'sqlite':
+        if has_rtree(connection):
+            return False
+        statements = RTREE_DDL
+    elif connection.dialect.name == 'postgresql' and _postgis_installed(connection):
+        if has_postgis(connection):
+            return False
+        statements = POSTGIS_DDL
+    else:
+        return False
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+def rebuild(connection, procedure_ids: Optional[Iterable[int]] = None,
+            stale_waypoint_ids: Iterable[int] = ()):
+    """Re-index every procedure, or only ``procedure_ids``.
+
+    ``stale_waypoint_ids`` are ids of waypoints that no longer belong to
+    those procedures (deleted or moved) and must be dropped as well.
+    """
+    if has_postgis(connection):
+        _rebuild_postgis(connection, procedure_ids)
+        return
+    if not has_rtree(connection):
+        return
+
+    if procedure_ids is None:
+        connection.execute(text("DELETE FROM waypoint_rtree"))
+        connection.execute(text("DELETE FROM leg_rtree"))
+        where = ''
+    else:
+        procedure_ids = _id_list(procedure_ids)
+        if not procedure_ids:
+            return
+        where = f'WHERE procedure_id IN ({procedure_ids})'
+        # R*Tree lookups by auxiliary column are full scans, so delete by id:
+        # the procedures' current waypoints plus the ones that went away
+        current = connection.execute(text(f"SELECT id FROM waypoints {where}")).scalars()
+        stale = _id_list(set(current) | set(stale_waypoint_ids))
+        if stale:
+            connection.execute(text(f"DELETE FROM waypoint_rtree WHERE id IN ({stale})"))
+            connection.execute(text(f"DELETE FROM leg_rtree WHERE id IN ({stale})"))
+
+    connection.execute(text(_INSERT_WAYPOINTS.format(where=where)))
+    connection.execute(text(_INSERT_LEGS.format(where=where)))
+
+
+def _rebuild_postgis(connection, procedure_ids: Optional[Iterable[int]]):
+    # Waypoint points are a generated column; only legs are derived from
+    # several rows. Moved waypoints list both procedures, so
+    # deleting by procedure covers them.
+    if procedure_ids is None:
+        connection.execute(text("DELETE FROM leg_geoms"))
+        where = ''
+    else:
+        procedure_ids = _id_list(procedure_ids)
+        if not procedure_ids:
+            return
+        where = f'WHERE procedure_id IN ({procedure_ids})'
+        connection.execute(text(f"DELETE FROM leg_geoms {where}"))
+    connection.execute(text(_INSERT_LEG_GEOMS.format(where=where)))
+
+
+# Keep the index in step with the tables
+
+@event.listens_for(Waypoint.__table__, 'after_create')
+def _create_rtree(target, connection, **kw):
+    ensure_schema(connection)
+
+
+@event.listens_for(Waypoint.__table__, 'before_drop')
+def _drop_rtree(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("DROP TABLE IF EXISTS waypoint_rtree"))
+        connection.execute(text("DROP TABLE IF EXISTS leg_rtree"))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text("DROP TABLE IF EXISTS leg_geoms"))
+
+
+@event.listens_for(Session, 'after_flush')
+def _reindex_flushed(session, flush_context):
+    """Re-index procedures whose waypoints were inserted, changed or deleted.
+
+    Core/bulk statements bypass the ORM and must call ``rebuild`` (or
+    ``flask afpd spatial-index``) themselves.
+    """
+    procedure_ids: Set[int] = set()
+    stale_waypoint_ids: Set[int] = set()
+
+    for obj in session.new:
+        if isinstance(obj, Waypoint):
+            procedure_ids.add(obj.procedure_id)
+    for obj in session.dirty:
+        if isinstance(obj, Waypoint) and session.is_modified(obj):
+            procedure_ids.add(obj.procedure_id)
+            history = inspect(obj).attrs.procedure_id.history
+            procedure_ids.update(history.deleted or ())
+            stale_waypoint_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Waypoint):
+            procedure_ids.add(obj.procedure_id)
+            stale_waypoint_ids.add(obj.id)
+        elif isinstance(obj, FlightProcedure):
+            procedure_ids.add(obj.id)
+
+    procedure_ids.discard(None)
+    if procedure_ids:
+        connection = session.connection()
+        if connection.dialect.name in ('sqlite', 'postgresql'):
+            rebuild(connection, procedure_ids, stale_waypoint_ids)
+
+
+# Geometry. Distances use a local equirectangular projection around the
+# query, which is accurate to well under 1% at the tens-of-NM scale of
+# terminal procedures.
+
+def _project(lat: float, lon: float, origin: Tuple[float, float]) -> Tuple[float, float]:
+    lat0, lon0 = origin
+    return ((lon - lon0) * NM_PER_DEGREE * math.cos(math.radians(lat0)),
+            (lat - lat0) * NM_PER_DEGREE)
+
+
+def _point_segment_distance(p, a, b) -> float:
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length2))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def _segments_intersect(a, b, c, d) -> bool:
+    def orient(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+
+    d1, d2 = orient(c, d, a), orient(c, d, b)
+    d3, d4 = orient(a, b, c), orient(a, b, d)
+    return (d1 * d2 < 0) and (d3 * d4 < 0)
+
+
+def _segment_distance(a, b, c, d) -> float:
+    if _segments_intersect(a, b, c, d):
+        return 0.0
+    return min(_point_segment_distance(a, c, d), _point_segment_distance(b, c, d),
+               _point_segment_distance(c, a, b), _point_segment_distance(d, a, b))
+
+
+def _segment_in_bbox(lat1, lon1, lat2, lon2, min_lat, min_lon, max_lat, max_lon) -> bool:
+    """Whether a leg (as a straight line in lat/lon) touches the box"""
+    def inside(lat, lon):
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+    if inside(lat1, lon1) or inside(lat2, lon2):
+        return True
+    a, b = (lon1, lat1), (lon2, lat2)
+    corners = [(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat), (min_lon, max_lat)]
+    return any(_segments_intersect(a, b, corners[i], corners[(i + 1) % 4]) for i in range(4))
+
+
+def expand_bbox(lat: float, lon: float, radius_nm: float) -> Tuple[float, float, float, float]:
+    """``(min_lat, min_lon, max_lat, max_lon)`` of a box containing the circle around a point"""
+    dlat = radius_nm / NM_PER_DEGREE
+    max_abs_lat = min(89.0, abs(lat) + dlat)
+    dlon = min(180.0, radius_nm / (NM_PER_DEGREE * math.cos(math.radians(max_abs_lat))))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def locate_on_path(latitude: float, longitude: float, latitudes: Sequence[float],
+                   longitudes: Sequence[float]) -> Tuple[int, float, float]:
+    """Nearest leg of a waypoint path to a point.
+
+    Returns ``(leg index, fraction along the leg, cross-track distance NM)``.
+    """
+    origin = (latitude, longitude)
+    centre = (0.0, 0.0)
+    best = (0, 0.0, math.inf)
+    for i in range(len(latitudes) - 1):
+        a = _project(latitudes[i], longitudes[i], origin)
+        b = _project(latitudes[i + 1], longitudes[i + 1], origin)
+        distance = _point_segment_distance(centre, a, b)
+        if distance < best[2]:
+            dx, dy = b[0] - a[0], b[1] - a[1]
+            length2 = dx * dx + dy * dy
+            fraction = 0.0 if length2 == 0 else max(0.0, min(1.0, -(a[0] * dx + a[1] * dy) / length2))
+            best = (i, fraction, distance)
+    return best
+
+
+# Candidate lookup. The R*Tree and GiST indexes are the fast paths; other
+# databases (or ones without the index yet) fall back to plain range
+# predicates.
+
+_ENVELOPE = "ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326)"
+
+
+def _waypoint_candidates(connection, min_lat, min_lon, max_lat, max_lon) -> List[Tuple]:
+    if has_postgis(connection):
+        statement = text(
+            "SELECT id, procedure_id, name, latitude, longitude, sequence FROM waypoints "
+            f"WHERE geom && {_ENVELOPE}"
+        )
+    elif has_rtree(connection):
+        statement = text(
+            "SELECT w.id, w.procedure_id, w.name, w.latitude, w.longitude, w.sequence "
+            "FROM waypoint_rtree r JOIN waypoints w ON w.id = r.id "
+            "WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat "
+            "AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon"
+        )
+    else:
+        statement = text(
+            "SELECT id, procedure_id, name, latitude, longitude, sequence FROM waypoints "
+            "WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon"
+        )
+    rows = connection.execute(statement, dict(min_lat=min_lat, min_lon=min_lon,
+                                               max_lat=max_lat, max_lon=max_lon))
+    # The R*Tree stores float32 bounds, so re-check exactly
+    return [tuple(r) for r in rows
+            if min_lat <= r[3] <= max_lat and min_lon <= r[4] <= max_lon]
+
+
+def _leg_candidates(connection, min_lat, min_lon, max_lat, max_lon) -> List[Tuple]:
+    """Legs whose bounding box meets the query box, as (id, procedure_id, lat1, lon1, lat2, lon2)"""
+    params = dict(min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+    if has_postgis(connection):
+        statement = text(
+            "SELECT id, procedure_id, lat1, lon1, lat2, lon2 FROM leg_geoms "
+            f"WHERE geom && {_ENVELOPE}"
+        )
+    elif has_rtree(connection):
+        statement = text(
+            "SELECT id, procedure_id, lat1, lon1, lat2, lon2 FROM leg_rtree "
+            "WHERE max_lat >= :min_lat AND min_lat <= :max_lat "
+            "AND max_lon >= :min_lon AND min_lon <= :max_lon"
+        )
+    else:
+        statement = text(
+            "SELECT id, procedure_id, lat1, lon1, lat2, lon2 FROM ("
+            "  SELECT id, procedure_id, latitude AS lat1, longitude AS lon1,"
+            "         lead(latitude) OVER (PARTITION BY procedure_id ORDER BY sequence, id) AS lat2,"
+            "         lead(longitude) OVER (PARTITION BY procedure_id ORDER BY sequence, id) AS lon2"
+            "  FROM waypoints"
+            ") legs "
+            "WHERE lat2 IS NOT NULL "
+            "AND (lat1 >= :min_lat OR lat2 >= :min_lat) AND (lat1 <= :max_lat OR lat2 <= :max_lat) "
+            "AND (lon1 >= :min_lon OR lon2 >= :min_lon) AND (lon1 <= :max_lon OR lon2 <= :max_lon)"
+        )
+    return [tuple(r) for r in connection.execute(statement, params)]
+
+
+# PostGIS evaluates the whole predicate. Distances are geodesic (WGS84)
+# rather than measured in the local projection used above; the two agree to
+# well under 1% at terminal procedure scales.
+
+def _postgis_bbox_legs(connection, min_lat, min_lon, max_lat, max_lon) -> List[Tuple]:
+    statement = text(
+        "SELECT id, procedure_id, lat1, lon1, lat2, lon2 FROM leg_geoms "
+        f"WHERE geom && {_ENVELOPE} AND ST_Intersects(geom, {_ENVELOPE})"
+    )
+    return [tuple(r) for r in connection.execute(statement, dict(min_lat=min_lat, min_lon=min_lon,
+                                                                 max_lat=max_lat, max_lon=max_lon))]
+
+
+def _postgis_radius(connection, latitude: float, longitude: float,
+                    radius_nm: float) -> Tuple[List[Tuple], List[Tuple]]:
+    """Waypoints and legs within ``radius_nm``, each row ending with its distance in NM"""
+    min_lat, min_lon, max_lat, max_lon = expand_bbox(latitude, longitude, radius_nm)
+    params = dict(lat=latitude, lon=longitude, metres=radius_nm * METRES_PER_NM,
+                  min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+    centre = "ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography"
+    # The envelope lets the planner use the GiST index; ST_DWithin is exact
+    waypoints = connection.execute(text(
+        "SELECT id, procedure_id, name, latitude, longitude, sequence, "
+        f"ST_Distance(geom::geography, {centre}) / {METRES_PER_NM} FROM waypoints "
+        f"WHERE geom && {_ENVELOPE} AND ST_DWithin(geom::geography, {centre}, :metres)"
+    ), params)
+    legs = connection.execute(text(
+        "SELECT id, procedure_id, lat1, lon1, lat2, lon2, "
+        f"ST_Distance(geom::geography, {centre}) / {METRES_PER_NM} FROM leg_geoms "
+        f"WHERE geom && {_ENVELOPE} AND ST_DWithin(geom::geography, {centre}, :metres)"
+    ), params)
+    return [tuple(r) for r in waypoints], [tuple(r) for r in legs]
+
+
+def _postgis_corridor(connection, path: Sequence[Tuple[float, float]], half_width_nm: float) -> List[Tuple]:
+    """Legs within ``half_width_nm`` of ``path``, each row ending with its distance in NM"""
+    line = 'LINESTRING({})'.format(', '.join(f'{lon!r} {lat!r}' for lat, lon in path))
+    # A degree of longitude is the shortest degree on the path, so this
+    # planar margin (which the GiST index can use) never misses a leg
+    max_abs_lat = min(89.0, max(abs(lat) for lat, _ in path) + half_width_nm / NM_PER_DEGREE)
+    margin = half_width_nm / (NM_PER_DEGREE * math.cos(math.radians(max_abs_lat)))
+    statement = text(
+        "SELECT id, procedure_id, lat1, lon1, lat2, lon2, "
+        f"ST_Distance(geom::geography, corridor::geography) / {METRES_PER_NM} "
+        "FROM leg_geoms, (SELECT ST_GeomFromText(:line, 4326) AS corridor) c "
+        "WHERE ST_DWithin(geom, corridor, :margin) AND ST_DWithin(geom::geography, corridor::geography, :metres)"
+    )
+    rows = connection.execute(statement, dict(line=line, margin=margin,
+                                              metres=half_width_nm * METRES_PER_NM))
+    return [tuple(r) for r in rows]
+
+
+def _procedure_rows(connection, procedure_ids: Iterable[int]) -> Dict[int, Dict]:
+    procedure_ids = list(procedure_ids)
+    if not procedure_ids:
+        return {}
+    rows = connection.execute(
+        select(FlightProcedure.id, FlightProcedure.name, FlightProcedure.airport_icao,
+               FlightProcedure.procedure_type, FlightProcedure.navigation_type)
+        .where(FlightProcedure.id.in_(procedure_ids))
+    )
+    return {
+        r.id: {
+            'id': r.id,
+            'name': r.name,
+            'airport_icao': r.airport_icao,
+            'procedure_type': r.procedure_type.value,
+            'navigation_type': r.navigation_type.value
+        }
+        for r in rows
+    }
+
+
+def _leg_dict(leg: Tuple, distance: Optional[float] = None) -> Dict:
+    result = {
+        'waypoint_id': leg[0],
+        'start': {'latitude': leg[2], 'longitude': leg[3]},
+        'end': {'latitude': leg[4], 'longitude': leg[5]}
+    }
+    if distance is not None:
+        result['distance_nm'] = round(distance, 3)
+    return result
+
+
+def _waypoint_dict(row: Tuple, distance: Optional[float] = None) -> Dict:
+    result = {'id': row[0], 'name': row[2], 'latitude': row[3], 'longitude': row[4], 'sequence': row[5]}
+    if distance is not None:
+        result['distance_nm'] = round(distance, 3)
+    return result
+
+
+def _collect(connection, waypoints: Dict[int, List[Dict]], legs: Dict[int, List[Dict]],
+             limit: Optional[int]) -> List[Dict]:
+    """Attach matches to procedure rows, nearest first when distances are known"""
+    procedure_ids = set(waypoints) | set(legs)
+
+    def nearest(pid):
+        distances = [m['distance_nm'] for m in waypoints.get(pid, []) + legs.get(pid, [])
+                     if 'distance_nm' in m]
+        return min(distances) if distances else 0.0
+
+    ordered = sorted(procedure_ids, key=lambda pid: (nearest(pid), pid))
+    if limit is not None:
+        ordered = ordered[:limit]
+
+    procedures = _procedure_rows(connection, ordered)
+    results = []
+    for pid in ordered:
+        if pid not in procedures:
+            continue
+        result = dict(procedures[pid],
+                      waypoints=sorted(waypoints.get(pid, []), key=lambda m: (m.get('distance_nm', 0), m['sequence'])),
+                      legs=sorted(legs.get(pid, []), key=lambda m: (m.get('distance_nm', 0), m['waypoint_id'])))
+        if any('distance_nm' in m for m in result['waypoints'] + result['legs']):
+            result['distance_nm'] = nearest(pid)
+        results.append(result)
+    return results
+
+
+# Queries
+
+def query_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+               limit: Optional[int] = None, connection=None) -> List[Dict]:
+    """Procedures with a waypoint inside, or a leg crossing, the box"""
+    connection = connection or db.session.connection()
+    waypoints = defaultdict(list)
+    for row in _waypoint_candidates(connection, min_lat, min_lon, max_lat, max_lon):
+        waypoints[row[1]].append(_waypoint_dict(row))
+
+    legs = defaultdict(list)
+    if has_postgis(connection):
+        for leg in _postgis_bbox_legs(connection, min_lat, min_lon, max_lat, max_lon):
+            legs[leg[1]].append(_leg_dict(leg))
+        return _collect(connection, waypoints, legs, limit)
+    for leg in _leg_candidates(connection, min_lat, min_lon, max_lat, max_lon):
+        if _segment_in_bbox(*leg[2:], min_lat, min_lon, max_lat, max_lon):
+            legs[leg[1]].append(_leg_dict(leg))
+
+    return _collect(connection, waypoints, legs, limit)
+
+
+def procedure_ids_in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                          connection=None) -> Set[int]:
+    """Ids of the procedures ``query_bbox`` would return, without their matches"""
+    connection = connection or db.session.connection()
+    procedure_ids = {row[1] for row in _waypoint_candidates(connection, min_lat, min_lon, max_lat, max_lon)}
+    if has_postgis(connection):
+        legs = _postgis_bbox_legs(connection, min_lat, min_lon, max_lat, max_lon)
+    else:
+        legs = [leg for leg in _leg_candidates(connection, min_lat, min_lon, max_lat, max_lon)
+                if leg[1] not in procedure_ids
+                and _segment_in_bbox(*leg[2:], min_lat, min_lon, max_lat, max_lon)]
+    procedure_ids.update(leg[1] for leg in legs)
+    return procedure_ids
+
+
+def query_radius(latitude: float, longitude: float, radius_nm: float,
+                 limit: Optional[int] = None, connection=None) -> List[Dict]:
+    """Procedures passing within ``radius_nm`` of a point, nearest first"""
+    connection = connection or db.session.connection()
+    if has_postgis(connection):
+        waypoint_rows, leg_rows = _postgis_radius(connection, latitude, longitude, radius_nm)
+        waypoints, legs = defaultdict(list), defaultdict(list)
+        for row in waypoint_rows:
+            waypoints[row[1]].append(_waypoint_dict(row[:-1], row[-1]))
+        for leg in leg_rows:
+            legs[leg[1]].append(_leg_dict(leg[:-1], leg[-1]))
+        return _collect(connection, waypoints, legs, limit)
+
+    origin = (latitude, longitude)
+    centre = (0.0, 0.0)
+    bbox = expand_bbox(latitude, longitude, radius_nm)
+
+    waypoints = defaultdict(list)
+    for row in _waypoint_candidates(connection, *bbox):
+        distance = math.hypot(*_project(row[3], row[4], origin))
+        if distance <= radius_nm:
+            waypoints[row[1]].append(_waypoint_dict(row, distance))
+
+    legs = defaultdict(list)
+    for leg in _leg_candidates(connection, *bbox):
+        distance = _point_segment_distance(centre, _project(leg[2], leg[3], origin),
+                                           _project(leg[4], leg[5], origin))
+        if distance <= radius_nm:
+            legs[leg[1]].append(_leg_dict(leg, distance))
+
+    return _collect(connection, waypoints, legs, limit)
+
+
+def query_corridor(path: Sequence[Tuple[float, float]], half_width_nm: float,
+                   limit: Optional[int] = None, connection=None) -> List[Dict]:
+    """Procedures with a leg within ``half_width_nm`` of the polyline ``path``"""
+    connection = connection or db.session.connection()
+    legs: Dict[int, Dict[int, Dict]] = defaultdict(dict)
+    if has_postgis(connection):
+        for leg in _postgis_corridor(connection, path, half_width_nm):
+            legs[leg[1]][leg[0]] = _leg_dict(leg[:-1], leg[-1])
+        return _collect(connection, {}, {pid: list(m.values()) for pid, m in legs.items()}, limit)
+
+    for (lat1, lon1), (lat2, lon2) in zip(path, path[1:]):
+        origin = ((lat1 + lat2) / 2, (lon1 + lon2) / 2)
+        a, b = _project(lat1, lon1, origin), _project(lat2, lon2, origin)
+
+        # A long diagonal segment has a huge bounding box, so prefilter it
+        # in pieces of at most CORRIDOR_PIECE_NM
+        pieces = max(1, math.ceil(math.hypot(b[0] - a[0], b[1] - a[1]) / CORRIDOR_PIECE_NM))
+        candidates = {}
+        for i in range(pieces):
+            start = (lat1 + (lat2 - lat1) * i / pieces, lon1 + (lon2 - lon1) * i / pieces)
+            end = (lat1 + (lat2 - lat1) * (i + 1) / pieces, lon1 + (lon2 - lon1) * (i + 1) / pieces)
+            low = expand_bbox(min(start[0], end[0]), min(start[1], end[1]), half_width_nm)
+            high = expand_bbox(max(start[0], end[0]), max(start[1], end[1]), half_width_nm)
+            for leg in _leg_candidates(connection, low[0], low[1], high[2], high[3]):
+                candidates[leg[0]] = leg
+
+        for leg in candidates.values():
+            distance = _segment_distance(_project(leg[2], leg[3], origin),
+                                         _project(leg[4], leg[5], origin), a, b)
+            if distance > half_width_nm:
+                continue
+            best = legs[leg[1]].get(leg[0])
+            if best is None or distance < best['distance_nm']:
+                legs[leg[1]][leg[0]] = _leg_dict(leg, distance)
+
+    legs = {pid: list(matches.values()) for pid, matches in legs.items()}
+    return _collect(connection, {}, legs, limit)
@@ -0,0 +1,118 @@
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .elevation import FEET_PER_METER
+
+
+def stub_elevation_m(lat: float, lon: float) -> float:
+    """Terrain model served by the stub, matching ``StubElevationProvider`` (in metres)"""
+    feet = 1500.0 + 2500.0 * (0.5 + 0.5 * math.sin(lat * 7.0) * math.cos(lon * 5.0))
+    return feet / FEET_PER_METER
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up (timeouts, cancelled load test requests) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            locations = json.loads(self.rfile.read(length))['locations']
+        except (ValueError, KeyError):
+            self._reply(400, {'error': 'Invalid JSON'})
+            return
+
+        with server.stats_lock:
+            server.request_count += 1
+        delay = server.latency + (server.rng.uniform(0, server.jitter) if server.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if server.failure_rate and server.rng.random() < server.failure_rate:
+            self._reply(503, {'error': 'Injected failure'})
+            return
+
+        self._reply(200, {'results': [
+            {
+                'latitude': loc['latitude'],
+                'longitude': loc['longitude'],
+                'elevation': stub_elevation_m(loc['latitude'], loc['longitude'])
+            }
+            for loc in locations
+        ]})
+
+
+class StubElevationServer:
+    """Local Open-Elevation compatible server with configurable latency and failures.
+
+    Used to exercise the remote provider chain (hedging, circuit breakers)
+    and for load tests without touching the public service::
+
+        with StubElevationServer(latency=0.2, failure_rate=0.1) as server:
+            analyzer = TerrainAnalyzer(build_elevation_resolver(api_url=server.url))
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, seed=None):
+        self.httpd = _StubHTTPServer((host, port), _LookupHandler)
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.failure_rate = failure_rate
+        self.httpd.rng = random.Random(seed)
+        self.httpd.request_count = 0
+        self.httpd.stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/api/v1/lookup'
+
+    @property
+    def request_count(self) -> int:
+        return self.httpd.request_count
+
+    def start(self) -> 'StubElevationServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='afpd-stub-elevation',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,128 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, insert, inspect, update
+from sqlalchemy.orm import Session
+
+from ..models.flight_procedure import FlightProcedure, ProcedureSummary, Waypoint
+from ..models.snapshot import ProcedureSnapshot
+from ..validation.icao_validator import ICAOValidator
+from .analysis import services
+
+logger = logging.getLogger(__name__)
+
+
+def validation_status(violations: Dict[str, List[str]]) -> str:
+    if violations['critical']:
+        return 'invalid'
+    return 'warnings' if violations['warnings'] else 'valid'
+
+
+def summarize(procedure: ProcedureSnapshot, validator: ICAOValidator) -> Dict:
+    """``procedure_summaries`` row values of a procedure, without the MSA"""
+    violations = validator.validate_procedure(procedure)
+    waypoint_count = len(procedure.waypoints)
+    total_distance = validator.track_generator.build(procedure).length if waypoint_count >= 2 else 0.0
+    return {
+        'procedure_id': procedure.id,
+        'waypoint_count': waypoint_count,
+        'leg_count': max(waypoint_count - 1, 0),
+        'total_distance': total_distance,
+        'validation_status': validation_status(violations),
+        'critical_count': len(violations['critical']),
+        'warning_count': len(violations['warnings']),
+        'digest': procedure.digest,
+        'updated_at': datetime.utcnow()
+    }
+
+
+def refresh(connection, procedure_ids: Optional[Iterable[int]] = None, batch_size: int = 1000,
+            validator: Optional[ICAOValidator] = None) -> int:
+    """Recompute the summaries of every procedure, or only ``procedure_ids``; returns how many.
+
+    The status is that of ``validator``, by default the current app's
+    (``ICAO_DISABLED_RULES``/``ICAO_RULE_SEVERITY``), as the API reports it.
+    The MSA of the previous summary is kept when the procedure's geometry
+    and constraints (its digest) did not change, and cleared otherwise.
+    """
+    table = ProcedureSummary.__table__
+    criteria = [] if procedure_ids is None else [FlightProcedure.id.in_(list(procedure_ids))]
+    snapshots = ProcedureSnapshot.load_many(*criteria, connection=connection)
+    ids = [s.id for s in snapshots]
+    if procedure_ids is not None:
+        gone = set(procedure_ids) - set(ids)
+        if gone:
+            connection.execute(delete(table).where(table.c.procedure_id.in_(gone)))
+    if not snapshots:
+        return 0
+
+    previous = {}
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        previous.update((row.procedure_id, row) for row in connection.execute(
+            table.select().with_only_columns(table.c.procedure_id, table.c.digest, table.c.max_msa,
+                                             table.c.msa_updated_at)
+            .where(table.c.procedure_id.in_(chunk))
+        ))
+
+    validator = validator or services.validator
+    rows = []
+    for snapshot in snapshots:
+        row = summarize(snapshot, validator)
+        old = previous.get(snapshot.id)
+        kept = old is not None and old.digest == row['digest']
+        row['max_msa'] = old.max_msa if kept else None
+        row['msa_updated_at'] = old.msa_updated_at if kept else None
+        rows.append(row)
+
+    for start in range(0, len(ids), batch_size):
+        connection.execute(delete(table).where(table.c.procedure_id.in_(ids[start:start + batch_size])))
+    connection.execute(insert(table), rows)
+    return len(rows)
+
+
+def record_msa(connection, procedure: ProcedureSnapshot, max_msa: float) -> bool:
+    """Store the MSA found by a terrain analysis, unless the procedure changed since its summary"""
+    table = ProcedureSummary.__table__
+    result = connection.execute(
+        update(table)
+        .where(table.c.procedure_id == procedure.id, table.c.digest == procedure.digest)
+        .values(max_msa=max_msa, msa_updated_at=datetime.utcnow())
+    )
+    return result.rowcount > 0
+
+
+# Keep the summaries in step with the tables
+
+@event.listens_for(Session, 'after_flush')
+def _summarize_flushed(session, flush_context):
+    """Recompute the summaries of procedures or waypoints inserted, changed or deleted.
+
+    Runs in the flush's transaction, so a summary commits or rolls back
+    with the change it describes. Core/bulk statements bypass the ORM and
+    must call ``refresh`` (or ``flask afpd summaries``) themselves.
+    """
+    procedure_ids: Set[int] = set()
+
+    for obj in session.new:
+        if isinstance(obj, FlightProcedure):
+            procedure_ids.add(obj.id)
+        elif isinstance(obj, Waypoint):
+            procedure_ids.add(obj.procedure_id)
+    for obj in session.dirty:
+        if isinstance(obj, (FlightProcedure, Waypoint)) and session.is_modified(obj):
+            if isinstance(obj, FlightProcedure):
+                procedure_ids.add(obj.id)
+            else:
+                procedure_ids.add(obj.procedure_id)
+                procedure_ids.update(inspect(obj).attrs.procedure_id.history.deleted or ())
+    for obj in session.deleted:
+        if isinstance(obj, FlightProcedure):
+            procedure_ids.add(obj.id)
+        elif isinstance(obj, Waypoint):
+            procedure_ids.add(obj.procedure_id)
+
+    procedure_ids.discard(None)
+    if procedure_ids:
+        refresh(session.connection(), procedure_ids)
@@ -0,0 +1,164 @@
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import insert, select
+
+from ..models.flight_procedure import FlightProcedure, Waypoint, ProcedureType, NavigationType
+from . import spatial_index, summaries
+from .procedure_tiles import procedure_tiles
+from .elevation import ElevationProvider, ElevationResolver
+from .terrain_analysis import TerrainAnalyzer
+from .. import db
+
+# Shapes of the synthetic procedures used by benchmarks and load tests
+PROCEDURE_SHAPES = {
+    'short_approach': {'procedure_type': ProcedureType.APPROACH, 'waypoint_count': 5},
+    'sid': {'procedure_type': ProcedureType.SID, 'waypoint_count': 8},
+    'star_50': {'procedure_type': ProcedureType.STAR, 'waypoint_count': 50},
+}
+
+
+def make_waypoint_data(
+    procedure_type: ProcedureType,
+    waypoint_count: int,
+    origin: Tuple[float, float] = (45.0, 6.0),
+    seed: int = 0
+) -> List[Dict]:
+    """Generate waypoint dicts for a plausible, ICAO-valid procedure.
+
+    Legs are 3-8 NM long, turns stay within +/-45 degrees and altitude
+    constraints change with gradients well below the validator limits.
+    """
+    rng = random.Random(seed)
+    lat, lon = origin
+    heading = rng.uniform(0, 360)
+    altitude = 3000.0 if procedure_type == ProcedureType.SID else 4000.0 + 300.0 * waypoint_count
+
+    waypoints = []
+    for i in range(waypoint_count):
+        waypoints.append({
+            'name': f'WP{i:03d}',
+            'latitude': round(lat, 6),
+            'longitude': round(lon, 6),
+            'sequence': i + 1,
+            'altitude_constraint': round(altitude, -1),
+            'speed_constraint': 210.0 if procedure_type != ProcedureType.APPROACH else 160.0
+        })
+
+        leg_length = rng.uniform(3.0, 8.0)  # NM
+        heading = (heading + rng.uniform(-45.0, 45.0)) % 360
+        lat += leg_length / 60.0 * math.cos(math.radians(heading))
+        lon += leg_length / 60.0 * math.sin(math.radians(heading)) / math.cos(math.radians(lat))
+
+        # ~3% gradient, comfortably inside every procedure type limit
+        altitude_change = leg_length * 6076 * 0.03
+        if procedure_type == ProcedureType.SID:
+            altitude += altitude_change
+        else:
+            altitude = max(1500.0, altitude - altitude_change)
+
+    return waypoints
+
+
+def make_procedure(shape: str = 'short_approach', seed: int = 0,
+                   origin: Tuple[float, float] = (45.0, 6.0)) -> FlightProcedure:
+    """Build a transient (not persisted) procedure of the given shape"""
+    params = PROCEDURE_SHAPES[shape]
+    procedure = FlightProcedure(
+        name=f'{shape.upper()} {seed}',
+        airport_icao='LFLB',
+        procedure_type=params['procedure_type'],
+        navigation_type=NavigationType.RNAV
+    )
+    for wp_data in make_waypoint_data(params['procedure_type'], params['waypoint_count'], origin, seed):
+        procedure.waypoints.append(Waypoint(**wp_data))
+    return procedure
+
+
+def procedure_payload(shape: str = 'short_approach', seed: int = 0) -> Dict:
+    """JSON body accepted by ``POST /api/procedures`` for a synthetic procedure"""
+    params = PROCEDURE_SHAPES[shape]
+    return {
+        'name': f'{shape.upper()} {seed}',
+        'airport_icao': 'LFLB',
+        'procedure_type': params['procedure_type'].name,
+        'navigation_type': NavigationType.RNAV.name,
+        'waypoints': make_waypoint_data(params['procedure_type'], params['waypoint_count'], seed=seed)
+    }
+
+
+def populate_database(count: int, waypoints_per_procedure: int = 8, seed: int = 0,
+                      batch_size: int = 1000) -> List[int]:
+    """Bulk insert ``count`` synthetic procedures, returning their ids.
+
+    Uses Core inserts so that building a 10k procedure database takes
+    seconds rather than minutes.
+    """
+    rng = random.Random(seed)
+    procedure_types = list(ProcedureType)
+    airports = ['LFLB', 'LFLL', 'LSGG', 'LIMC', 'LFMN']
+    procedure_ids = []
+
+    for start in range(0, count, batch_size):
+        batch = range(start, min(start + batch_size, count))
+        rows = []
+        for n in batch:
+            rows.append({
+                'name': f'SYN{n:06d}',
+                'airport_icao': airports[n % len(airports)],
+                'procedure_type': procedure_types[n % len(procedure_types)],
+                'navigation_type': NavigationType.RNAV
+            })
+        result = db.session.execute(
+            insert(FlightProcedure).returning(FlightProcedure.id),
+            rows
+        )
+        ids = list(result.scalars())
+        procedure_ids.extend(ids)
+
+        waypoint_rows = []
+        for procedure_id, n in zip(ids, batch):
+            origin = (rng.uniform(43.0, 47.0), rng.uniform(4.0, 10.0))
+            for wp_data in make_waypoint_data(procedure_types[n % len(procedure_types)],
+                                              waypoints_per_procedure, origin, seed + n):
+                waypoint_rows.append(dict(wp_data, procedure_id=procedure_id))
+        db.session.execute(insert(Waypoint), waypoint_rows)
+        # Bulk inserts bypass the ORM flush hooks that maintain the index,
+        # the summaries and the map tiles
+        spatial_index.rebuild(db.session.connection(), ids)
+        summaries.refresh(db.session.connection(), ids)
+
+    db.session.commit()
+    procedure_tiles.clear()
+    return procedure_ids
+
+
+def first_procedure_id() -> Optional[int]:
+    """Return the lowest procedure id, used to pick a representative row"""
+    return db.session.execute(select(FlightProcedure.id).order_by(FlightProcedure.id).limit(1)).scalar()
+
+
+class StubElevationProvider(ElevationProvider):
+    """Deterministic, offline elevation model (feet) for benchmarks and tests"""
+
+    name = 'stub'
+
+    def __init__(self, base: float = 1500.0, amplitude: float = 2500.0):
+        self.base = base
+        self.amplitude = amplitude
+
+    def fetch(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        return self.base + self.amplitude * (0.5 + 0.5 * np.sin(lats * 7.0) * np.cos(lons * 5.0))
+
+
+class StubTerrainAnalyzer(TerrainAnalyzer):
+    """TerrainAnalyzer whose elevation lookups never leave the process.
+
+    The elevation cache is disabled so benchmarks measure the full pipeline.
+    """
+
+    def __init__(self, provider: Optional[ElevationProvider] = None):
+        super().__init__(ElevationResolver([provider or StubElevationProvider()]))
+        self.elevation_cache = None
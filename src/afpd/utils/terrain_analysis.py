@@ -1,30 +1,92 @@
-import requests
-import numpy as np
-from typing import List, Dict, Tuple
+import logging
+import math
+import os
+import threading
+from typing import List, Dict, Optional, Sequence, Tuple, Union
 from ..models.flight_procedure import FlightProcedure, Waypoint
-import time
+from ..models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from .elevation_cache import ESTIMATED, ElevationCache
+from .metrics import span
+from .track import NominalTrack, TrackGenerator
+
+logger = logging.getLogger(__name__)
 
 class TerrainAnalyzer:
     """Analyze terrain along flight procedures using open elevation data"""
     
-    def __init__(self):
-        # Primary API
-        self.elevation_api_url = "https://api.open-elevation.com/api/v1/lookup"
-        # Backup APIs
-        self.backup_apis = [
-            "https://elevation-api.io/api/elevation",  # Backup 1
-            "https://maps.googleapis.com/maps/api/elevation/json"  # Backup 2
-        ]
-        self.samples_between_waypoints = 20  # Number of points to sample between waypoints
+    def __init__(self, elevation_resolver=None, resolver_options: Optional[Dict] = None,
+                 samples_between_waypoints: int = 20, elevation_cache_size: int = 200000,
+                 track_generator: Optional[TrackGenerator] = None):
+        # Built on first use so that importing the app does not pull in
+        # NumPy, requests or DEM indexes (see ``elevation_resolver``)
+        self._elevation_resolver = elevation_resolver
+        self._resolver_options = resolver_options
+        self._resolver_lock = threading.Lock()
+        self.samples_between_waypoints = samples_between_waypoints  # Number of points to sample between waypoints
         self.minimum_obstacle_clearance = {
             'SID': 1000,  # feet
             'STAR': 1000,
             'APPROACH': 500
         }
-        self.request_timeout = 5  # seconds
+        # Lateral half-width of the area in which obstacles are assessed
+        self.obstacle_corridor_half_width = {
+            'SID': 2.5,  # nautical miles
+            'STAR': 2.5,
+            'APPROACH': 1.0
+        }
+        self.elevation_cache = ElevationCache(elevation_cache_size) if elevation_cache_size else None
+        # Fly-by / fly-over turn geometry; terrain is sampled along the flown track
+        self.track_generator = track_generator or TrackGenerator()
+    
+    @property
+    def elevation_resolver(self):
+        """Elevation sources, tried in order: local DEMs, remote API(s), estimate.
+
+        Built from ``resolver_options`` (``build_elevation_resolver``
+        arguments), or from the environment when none were given.
+        """
+        if self._elevation_resolver is None:
+            with self._resolver_lock:
+                if self._elevation_resolver is None:
+                    from .elevation import build_elevation_resolver
+                    
+                    options = self._resolver_options
+                    if options is None:
+                        # Backup URLs must speak the Open-Elevation lookup protocol
+                        options = {
+                            'api_url': "https://api.open-elevation.com/api/v1/lookup",
+                            'backup_urls': [u for u in os.getenv('ELEVATION_BACKUP_URLS', '').split(',') if u],
+                            'high_res_dem': os.getenv('DEM_HIGHRES_DIR'),
+                            'global_dem': os.getenv('DEM_GLOBAL_DIR'),
+                            'timeout': 5  # seconds
+                        }
+                    self._elevation_resolver = build_elevation_resolver(**options)
+        return self._elevation_resolver
     
-    def analyze_procedure(self, procedure: FlightProcedure) -> Dict:
-        """Analyze terrain along a flight procedure"""
+    def preload(self):
+        """Build the elevation chain and open every local DEM tile up front"""
+        for provider in self.elevation_resolver.providers:
+            store = getattr(provider, 'store', None)
+            if store is not None:
+                store.open_all()
+    
+    def invalidate_region(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        """Forget elevations inside a box after the underlying DEM data changed"""
+        if self.elevation_cache is not None:
+            self.elevation_cache.invalidate_bbox(min_lat, min_lon, max_lat, max_lon)
+        if self._elevation_resolver is not None:
+            for provider in self._elevation_resolver.providers:
+                store = getattr(provider, 'store', None)
+                if store is not None:
+                    store.reload()
+    
+    def analyze_procedure(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> Dict:
+        """Analyze terrain along a flight procedure.
+
+        ORM procedures are copied into a ``ProcedureSnapshot`` first, so no
+        analysis state references the database session.
+        """
+        procedure = ProcedureSnapshot.coerce(procedure)
         waypoints = procedure.waypoints
         if len(waypoints) < 2:
             return {
@@ -32,10 +94,9 @@ class TerrainAnalyzer:
                 'message': 'Procedure must have at least 2 waypoints'
             }
         
-        # Get all points to analyze (waypoints + intermediate points)
-        analysis_points = self._generate_analysis_points(waypoints)
-        
-        # Get elevation data
+        with span('sampling'):
+            track = self.track_generator.build(procedure)
+            analysis_points = self._generate_analysis_points(track, waypoints)
         elevations = self._get_elevations(analysis_points)
         if not elevations:
             return {
@@ -44,161 +105,315 @@ class TerrainAnalyzer:
             }
         
         # Analyze terrain clearance
-        clearance_analysis = self._analyze_clearance(
+        with span('clearance'):
+            return self._procedure_result(procedure, track, analysis_points, elevations)
+    
+    async def analyze_procedure_async(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> Dict:
+        """``analyze_procedure`` for the asynchronous API: elevation lookups are awaited"""
+        procedure = ProcedureSnapshot.coerce(procedure)
+        waypoints = procedure.waypoints
+        if len(waypoints) < 2:
+            return {
+                'status': 'error',
+                'message': 'Procedure must have at least 2 waypoints'
+            }
+        
+        with span('sampling'):
+            track = self.track_generator.build(procedure)
+            analysis_points = self._generate_analysis_points(track, waypoints)
+        elevations = await self._get_elevations_async(analysis_points)
+        if not elevations:
+            return {
+                'status': 'error',
+                'message': 'Failed to get elevation data'
+            }
+        
+        with span('clearance'):
+            return self._procedure_result(procedure, track, analysis_points, elevations)
+    
+    def analyze_bundle(self, procedures: Sequence[Union[FlightProcedure, ProcedureSnapshot]],
+                       overview_cell_nm: float = 1.0) -> Dict:
+        """Analyze terrain for several procedures, e.g. all those of an airport, at once.
+
+        Sample points of all procedures are merged and de-duplicated on the
+        elevation cache key, so the fixes and legs they share are looked up
+        once, in a single batch through the cache and the provider chain.
+        Per-procedure results are those of ``analyze_procedure``; the
+        ``overview`` combines the terrain under all of them on a coarse grid.
+        """
+        import numpy as np
+        
+        snapshots = [ProcedureSnapshot.coerce(p) for p in procedures]
+        results = {}
+        sampled = []
+        with span('sampling'):
+            for procedure in snapshots:
+                if len(procedure.waypoints) < 2:
+                    results[procedure.id] = {
+                        'status': 'error',
+                        'message': 'Procedure must have at least 2 waypoints'
+                    }
+                    continue
+                track = self.track_generator.build(procedure)
+                sampled.append((procedure, track, self._generate_analysis_points(track, procedure.waypoints)))
+            
+            precision = self.elevation_cache.precision if self.elevation_cache is not None else 5
+            unique: Dict[Tuple[float, float], int] = {}
+            shared_points = []
+            indices = []
+            for _, _, points in sampled:
+                index = []
+                for point in points:
+                    key = (round(point['latitude'], precision), round(point['longitude'], precision))
+                    i = unique.get(key)
+                    if i is None:
+                        i = unique[key] = len(shared_points)
+                        shared_points.append({'latitude': point['latitude'], 'longitude': point['longitude']})
+                    index.append(i)
+                indices.append(index)
+        
+        shared_elevations = self._get_elevations(shared_points) if shared_points else []
+        if shared_points and not shared_elevations:
+            return {
+                'status': 'error',
+                'message': 'Failed to get elevation data'
+            }
+        
+        with span('clearance'):
+            for (procedure, track, points), index in zip(sampled, indices):
+                for point, i in zip(points, index):
+                    point['elevation_source'] = shared_points[i]['elevation_source']
+                elevations = [shared_elevations[i] for i in index]
+                results[procedure.id] = self._procedure_result(procedure, track, points, elevations)
+            overview = self._terrain_overview(sampled, indices, shared_points, np.asarray(shared_elevations),
+                                              overview_cell_nm)
+        
+        total_points = sum(len(index) for index in indices)
+        return {
+            'status': 'success',
+            'procedures': [dict(results[p.id], procedure_id=p.id) for p in snapshots],
+            'overview': overview,
+            'samples': {
+                'total': total_points,
+                'unique': len(shared_points)
+            },
+            'using_estimated_data': any(p.get('elevation_source') == ESTIMATED for p in shared_points)
+        }
+    
+    def _procedure_result(self, procedure: ProcedureSnapshot, track: NominalTrack, analysis_points: List[Dict],
+                          elevations: List[float]) -> Dict:
+        clearance_analysis = self.analyze_clearance(
             procedure.procedure_type.name,
             analysis_points,
             elevations,
-            waypoints
+            procedure.waypoints
         )
         
+        elevation_sources = [p.get('elevation_source', 'unknown') for p in analysis_points]
         return {
             'status': 'success',
             'analysis': clearance_analysis,
             'terrain_profile': {
                 'distances': [p['distance'] for p in analysis_points],
                 'elevations': elevations,
+                'elevation_sources': elevation_sources,
                 'minimum_altitudes': clearance_analysis['minimum_altitudes']
-            }
+            },
+            'nominal_track': {
+                'length': track.length,
+                'turns': track.turns
+            },
+            'using_estimated_data': ESTIMATED in elevation_sources
         }
     
-    def _generate_analysis_points(self, waypoints: List[Waypoint]) -> List[Dict]:
-        """Generate points for terrain analysis, including intermediate points"""
-        analysis_points = []
-        total_distance = 0
+    @staticmethod
+    def _terrain_overview(sampled, indices, shared_points: List[Dict], elevations, cell_nm: float) -> Dict:
+        """Highest terrain per grid cell under a set of procedures, and which procedures overfly it"""
+        import numpy as np
         
-        for i in range(len(waypoints) - 1):
-            wp1, wp2 = waypoints[i], waypoints[i + 1]
-            
-            # Calculate distance between waypoints
-            segment_distance = self._calculate_distance(
-                wp1.latitude, wp1.longitude,
-                wp2.latitude, wp2.longitude
-            )
-            
-            # Add current waypoint
-            analysis_points.append({
-                'latitude': wp1.latitude,
-                'longitude': wp1.longitude,
-                'distance': total_distance,
-                'is_waypoint': True,
-                'waypoint': wp1
-            })
-            
-            # Add intermediate points
-            for j in range(1, self.samples_between_waypoints):
-                fraction = j / self.samples_between_waypoints
-                lat = wp1.latitude + (wp2.latitude - wp1.latitude) * fraction
-                lon = wp1.longitude + (wp2.longitude - wp1.longitude) * fraction
-                analysis_points.append({
-                    'latitude': lat,
-                    'longitude': lon,
-                    'distance': total_distance + segment_distance * fraction,
-                    'is_waypoint': False,
-                    'waypoint': None
-                })
-            
-            total_distance += segment_distance
+        if not shared_points:
+            return {'cell_nm': cell_nm, 'bbox': None, 'highest_terrain': None, 'cells': []}
         
-        # Add final waypoint
-        analysis_points.append({
-            'latitude': waypoints[-1].latitude,
-            'longitude': waypoints[-1].longitude,
-            'distance': total_distance,
-            'is_waypoint': True,
-            'waypoint': waypoints[-1]
-        })
+        latitudes = np.array([p['latitude'] for p in shared_points])
+        longitudes = np.array([p['longitude'] for p in shared_points])
+        min_lat, max_lat = float(latitudes.min()), float(latitudes.max())
+        min_lon, max_lon = float(longitudes.min()), float(longitudes.max())
+        cell_lat = cell_nm / 60
+        cell_lon = cell_lat / max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.01)
+        rows = ((latitudes - min_lat) // cell_lat).astype(int)
+        cols = ((longitudes - min_lon) // cell_lon).astype(int)
+        width = int(cols.max()) + 1
+        cell_of_point = rows * width + cols
         
-        return analysis_points
+        cells, inverse = np.unique(cell_of_point, return_inverse=True)
+        highest = np.full(len(cells), -np.inf)
+        np.maximum.at(highest, inverse, elevations)
+        overflown = [set() for _ in cells]
+        for (procedure, _, _), index in zip(sampled, indices):
+            for cell in np.unique(inverse[index]).tolist():
+                overflown[cell].add(procedure.id)
+        
+        top = int(np.argmax(elevations))
+        return {
+            'cell_nm': cell_nm,
+            'bbox': [min_lat, min_lon, max_lat, max_lon],
+            'highest_terrain': {
+                'latitude': float(latitudes[top]),
+                'longitude': float(longitudes[top]),
+                'elevation': float(elevations[top])
+            },
+            'cells': [{
+                'latitude': min_lat + (cell // width + 0.5) * cell_lat,
+                'longitude': min_lon + (cell % width + 0.5) * cell_lon,
+                'max_elevation': float(elevation),
+                'procedure_ids': sorted(ids)
+            } for cell, elevation, ids in zip(cells.tolist(), highest.tolist(), overflown)]
+        }
     
-    def _get_elevations(self, points: List[Dict]) -> List[float]:
-        """Get elevation data for a list of points with fallback options"""
-        try:
-            # Prepare request data
-            locations = [
-                {"latitude": p['latitude'], "longitude": p['longitude']}
-                for p in points
-            ]
-            
-            # Split into smaller chunks and add retries
-            chunk_size = 50  # Reduced chunk size
-            elevations = []
-            max_retries = 3
-            
-            for i in range(0, len(locations), chunk_size):
-                chunk = locations[i:i + chunk_size]
-                retry_count = 0
-                success = False
-                
-                while not success and retry_count < max_retries:
-                    try:
-                        response = requests.post(
-                            self.elevation_api_url,
-                            json={"locations": chunk},
-                            timeout=self.request_timeout
-                        )
-                        response.raise_for_status()
-                        
-                        data = response.json()
-                        chunk_elevations = [
-                            result['elevation'] * 3.28084  # Convert meters to feet
-                            for result in data['results']
-                        ]
-                        elevations.extend(chunk_elevations)
-                        success = True
-                        
-                    except (requests.RequestException, KeyError) as e:
-                        print(f"API request failed (attempt {retry_count + 1}): {str(e)}")
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            time.sleep(1)  # Wait before retry
-                
-                if not success:
-                    # Use fallback elevation estimation
-                    print("Using fallback elevation data")
-                    return self._estimate_elevations(points)
-            
-            return elevations
-            
-        except Exception as e:
-            print(f"Error getting elevation data: {str(e)}")
-            return self._estimate_elevations(points)
+    def sample_terrain(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> Tuple[List[Dict], List[float]]:
+        """Analysis points along the flown track (waypoints + intermediate points) and their elevations"""
+        procedure = ProcedureSnapshot.coerce(procedure)
+        with span('sampling'):
+            track = self.track_generator.build(procedure)
+            analysis_points = self._generate_analysis_points(track, procedure.waypoints)
+        return analysis_points, self._get_elevations(analysis_points)
     
-    def _estimate_elevations(self, points: List[Dict]) -> List[float]:
-        """Fallback method to estimate elevations when API fails"""
-        # Use a simple elevation model based on latitude and typical terrain
-        elevations = []
-        for point in points:
-            # Basic elevation estimate:
-            # - Higher elevations near mountains (typically between 30-50 degrees latitude)
-            # - Lower elevations near equator and poles
-            lat = abs(point['latitude'])
-            base_elevation = 0
-            
-            if 30 <= lat <= 50:
-                # Mountain regions: 1000-5000 feet
-                base_elevation = 1000 + (lat - 30) * 200
-            elif lat < 30:
-                # Lower latitudes: 0-1000 feet
-                base_elevation = lat * 33.33
-            else:
-                # Higher latitudes: 500-1000 feet
-                base_elevation = 1000 - (lat - 50) * 10
-            
-            # Add some variation
-            variation = np.sin(point['longitude'] / 10) * 500
-            elevation = max(0, base_elevation + variation)
-            elevations.append(elevation)
+    def assess_obstacles(self, procedure: Union[FlightProcedure, ProcedureSnapshot],
+                         obstacles: Sequence[Dict]) -> List[Dict]:
+        """Clearance of the procedure above each obstacle inside its corridor.
+
+        Obstacles are dicts with ``latitude``, ``longitude``, ``height`` (feet
+        above ground) and an optional ``name``; their top is the terrain
+        elevation plus ``height``. Offsets are measured from the flown track,
+        and the procedure altitude abeam each obstacle is interpolated along
+        it from the waypoint constraints as in ``analyze_procedure``.
+        """
+        import numpy as np
+        
+        procedure = ProcedureSnapshot.coerce(procedure)
+        waypoints = procedure.waypoints
+        if len(waypoints) < 2 or not obstacles:
+            return []
+        procedure_type = procedure.procedure_type.name
+        half_width = self.obstacle_corridor_half_width[procedure_type]
+        required_clearance = self.minimum_obstacle_clearance[procedure_type]
         
+        track = self.track_generator.build(procedure)
+        along, offsets = track.locate([o['latitude'] for o in obstacles],
+                                      [o['longitude'] for o in obstacles])
+        located = []
+        for obstacle, distance, offset in zip(obstacles, along.tolist(), offsets.tolist()):
+            if offset > half_width:
+                continue
+            abeam = {
+                'latitude': obstacle['latitude'],
+                'longitude': obstacle['longitude'],
+                'distance': distance
+            }
+            located.append((obstacle, abeam, offset))
+        if not located:
+            return []
+        
+        waypoint_points = [{'distance': d, 'is_waypoint': True, 'waypoint': w}
+                           for d, w in zip(track.waypoint_distances.tolist(), waypoints)]
+        waypoint_altitudes = self.altitude_profile(waypoint_points, waypoints)
+        altitudes = np.interp([abeam['distance'] for _, abeam, _ in located],
+                              track.waypoint_distances, waypoint_altitudes).tolist()
+        ground = self._get_elevations([abeam for _, abeam, _ in located])
+        
+        assessments = []
+        for (obstacle, abeam, offset), ground_elevation, procedure_altitude in zip(located, ground, altitudes):
+            top_elevation = ground_elevation + obstacle['height']
+            clearance = procedure_altitude - top_elevation
+            assessments.append({
+                'obstacle_name': obstacle.get('name'),
+                'latitude': obstacle['latitude'],
+                'longitude': obstacle['longitude'],
+                'height': obstacle['height'],
+                'ground_elevation': ground_elevation,
+                'top_elevation': top_elevation,
+                'distance': abeam['distance'],
+                'offset': offset,
+                'procedure_altitude': procedure_altitude,
+                'clearance': clearance,
+                'required_clearance': required_clearance,
+                'violation': clearance < required_clearance,
+                'elevation_source': abeam.get('elevation_source', 'unknown')
+            })
+        return assessments
+    
+    def _generate_analysis_points(self, track: NominalTrack, waypoints: Sequence[WaypointSnapshot]) -> List[Dict]:
+        """Generate points for terrain analysis, including intermediate points"""
+        return track.sample(waypoints, self.samples_between_waypoints)
+    
+    def _get_elevations(self, points: List[Dict]) -> List[float]:
+        """Get elevation data for a list of points, served from cache where possible.
+
+        Cache misses are resolved in one batch through the provider chain.
+        Each point gets an ``elevation_source`` entry recording where its
+        elevation came from; estimated values are never cached.
+        """
+        elevations, missing = self._cached_elevations(points)
+        if missing:
+            values, sources = self.elevation_resolver.resolve(
+                [points[i]['latitude'] for i in missing],
+                [points[i]['longitude'] for i in missing]
+            )
+            self._store_elevations(points, elevations, missing, values, sources)
         return elevations
     
-    def _analyze_clearance(
+    async def _get_elevations_async(self, points: List[Dict]) -> List[float]:
+        """``_get_elevations`` with remote lookups awaited instead of blocking"""
+        elevations, missing = self._cached_elevations(points)
+        if missing:
+            values, sources = await self.elevation_resolver.resolve_async(
+                [points[i]['latitude'] for i in missing],
+                [points[i]['longitude'] for i in missing]
+            )
+            self._store_elevations(points, elevations, missing, values, sources)
+        return elevations
+    
+    def _cached_elevations(self, points: List[Dict]) -> Tuple[List[float], List[int]]:
+        """Elevations found in the cache, and the indices of the points still missing"""
+        if self.elevation_cache is not None:
+            cached = self.elevation_cache.get_many(points)
+        else:
+            cached = [None] * len(points)
+        
+        elevations = [0.0] * len(points)
+        missing = []
+        for i, entry in enumerate(cached):
+            if entry is None:
+                missing.append(i)
+            else:
+                elevations[i], points[i]['elevation_source'] = entry
+        return elevations, missing
+    
+    def _store_elevations(self, points: List[Dict], elevations: List[float], missing: List[int],
+                          values, sources):
+        """Fill in resolved elevations and cache the measured ones"""
+        measured = []
+        for i, elevation, source in zip(missing, values.tolist(), sources):
+            elevations[i] = elevation
+            points[i]['elevation_source'] = source
+            if source != ESTIMATED:
+                measured.append((points[i], elevation, source))
+        if measured and self.elevation_cache is not None:
+            self.elevation_cache.put_many(*zip(*measured))
+    
+    def analyze_clearance(
         self,
         procedure_type: str,
         points: List[Dict],
         elevations: List[float],
-        waypoints: List[Waypoint]
+        waypoints: Sequence[WaypointSnapshot]
     ) -> Dict:
-        """Analyze terrain clearance along the route"""
+        """Terrain clearance of ``points`` at ``elevations``, as sampled by ``sample_terrain``
+
+        Returns the minimum altitude at each point, violations where a
+        waypoint constraint is below it and warnings where the altitude
+        interpolated between constraints is.
+        """
         min_clearance = self.minimum_obstacle_clearance[procedure_type]
         
         # Calculate required altitudes at each point
@@ -207,7 +422,7 @@ class TerrainAnalyzer:
         warnings = []
         
         # Get waypoint altitudes (including interpolated)
-        waypoint_altitudes = self._interpolate_altitudes(points, waypoints)
+        waypoint_altitudes = self.altitude_profile(points, waypoints)
         
         for i, point in enumerate(points):
             terrain_elevation = elevations[i]
@@ -248,12 +463,12 @@ class TerrainAnalyzer:
             'warnings': warnings
         }
     
-    def _interpolate_altitudes(
+    def altitude_profile(
         self,
         points: List[Dict],
-        waypoints: List[Waypoint]
+        waypoints: Sequence[WaypointSnapshot]
     ) -> List[float]:
-        """Interpolate altitudes between waypoints with constraints"""
+        """Procedure altitude at each of ``points``, interpolated between the waypoint altitude constraints"""
         interpolated = []
         waypoint_distances = [
             p['distance'] for p in points if p['is_waypoint']
@@ -281,26 +496,17 @@ class TerrainAnalyzer:
                 )
                 waypoint_altitudes[i] = (prev_alt + next_alt) / 2
         
-        # Interpolate for all points
+        # Interpolate for all points; points are ordered along the route, so
+        # intermediate points lie between the last waypoint seen and the next
+        waypoint_idx = -1
         for point in points:
             if point['is_waypoint']:
-                interpolated.append(
-                    waypoint_altitudes[waypoints.index(point['waypoint'])]
-                )
+                waypoint_idx += 1
+                interpolated.append(waypoint_altitudes[waypoint_idx])
             else:
-                # Find surrounding waypoints
-                prev_idx = next(
-                    i for i in range(len(waypoint_distances))
-                    if waypoint_distances[i] <= point['distance']
-                )
-                next_idx = next(
-                    i for i in range(len(waypoint_distances))
-                    if waypoint_distances[i] > point['distance']
-                )
-                
                 # Linear interpolation
-                d1, d2 = waypoint_distances[prev_idx], waypoint_distances[next_idx]
-                a1, a2 = waypoint_altitudes[prev_idx], waypoint_altitudes[next_idx]
+                d1, d2 = waypoint_distances[waypoint_idx], waypoint_distances[waypoint_idx + 1]
+                a1, a2 = waypoint_altitudes[waypoint_idx], waypoint_altitudes[waypoint_idx + 1]
                 fraction = (point['distance'] - d1) / (d2 - d1)
                 interpolated.append(a1 + (a2 - a1) * fraction)
         
@@ -311,47 +517,36 @@ class TerrainAnalyzer:
         """Calculate distance between two points in nautical miles"""
         R = 3440.065  # Earth radius in nautical miles
         
-        lat1, lon1 = np.radians(lat1), np.radians(lon1)
-        lat2, lon2 = np.radians(lat2), np.radians(lon2)
+        lat1, lon1 = math.radians(lat1), math.radians(lon1)
+        lat2, lon2 = math.radians(lat2), math.radians(lon2)
         
         dlat = lat2 - lat1
         dlon = lon2 - lon1
         
-        a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
         
         return R * c
 
     @staticmethod
     def _calculate_bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Calculate initial bearing between two points in degrees"""
-        lat1, lon1 = np.radians(lat1), np.radians(lon1)
-        lat2, lon2 = np.radians(lat2), np.radians(lon2)
+        lat1, lon1 = math.radians(lat1), math.radians(lon1)
+        lat2, lon2 = math.radians(lat2), math.radians(lon2)
         
         dlon = lon2 - lon1
         
-        y = np.sin(dlon) * np.cos(lat2)
-        x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+        y = math.sin(dlon) * math.cos(lat2)
+        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
         
-        initial_bearing = np.arctan2(y, x)
-        initial_bearing = np.degrees(initial_bearing)
+        initial_bearing = math.atan2(y, x)
+        initial_bearing = math.degrees(initial_bearing)
         bearing = (initial_bearing + 360) % 360
         
         return bearing
 
-    def analyze_segment(self, wp1: Waypoint, wp2: Waypoint) -> Dict:
-        """Analyze a segment between two waypoints"""
-        # Calculate distance and bearing
-        distance = self._calculate_distance(
-            wp1.latitude, wp1.longitude,
-            wp2.latitude, wp2.longitude
-        )
-        bearing = self._calculate_bearing(
-            wp1.latitude, wp1.longitude,
-            wp2.latitude, wp2.longitude
-        )
-        
-        # Generate analysis points along the segment
+    def _generate_segment_points(self, wp1: WaypointSnapshot, wp2: WaypointSnapshot, distance: float) -> List[Dict]:
+        """Generate evenly spaced analysis points between two waypoints, inclusive"""
         analysis_points = []
         for i in range(self.samples_between_waypoints + 1):
             fraction = i / self.samples_between_waypoints
@@ -364,38 +559,106 @@ class TerrainAnalyzer:
                 'is_waypoint': i == 0 or i == self.samples_between_waypoints,
                 'waypoint': wp1 if i == 0 else (wp2 if i == self.samples_between_waypoints else None)
             })
+        return analysis_points
+
+    def _generate_track_segment_points(self, track: NominalTrack, wp1: WaypointSnapshot,
+                                       wp2: WaypointSnapshot, leg: int) -> List[Dict]:
+        """Evenly spaced analysis points along the flown track of one leg, turn arcs included"""
+        import numpy as np
+
+        start, end = track.waypoint_distances[leg], track.waypoint_distances[leg + 1]
+        fractions = np.arange(self.samples_between_waypoints + 1) / self.samples_between_waypoints
+        distances = start + (end - start) * fractions
+        latitudes, longitudes = track.positions(distances)
+        last = self.samples_between_waypoints
+        return [{
+            'latitude': lat,
+            'longitude': lon,
+            'distance': distance - float(start),
+            'is_waypoint': i == 0 or i == last,
+            'waypoint': wp1 if i == 0 else (wp2 if i == last else None)
+        } for i, (lat, lon, distance) in enumerate(zip(latitudes.tolist(), longitudes.tolist(),
+                                                        distances.tolist()))]
+
+    def analyze_segment(self, wp1: Union[Waypoint, WaypointSnapshot], wp2: Union[Waypoint, WaypointSnapshot],
+                        track: Optional[NominalTrack] = None, leg: int = 0) -> Dict:
+        """Analyze a segment between two waypoints.
+
+        Given the procedure's ``track``, of which ``wp1`` and ``wp2`` are
+        waypoints ``leg`` and ``leg + 1``, terrain is sampled along the flown
+        track as in ``analyze_procedure`` and ``distance`` is the flown
+        distance; otherwise along the straight line between the fixes.
+        """
+        distance, bearing, analysis_points = self._segment_points(wp1, wp2, track, leg)
         
         # Get elevation data
         elevations = self._get_elevations(analysis_points)
+        return self._segment_result(distance, bearing, analysis_points, elevations)
+    
+    async def analyze_segment_async(self, wp1: Union[Waypoint, WaypointSnapshot],
+                                    wp2: Union[Waypoint, WaypointSnapshot],
+                                    track: Optional[NominalTrack] = None, leg: int = 0) -> Dict:
+        """``analyze_segment`` for the asynchronous API: elevation lookups are awaited"""
+        distance, bearing, analysis_points = self._segment_points(wp1, wp2, track, leg)
+        elevations = await self._get_elevations_async(analysis_points)
+        return self._segment_result(distance, bearing, analysis_points, elevations)
+    
+    def _segment_points(self, wp1, wp2, track: Optional[NominalTrack] = None,
+                        leg: int = 0) -> Tuple[float, float, List[Dict]]:
+        # Calculate distance and bearing
+        distance = self._calculate_distance(
+            wp1.latitude, wp1.longitude,
+            wp2.latitude, wp2.longitude
+        )
+        bearing = self._calculate_bearing(
+            wp1.latitude, wp1.longitude,
+            wp2.latitude, wp2.longitude
+        )
+        
+        # Generate analysis points along the segment
+        with span('sampling'):
+            if track is not None:
+                analysis_points = self._generate_track_segment_points(track, wp1, wp2, leg)
+                distance = analysis_points[-1]['distance']
+            else:
+                analysis_points = self._generate_segment_points(wp1, wp2, distance)
+        return distance, bearing, analysis_points
+    
+    def _segment_result(self, distance: float, bearing: float, analysis_points: List[Dict],
+                        elevations: List[float]) -> Dict:
         if not elevations:
             return {
                 'status': 'error',
                 'message': 'Failed to get elevation data'
             }
         
-        # Calculate minimum safe altitude (highest elevation + minimum clearance)
-        max_elevation = max(elevations)
-        minimum_safe_altitude = max_elevation + self.minimum_obstacle_clearance['APPROACH']
-        
-        # Check for terrain violations
-        violations = []
-        for i, point in enumerate(analysis_points):
-            if point['is_waypoint'] and point['waypoint'].altitude_constraint:
-                if point['waypoint'].altitude_constraint < elevations[i] + self.minimum_obstacle_clearance['APPROACH']:
-                    violations.append({
-                        'waypoint_name': point['waypoint'].name,
-                        'terrain_elevation': elevations[i],
-                        'required_altitude': elevations[i] + self.minimum_obstacle_clearance['APPROACH'],
-                        'actual_altitude': point['waypoint'].altitude_constraint
-                    })
+        with span('clearance'):
+            # Calculate minimum safe altitude (highest elevation + minimum clearance)
+            max_elevation = max(elevations)
+            minimum_safe_altitude = max_elevation + self.minimum_obstacle_clearance['APPROACH']
+            
+            # Check for terrain violations
+            violations = []
+            for i, point in enumerate(analysis_points):
+                if point['is_waypoint'] and point['waypoint'].altitude_constraint:
+                    if point['waypoint'].altitude_constraint < elevations[i] + self.minimum_obstacle_clearance['APPROACH']:
+                        violations.append({
+                            'waypoint_name': point['waypoint'].name,
+                            'terrain_elevation': elevations[i],
+                            'required_altitude': elevations[i] + self.minimum_obstacle_clearance['APPROACH'],
+                            'actual_altitude': point['waypoint'].altitude_constraint
+                        })
         
+        elevation_sources = [p.get('elevation_source', 'unknown') for p in analysis_points]
         return {
             'distance': distance,
             'bearing': bearing,
             'terrain_profile': {
                 'distances': [p['distance'] for p in analysis_points],
-                'elevations': elevations
+                'elevations': elevations,
+                'elevation_sources': elevation_sources
             },
             'minimum_safe_altitude': minimum_safe_altitude,
-            'violations': violations
+            'violations': violations,
+            'using_estimated_data': ESTIMATED in elevation_sources
         }
\ No newline at end of file
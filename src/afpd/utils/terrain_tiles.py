@@ -0,0 +1,62 @@
+import os
+from typing import Optional, Tuple
+
+from flask import current_app
+
+from .analysis import services
+from .map_tiles import TileCache
+
+STYLES = ('hillshade', 'tint')
+
+
+class TerrainTiles:
+    """Flask extension serving hillshade and elevation-tint map tiles from the
+    local DEMs of the app's elevation chain, through a ``TileCache``"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TERRAIN_TILE_DIR',
+                              os.getenv('TERRAIN_TILE_DIR', os.path.join(app.instance_path, 'terrain_tiles')))
+        app.config.setdefault('TERRAIN_TILE_CACHE_MB', int(os.getenv('TERRAIN_TILE_CACHE_MB', '512')))
+        app.config.setdefault('TERRAIN_TILE_MAX_AGE', int(os.getenv('TERRAIN_TILE_MAX_AGE', '86400')))  # seconds
+        app.config.setdefault('TERRAIN_TILE_MAX_ZOOM', int(os.getenv('TERRAIN_TILE_MAX_ZOOM', '16')))
+        app.config.setdefault('TERRAIN_TILE_EXAGGERATION', float(os.getenv('TERRAIN_TILE_EXAGGERATION', '2')))
+        app.extensions['afpd_terrain_tiles'] = TileCache(
+            app.config['TERRAIN_TILE_DIR'], app.config['TERRAIN_TILE_CACHE_MB'] * 1024 * 1024
+        )
+
+    @staticmethod
+    def cache_for(app) -> TileCache:
+        return app.extensions['afpd_terrain_tiles']
+
+    @staticmethod
+    def stores(app) -> list:
+        """DEM tile stores of the app's elevation chain, highest resolution first"""
+        providers = services.for_app(app).analyzer.elevation_resolver.providers
+        return [p.store for p in providers if getattr(p, 'store', None) is not None]
+
+    def tile(self, z: int, x: int, y: int, style: str = 'hillshade', app=None) -> Tuple[Optional[bytes], bool]:
+        """A tile's PNG and whether it came from the cache; ``None`` without local DEMs"""
+        app = app or current_app._get_current_object()
+        cache = self.cache_for(app)
+        key = (style, z, x, y)
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+        stores = self.stores(app)
+        if not stores:
+            return None, False
+        from .hillshade import render_tile
+
+        data = render_tile(stores, z, x, y, style, app.config['TERRAIN_TILE_EXAGGERATION'])
+        cache.put(key, data)
+        return data, False
+
+    def invalidate_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, app=None) -> int:
+        return self.cache_for(app or current_app).invalidate_bbox(min_lat, min_lon, max_lat, max_lon)
+
+
+terrain_tiles = TerrainTiles()
@@ -0,0 +1,338 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from ..models.flight_procedure import FlightProcedure
+from ..models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from .spatial_index import NM_PER_DEGREE
+
+MAX_RATE_OF_TURN = 3.0  # degrees per second (PANS-OPS)
+ARC_POINTS = 13  # vertices per turn arc; odd, so that the middle one is abeam a fly-by fix
+
+
+class NominalTrack:
+    """Flown path of a procedure as a polyline in a local projection.
+
+    ``x`` and ``y`` are NM east and north of ``origin``; ``distances`` is
+    the along-track distance of each vertex. ``waypoint_distances`` gives,
+    for every waypoint, the along-track distance of the point abeam it:
+    the fix itself, or the middle of the arc that cuts a fly-by fix.
+    """
+
+    def __init__(self, origin: Tuple[float, float], x, y, waypoint_vertices, turns: List[Dict],
+                 leg_lengths, leg_required):
+        import numpy as np
+
+        self.origin = origin
+        self.x = x
+        self.y = y
+        self.distances = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+        self.waypoint_distances = self.distances[waypoint_vertices]
+        self.turns = turns
+        self.leg_lengths = leg_lengths
+        self.leg_required = leg_required
+
+    @property
+    def length(self) -> float:
+        return float(self.distances[-1])
+
+    @property
+    def leg_distances(self) -> List[float]:
+        """Flown distance between consecutive waypoints"""
+        import numpy as np
+
+        return np.diff(self.waypoint_distances).tolist()
+
+    def _project(self, latitudes, longitudes):
+        import numpy as np
+
+        lat0, lon0 = self.origin
+        return ((np.asarray(longitudes, dtype=float) - lon0) * NM_PER_DEGREE * math.cos(math.radians(lat0)),
+                (np.asarray(latitudes, dtype=float) - lat0) * NM_PER_DEGREE)
+
+    def _unproject(self, x, y):
+        lat0, lon0 = self.origin
+        return lat0 + y / NM_PER_DEGREE, lon0 + x / (NM_PER_DEGREE * math.cos(math.radians(lat0)))
+
+    def positions(self, distances):
+        """Latitudes and longitudes of the track at the given along-track distances"""
+        import numpy as np
+
+        return self._unproject(np.interp(distances, self.distances, self.x),
+                               np.interp(distances, self.distances, self.y))
+
+    def offset_positions(self, distances, offsets):
+        """Latitudes and longitudes ``offsets`` NM right of the track at ``distances``.
+
+        ``offsets`` may have extra leading dimensions, e.g. one row per
+        perturbed track.
+        """
+        import numpy as np
+
+        x = np.interp(distances, self.distances, self.x)
+        y = np.interp(distances, self.distances, self.y)
+        dx, dy = np.gradient(x), np.gradient(y)
+        norm = np.hypot(dx, dy)
+        norm[norm == 0] = 1.0
+        # Unit normal pointing right of the direction of flight
+        nx, ny = dy / norm, -dx / norm
+        return self._unproject(x + offsets * nx, y + offsets * ny)
+
+    def sample(self, waypoints: Sequence[WaypointSnapshot], samples_per_leg: int) -> List[Dict]:
+        """Analysis points: each waypoint's abeam point plus evenly spaced points between them"""
+        import numpy as np
+
+        starts = self.waypoint_distances[:-1, None]
+        spans = np.diff(self.waypoint_distances)[:, None]
+        fractions = np.arange(samples_per_leg) / samples_per_leg
+        distances = np.append((starts + spans * fractions).ravel(), self.waypoint_distances[-1])
+        latitudes, longitudes = self.positions(distances)
+
+        points = []
+        for k, (lat, lon, distance) in enumerate(zip(latitudes.tolist(), longitudes.tolist(),
+                                                     distances.tolist())):
+            leg, j = divmod(k, samples_per_leg)
+            is_waypoint = j == 0
+            points.append({
+                'latitude': lat,
+                'longitude': lon,
+                'distance': distance,
+                'is_waypoint': is_waypoint,
+                'waypoint': waypoints[leg] if is_waypoint else None
+            })
+        return points
+
+    def locate(self, latitudes: Sequence[float], longitudes: Sequence[float]):
+        """Along-track distance and cross-track offset (NM) of the track's nearest point to each point"""
+        import numpy as np
+
+        px, py = self._project(latitudes, longitudes)
+        ax, ay = self.x[:-1], self.y[:-1]
+        dx, dy = np.diff(self.x), np.diff(self.y)
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((px[:, None] - ax) * dx + (py[:, None] - ay) * dy) / length2
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+        offsets = np.hypot(px[:, None] - ax - t * dx, py[:, None] - ay - t * dy)
+        nearest = offsets.argmin(axis=1)
+        rows = np.arange(len(px))
+        along = self.distances[nearest] + t[rows, nearest] * np.sqrt(length2[nearest])
+        return along, offsets[rows, nearest]
+
+
+class TrackGenerator:
+    """Nominal track of a procedure with fly-by and fly-over turns.
+
+    Turn radii follow PANS-OPS: the rate of turn for the bank angle,
+    capped at 3°/s. The speed at a fix is its speed constraint, else the
+    last constraint before it, else the procedure type's default. Speeds
+    are used as given rather than converted to true airspeed from the
+    altitude constraints, so that the track (and the terrain under it)
+    does not move when altitudes are changed.
+
+    A fly-by turn starts ``r * tan(track change / 2)`` before the fix on an
+    arc tangent to both legs. When the turns at both ends of a leg need
+    more than its length, their radii shrink to fit and the leg is
+    reported in ``leg_required``. A fly-over turn starts at the fix and
+    rolls out direct to the next fix. All turns are computed at once with
+    NumPy, so a track costs about as much as the straight-line sampler.
+    """
+
+    def __init__(self, bank_angle: Optional[Dict[str, float]] = None,
+                 default_speed: Optional[Dict[str, float]] = None, max_cached: int = 256):
+        self.bank_angle = bank_angle or {
+            'SID': 15,  # degrees
+            'STAR': 25,
+            'APPROACH': 25
+        }
+        self.default_speed = default_speed or {
+            'SID': 250,  # knots IAS
+            'STAR': 250,
+            'APPROACH': 180
+        }
+        # Tracks by snapshot digest: the validator and the analyzer often
+        # build the same one within a request
+        self.max_cached = max_cached
+        self._cache: 'OrderedDict[str, NominalTrack]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def turn_radius(self, speeds, bank_angle: float):
+        """Turn radius in NM for speeds in knots"""
+        import numpy as np
+
+        speed = np.maximum(np.asarray(speeds, dtype=float), 1.0)
+        rate = np.minimum(3431 * math.tan(math.radians(bank_angle)) / (math.pi * speed), MAX_RATE_OF_TURN)
+        return speed / (20 * math.pi * rate)
+
+    def _speeds(self, procedure: ProcedureSnapshot) -> List[float]:
+        speeds = []
+        speed = self.default_speed[procedure.procedure_type.name]
+        for waypoint in procedure.waypoints:
+            if waypoint.speed_constraint:
+                speed = waypoint.speed_constraint
+            speeds.append(speed)
+        return speeds
+
+    def build(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> NominalTrack:
+        """Nominal track through the procedure's waypoints (at least two)"""
+        procedure = ProcedureSnapshot.coerce(procedure)
+        key = procedure.digest
+        with self._lock:
+            track = self._cache.get(key)
+            if track is not None:
+                self._cache.move_to_end(key)
+                return track
+
+        track = self._build(procedure)
+        with self._lock:
+            self._cache[key] = track
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return track
+
+    def _build(self, procedure: ProcedureSnapshot) -> NominalTrack:
+        import numpy as np
+
+        # Degenerate legs and unreachable fly-over fixes divide by zero;
+        # they are masked out below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._geometry(procedure)
+
+    def turn_requirements(self, procedure: Union[FlightProcedure, ProcedureSnapshot], speeds) -> Dict:
+        """Turn radii, fly-over feasibility and leg length used by the turns, for several speed profiles.
+
+        ``speeds`` has shape ``(..., waypoints)``; every result gains the
+        same leading dimensions, so e.g. all aircraft categories are
+        evaluated at once over the same procedure geometry.
+        """
+        import numpy as np
+
+        procedure = ProcedureSnapshot.coerce(procedure)
+        _, px, py = self._local_xy(procedure)
+        fly_over = np.array([w.fly_over for w in procedure.waypoints[1:-1]], dtype=bool)
+        speeds = np.asarray(speeds, dtype=float)
+        radius = self.turn_radius(speeds[..., 1:-1], self.bank_angle[procedure.procedure_type.name])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            turns = self._turns(px, py, fly_over, radius)
+        return {
+            'radius': radius,
+            'feasible': np.broadcast_to(turns['feasible'], radius.shape),
+            'leg_lengths': turns['lengths'],
+            'leg_required': turns['required']
+        }
+
+    @staticmethod
+    def _local_xy(procedure: ProcedureSnapshot):
+        import numpy as np
+
+        waypoints = procedure.waypoints
+        origin = (sum(procedure.latitudes) / len(waypoints), sum(procedure.longitudes) / len(waypoints))
+        px = (np.asarray(procedure.longitudes) - origin[1]) * NM_PER_DEGREE * math.cos(math.radians(origin[0]))
+        py = (np.asarray(procedure.latitudes) - origin[0]) * NM_PER_DEGREE
+        return origin, px, py
+
+    @staticmethod
+    def _turns(px, py, fly_over, radius) -> Dict:
+        """Turn geometry at the interior waypoints; ``radius`` may carry leading dimensions"""
+        import numpy as np
+
+        # Legs and their unit directions
+        vx, vy = np.diff(px), np.diff(py)
+        lengths = np.hypot(vx, vy)
+        safe = np.where(lengths > 0, lengths, 1.0)
+        ux, uy = vx / safe, vy / safe
+
+        # Turns at the interior waypoints: signed track change (left positive)
+        # and the unit normal pointing at the turn centre
+        inx, iny, outx, outy = ux[:-1], uy[:-1], ux[1:], uy[1:]
+        change = np.arctan2(inx * outy - iny * outx, inx * outx + iny * outy)
+        side = np.where(change < 0, -1.0, 1.0)
+        nx, ny = -iny * side, inx * side
+        wx, wy = px[1:-1], py[1:-1]
+
+        # Fly-by anticipation: the turn starts this far before the fix
+        anticipation = np.where(fly_over, 0.0, radius * np.tan(np.abs(change) / 2))
+
+        # Fly-over: turn from the fix around C until heading for the next fix
+        cx, cy = wx + radius * nx, wy + radius * ny
+        tx, ty = px[2:] - cx, py[2:] - cy
+        reach = np.hypot(tx, ty)
+        feasible = ~fly_over | (reach > radius)
+        start_angle = np.arctan2(-ny, -nx)
+        tangent_angle = np.arctan2(ty, tx) - side * np.arccos(np.clip(radius / reach, -1.0, 1.0))
+        sweep = np.mod(side * (tangent_angle - start_angle), 2 * math.pi)
+        sweep = np.where(feasible & (sweep < 2 * math.pi - 1e-9), sweep, 0.0)
+        exit_x = cx + radius * np.cos(start_angle + side * sweep)
+        exit_y = cy + radius * np.sin(start_angle + side * sweep)
+        rejoin = np.where(fly_over & feasible, np.maximum((exit_x - wx) * outx + (exit_y - wy) * outy, 0.0), 0.0)
+
+        # Leg length the turns at both ends use; fly-by turns that do not fit
+        # are tightened, on both of their legs
+        zero = np.zeros(np.shape(anticipation)[:-1] + (1,))
+        start_rejoin = np.concatenate((zero, rejoin), axis=-1)
+        fly_by_demand = (np.concatenate((zero, anticipation), axis=-1)
+                         + np.concatenate((anticipation, zero), axis=-1))
+        required = fly_by_demand + start_rejoin
+        fit = np.where(fly_by_demand > 0, np.clip((lengths - start_rejoin) / fly_by_demand, 0.0, 1.0), 1.0)
+        scale = np.where(fly_over, 1.0, np.minimum(fit[..., :-1], fit[..., 1:]))
+
+        return {
+            'lengths': lengths, 'inx': inx, 'iny': iny, 'change': change, 'side': side,
+            'nx': nx, 'ny': ny, 'wx': wx, 'wy': wy, 'anticipation': anticipation,
+            'cx': cx, 'cy': cy, 'feasible': feasible, 'start_angle': start_angle,
+            'sweep': sweep, 'rejoin': rejoin, 'required': required, 'scale': scale
+        }
+
+    def _geometry(self, procedure: ProcedureSnapshot) -> NominalTrack:
+        import numpy as np
+
+        waypoints = procedure.waypoints
+        origin, px, py = self._local_xy(procedure)
+        fly_over = np.array([w.fly_over for w in waypoints[1:-1]], dtype=bool)
+        bank = self.bank_angle[procedure.procedure_type.name]
+        radius = self.turn_radius(self._speeds(procedure)[1:-1], bank)
+
+        turns = self._turns(px, py, fly_over, radius)
+        lengths, change, side = turns['lengths'], turns['change'], turns['side']
+        inx, iny, nx, ny, wx, wy = (turns[k] for k in ('inx', 'iny', 'nx', 'ny', 'wx', 'wy'))
+        feasible, start_angle, rejoin, scale = (turns[k] for k in ('feasible', 'start_angle', 'rejoin', 'scale'))
+        radius = radius * scale
+        anticipation = turns['anticipation'] * scale
+
+        # Arc centres, start angles and signed sweeps for both turn kinds
+        entry_x, entry_y = wx - anticipation * inx, wy - anticipation * iny
+        cx = np.where(fly_over, turns['cx'], entry_x + radius * nx)
+        cy = np.where(fly_over, turns['cy'], entry_y + radius * ny)
+        sweep = np.where(fly_over, turns['sweep'], np.abs(change)) * side
+
+        angles = start_angle[:, None] + sweep[:, None] * (np.arange(ARC_POINTS) / (ARC_POINTS - 1))
+        arc_x = np.where(feasible[:, None], cx[:, None] + radius[:, None] * np.cos(angles), wx[:, None])
+        arc_y = np.where(feasible[:, None], cy[:, None] + radius[:, None] * np.sin(angles), wy[:, None])
+
+        x = np.concatenate([px[:1], arc_x.ravel(), px[-1:]])
+        y = np.concatenate([py[:1], arc_y.ravel(), py[-1:]])
+        turns_count = len(waypoints) - 2
+        waypoint_vertices = np.concatenate([
+            [0],
+            1 + np.arange(turns_count) * ARC_POINTS + np.where(fly_over, 0, ARC_POINTS // 2),
+            [len(x) - 1]
+        ]).astype(int)
+
+        turn_list = [{
+            'waypoint_name': waypoint.name,
+            'sequence': waypoint.sequence,
+            'type': 'fly_over' if over else 'fly_by',
+            'track_change': angle,
+            'bank_angle': bank,
+            'radius': r,
+            'anticipation': rejoin_distance if over else distance,
+            'reduced': factor < 1.0,
+            'feasible': ok
+        } for waypoint, over, angle, r, distance, rejoin_distance, factor, ok in zip(
+            waypoints[1:-1], fly_over.tolist(), np.degrees(np.abs(change)).tolist(), radius.tolist(),
+            anticipation.tolist(), rejoin.tolist(), scale.tolist(), feasible.tolist()
+        )]
+
+        return NominalTrack(origin, x, y, waypoint_vertices, turn_list, lengths.tolist(),
+                            turns['required'].tolist())
@@ -0,0 +1,142 @@
+from typing import Dict, Union
+
+from ..models.flight_procedure import FlightProcedure
+from ..models.snapshot import ProcedureSnapshot
+from ..validation.rules import FEET_PER_NM
+from .elevation_cache import ESTIMATED
+from .metrics import span
+
+
+class VerticalProfileOptimizer:
+    """Lowest altitude constraints that clear terrain and respect gradients.
+
+    The terrain along the procedure is sampled once. Each leg gets a floor:
+    its highest terrain plus the analyzer's minimum obstacle clearance. A
+    waypoint must be at or above the floors of both legs it bounds, so the
+    interpolated profile clears every sample of every leg. The validator's
+    maximum gradient limits how fast the profile may change between
+    waypoints. The lowest profile satisfying both is the upper envelope of
+    the floors' gradient cones:
+
+        A[i] = max_j (F[j] - s * |D[i] - D[j]|)
+
+    which a forward and a backward running maximum give in one vectorized
+    pass. Rounding up to publishable increments is followed by a repair
+    sweep for the (rare) gradient overshoot it causes.
+    """
+
+    def __init__(self, analyzer, validator):
+        self.analyzer = analyzer
+        self.validator = validator
+
+    def suggest(self, procedure: Union[FlightProcedure, ProcedureSnapshot], round_to: float = 100) -> Dict:
+        """Suggested ``altitude_constraint`` for every waypoint of ``procedure``"""
+        import numpy as np
+
+        procedure = ProcedureSnapshot.coerce(procedure)
+        waypoints = procedure.waypoints
+        if len(waypoints) < 2:
+            return {
+                'status': 'error',
+                'message': 'Procedure must have at least 2 waypoints'
+            }
+
+        points, elevations = self.analyzer.sample_terrain(procedure)
+        if not elevations:
+            return {
+                'status': 'error',
+                'message': 'Failed to get elevation data'
+            }
+
+        with span('optimization'):
+            clearance = self.analyzer.minimum_obstacle_clearance[procedure.procedure_type.name]
+            max_gradient = self.validator.max_gradient[procedure.procedure_type]
+            # Feet per NM, kept a hair under the limit so that float rounding
+            # cannot trip the validator's strict comparison
+            slope = max_gradient / 100 * FEET_PER_NM * (1 - 1e-9)
+
+            # Leg floors: highest requirement from a leg's first waypoint up
+            # to and including its last one
+            required = np.asarray(elevations, dtype=float) + clearance
+            waypoint_index = np.flatnonzero([p['is_waypoint'] for p in points])
+            leg_floors = np.maximum(np.maximum.reduceat(required, waypoint_index[:-1]),
+                                    required[waypoint_index[1:]])
+
+            floors = np.empty(len(waypoints))
+            floors[0], floors[-1] = leg_floors[0], leg_floors[-1]
+            floors[1:-1] = np.maximum(leg_floors[:-1], leg_floors[1:])
+            terrain_floors = floors.copy()
+            if procedure.minimum_altitude is not None:
+                floors = np.maximum(floors, procedure.minimum_altitude)
+            if round_to:
+                floors = np.ceil(floors / round_to) * round_to
+            else:
+                # A hair above, so that float rounding of the altitudes
+                # interpolated between waypoints cannot dip below a floor
+                floors = floors * (1 + 1e-9)
+
+            # Cumulative flown distance, measured as the validator measures it
+            legs = np.asarray(self.validator.leg_distances(procedure))
+            distance = np.concatenate([[0.0], np.cumsum(legs)])
+
+            forward = np.maximum.accumulate(floors + slope * distance) - slope * distance
+            backward = (np.maximum.accumulate((floors - slope * distance)[::-1])[::-1]
+                        + slope * distance)
+            altitudes = np.maximum(forward, backward)
+
+            if round_to:
+                altitudes = self._round_up(altitudes, legs * slope, round_to)
+
+        using_estimated_data = any(p.get('elevation_source') == ESTIMATED for p in points)
+        exceeds_maximum = (procedure.maximum_altitude is not None
+                           and bool((altitudes > procedure.maximum_altitude).any()))
+
+        suggestions = []
+        for i, waypoint in enumerate(waypoints):
+            suggested = float(altitudes[i])
+            if suggested > floors[i]:
+                limited_by = 'gradient'
+            elif procedure.minimum_altitude is not None and procedure.minimum_altitude > terrain_floors[i]:
+                limited_by = 'minimum_altitude'
+            else:
+                limited_by = 'terrain'
+            current = waypoint.altitude_constraint
+            suggestions.append({
+                'waypoint_id': waypoint.id,
+                'waypoint_name': waypoint.name,
+                'sequence': waypoint.sequence,
+                'current_altitude': current,
+                'suggested_altitude': suggested,
+                'terrain_floor': float(terrain_floors[i]),
+                'limited_by': limited_by,
+                'change': None if current is None else suggested - current
+            })
+
+        return {
+            'status': 'success',
+            'procedure_id': procedure.id,
+            'minimum_obstacle_clearance': clearance,
+            'max_gradient': max_gradient,
+            'feasible': not exceeds_maximum,
+            'suggestions': suggestions,
+            'using_estimated_data': using_estimated_data
+        }
+
+    @staticmethod
+    def _round_up(altitudes, max_change, step: float):
+        """Round up to ``step`` and raise the lower end of any leg left too steep"""
+        import numpy as np
+
+        altitudes = np.ceil(altitudes / step) * step
+        for _ in range(len(altitudes)):
+            # A leg is too steep when its high end exceeds the low end plus
+            # ``max_change``; raise the low end to the nearest allowed step
+            high = np.maximum(altitudes[:-1], altitudes[1:])
+            low_floor = np.ceil((high - max_change) / step) * step
+            raise_left = (altitudes[:-1] < low_floor)
+            raise_right = (altitudes[1:] < low_floor)
+            if not (raise_left.any() or raise_right.any()):
+                break
+            altitudes[:-1] = np.where(raise_left, low_floor, altitudes[:-1])
+            altitudes[1:] = np.where(raise_right, np.maximum(altitudes[1:], low_floor), altitudes[1:])
+        return altitudes
@@ -1,10 +1,20 @@
-from typing import List, Dict, Optional
-from ..models.flight_procedure import FlightProcedure, Waypoint, ProcedureType, NavigationType
+from typing import Any, Iterable, List, Dict, Optional, Union
+from ..models.flight_procedure import FlightProcedure, ProcedureType, NavigationType
+from ..models.snapshot import ProcedureSnapshot
+from ..utils.track import TrackGenerator
+from .rules import compile_rules, compute_features
 
 class ICAOValidator:
-    """ICAO PANS-OPS validator for flight procedures"""
+    """ICAO PANS-OPS validator for flight procedures.
+
+    The checks are the rules registered in ``validation.rules``; the limits
+    they compare against are the tables below. ``disabled_rules`` turns
+    rules off and ``rule_severity`` maps rule names to ``critical`` or
+    ``warning``.
+    """
     
-    def __init__(self):
+    def __init__(self, track_generator: Optional[TrackGenerator] = None, disabled_rules: Iterable[str] = (),
+                 rule_severity: Optional[Dict[str, str]] = None):
         # Minimum obstacle clearance requirements (in feet)
         self.minimum_clearance = {
             ProcedureType.SID: 1000,
@@ -18,143 +28,65 @@ class ICAOValidator:
             }
         }
         
+        # Minimum distance between consecutive waypoints (in NM)
+        self.min_leg_distance = {
+            ProcedureType.SID: 2,
+            ProcedureType.STAR: 2,
+            ProcedureType.APPROACH: 2
+        }
+        
         # Maximum turn angle between waypoints (in degrees)
         self.max_turn_angle = {
             ProcedureType.SID: 120,
             ProcedureType.STAR: 90,
             ProcedureType.APPROACH: 90
         }
+        
+        # Maximum climb/descent gradient between constrained waypoints (in %)
+        self.max_gradient = {
+            ProcedureType.SID: 8.3,  # CAT A/B aircraft
+            ProcedureType.STAR: 6.1,
+            ProcedureType.APPROACH: 5.2
+        }
+        
+        # Maximum speed (knots IAS) of each aircraft category (PANS-OPS):
+        # departure, initial approach and final approach speeds
+        self.category_speed = {
+            ProcedureType.SID: {'A': 120, 'B': 165, 'C': 265, 'D': 290, 'E': 300},
+            ProcedureType.STAR: {'A': 150, 'B': 180, 'C': 240, 'D': 250, 'E': 250},
+            ProcedureType.APPROACH: {'A': 100, 'B': 130, 'C': 160, 'D': 185, 'E': 230}
+        }
+        
+        # Climb gradient (in %) departing aircraft are assumed to achieve
+        self.climb_gradient = 3.3
+        
+        # Turn geometry (fly-by anticipation, fly-over) of the flown track,
+        # shared with the terrain analyzer where both are built together
+        self.track_generator = track_generator or TrackGenerator()
+        
+        self.rules = compile_rules(disabled_rules, rule_severity)
     
-    def validate_procedure(self, procedure: FlightProcedure) -> Dict[str, List[str]]:
+    def validate_procedure(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> Dict[str, List[str]]:
         """
         Validate a flight procedure against ICAO PANS-OPS criteria
         Returns a dictionary of validation results with any violations
         """
-        violations = {
-            "critical": [],
-            "warnings": []
-        }
+        procedure = ProcedureSnapshot.coerce(procedure)
         
         # Check minimum waypoint count
         if len(procedure.waypoints) < 2:
-            violations["critical"].append("Procedure must have at least 2 waypoints")
-            return violations
-        
-        # Validate waypoint sequence
-        self._validate_waypoint_sequence(procedure, violations)
-        
-        # Validate turn angles
-        self._validate_turn_angles(procedure, violations)
-        
-        # Validate altitude constraints
-        self._validate_altitude_constraints(procedure, violations)
-        
-        return violations
-    
-    def _validate_waypoint_sequence(self, procedure: FlightProcedure, violations: Dict[str, List[str]]):
-        """Validate the sequence and spacing of waypoints"""
-        waypoints = procedure.waypoints
-        
-        for i in range(len(waypoints) - 1):
-            current = waypoints[i]
-            next_wp = waypoints[i + 1]
-            
-            # Check sequence numbers
-            if current.sequence >= next_wp.sequence:
-                violations["critical"].append(
-                    f"Invalid waypoint sequence between {current.name} and {next_wp.name}"
-                )
-            
-            # Check minimum distance between waypoints (2 NM for most procedures)
-            distance = self._calculate_distance(current, next_wp)
-            if distance < 2:
-                violations["warnings"].append(
-                    f"Waypoints {current.name} and {next_wp.name} are too close ({distance:.1f} NM)"
-                )
-    
-    def _validate_turn_angles(self, procedure: FlightProcedure, violations: Dict[str, List[str]]):
-        """Validate turn angles between waypoints"""
-        waypoints = procedure.waypoints
-        max_angle = self.max_turn_angle[procedure.procedure_type]
-        
-        for i in range(len(waypoints) - 2):
-            angle = self._calculate_turn_angle(
-                waypoints[i],
-                waypoints[i + 1],
-                waypoints[i + 2]
-            )
-            
-            if angle > max_angle:
-                violations["critical"].append(
-                    f"Turn angle between {waypoints[i+1].name} exceeds maximum "
-                    f"({angle:.1f}° > {max_angle}°)"
-                )
-    
-    def _validate_altitude_constraints(self, procedure: FlightProcedure, violations: Dict[str, List[str]]):
-        """Validate altitude constraints and profiles"""
-        waypoints = procedure.waypoints
+            return {
+                "critical": ["Procedure must have at least 2 waypoints"],
+                "warnings": []
+            }
         
-        for i in range(len(waypoints) - 1):
-            current = waypoints[i]
-            next_wp = waypoints[i + 1]
-            
-            if current.altitude_constraint and next_wp.altitude_constraint:
-                # Check maximum climb/descent gradients (based on ICAO criteria)
-                if procedure.procedure_type == ProcedureType.SID:
-                    max_gradient = 8.3  # % for SID (CAT A/B aircraft)
-                elif procedure.procedure_type == ProcedureType.APPROACH:
-                    max_gradient = 5.2  # % for approach
-                else:
-                    max_gradient = 6.1  # % for STAR
-                
-                distance = self._calculate_distance(current, next_wp)
-                altitude_change = abs(next_wp.altitude_constraint - current.altitude_constraint)
-                gradient = (altitude_change / (distance * 6076)) * 100  # Convert NM to feet
-                
-                if gradient > max_gradient:
-                    violations["critical"].append(
-                        f"Gradient between {current.name} and {next_wp.name} "
-                        f"exceeds maximum ({gradient:.1f}% > {max_gradient}%)"
-                    )
+        # Every enabled rule (see ``rules``) over features computed once per procedure
+        return self.rules.evaluate(procedure, self)
     
-    @staticmethod
-    def _calculate_distance(wp1: Waypoint, wp2: Waypoint) -> float:
-        """Calculate distance between waypoints in nautical miles"""
-        # Simplified distance calculation - replace with proper geodesic calculation
-        from math import cos, radians, sqrt
-        
-        lat1, lon1 = radians(wp1.latitude), radians(wp1.longitude)
-        lat2, lon2 = radians(wp2.latitude), radians(wp2.longitude)
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        
-        return 3440 * c  # Earth radius in NM * central angle
+    def features(self, procedure: Union[FlightProcedure, ProcedureSnapshot], *names: str) -> Dict[str, Any]:
+        """Rule features of ``procedure`` by name, computed as the rules see them"""
+        return compute_features(ProcedureSnapshot.coerce(procedure), self, names)
     
-    @staticmethod
-    def _calculate_turn_angle(wp1: Waypoint, wp2: Waypoint, wp3: Waypoint) -> float:
-        """Calculate turn angle at wp2 in degrees"""
-        # Simplified angle calculation - replace with proper geodesic calculation
-        from math import atan2, degrees
-        
-        # Convert to radians
-        lat1, lon1 = radians(wp1.latitude), radians(wp1.longitude)
-        lat2, lon2 = radians(wp2.latitude), radians(wp2.longitude)
-        lat3, lon3 = radians(wp3.latitude), radians(wp3.longitude)
-        
-        # Calculate bearings
-        bearing1 = atan2(
-            sin(lon2-lon1) * cos(lat2),
-            cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(lon2-lon1)
-        )
-        bearing2 = atan2(
-            sin(lon3-lon2) * cos(lat3),
-            cos(lat2) * sin(lat3) - sin(lat2) * cos(lat3) * cos(lon3-lon2)
-        )
-        
-        # Calculate turn angle
-        angle = degrees(abs(bearing2 - bearing1))
-        return min(angle, 360 - angle) 
\ No newline at end of file
+    def leg_distances(self, procedure: Union[FlightProcedure, ProcedureSnapshot]) -> List[float]:
+        """Flown distance between consecutive waypoints, as used for the gradient check"""
+        return self.track_generator.build(ProcedureSnapshot.coerce(procedure)).leg_distances
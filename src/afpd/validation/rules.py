@@ -0,0 +1,358 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..utils.metrics import metrics
+
+SEVERITIES = ('critical', 'warning')
+# Result lists of ``ICAOValidator.validate_procedure`` by severity
+_RESULT_KEYS = {'critical': 'critical', 'warning': 'warnings'}
+
+EARTH_RADIUS_NM = 3440
+FEET_PER_NM = 6076
+
+
+class Feature:
+    """A per-leg or per-turn quantity computed from named inputs.
+
+    The values of ``procedure``, ``validator`` and every other feature are
+    available as inputs. Leg features are NumPy arrays of one value per
+    leg (waypoint ``i`` to ``i + 1``), turn features of one value per
+    interior waypoint.
+    """
+
+    def __init__(self, name: str, inputs: Sequence[str], compute: Callable):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.compute = compute
+
+
+class Rule:
+    """A validation rule declared by the features it reads.
+
+    ``test`` is called once with every input, in order, then ``limit``:
+    the rule's entry in the validator table named ``limit`` for the
+    procedure type. It returns a boolean array, True for each leg or turn
+    that violates the rule. ``message`` is formatted per
+    violation with the input names, ``limit`` and the waypoint names
+    (``from_name``/``to_name`` of a leg, ``waypoint_name`` of a turn).
+    """
+
+    def __init__(self, name: str, scope: str, inputs: Sequence[str], test: Callable, message: str,
+                 severity: str = 'critical', limit: Optional[str] = None, description: str = ''):
+        if scope not in ('leg', 'turn'):
+            raise ValueError(f'Rule {name}: scope must be leg or turn')
+        if severity not in SEVERITIES:
+            raise ValueError(f'Rule {name}: severity must be one of {", ".join(SEVERITIES)}')
+        self.name = name
+        self.scope = scope
+        self.inputs = tuple(inputs)
+        self.test = test
+        self.message = message
+        self.severity = severity
+        self.limit = limit
+        self.description = description
+
+
+FEATURES: Dict[str, Feature] = {}
+RULES: 'OrderedDict[str, Rule]' = OrderedDict()
+
+
+def feature(name: str, *inputs: str):
+    """Register the decorated function as the feature ``name``, computed from ``inputs``"""
+    def register(compute: Callable) -> Callable:
+        FEATURES[name] = Feature(name, inputs, compute)
+        return compute
+    return register
+
+
+def register_rule(rule: Rule) -> Rule:
+    """Add a rule to the registry; rules report in registration order"""
+    missing = [name for name in rule.inputs if name not in FEATURES]
+    if missing:
+        raise ValueError(f'Rule {rule.name}: unknown features {", ".join(missing)}')
+    RULES[rule.name] = rule
+    return rule
+
+
+class RuleStats:
+    """Time spent in each feature and rule, and violations per rule, over all validators of the process.
+
+    A validation adds its step timestamps under one lock acquisition; the
+    metrics collector below publishes the totals when ``/metrics`` is scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[Tuple[str, str], float] = {}
+        self.violations: Dict[Tuple[str, str], int] = {}
+        self._published: Dict[Tuple, float] = {}
+
+    def add(self, steps: Sequence[Tuple[str, str]], stamps: Sequence[float],
+            violations: Iterable[Tuple[Tuple[str, str], int]]):
+        """Add ``stamps[i + 1] - stamps[i]`` to the time of ``steps[i]``"""
+        seconds = self.seconds
+        with self._lock:
+            for step, start, end in zip(steps, stamps, stamps[1:]):
+                seconds[step] = seconds.get(step, 0.0) + (end - start)
+            for key, count in violations:
+                self.violations[key] = self.violations.get(key, 0) + count
+
+    def publish(self, registry):
+        """Add what was counted since the last call to the registry's counters"""
+        with self._lock:
+            totals = [(('seconds',) + key, value) for key, value in self.seconds.items()]
+            totals += [(('violations',) + key, value) for key, value in self.violations.items()]
+            deltas = [(key, value - self._published.get(key, 0)) for key, value in totals]
+            self._published.update(totals)
+        for (kind, first, second), delta in deltas:
+            if not delta:
+                continue
+            if kind == 'seconds':
+                registry.inc(f'afpd_validation_{first}_seconds_total', delta, **{first: second})
+            else:
+                registry.inc('afpd_validation_rule_violations_total', delta, rule=first, severity=second)
+
+
+rule_stats = RuleStats()
+metrics.register_collector(rule_stats.publish)
+
+
+class CompiledRules:
+    """The enabled rules of one validator, with the features they need in evaluation order.
+
+    ``evaluate`` computes each of those features once for the whole
+    procedure, then runs every rule over them, timing both.
+    """
+
+    def __init__(self, rules: Iterable[Rule], severity: Optional[Dict[str, str]] = None):
+        severity = severity or {}
+        self.rules: List[Tuple[Rule, str]] = [(rule, severity.get(rule.name, rule.severity)) for rule in rules]
+        self.features: List[Feature] = []
+        for rule, _ in self.rules:
+            for name in rule.inputs:
+                self._require(name, ())
+        self.steps = [('feature', spec.name) for spec in self.features] + [('rule', rule.name) for rule, _ in self.rules]
+
+    def _require(self, name: str, path: Tuple[str, ...]):
+        if name in ('procedure', 'validator') or any(f.name == name for f in self.features):
+            return
+        if name in path:
+            raise ValueError(f'Feature {name} depends on itself')
+        spec = FEATURES[name]
+        for dependency in spec.inputs:
+            self._require(dependency, path + (name,))
+        self.features.append(spec)
+
+    def evaluate(self, procedure, validator) -> Dict[str, List[str]]:
+        clock = time.perf_counter
+        stamps = [clock()]
+        values = {'procedure': procedure, 'validator': validator}
+        for spec in self.features:
+            values[spec.name] = spec.compute(*[values[name] for name in spec.inputs])
+            stamps.append(clock())
+
+        violations = {'critical': [], 'warnings': []}
+        counts = []
+        names = None
+        for rule, severity in self.rules:
+            limit = None
+            if rule.limit is not None:
+                table = getattr(validator, rule.limit)
+                limit = table[procedure.procedure_type] if isinstance(table, dict) else table
+            inputs = [values[name] for name in rule.inputs]
+            rows = rule.test(*inputs, limit).nonzero()[0].tolist()
+            if rows:
+                names = names or [w.name for w in procedure.waypoints]
+                messages = violations[_RESULT_KEYS[severity]]
+                for i in rows:
+                    fields = {name: array[i].item() for name, array in zip(rule.inputs, inputs)}
+                    if rule.scope == 'leg':
+                        fields.update(from_name=names[i], to_name=names[i + 1])
+                    else:
+                        fields['waypoint_name'] = names[i + 1]
+                    messages.append(rule.message.format(limit=limit, **fields))
+                counts.append(((rule.name, severity), len(rows)))
+            stamps.append(clock())
+        rule_stats.add(self.steps, stamps, counts)
+        return violations
+
+
+def compile_rules(disabled: Iterable[str] = (), severity: Optional[Dict[str, str]] = None) -> CompiledRules:
+    """Compile the registered rules, less ``disabled``, with per-rule ``severity`` overrides"""
+    disabled = set(disabled)
+    severity = dict(severity or {})
+    unknown = (disabled | set(severity)) - set(RULES)
+    if unknown:
+        raise ValueError(f'Unknown validation rules: {", ".join(sorted(unknown))}')
+    for name, value in severity.items():
+        if value not in SEVERITIES:
+            raise ValueError(f'Severity of {name} must be one of {", ".join(SEVERITIES)}')
+    return CompiledRules((rule for name, rule in RULES.items() if name not in disabled), severity)
+
+
+def compute_features(procedure, validator, names: Iterable[str]) -> Dict:
+    """Values of the features ``names``, and of every feature they read, for ``procedure``"""
+    names = list(names)
+    unknown = [name for name in names if name not in FEATURES]
+    if unknown:
+        raise ValueError(f'Unknown features: {", ".join(unknown)}')
+    values = {'procedure': procedure, 'validator': validator}
+
+    def compute(name):
+        if name not in values:
+            spec = FEATURES[name]
+            for dependency in spec.inputs:
+                compute(dependency)
+            values[name] = spec.compute(*[values[dependency] for dependency in spec.inputs])
+
+    for name in names:
+        compute(name)
+    return {name: values[name] for name in names}
+
+
+# Features
+
+@feature('sequence_step', 'procedure')
+def _sequence_step(procedure):
+    import numpy as np
+
+    sequences = np.array([w.sequence for w in procedure.waypoints], dtype=float)
+    return sequences[1:] - sequences[:-1]
+
+
+@feature('geometry', 'procedure')
+def _geometry(procedure):
+    """Sines and cosines of the waypoint latitudes, and the latitude and longitude change of each leg, in radians"""
+    import numpy as np
+
+    lat = np.radians(procedure.latitudes)
+    lon = np.radians(procedure.longitudes)
+    return np.sin(lat), np.cos(lat), lat[1:] - lat[:-1], lon[1:] - lon[:-1]
+
+
+@feature('distance', 'geometry')
+def _distance(geometry):
+    """Great circle distance of each leg in NM"""
+    import numpy as np
+
+    _, cos_lat, dlat, dlon = geometry
+    a = np.sin(dlat / 2) ** 2 + cos_lat[:-1] * cos_lat[1:] * np.sin(dlon / 2) ** 2
+    return (2 * EARTH_RADIUS_NM) * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+@feature('turn_angle', 'geometry')
+def _turn_angle(geometry):
+    """Change of initial great circle bearing at each interior waypoint, in degrees"""
+    import numpy as np
+
+    sin_lat, cos_lat, _, dlon = geometry
+    bearing = np.arctan2(np.sin(dlon) * cos_lat[1:],
+                         cos_lat[:-1] * sin_lat[1:] - sin_lat[:-1] * cos_lat[1:] * np.cos(dlon))
+    angle = np.degrees(np.abs(bearing[1:] - bearing[:-1]))
+    return np.minimum(angle, 360 - angle)
+
+
+@feature('track', 'procedure', 'validator')
+def _track(procedure, validator):
+    return validator.track_generator.build(procedure)
+
+
+@feature('flown_distance', 'track')
+def _flown_distance(track):
+    """Distance flown between consecutive waypoints along the nominal track, in NM"""
+    distances = track.waypoint_distances
+    return distances[1:] - distances[:-1]
+
+
+@feature('gradient', 'procedure', 'flown_distance')
+def _gradient(procedure, flown_distance):
+    """Climb or descent gradient (%) between altitude constraints, NaN where a leg has none at either end"""
+    import numpy as np
+
+    altitudes = np.array([w.altitude_constraint or np.nan for w in procedure.waypoints], dtype=float)
+    rise = np.abs(altitudes[1:] - altitudes[:-1])
+    run = flown_distance * (FEET_PER_NM / 100)
+    # Coincident waypoints have no gradient rather than an infinite one
+    return np.divide(rise, run, out=np.full_like(rise, np.nan), where=run > 0)
+
+
+@feature('leg_length', 'track')
+def _leg_length(track):
+    import numpy as np
+
+    return np.asarray(track.leg_lengths)
+
+
+@feature('leg_required', 'track')
+def _leg_required(track):
+    """Leg length the turns at both ends of each leg use, in NM"""
+    import numpy as np
+
+    return np.asarray(track.leg_required)
+
+
+@feature('turn_feasible', 'track')
+def _turn_feasible(track):
+    import numpy as np
+
+    return np.array([turn['feasible'] for turn in track.turns], dtype=bool)
+
+
+@feature('turn_radius', 'track')
+def _turn_radius(track):
+    import numpy as np
+
+    return np.array([turn['radius'] for turn in track.turns], dtype=float)
+
+
+# ICAO PANS-OPS rules
+
+register_rule(Rule(
+    'waypoint_sequence', 'leg', ('sequence_step',),
+    test=lambda sequence_step, limit: sequence_step <= 0,
+    message='Invalid waypoint sequence between {from_name} and {to_name}',
+    description='Sequence numbers increase along the procedure'
+))
+
+register_rule(Rule(
+    'leg_distance', 'leg', ('distance',), limit='min_leg_distance', severity='warning',
+    test=lambda distance, limit: distance < limit,
+    message='Waypoints {from_name} and {to_name} are too close ({distance:.1f} NM)',
+    description='Minimum distance between consecutive waypoints'
+))
+
+register_rule(Rule(
+    'turn_angle', 'turn', ('turn_angle',), limit='max_turn_angle',
+    test=lambda turn_angle, limit: turn_angle > limit,
+    message='Turn angle between {waypoint_name} exceeds maximum ({turn_angle:.1f}° > {limit}°)',
+    description='Maximum track change at a waypoint'
+))
+
+register_rule(Rule(
+    'turn_leg_length', 'leg', ('leg_length', 'leg_required'), severity='warning',
+    test=lambda leg_length, leg_required, limit: leg_required > leg_length,
+    message='Leg {from_name}-{to_name} ({leg_length:.1f} NM) is shorter than the turns at its ends '
+            'need ({leg_required:.1f} NM)',
+    description='Legs long enough for the flown turns at both ends'
+))
+
+register_rule(Rule(
+    'fly_over_turn', 'turn', ('turn_feasible', 'turn_radius'),
+    test=lambda turn_feasible, turn_radius, limit: ~turn_feasible,
+    message='Fly-over turn at {waypoint_name} cannot reach the next waypoint (turn radius {turn_radius:.1f} NM)',
+    description='Fly-over turns can roll out towards the next waypoint'
+))
+
+register_rule(Rule(
+    'gradient', 'leg', ('gradient',), limit='max_gradient',
+    test=lambda gradient, limit: gradient > limit,
+    message='Gradient between {from_name} and {to_name} exceeds maximum ({gradient:.1f}% > {limit}%)',
+    description='Maximum climb/descent gradient between altitude constraints, over the flown distance'
+))
+
+
+metrics.describe('afpd_validation_feature_seconds_total', 'counter', 'Time spent computing each validation feature.')
+metrics.describe('afpd_validation_rule_seconds_total', 'counter', 'Time spent evaluating each validation rule.')
+metrics.describe('afpd_validation_rule_violations_total', 'counter', 'Violations found by each validation rule.')
@@ -0,0 +1,29 @@
+import pytest
+
+from afpd import create_app, db
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build isolated apps: a SQLite database and caches under ``tmp_path`` unless overridden"""
+    def factory(database_url=None, **config):
+        return create_app(dict({
+            'SQLALCHEMY_DATABASE_URI': database_url or f'sqlite:///{tmp_path / "test.db"}',
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'ROUTE_GRID_DIR': str(tmp_path / 'route_grids'),
+            'TERRAIN_TILE_DIR': str(tmp_path / 'terrain_tiles'),
+            'PROCEDURE_TILE_DIR': str(tmp_path / 'procedure_tiles'),
+            'PROFILER_DIR': str(tmp_path / 'profiles')
+        }, **config))
+    return factory
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
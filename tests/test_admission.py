@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from afpd.utils.admission import AdmissionController, AdmissionRejected, request_priority
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+class Waiter(threading.Thread):
+    """Acquire a slot in the background, recording the grant order in ``log``"""
+
+    def __init__(self, controller, user, priority, log):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.user = user
+        self.priority = priority
+        self.log = log
+        self.error = None
+
+    def run(self):
+        try:
+            self.controller.acquire(self.user, self.priority)
+            self.log.append(self.user)
+        except AdmissionRejected as e:
+            self.error = e
+
+
+def queue(controller, user, priority, log):
+    """Start a waiter and return once it is queued"""
+    expected = controller.stats()['queued'][priority] + 1
+    waiter = Waiter(controller, user, priority, log)
+    waiter.start()
+    wait_until(lambda: controller.stats()['queued'][priority] == expected)
+    return waiter
+
+
+def test_requests_run_at_once_below_the_limit():
+    controller = AdmissionController(max_concurrent=2)
+
+    assert controller.acquire('a') == 0.0
+    assert controller.acquire('b', 'batch') == 0.0
+    assert controller.stats() == {'running': 2, 'queued': {'interactive': 0, 'batch': 0}}
+
+
+def test_release_grants_the_next_ticket():
+    controller = AdmissionController(max_concurrent=1)
+    controller.acquire('a')
+    log = []
+    waiter = queue(controller, 'b', 'interactive', log)
+
+    controller.release('a', 0.1)
+    waiter.join(1)
+
+    assert log == ['b']
+    assert controller.stats() == {'running': 1, 'queued': {'interactive': 0, 'batch': 0}}
+
+
+def test_interactive_goes_ahead_of_batch():
+    controller = AdmissionController(max_concurrent=1)
+    controller.acquire('holder')
+    log = []
+    waiters = [
+        queue(controller, 'batch-1', 'batch', log),
+        queue(controller, 'batch-2', 'batch', log),
+        queue(controller, 'interactive-1', 'interactive', log),
+        queue(controller, 'interactive-2', 'interactive', log),
+    ]
+
+    for user in ['holder', 'interactive-1', 'interactive-2', 'batch-1']:
+        granted = len(log)
+        controller.release(user, 0.1)
+        wait_until(lambda: len(log) == granted + 1)
+    for waiter in waiters:
+        waiter.join(1)
+
+    # First come first served within a priority
+    assert log == ['interactive-1', 'interactive-2', 'batch-1', 'batch-2']
+
+
+def test_user_over_quota_is_rejected_with_429():
+    controller = AdmissionController(max_concurrent=1, user_quota=2)
+    controller.acquire('a')
+    log = []
+    queue(controller, 'a', 'interactive', log)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('a')
+    assert rejected.value.status == 429
+    assert rejected.value.retry_after >= 1
+
+    # Other users are not affected by the quota of ``a``
+    queue(controller, 'b', 'interactive', log)
+
+
+def test_quota_is_given_back_on_release():
+    controller = AdmissionController(max_concurrent=4, user_quota=1)
+    controller.acquire('a')
+    with pytest.raises(AdmissionRejected):
+        controller.acquire('a')
+
+    controller.release('a', 0.1)
+    assert controller.acquire('a') == 0.0
+
+
+def test_full_queue_is_rejected_with_503():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, batch_queue=2)
+    controller.acquire('holder')
+    log = []
+    queue(controller, 'a', 'interactive', log)
+    queue(controller, 'b', 'interactive', log)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('c')
+    assert rejected.value.status == 503
+
+
+def test_batch_queue_is_shorter_than_interactive():
+    controller = AdmissionController(max_concurrent=1, max_queue=3, batch_queue=1)
+    controller.acquire('holder')
+    log = []
+    queue(controller, 'a', 'batch', log)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('b', 'batch')
+    assert rejected.value.status == 503
+
+    # Interactive requests still queue up to ``max_queue``
+    queue(controller, 'c', 'interactive', log)
+    queue(controller, 'd', 'interactive', log)
+
+
+def test_queue_timeout_is_rejected_with_503():
+    controller = AdmissionController(max_concurrent=1, user_quota=1, queue_timeout=0.05)
+    controller.acquire('holder')
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('a')
+    assert rejected.value.status == 503
+    # The expired ticket holds neither a queue place nor the user's quota
+    assert controller.stats() == {'running': 1, 'queued': {'interactive': 0, 'batch': 0}}
+
+    controller.release('holder', 0.1)
+    assert controller.acquire('a') == 0.0
+
+
+def test_async_waiter_shares_slots_with_threads():
+    controller = AdmissionController(max_concurrent=1)
+    controller.acquire('holder')
+
+    async def run():
+        task = asyncio.ensure_future(controller.acquire_async('a', 'batch'))
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        controller.release('holder', 0.1)
+        return await asyncio.wait_for(task, 1)
+
+    assert asyncio.run(run()) > 0.0
+    assert controller.stats()['running'] == 1
+
+
+def test_cancelled_async_waiter_gives_back_its_place():
+    controller = AdmissionController(max_concurrent=1, user_quota=1)
+    controller.acquire('holder')
+
+    async def run():
+        task = asyncio.ensure_future(controller.acquire_async('a'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert controller.stats() == {'running': 1, 'queued': {'interactive': 0, 'batch': 0}}
+    controller.release('holder', 0.1)
+    assert controller.acquire('a') == 0.0
+
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(ValueError):
+        AdmissionController().acquire('a', 'urgent')
+
+
+@pytest.mark.parametrize('priority, requested, expected', [
+    ('interactive', None, 'interactive'),
+    ('interactive', ' Batch ', 'batch'),
+    ('batch', 'interactive', 'batch'),
+])
+def test_request_priority_is_never_upgraded(priority, requested, expected):
+    assert request_priority(priority, requested) == expected
@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+from afpd import db
+from afpd.asgi import AsyncAPI
+from afpd.models.flight_procedure import FlightProcedure
+from afpd.models.user import User
+from afpd.utils import circuit_breaker
+from afpd.utils.admission import admission
+from afpd.utils.stub_elevation_server import StubElevationServer
+from afpd.utils.synthetic import make_procedure
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    """Fresh process-wide breakers for every test"""
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+
+
+@pytest.fixture
+def server():
+    with StubElevationServer() as server:
+        yield server
+
+
+@pytest.fixture
+def api(make_app, server):
+    app = make_app(ELEVATION_API_URL=server.url, ELEVATION_MAX_RETRIES=1, ELEVATION_RETRY_DELAY=0.0,
+                   LOGIN_DISABLED=True)
+    with app.app_context():
+        db.create_all()
+        user = User(username='pilot', email='pilot@example.com')
+        db.session.add(user)
+        db.session.add(make_procedure('short_approach', seed=5))
+        db.session.commit()
+        api = AsyncAPI(app, threads=2)
+        api.user_id = user.id
+        yield api
+        api.executor.shutdown(wait=True)
+        db.session.remove()
+        db.drop_all()
+
+
+def session_cookie(app, user_id):
+    value = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(user_id)})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}".encode()
+
+
+def get(api, path, query='', user_id=None):
+    """Status, headers and body of a GET through the ASGI application"""
+    headers = []
+    if user_id is not None:
+        headers.append((b'cookie', session_cookie(api.flask_app, user_id)))
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'headers': headers}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    async def request():
+        try:
+            await api(scope, receive, send)
+        finally:
+            # Elevation API connections belong to this event loop
+            await api.aclose()
+
+    asyncio.run(request())
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def procedure_id():
+    return db.session.execute(db.select(FlightProcedure.id)).scalar_one()
+
+
+def test_chain_matches_the_flask_view(api, server):
+    pid = procedure_id()
+    status, headers, body = get(api, '/api/chain', f'procedure_id={pid}', user_id=api.user_id)
+
+    assert status == 200
+    assert headers[b'content-type'] == b'application/json'
+    assert b'server-timing' in headers
+    chain = json.loads(body)
+    assert server.request_count > 0
+    assert len(chain['segments']) == 4
+    assert not chain['using_estimated_data']
+
+    expected = api.flask_app.test_client().get(f'/api/chain?procedure_id={pid}').get_json()
+    assert chain == expected
+
+
+def test_streamed_chain_sends_a_line_per_segment_then_the_summary(api):
+    pid = procedure_id()
+    status, headers, body = get(api, '/api/chain', f'procedure_id={pid}&stream=1', user_id=api.user_id)
+
+    assert status == 200
+    assert headers[b'content-type'] == b'application/x-ndjson'
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert [list(line) for line in lines[:-1]] == [['segment']] * 4
+    assert lines[-1]['procedure_id'] == pid
+    assert lines[-1]['total_distance'] == pytest.approx(sum(line['segment']['distance'] for line in lines[:-1]))
+
+
+@pytest.mark.parametrize('query, user, status', [
+    ('procedure_id=1', None, 401),
+    ('procedure_id=1', 999, 401),
+    ('', 'self', 400),
+    ('procedure_id=x', 'self', 400),
+    ('procedure_id=999', 'self', 404),
+])
+def test_chain_errors(api, query, user, status):
+    user_id = api.user_id if user == 'self' else user
+
+    assert get(api, '/api/chain', query, user_id=user_id)[0] == status
+
+
+def test_chain_waits_for_an_admission_slot(api):
+    controller = admission.for_app(api.flask_app)
+    pid = procedure_id()
+    before = controller.stats()
+
+    assert get(api, '/api/chain', f'procedure_id={pid}', user_id=api.user_id)[0] == 200
+    # The slot is given back once the response is sent
+    assert controller.stats() == before
+
+
+def test_other_requests_are_served_by_flask(api):
+    status, headers, body = get(api, '/api/procedures')
+
+    assert status == 200
+    assert [p['name'] for p in json.loads(body)] == ['SHORT_APPROACH 5']
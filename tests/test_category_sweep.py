@@ -0,0 +1,96 @@
+import math
+
+import pytest
+
+from afpd.models.flight_procedure import NavigationType, ProcedureType
+from afpd.models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from afpd.utils.category_sweep import CategorySweep
+from afpd.utils.synthetic import StubElevationProvider, StubTerrainAnalyzer
+from afpd.validation.icao_validator import ICAOValidator
+
+# Well above the stub terrain, which peaks at 4000 ft
+HIGH = [9000, 8000, 7000, 6000]
+
+
+def build(procedure_type, legs, altitudes, fly_over=(), speeds=None):
+    """Snapshot starting at 45N 6E and flying ``legs`` of (heading, NM); waypoints are WP0, WP1, ..."""
+    lat, lon = 45.0, 6.0
+    points = [(lat, lon)]
+    for heading, length in legs:
+        lat += length / 60 * math.cos(math.radians(heading))
+        lon += length / 60 * math.sin(math.radians(heading)) / math.cos(math.radians(lat))
+        points.append((lat, lon))
+    speeds = speeds or [None] * len(points)
+    return ProcedureSnapshot(1, 'TEST', 'LFLB', procedure_type, NavigationType.RNAV, waypoints=[
+        WaypointSnapshot(i, f'WP{i}', lat, lon, i + 1, altitude, speed, i in fly_over)
+        for i, ((lat, lon), altitude, speed) in enumerate(zip(points, altitudes, speeds))
+    ])
+
+
+def fly_over_turn(speeds=None):
+    """Fly-over 90° turn 2.5 NM before the next waypoint: too tight at category E approach speed"""
+    return build(ProcedureType.APPROACH, [(0, 8), (90, 2.5), (90, 5)], HIGH, fly_over=(1,), speeds=speeds)
+
+
+@pytest.fixture
+def validator():
+    return ICAOValidator()
+
+
+@pytest.fixture
+def sweep(validator):
+    return CategorySweep(StubTerrainAnalyzer(StubElevationProvider()), validator)
+
+
+def by_category(result):
+    return {entry['category']: entry for entry in result['categories']}
+
+
+def test_only_the_fastest_category_fails_a_tight_fly_over_turn(sweep, validator):
+    procedure = fly_over_turn()
+    result = sweep.evaluate(procedure)
+
+    assert result['compliant_categories'] == ['A', 'B', 'C', 'D']
+    e = by_category(result)['E']
+    assert e['checks'] == {'terrain': True, 'gradient': True, 'turns': False, 'climb': None}
+    assert e['critical'][0].startswith('Fly-over turn at WP1 cannot reach the next waypoint')
+    # The validator, at its default speed, has no objection
+    assert validator.validate_procedure(procedure)['critical'] == []
+
+
+def test_speed_constraint_slows_the_fast_categories(sweep):
+    result = sweep.evaluate(fly_over_turn(speeds=[160, 160, None, None]))
+
+    assert result['compliant_categories'] == ['A', 'B', 'C', 'D', 'E']
+
+
+def test_gradient_is_the_validators(sweep, validator):
+    procedure = build(ProcedureType.APPROACH, [(0, 8), (0, 2), (0, 5)], HIGH)
+    result = sweep.evaluate(procedure, max_gradients={'A': 10.0})
+
+    gradient = validator.features(procedure, 'gradient')['gradient']
+    assert gradient[1] > validator.max_gradient[ProcedureType.APPROACH]
+    categories = by_category(result)
+    assert categories['A']['checks']['gradient']
+    for category in 'BCDE':
+        assert categories[category]['critical'] == [
+            message for message in validator.validate_procedure(procedure)['critical'] if 'Gradient' in message
+        ]
+
+
+def test_sid_climb_gradient_is_required_per_category(sweep):
+    procedure = build(ProcedureType.SID, [(0, 5), (0, 5), (0, 5)], [5000, 9000, 10000, 11000])
+    result = sweep.evaluate(procedure, climb_gradients={'A': 20.0})
+
+    # Set by the first constraint: 4000 ft in 5 NM
+    assert result['required_climb_gradient'] == pytest.approx(4000 / (5 * 6076) * 100, rel=1e-2)
+    categories = by_category(result)
+    assert categories['A']['checks']['climb']
+    assert not categories['B']['checks']['climb']
+
+
+def test_unknown_category_is_an_error(sweep):
+    result = sweep.evaluate(fly_over_turn(), categories=('A', 'Z'))
+
+    assert result['status'] == 'error'
+    assert 'Z' in result['message']
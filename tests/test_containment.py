@@ -0,0 +1,88 @@
+import math
+
+import pytest
+
+from afpd.models.flight_procedure import NavigationType, ProcedureType
+from afpd.models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from afpd.utils.containment import ContainmentAnalyzer
+from afpd.utils.route_optimizer import CostGridCache
+from afpd.utils.synthetic import StubElevationProvider, StubTerrainAnalyzer
+
+
+def build(altitudes, navigation_type=NavigationType.RNAV, leg_nm=5.0):
+    """STAR flying north from 45N 6E in legs of ``leg_nm``, one waypoint per altitude"""
+    return ProcedureSnapshot(1, 'TEST', 'LFLB', ProcedureType.STAR, navigation_type, waypoints=[
+        WaypointSnapshot(i, f'WP{i}', 45.0 + i * leg_nm / 60, 6.0, i + 1, altitude)
+        for i, altitude in enumerate(altitudes)
+    ])
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CostGridCache()
+    cache.directory = str(tmp_path / 'route_grids')
+    return cache
+
+
+def containment(cache, terrain=None, **options):
+    options.setdefault('samples', 400)
+    options.setdefault('chunk_size', 100)
+    return ContainmentAnalyzer(StubTerrainAnalyzer(terrain), cache=cache, **options)
+
+
+def probabilities(result):
+    return [leg['violation_probability'] for leg in result['legs']]
+
+
+def test_flat_terrain_is_cleared_or_violated_on_every_track(cache):
+    # Flat at 1000 ft, so a leg's clearance does not depend on the track flown
+    flat = StubElevationProvider(base=1000.0, amplitude=0.0)
+    result = containment(cache, flat).analyze(build([5000, 5000, 5000, 1500]), seed=1)
+
+    assert result['status'] == 'success'
+    assert result['required_clearance'] == 1000
+    assert probabilities(result) == [0.0, 0.0, 1.0]
+    assert result['violation_probability'] == 1.0
+    assert result['legs'][0]['minimum_clearance_median'] == pytest.approx(4000.0, abs=1.0)
+    assert result['legs'][2]['standard_error'] == 0.0
+
+
+def test_results_depend_on_the_seed_not_on_workers(cache):
+    # Close above the stub terrain, so that some tracks violate and some do not
+    procedure = build([4000, 4000, 4000, 4000], navigation_type=NavigationType.NDB)
+
+    inline = containment(cache).analyze(procedure, seed=7)
+    pooled = containment(cache, workers=2).analyze(procedure, seed=7)
+    other = containment(cache).analyze(procedure, seed=8)
+
+    assert inline['legs'] == pooled['legs']
+    assert inline['violation_probability'] == pooled['violation_probability']
+    assert any(0.0 < p < 1.0 for p in probabilities(inline))
+    assert inline['legs'] != other['legs']
+
+
+def test_grid_is_cached_between_analyses(cache):
+    procedure = build([9000, 9000])
+    analyzer = containment(cache)
+
+    assert not analyzer.analyze(procedure, seed=1)['grid']['cached']
+    assert analyzer.analyze(procedure, seed=1)['grid']['cached']
+
+
+def test_oversized_grid_is_refused(cache):
+    result = containment(cache, max_cells=100).analyze(build([9000, 9000]))
+
+    assert result['status'] == 'error'
+    assert '100 cells' in result['message']
+    assert not cache._stored_keys()
+
+
+def test_sampling_error_shrinks_with_samples(cache):
+    procedure = build([4000, 4000], navigation_type=NavigationType.NDB)
+    few = containment(cache, samples=100).analyze(procedure, seed=3)['legs'][0]
+    many = containment(cache, samples=1600).analyze(procedure, seed=3)['legs'][0]
+
+    p = many['violation_probability']
+    assert many['standard_error'] == pytest.approx(math.sqrt(p * (1 - p) / 1600))
+    assert many['standard_error'] < few['standard_error']
+    assert abs(few['violation_probability'] - p) < 4 * few['standard_error'] + 1e-9
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from afpd.utils import dem_ingest
+from afpd.utils.dem_ingest import INT16_NODATA, JOURNAL, AsciiGridSource, ingest
+from afpd.utils.elevation import FEET_PER_METER, DEMTileStore
+
+
+def elevation_m(lat, lon):
+    """Plane the test grids sample: linear, so bilinear resampling is exact"""
+    return 100 + 200 * (lat - 45) + 50 * (lon - 6)
+
+
+def write_grid(directory, name, west, south=45.0, cells=10, nodata=()):
+    """ESRI ASCII grid of ``elevation_m`` over one degree, ``cells`` cells a side, nodes on the edges"""
+    step = 1 / cells
+    lines = [f'ncols {cells + 1}', f'nrows {cells + 1}', f'xllcenter {west}', f'yllcenter {south}',
+             f'cellsize {step}', 'NODATA_value -9999']
+    for row in range(cells + 1):
+        lat = south + (cells - row) * step
+        values = [-9999 if (row, col) in nodata else elevation_m(lat, west + col * step)
+                  for col in range(cells + 1)]
+        lines.append(' '.join(f'{v:g}' for v in values))
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+@pytest.fixture
+def sources(tmp_path):
+    directory = tmp_path / 'raw'
+    directory.mkdir()
+    return [write_grid(str(directory), 'west.asc', 6.0), write_grid(str(directory), 'east.asc', 7.0)]
+
+
+def quiet(message):
+    pass
+
+
+def test_ascii_grid_header_and_window(sources):
+    source = AsciiGridSource(sources[0])
+
+    assert (source.width, source.height) == (11, 11)
+    assert source.bounds == pytest.approx((45.0, 6.0, 46.0, 7.0))
+    window = source.window(0, 2, 3, 5)
+    # Rows from the north, as written: 46.0N then 45.9N at 6.3E and 6.4E
+    assert window.tolist() == [[315, 320], [295, 300]]
+
+
+def test_ingest_writes_tiles_the_store_reads(sources, tmp_path):
+    output = str(tmp_path / 'tiles')
+    result = ingest(sources, output, workers=1, echo=quiet)
+
+    assert result['written'] == ['N45E006', 'N45E007']
+    with open(os.path.join(output, 'manifest.json')) as f:
+        manifest = json.load(f)
+    assert manifest['cells'] == 10 and manifest['dtype'] == 'int16'
+    assert manifest['tiles']['N45E006']['min'] == 100 and manifest['tiles']['N45E006']['max'] == 350
+    assert not os.path.exists(os.path.join(output, JOURNAL))
+
+    tile = np.load(os.path.join(output, 'N45E006.npy'))
+    assert tile.shape == (11, 11)
+    assert tile[0, 0] == elevation_m(46.0, 6.0) and tile[-1, -1] == elevation_m(45.0, 7.0)
+    assert np.load(os.path.join(output, 'overviews', 'N45E006.npy')).max() == 350
+
+    store = DEMTileStore(output)
+    sampled = store.sample(np.array([45.55, 45.25]), np.array([6.25, 7.75]))
+    assert sampled == pytest.approx([elevation_m(45.55, 6.25) * FEET_PER_METER,
+                                     elevation_m(45.25, 7.75) * FEET_PER_METER], rel=1e-4)
+
+
+def test_voids_are_stored_as_nodata(tmp_path):
+    path = write_grid(str(tmp_path), 'voids.asc', 6.0, nodata={(0, 0), (5, 5)})
+    output = str(tmp_path / 'tiles')
+
+    ingest([path], output, workers=1, echo=quiet)
+
+    tile = np.load(os.path.join(output, 'N45E006.npy'))
+    assert tile[0, 0] == tile[5, 5] == INT16_NODATA
+    assert tile[0, 1] == elevation_m(46.0, 6.1)
+    with open(os.path.join(output, 'manifest.json')) as f:
+        assert json.load(f)['tiles']['N45E006']['voids'] == pytest.approx(2 / 121, abs=1e-6)
+
+
+def test_second_run_skips_tiles_that_are_up_to_date(sources, tmp_path):
+    output = str(tmp_path / 'tiles')
+    ingest(sources, output, workers=1, echo=quiet)
+
+    again = ingest(sources, output, workers=1, echo=quiet)
+    assert again['written'] == [] and again['up_to_date'] == 2
+
+    # A replaced source rewrites the tiles it overlaps, and only those
+    os.utime(sources[1], ns=(0, 0))
+    assert ingest(sources, output, workers=1, echo=quiet)['written'] == ['N45E007']
+    assert ingest(sources, output, workers=1, echo=quiet, force=True)['written'] == ['N45E006', 'N45E007']
+
+
+def test_interrupted_run_resumes_after_the_last_finished_tile(sources, tmp_path, monkeypatch):
+    output = str(tmp_path / 'tiles')
+    write_tile = dem_ingest._Ingest.tile
+
+    def fail_on_east(self, lat_index, lon_index, source_ids):
+        if lon_index == 7:
+            raise KeyboardInterrupt
+        return write_tile(self, lat_index, lon_index, source_ids)
+
+    monkeypatch.setattr(dem_ingest._Ingest, 'tile', fail_on_east)
+    with pytest.raises(KeyboardInterrupt):
+        ingest(sources, output, workers=1, echo=quiet)
+    monkeypatch.undo()
+
+    assert sorted(os.listdir(output)) == ['N45E006.npy', 'manifest.json', 'overviews']
+    result = ingest(sources, output, workers=1, echo=quiet)
+    assert result['written'] == ['N45E007'] and result['up_to_date'] == 1
+
+
+def test_journal_of_a_killed_run_is_folded_in(sources, tmp_path):
+    output = str(tmp_path / 'tiles')
+    ingest(sources, output, workers=1, echo=quiet)
+
+    # As left by a process killed after writing one tile: the tile is in the
+    # journal only, the next line half written, and a temporary file remains
+    manifest_path = os.path.join(output, 'manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    entry = manifest['tiles'].pop('N45E007')
+    signature = entry.pop('source')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    with open(os.path.join(output, JOURNAL), 'w') as f:
+        f.write(json.dumps(['N45E007', signature, entry]) + '\n["N45E0')
+    open(os.path.join(output, 'N45E008.npy.123.tmp'), 'w').close()
+
+    result = ingest(sources, output, workers=1, echo=quiet)
+
+    assert result['written'] == [] and result['up_to_date'] == 2
+    assert not any(name.endswith('.tmp') for name in os.listdir(output))
+
+
+def test_other_layout_is_refused(sources, tmp_path):
+    output = str(tmp_path / 'tiles')
+    ingest(sources, output, workers=1, echo=quiet)
+
+    with pytest.raises(ValueError, match='dtype'):
+        ingest(sources, output, dtype='float32', workers=1, echo=quiet)
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from afpd.utils import circuit_breaker
+from afpd.utils.circuit_breaker import CircuitBreaker
+from afpd.utils.elevation import (
+    FEET_PER_METER, HedgedRemoteProvider, RemoteElevationProvider, build_elevation_resolver
+)
+from afpd.utils.elevation_cache import ESTIMATED
+from afpd.utils.stub_elevation_server import StubElevationServer, stub_elevation_m
+
+# (45.5, 6.5) lies on the DEM tile written by ``dem_dir``, (47.5, 8.5) does not
+LATS = np.array([45.5, 47.5])
+LONS = np.array([6.5, 8.5])
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    """Fresh process-wide breakers for every test"""
+    monkeypatch.setattr(circuit_breaker, '_breakers', {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manual clock for the circuit breakers"""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(circuit_breaker, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def dem_dir(tmp_path):
+    """One-tile DEM store: N45E006 at a constant 500 m"""
+    np.save(tmp_path / 'N45E006.npy', np.full((11, 11), 500, dtype=np.int16))
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        json.dump({'tile_degrees': 1.0, 'units': 'm', 'tiles': {'N45E006': {}}}, f)
+    return str(tmp_path)
+
+
+class FakeProvider(RemoteElevationProvider):
+    """Remote provider answering ``value`` after ``delay`` seconds, or failing"""
+
+    def __init__(self, name, delay=0.0, value=100.0, fail=False):
+        super().__init__('http://fake.invalid', name=name, timeout=2.0)
+        self.delay = delay
+        self.value = value
+        self.fail = fail
+        self.calls = 0
+        self.threads = []
+        self.cancelled = threading.Event()
+
+    def fetch_chunk(self, lats, lons):
+        self.calls += 1
+        self.threads.append(threading.current_thread())
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError(f'{self.name} failed')
+        return np.full(lats.shape, self.value)
+
+    async def fetch_chunk_async(self, lats, lons):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        if self.fail:
+            raise ConnectionError(f'{self.name} failed')
+        return np.full(lats.shape, self.value)
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()['retry_in_seconds'] == pytest.approx(30.0)
+
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    clock.value += 29.0
+    assert not breaker.allow_request()
+
+    clock.value += 1.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_breaker_closes_after_successful_trial(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    clock.value += 30.0
+    assert breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_breaker_reopens_after_failed_trial(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30.0)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.value += 30.0
+    assert breaker.allow_request()
+
+    # A single failed trial is enough, whatever the threshold
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    clock.value += 30.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_get_breaker_is_shared_per_name():
+    assert circuit_breaker.get_breaker('a') is circuit_breaker.get_breaker('a')
+    assert circuit_breaker.get_breaker('a') is not circuit_breaker.get_breaker('b')
+
+
+def test_hedge_answers_from_backup_when_primary_is_slow():
+    slow = FakeProvider('slow', delay=1.0, value=1.0)
+    fast = FakeProvider('fast', delay=0.01, value=2.0)
+    hedged = HedgedRemoteProvider([slow, fast], default_hedge_delay=0.05)
+    try:
+        started = time.perf_counter()
+        values, sources = hedged.fetch_with_sources(LATS, LONS)
+        assert time.perf_counter() - started < 0.5
+    finally:
+        hedged.close()
+
+    assert values.tolist() == [2.0, 2.0]
+    assert sources.tolist() == ['fast', 'fast']
+    assert slow.calls == fast.calls == 1
+
+
+def test_hedge_fires_backup_at_once_when_primary_fails():
+    broken = FakeProvider('broken', fail=True)
+    backup = FakeProvider('backup', value=3.0)
+    hedged = HedgedRemoteProvider([broken, backup], default_hedge_delay=5.0)
+    try:
+        started = time.perf_counter()
+        values, sources = hedged.fetch_with_sources(LATS, LONS)
+        assert time.perf_counter() - started < 1.0
+    finally:
+        hedged.close()
+
+    assert values.tolist() == [3.0, 3.0]
+    assert sources.tolist() == ['backup', 'backup']
+
+
+def test_hedge_skips_providers_with_open_breaker():
+    primary = FakeProvider('primary', value=1.0)
+    backup = FakeProvider('backup', value=2.0)
+    for _ in range(primary.breaker.failure_threshold):
+        primary.breaker.record_failure()
+    hedged = HedgedRemoteProvider([primary, backup])
+    try:
+        _, sources = hedged.fetch_with_sources(LATS, LONS)
+    finally:
+        hedged.close()
+
+    assert sources.tolist() == ['backup', 'backup']
+    assert primary.calls == 0
+
+
+def test_hedge_without_answer_leaves_points_unresolved():
+    hedged = HedgedRemoteProvider([FakeProvider('a', fail=True), FakeProvider('b', fail=True)],
+                                  default_hedge_delay=0.01)
+    try:
+        values, sources = hedged.fetch_with_sources(LATS, LONS)
+    finally:
+        hedged.close()
+
+    assert np.isnan(values).all()
+    assert sources.tolist() == [None, None]
+
+
+def test_hedge_runs_inline_when_threads_are_exhausted():
+    slow = FakeProvider('slow', delay=0.5, value=1.0)
+    fast = FakeProvider('fast', value=2.0)
+    hedged = HedgedRemoteProvider([slow, fast], default_hedge_delay=0.02, max_threads=1)
+    try:
+        _, sources = hedged.fetch_with_sources(LATS, LONS)
+        # The slow request holds the only thread; the backup ran in this one
+        assert sources.tolist() == ['fast', 'fast']
+        assert fast.threads == [threading.current_thread()]
+        assert slow.threads[0] is not threading.current_thread()
+    finally:
+        hedged.close()
+
+
+def test_hedge_releases_thread_slots():
+    slow = FakeProvider('slow', delay=0.2, value=1.0)
+    fast = FakeProvider('fast', value=2.0)
+    hedged = HedgedRemoteProvider([slow, fast], default_hedge_delay=0.02, max_threads=2)
+    try:
+        for _ in range(3):
+            hedged.fetch_with_sources(LATS, LONS)
+        hedged._executor.shutdown(wait=True)
+    finally:
+        hedged.close()
+
+    # Every slot taken by a request, won or lost, is given back
+    assert hedged._threads._value == 2
+    assert len(hedged._executor._threads) <= 2
+
+
+def test_async_hedge_cancels_losing_request():
+    slow = FakeProvider('slow', delay=5.0, value=1.0)
+    fast = FakeProvider('fast', delay=0.01, value=2.0)
+    hedged = HedgedRemoteProvider([slow, fast], default_hedge_delay=0.05)
+
+    async def run():
+        answer = await hedged.fetch_with_sources_async(LATS, LONS)
+        # Let the cancellation reach the losing task
+        await asyncio.sleep(0)
+        return answer
+
+    try:
+        started = time.perf_counter()
+        values, sources = asyncio.run(run())
+        assert time.perf_counter() - started < 1.0
+    finally:
+        hedged.close()
+
+    assert values.tolist() == [2.0, 2.0]
+    assert sources.tolist() == ['fast', 'fast']
+    assert slow.cancelled.is_set()
+    assert not fast.cancelled.is_set()
+
+
+def test_resolver_prefers_local_dem_then_remote(dem_dir):
+    with StubElevationServer() as server:
+        resolver = build_elevation_resolver(api_url=server.url, high_res_dem=dem_dir,
+                                            max_retries=1, retry_delay=0.0)
+        elevations, sources = resolver.resolve(LATS, LONS)
+        # Only the point the DEM does not cover was sent to the service
+        assert server.request_count == 1
+
+    assert sources.tolist() == ['dem-highres', 'open-elevation']
+    assert elevations[0] == pytest.approx(500 * FEET_PER_METER)
+    assert elevations[1] == pytest.approx(stub_elevation_m(47.5, 8.5) * FEET_PER_METER)
+
+
+def test_resolver_estimates_what_the_remote_cannot_answer(dem_dir):
+    with StubElevationServer(failure_rate=1.0) as server:
+        resolver = build_elevation_resolver(api_url=server.url, high_res_dem=dem_dir,
+                                            max_retries=1, retry_delay=0.0)
+        elevations, sources = resolver.resolve(LATS, LONS)
+
+    assert sources.tolist() == ['dem-highres', ESTIMATED]
+    assert np.isfinite(elevations).all()
+
+
+def test_resolver_falls_over_to_backup_service():
+    with StubElevationServer(failure_rate=1.0) as primary, StubElevationServer() as backup:
+        resolver = build_elevation_resolver(api_url=primary.url, backup_urls=[backup.url],
+                                            max_retries=1, retry_delay=0.0)
+        try:
+            elevations, sources = resolver.resolve(LATS, LONS)
+        finally:
+            resolver.providers[-1].close()
+
+    assert sources.tolist() == ['backup-1', 'backup-1']
+    assert elevations[1] == pytest.approx(stub_elevation_m(47.5, 8.5) * FEET_PER_METER)
+
+
+def test_resolver_stops_calling_a_service_once_its_breaker_opens():
+    with StubElevationServer(failure_rate=1.0) as server:
+        resolver = build_elevation_resolver(api_url=server.url, max_retries=1, retry_delay=0.0)
+        remote = resolver.providers[0]
+        for _ in range(remote.breaker.failure_threshold):
+            resolver.resolve(LATS, LONS)
+        assert remote.breaker.state == CircuitBreaker.OPEN
+
+        calls = server.request_count
+        _, sources = resolver.resolve(LATS, LONS)
+        assert server.request_count == calls
+
+    assert sources.tolist() == [ESTIMATED, ESTIMATED]
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from afpd import db
+from afpd.utils.load_test import DEFAULT_MIX, endpoint_key, parse_mix, read_request_log
+from afpd.utils.synthetic import procedure_payload
+
+
+@pytest.mark.parametrize('text, mix', [
+    ('index=2,list=4', {'index': 2.0, 'list': 4.0}),
+    (' chain = 0.5 , terrain', {'chain': 0.5, 'terrain': 1.0}),
+    ('create=0,view=3', {'create': 0.0, 'view': 3.0}),
+])
+def test_parse_mix(text, mix):
+    assert parse_mix(text) == mix
+
+
+@pytest.mark.parametrize('text, message', [
+    ('index=2,delete=1', 'Unknown operation delete'),
+    ('index=0,list=0', 'positive weight'),
+    ('index=many', 'could not convert'),
+])
+def test_parse_mix_refuses_bad_mixes(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_mix(text)
+
+
+def test_default_mix_parses_as_written():
+    text = ','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items())
+
+    assert parse_mix(text) == DEFAULT_MIX
+
+
+@pytest.mark.parametrize('method, path, key', [
+    ('GET', '/api/procedures/42/terrain?x=1', 'GET /api/procedures/<id>/terrain'),
+    ('PUT', '/api/procedures/7', 'PUT /api/procedures/<id>'),
+    ('GET', '/api/chain?procedure_id=3', 'GET /api/chain'),
+    ('GET', '/tiles/procedures/9/265/180.mvt', 'GET /tiles/procedures/<id>/<id>/180.mvt'),
+])
+def test_endpoint_key(method, path, key):
+    assert endpoint_key(method, path) == key
+
+
+def test_read_request_log_merges_formats_in_time_order(tmp_path):
+    path = tmp_path / 'requests.log'
+    path.write_text('\n'.join([
+        json.dumps({'t': 1700000010.5, 'method': 'PUT', 'path': '/api/procedures/1', 'status': 200,
+                    'body': {'name': 'X'}}),
+        '127.0.0.1 - - [14/Nov/2023:22:13:25 +0000] "GET /api/procedures?limit=5 HTTP/1.1" 200 512 "-" "curl"',
+        '',
+        'not a request',
+        '127.0.0.1 - - [14/Nov/2023:22:13:40 +0000] "POST /auth/login HTTP/1.1" 302 0',
+        json.dumps({'t': 1700000000.0, 'method': 'GET', 'path': '/', 'status': 200}),
+    ]) + '\n')
+
+    entries = read_request_log(str(path))
+
+    assert [(e['method'], e['path']) for e in entries] == [
+        ('GET', '/'), ('GET', '/api/procedures?limit=5'), ('PUT', '/api/procedures/1')
+    ]
+    assert entries[1] == {'t': 1700000005.0, 'method': 'GET', 'path': '/api/procedures?limit=5', 'status': 200}
+    assert entries[2]['body'] == {'name': 'X'}
+
+
+def test_request_log_of_the_app_reads_back_for_replay(make_app, tmp_path):
+    log = tmp_path / 'requests.jsonl'
+    app = make_app(REQUEST_LOG=str(log), LOGIN_DISABLED=True)
+    payload = procedure_payload('short_approach')
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        client.get('/api/procedures', query_string={'limit': 5})
+        procedure_id = client.post('/api/procedures', json=payload).get_json()['id']
+        client.get(f'/api/procedures/{procedure_id}')
+        app.extensions['afpd_request_log'].close()
+        db.session.remove()
+        db.drop_all()
+
+    entries = read_request_log(str(log))
+
+    assert [endpoint_key(e['method'], e['path']) for e in entries] == [
+        'GET /api/procedures', 'POST /api/procedures', 'GET /api/procedures/<id>'
+    ]
+    assert entries[0]['path'] == '/api/procedures?limit=5'
+    assert [e['status'] for e in entries] == [200, 201, 200]
+    assert entries[1]['body'] == payload
+    assert 'body' not in entries[2]
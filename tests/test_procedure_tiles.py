@@ -0,0 +1,108 @@
+import pytest
+
+from afpd.utils.map_tiles import tile_at
+from afpd.utils.procedure_tiles import procedure_tiles
+from afpd.utils.synthetic import procedure_payload
+
+Z = 9
+X, Y = tile_at(45.0, 6.0, Z)
+URL = f'/tiles/procedures/{Z}/{X}/{Y}'
+
+
+@pytest.fixture
+def client(app):
+    app.config['LOGIN_DISABLED'] = True
+    return app.test_client()
+
+
+def create(client, payload):
+    response = client.post('/api/procedures', json=payload)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def names(client):
+    collection = client.get(f'{URL}.geojson').get_json()
+    return sorted(f['properties']['name'] for f in collection['features']
+                  if f['properties']['layer'] == 'procedures')
+
+
+def test_tile_is_cached_with_an_etag(client):
+    create(client, procedure_payload('sid'))
+
+    first = client.get(f'{URL}.mvt')
+    second = client.get(f'{URL}.mvt', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.status_code == 200
+    assert first.mimetype == 'application/vnd.mapbox-vector-tile'
+    assert first.headers['X-Tile-Cache'] == 'miss'
+    assert first.cache_control.no_cache and first.cache_control.private
+    assert second.status_code == 304
+    assert second.headers['X-Tile-Cache'] == 'hit'
+
+
+def test_formats_are_cached_separately(client):
+    create(client, procedure_payload('sid'))
+    client.get(f'{URL}.mvt')
+
+    geojson = client.get(f'{URL}.geojson')
+    assert geojson.headers['X-Tile-Cache'] == 'miss'
+    assert geojson.mimetype == 'application/geo+json'
+    assert names(client) == ['SID 0']
+
+
+def test_created_procedure_appears_on_cached_tiles(client):
+    create(client, procedure_payload('sid'))
+    etag = client.get(f'{URL}.mvt').headers['ETag']
+    assert names(client) == ['SID 0']
+
+    create(client, procedure_payload('short_approach'))
+
+    assert names(client) == ['SHORT_APPROACH 0', 'SID 0']
+    assert client.get(f'{URL}.mvt', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_updated_procedure_is_redrawn(client):
+    procedure_id = create(client, procedure_payload('sid'))
+    assert names(client) == ['SID 0']
+
+    client.put(f'/api/procedures/{procedure_id}', json={'name': 'RENAMED'})
+    assert names(client) == ['RENAMED']
+
+    # Moved far away: the old area is invalidated as well as the new one
+    payload = procedure_payload('sid')
+    for waypoint in payload['waypoints']:
+        waypoint['latitude'] -= 20.0
+    client.put(f'/api/procedures/{procedure_id}', json={'waypoints': payload['waypoints']})
+    assert names(client) == []
+
+
+def test_deleted_procedure_is_removed_from_cached_tiles(client):
+    create(client, procedure_payload('sid'))
+    procedure_id = create(client, procedure_payload('short_approach'))
+    assert names(client) == ['SHORT_APPROACH 0', 'SID 0']
+
+    assert client.delete(f'/api/procedures/{procedure_id}').status_code == 200
+    assert names(client) == ['SID 0']
+
+
+def test_tiles_away_from_the_change_stay_cached(client):
+    far = f'/tiles/procedures/{Z}/{(X + 100) % 2 ** Z}/{Y}.mvt'
+    client.get(far)
+
+    create(client, procedure_payload('sid'))
+
+    assert client.get(far).headers['X-Tile-Cache'] == 'hit'
+
+
+def test_clear_drops_every_tile(client):
+    client.get(f'{URL}.mvt')
+    client.get(f'{URL}.geojson')
+
+    assert procedure_tiles.clear() == 2
+    assert client.get(f'{URL}.mvt').headers['X-Tile-Cache'] == 'miss'
+
+
+def test_tiles_out_of_range_are_not_found(client):
+    assert client.get('/tiles/procedures/19/0/0.mvt').status_code == 404
+    assert client.get(f'/tiles/procedures/{Z}/{2 ** Z}/0.mvt').status_code == 404
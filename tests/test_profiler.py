@@ -0,0 +1,67 @@
+import os
+
+import pytest
+from flask import Flask
+
+from afpd.utils.profiler import PROFILE_HEADER, RequestProfiler
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(PROFILER_TOKEN='secret', PROFILER_DIR=str(tmp_path / 'profiles'),
+                      PROFILER_MIN_INTERVAL=0.0)
+    profiler = RequestProfiler(app)
+
+    @app.route('/procedures/<int:id>/work')
+    @profiler.profiled
+    def work(id):
+        return {'id': id}
+
+    @app.route('/work')
+    @profiler.profiled
+    def work_any():
+        return {}
+
+    return app
+
+
+@pytest.mark.parametrize('supplied', [None, 'wrong', 'sécret', 'é'])
+def test_requests_without_the_token_are_not_profiled(app, supplied):
+    headers = {PROFILE_HEADER: supplied} if supplied else {}
+    response = app.test_client().get('/procedures/7/work', headers=headers)
+
+    assert response.status_code == 200
+    assert PROFILE_HEADER not in response.headers
+    assert not os.path.exists(app.config['PROFILER_DIR'])
+
+
+def test_non_ascii_query_token_is_refused(app):
+    response = app.test_client().get('/work', query_string={'profile': 'é'})
+
+    assert response.status_code == 200
+    assert PROFILE_HEADER not in response.headers
+
+
+def test_profile_is_filed_under_the_procedure_id(app):
+    response = app.test_client().get('/procedures/7/work', headers={PROFILE_HEADER: 'secret'})
+
+    saved = response.headers[PROFILE_HEADER]
+    assert saved.startswith(os.path.join('work', '7', ''))
+    assert saved.endswith('.collapsed')
+    assert os.path.isfile(os.path.join(app.config['PROFILER_DIR'], saved))
+
+
+@pytest.mark.parametrize('procedure_id', ['../../etc', '12abc', ''])
+def test_non_integer_procedure_ids_are_filed_under_none(app, procedure_id):
+    response = app.test_client().get('/work', query_string={'profile': 'secret', 'procedure_id': procedure_id})
+
+    assert response.headers[PROFILE_HEADER].startswith(os.path.join('work_any', 'none', ''))
+
+
+def test_profiles_are_rate_limited(app):
+    app.config['PROFILER_MIN_INTERVAL'] = 60.0
+    client = app.test_client()
+
+    assert client.get('/work', headers={PROFILE_HEADER: 'secret'}).headers[PROFILE_HEADER].endswith('.collapsed')
+    assert client.get('/work', headers={PROFILE_HEADER: 'secret'}).headers[PROFILE_HEADER] == 'rate-limited'
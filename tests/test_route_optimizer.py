@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import pytest
+
+from afpd import db
+from afpd.models.flight_procedure import FlightProcedure, NavigationType, ProcedureType, Waypoint
+from afpd.utils.route_optimizer import CostGrid, CostGridCache, RouteOptimizer
+from afpd.utils.synthetic import StubElevationProvider, StubTerrainAnalyzer
+from afpd.validation.icao_validator import ICAOValidator
+
+START = (45.0, 6.0)
+END = (45.3, 6.4)
+
+
+class CountingProvider(StubElevationProvider):
+    """Stub terrain counting the points it is asked for"""
+
+    points = 0
+
+    def fetch(self, lats, lons):
+        self.points += len(lats)
+        return super().fetch(lats, lons)
+
+
+@pytest.fixture
+def provider():
+    return CountingProvider()
+
+
+@pytest.fixture
+def analyzer(provider):
+    return StubTerrainAnalyzer(provider)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CostGridCache()
+    cache.directory = str(tmp_path / 'route_grids')
+    return cache
+
+
+@pytest.fixture
+def optimizer(analyzer, cache):
+    return RouteOptimizer(analyzer, ICAOValidator(), cache=cache)
+
+
+@pytest.mark.parametrize('procedure_type', [ProcedureType.SID, ProcedureType.STAR])
+def test_candidates_respect_turn_and_leg_limits(optimizer, procedure_type):
+    result = optimizer.optimize(START, END, procedure_type)
+
+    assert result['status'] == 'success'
+    max_turn = optimizer.validator.max_turn_angle[procedure_type]
+    for candidate in result['candidates']:
+        assert candidate['waypoints'][0]['latitude'] == START[0]
+        assert candidate['waypoints'][-1]['longitude'] == END[1]
+        assert all(angle <= max_turn + 1e-6 for angle in candidate['turn_angles'])
+        assert all(leg >= optimizer.min_leg_nm - 1e-6 for leg in candidate['leg_distances'])
+        assert not candidate['violations']['critical']
+
+
+def test_longer_minimum_leg_is_enforced(analyzer, cache):
+    optimizer = RouteOptimizer(analyzer, ICAOValidator(), cache=cache, min_leg_nm=6.0)
+    result = optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0, 4.0))
+
+    assert result['candidates']
+    for candidate in result['candidates']:
+        assert min(candidate['leg_distances']) >= 6.0 - 1e-6
+
+
+def test_grid_is_cached_on_the_second_call(optimizer, provider, cache):
+    first = optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))
+    sampled = provider.points
+    second = optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))
+
+    assert not first['grid']['cached']
+    assert second['grid']['cached']
+    assert provider.points == sampled
+    assert len(os.listdir(cache.directory)) == 1
+
+    # A fresh process finds the grid on disk
+    cache.clear()
+    assert optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))['grid']['cached']
+    assert provider.points == sampled
+
+
+def test_oversized_cached_grid_is_not_used(optimizer, analyzer, cache):
+    # An airport-wide grid, as precomputed without a cell cap
+    airport = (43.0, 4.0, 47.0, 8.0)
+    big, _ = cache.get(airport, optimizer.cell_nm, analyzer.elevation_resolver)
+    assert big.shape[0] * big.shape[1] > optimizer.max_cells
+
+    result = optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))
+
+    assert result['status'] == 'success'
+    assert not result['grid']['cached']
+    assert result['grid']['shape'][0] * result['grid']['shape'][1] <= optimizer.max_cells
+
+
+def test_containing_grid_within_the_cap_is_reused(optimizer, analyzer, cache):
+    cache.get((44.5, 5.5, 45.75, 7.0), optimizer.cell_nm, analyzer.elevation_resolver)
+
+    result = optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))
+
+    assert result['grid']['cached']
+    assert result['grid']['bounds'] == (44.5, 5.5, 45.75, 7.0)
+
+
+def test_search_region_limits(optimizer, analyzer, cache):
+    assert optimizer.optimize(START, (48.0, 6.0), ProcedureType.SID)['status'] == 'error'
+
+    fine = RouteOptimizer(analyzer, ICAOValidator(), cache=cache, cell_nm=0.25)
+    result = fine.optimize(START, END, ProcedureType.SID)
+    assert result['status'] == 'error'
+    assert 'cells' in result['message']
+
+
+def test_invalidate_bbox_drops_grids_over_the_box(optimizer, cache):
+    optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))
+
+    assert cache.invalidate_bbox(50.0, 10.0, 51.0, 11.0) == 0
+    assert cache.invalidate_bbox(45.1, 6.1, 45.2, 6.2) == 1
+    assert os.listdir(cache.directory) == []
+    assert not optimizer.optimize(START, END, ProcedureType.SID, terrain_weights=(0.0,))['grid']['cached']
+
+
+def test_minimum_safe_altitudes_take_the_highest_neighbour():
+    elevations = np.zeros((5, 5))
+    elevations[2, 2] = 3000.0
+    grid = CostGrid((45.0, 6.0, 45.1, 6.1), 1.0, elevations)
+
+    msa = grid.minimum_safe_altitudes(1000.0, radius_cells=1)
+
+    assert (msa[1:4, 1:4] == 4000.0).all()
+    assert msa[0, 0] == 1000.0
+
+
+def test_route_grid_command_skips_oversized_airports(make_app):
+    app = make_app(ELEVATION_API_URL='')
+    with app.app_context():
+        db.create_all()
+        result = _route_grid(app)
+        db.session.remove()
+        db.drop_all()
+
+    assert result.exit_code == 0, result.output
+    assert 'LSMALL: ' in result.output and 'computed' in result.output
+    assert 'LLARGE: ' in result.output and 'exceeds 2000 cells, skipped' in result.output
+
+
+def _route_grid(app):
+    for icao, span_degrees in (('LSMALL', 0.2), ('LLARGE', 3.0)):
+        procedure = FlightProcedure(name=icao, airport_icao=icao, procedure_type=ProcedureType.SID,
+                                    navigation_type=NavigationType.RNAV)
+        procedure.waypoints = [Waypoint(name='A', latitude=45.0, longitude=6.0, sequence=1),
+                               Waypoint(name='B', latitude=45.0 + span_degrees, longitude=6.0, sequence=2)]
+        db.session.add(procedure)
+    db.session.commit()
+
+    return app.test_cli_runner().invoke(args=['afpd', 'route-grid', 'LSMALL', 'LLARGE', '--margin-nm', '5',
+                                              '--max-cells', '2000'])
@@ -0,0 +1,107 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from afpd import db
+from afpd.models.flight_procedure import FlightProcedure
+from afpd.models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from afpd.utils.synthetic import make_procedure, procedure_payload
+
+DIGEST_SCRIPT = '''
+from afpd.models.snapshot import ProcedureSnapshot
+from afpd.utils.synthetic import procedure_payload
+print(ProcedureSnapshot.from_dict(procedure_payload('sid', seed=4)).digest)
+'''
+
+
+def snapshot(shape='sid', seed=4, **changes):
+    payload = procedure_payload(shape, seed=seed)
+    payload.update(changes)
+    return ProcedureSnapshot.from_dict(payload)
+
+
+def test_pickle_round_trip_keeps_content_and_digest():
+    original = snapshot(minimum_altitude=2000)
+    copy = pickle.loads(pickle.dumps(original))
+
+    assert copy == original
+    assert copy.digest == original.digest
+    assert hash(copy) == hash(original)
+    assert copy.waypoints[3].as_tuple() == original.waypoints[3].as_tuple()
+    assert [view.tolist() for view in copy.coordinates()] == [view.tolist() for view in original.coordinates()]
+
+
+def test_waypoint_snapshot_pickles_on_its_own():
+    waypoint = WaypointSnapshot(1, 'WP1', 45.0, 6.0, 1, 3000, 210, True)
+
+    assert pickle.loads(pickle.dumps(waypoint)).as_tuple() == waypoint.as_tuple()
+
+
+def test_digest_ignores_identity_fields():
+    original = snapshot()
+    renamed = ProcedureSnapshot(99, 'OTHER', 'EGLL', original.procedure_type, original.navigation_type,
+                                waypoints=original.waypoints)
+
+    assert renamed.digest == original.digest
+    assert renamed != original
+
+
+@pytest.mark.parametrize('change', [
+    {'minimum_altitude': 2000},
+    {'procedure_type': 'STAR'},
+    {'navigation_type': 'RNP'},
+])
+def test_digest_follows_procedure_inputs(change):
+    assert snapshot(**change).digest != snapshot().digest
+
+
+@pytest.mark.parametrize('field, value', [
+    ('altitude_constraint', 9990),
+    ('speed_constraint', 180),
+    ('fly_over', True),
+    ('latitude', 45.5),
+])
+def test_digest_follows_waypoint_inputs(field, value):
+    payload = procedure_payload('sid', seed=4)
+    payload['waypoints'][2][field] = value
+
+    assert ProcedureSnapshot.from_dict(payload).digest != snapshot().digest
+
+
+def test_digest_is_stable_across_processes():
+    root = os.path.join(os.path.dirname(__file__), '..', 'src')
+    env = dict(os.environ, PYTHONHASHSEED='123', PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-c', DIGEST_SCRIPT], env=env, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert output.strip() == snapshot().digest
+
+
+def test_snapshots_are_immutable():
+    procedure = snapshot()
+
+    with pytest.raises(AttributeError):
+        procedure.name = 'OTHER'
+    with pytest.raises(AttributeError):
+        procedure.waypoints[0].altitude_constraint = 0
+    with pytest.raises(ValueError):
+        procedure.coordinates()[2][0] = 0.0
+
+
+def test_orm_and_payload_snapshots_agree():
+    assert ProcedureSnapshot.from_procedure(make_procedure('sid', seed=4)) == snapshot()
+
+
+def test_load_matches_the_stored_procedure(app):
+    procedure = make_procedure('star_50', seed=2)
+    procedure.minimum_altitude = 1500
+    db.session.add(procedure)
+    db.session.commit()
+
+    loaded = ProcedureSnapshot.load(procedure.id)
+    assert loaded == ProcedureSnapshot.from_procedure(procedure)
+    assert [w.sequence for w in loaded.waypoints] == list(range(1, 51))
+    assert ProcedureSnapshot.load_many(FlightProcedure.id == procedure.id + 1) == []
@@ -0,0 +1,143 @@
+import os
+
+import pytest
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from afpd import db
+from afpd.models.flight_procedure import FlightProcedure, NavigationType, ProcedureType, Waypoint
+from afpd.utils import spatial_index
+
+# A dedicated, disposable PostGIS database: its tables are dropped
+POSTGRES_URL = os.getenv('AFPD_TEST_POSTGRES_URL')
+
+
+@pytest.fixture(params=['sqlite', 'sqlite-plain', 'postgresql'])
+def backend(request, make_app):
+    """App context on each spatial backend: R*Tree, plain range queries and PostGIS"""
+    if request.param == 'postgresql':
+        if not POSTGRES_URL:
+            pytest.skip('set AFPD_TEST_POSTGRES_URL to a PostGIS database')
+        pytest.importorskip('psycopg2')
+        app = make_app(POSTGRES_URL)
+    else:
+        app = make_app()
+
+    with app.app_context():
+        if request.param == 'postgresql':
+            try:
+                db.session.execute(text('CREATE EXTENSION IF NOT EXISTS postgis'))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                pytest.skip(f'PostGIS unavailable: {e}')
+        db.drop_all()
+        db.create_all()
+        if request.param == 'sqlite-plain':
+            db.session.execute(text('DROP TABLE waypoint_rtree'))
+            db.session.execute(text('DROP TABLE leg_rtree'))
+            db.session.commit()
+        yield request.param
+        db.session.remove()
+        db.drop_all()
+
+
+def add_procedure(name, points):
+    procedure = FlightProcedure(name=name, airport_icao='TEST', procedure_type=ProcedureType.SID,
+                                navigation_type=NavigationType.RNAV)
+    for sequence, (latitude, longitude) in enumerate(points, start=1):
+        procedure.waypoints.append(Waypoint(name=f'{name[:3]}{sequence}', latitude=latitude,
+                                            longitude=longitude, sequence=sequence))
+    db.session.add(procedure)
+    db.session.commit()
+    return procedure.id
+
+
+@pytest.fixture
+def procedures(backend):
+    return {
+        'east': add_procedure('EAST', [(45.0, 6.0), (45.0, 6.5)]),
+        'north': add_procedure('NORTH', [(46.0, 7.0), (46.5, 7.0)]),
+        'far': add_procedure('FAR', [(10.0, 10.0), (10.1, 10.0)])
+    }
+
+
+def test_index_matches_backend(backend):
+    connection = db.session.connection()
+    assert spatial_index.has_rtree(connection) == (backend == 'sqlite')
+    assert spatial_index.has_postgis(connection) == (backend == 'postgresql')
+
+
+def test_bbox_finds_legs_crossing_the_box(procedures):
+    # No waypoint of EAST lies inside; its leg crosses the box
+    matches = spatial_index.query_bbox(44.9, 6.2, 45.1, 6.3)
+    assert [m['id'] for m in matches] == [procedures['east']]
+    assert matches[0]['waypoints'] == []
+    assert len(matches[0]['legs']) == 1
+    assert spatial_index.procedure_ids_in_bbox(44.9, 6.2, 45.1, 6.3) == {procedures['east']}
+
+
+def test_bbox_finds_waypoints(procedures):
+    matches = spatial_index.query_bbox(46.4, 6.9, 46.6, 7.1)
+    assert [m['id'] for m in matches] == [procedures['north']]
+    assert [w['name'] for w in matches[0]['waypoints']] == ['NOR2']
+
+
+def test_radius_measures_distance_to_legs(procedures):
+    # 0.1 degree of latitude north of the EAST leg: 6 NM
+    matches = spatial_index.query_radius(45.1, 6.25, 10)
+    assert [m['id'] for m in matches] == [procedures['east']]
+    assert matches[0]['distance_nm'] == pytest.approx(6.0, rel=0.01)
+    assert spatial_index.query_radius(45.1, 6.25, 5) == []
+
+
+def test_radius_orders_nearest_first(procedures):
+    matches = spatial_index.query_radius(45.6, 6.8, 60)
+    assert [m['id'] for m in matches] == [procedures['north'], procedures['east']]
+
+
+def test_corridor(procedures):
+    # North-south path crossing the EAST leg, well west of NORTH
+    path = [(44.5, 6.25), (45.5, 6.25)]
+    matches = spatial_index.query_corridor(path, 1.0)
+    assert [m['id'] for m in matches] == [procedures['east']]
+    assert matches[0]['distance_nm'] == pytest.approx(0.0, abs=0.01)
+
+
+def test_moved_waypoint_is_reindexed(procedures):
+    waypoint = Waypoint.query.filter_by(procedure_id=procedures['far'], sequence=1).one()
+    waypoint.latitude, waypoint.longitude = 45.05, 6.25
+    db.session.commit()
+
+    matches = spatial_index.query_bbox(44.95, 6.2, 45.1, 6.3)
+    assert {m['id'] for m in matches} == {procedures['east'], procedures['far']}
+    assert spatial_index.query_bbox(9.9, 9.9, 10.05, 10.1) == []
+
+
+@pytest.fixture
+def client(procedures):
+    current_app.config['LOGIN_DISABLED'] = True
+    return current_app.test_client()
+
+
+def test_limit_truncates_results(client):
+    response = client.get('/api/spatial/radius', query_string={'lat': 45.6, 'lon': 6.8, 'radius_nm': 60, 'limit': 1})
+    assert response.status_code == 200
+    assert response.get_json()['count'] == 1
+
+    response = client.post('/api/spatial/corridor', json={
+        'path': [{'latitude': 44.0, 'longitude': 6.25}, {'latitude': 47.0, 'longitude': 6.25}],
+        'half_width_nm': 60, 'limit': 1
+    })
+    assert response.get_json()['count'] == 1
+
+
+@pytest.mark.parametrize('limit', ['0', '-1', '10001', 'many'])
+def test_invalid_limit_is_rejected(client, limit):
+    bbox = {'min_lat': 44, 'min_lon': 5, 'max_lat': 47, 'max_lon': 8, 'limit': limit}
+    assert client.get('/api/spatial/bbox', query_string=bbox).status_code == 400
+    radius = {'lat': 45.6, 'lon': 6.8, 'limit': limit}
+    assert client.get('/api/spatial/radius', query_string=radius).status_code == 400
+    corridor = {'path': [{'latitude': 44.0, 'longitude': 6.25}, {'latitude': 47.0, 'longitude': 6.25}],
+                'limit': limit}
+    assert client.post('/api/spatial/corridor', json=corridor).status_code == 400
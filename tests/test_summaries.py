@@ -0,0 +1,104 @@
+import math
+
+import pytest
+
+from afpd import db
+from afpd.models.flight_procedure import ProcedureSummary
+from afpd.models.snapshot import ProcedureSnapshot
+from afpd.utils import summaries
+from afpd.utils.synthetic import procedure_payload
+
+
+@pytest.fixture
+def client(app):
+    app.config['LOGIN_DISABLED'] = True
+    return app.test_client()
+
+
+def close_pair_payload():
+    """A valid approach whose last leg is too short: a ``leg_distance`` warning"""
+    payload = procedure_payload('short_approach', seed=1)
+    first, before, last = payload['waypoints'][-3:]
+    # 1.5 NM further along the previous leg, without a turn or an altitude change
+    scale = 1.5 / 60 / math.hypot(before['latitude'] - first['latitude'],
+                                  (before['longitude'] - first['longitude']) * math.cos(math.radians(45)))
+    last['latitude'] = before['latitude'] + (before['latitude'] - first['latitude']) * scale
+    last['longitude'] = before['longitude'] + (before['longitude'] - first['longitude']) * scale
+    last['altitude_constraint'] = None
+    return payload
+
+
+def create(client, payload):
+    response = client.post('/api/procedures', json=payload)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def summary(procedure_id):
+    db.session.expire_all()
+    return db.session.get(ProcedureSummary, procedure_id)
+
+
+def test_summary_is_written_on_create(client):
+    payload = procedure_payload('sid', seed=2)
+    procedure_id = create(client, payload)
+
+    row = summary(procedure_id)
+    assert row.waypoint_count == len(payload['waypoints'])
+    assert row.leg_count == len(payload['waypoints']) - 1
+    assert row.total_distance > 0
+    assert row.validation_status == 'valid'
+    assert row.digest == ProcedureSnapshot.load(procedure_id).digest
+
+
+def test_summary_follows_update(client):
+    procedure_id = create(client, procedure_payload('short_approach', seed=1))
+    summaries.record_msa(db.session.connection(), ProcedureSnapshot.load(procedure_id), 4200.0)
+    db.session.commit()
+
+    # A new name keeps the geometry, and so the MSA
+    client.put(f'/api/procedures/{procedure_id}', json={'name': 'RENAMED'})
+    assert summary(procedure_id).max_msa == 4200.0
+
+    response = client.put(f'/api/procedures/{procedure_id}', json={'waypoints': close_pair_payload()['waypoints']})
+    assert response.status_code == 200
+    row = summary(procedure_id)
+    assert row.validation_status == 'warnings'
+    assert row.warning_count == 1
+    assert row.max_msa is None
+
+
+def test_summary_is_removed_on_delete(client):
+    procedure_id = create(client, procedure_payload('short_approach'))
+
+    assert client.delete(f'/api/procedures/{procedure_id}').status_code == 200
+    assert summary(procedure_id) is None
+
+
+def test_record_msa_ignores_changed_geometry(client):
+    procedure_id = create(client, procedure_payload('short_approach'))
+    stale = ProcedureSnapshot.load(procedure_id)
+    client.put(f'/api/procedures/{procedure_id}', json={'waypoints': close_pair_payload()['waypoints']})
+
+    assert not summaries.record_msa(db.session.connection(), stale, 4200.0)
+    assert summary(procedure_id).max_msa is None
+
+
+@pytest.mark.parametrize('config, status', [
+    ({}, 'warnings'),
+    ({'ICAO_DISABLED_RULES': ['leg_distance']}, 'valid'),
+])
+def test_listing_status_matches_validate_endpoint(make_app, config, status):
+    app = make_app(LOGIN_DISABLED=True, **config)
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        procedure_id = create(client, close_pair_payload())
+
+        listed = client.get('/api/procedures').get_json()
+        validated = client.get(f'/api/procedures/{procedure_id}/validate').get_json()
+        db.session.remove()
+        db.drop_all()
+
+    assert [p['validation_status'] for p in listed] == [status]
+    assert bool(validated['violations']['warnings']) == (status == 'warnings')
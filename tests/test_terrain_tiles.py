@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+from afpd import db
+from afpd.utils.map_tiles import tile_at, tile_bounds
+from afpd.utils.terrain_tiles import terrain_tiles
+
+Z = 10
+X, Y = tile_at(45.5, 6.5, Z)
+URL = f'/tiles/terrain/{Z}/{X}/{Y}.png'
+
+
+@pytest.fixture
+def dem_dir(tmp_path):
+    """One-tile DEM store: N45E006 sloping up to the east"""
+    directory = tmp_path / 'dem'
+    directory.mkdir()
+    np.save(directory / 'N45E006.npy', np.tile(np.arange(0, 1100, 10, dtype=np.int16), (111, 1)))
+    with open(directory / 'manifest.json', 'w') as f:
+        json.dump({'tile_degrees': 1.0, 'units': 'm', 'tiles': {'N45E006': {}}}, f)
+    return str(directory)
+
+
+@pytest.fixture
+def client(make_app, dem_dir):
+    app = make_app(DEM_HIGHRES_DIR=dem_dir, ELEVATION_API_URL='', LOGIN_DISABLED=True)
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def test_tile_is_rendered_once_then_served_from_the_cache(client):
+    first = client.get(URL)
+    second = client.get(URL)
+
+    assert first.status_code == second.status_code == 200
+    assert first.mimetype == 'image/png'
+    assert first.data.startswith(b'\x89PNG')
+    assert first.headers['X-Tile-Cache'] == 'miss'
+    assert second.headers['X-Tile-Cache'] == 'hit'
+    assert second.data == first.data
+    assert first.cache_control.private and first.cache_control.max_age == 86400
+
+
+def test_etag_answers_conditional_requests(client):
+    etag = client.get(URL).headers['ETag']
+
+    revalidated = client.get(URL, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert client.get(URL, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_styles_have_their_own_tiles(client):
+    hillshade = client.get(URL)
+    tint = client.get(URL, query_string={'style': 'tint'})
+
+    assert tint.headers['X-Tile-Cache'] == 'miss'
+    assert tint.headers['ETag'] != hillshade.headers['ETag']
+    assert client.get(URL, query_string={'style': 'relief'}).status_code == 400
+
+
+@pytest.mark.parametrize('url', ['/tiles/terrain/17/0/0.png', f'/tiles/terrain/{Z}/{2 ** Z}/0.png'])
+def test_tiles_out_of_range_are_not_found(client, url):
+    assert client.get(url).status_code == 404
+
+
+def test_invalidation_drops_the_tiles_over_a_box(client):
+    client.get(URL)
+    client.get(URL, query_string={'style': 'tint'})
+
+    assert terrain_tiles.invalidate_bbox(10.0, 10.0, 11.0, 11.0) == 0
+    assert client.get(URL).headers['X-Tile-Cache'] == 'hit'
+    assert terrain_tiles.invalidate_bbox(*tile_bounds(Z, X, Y)) == 2
+    assert client.get(URL).headers['X-Tile-Cache'] == 'miss'
+
+
+def test_changed_dem_tiles_invalidate_the_map_tiles(client):
+    client.get(URL)
+
+    response = client.post('/api/impact', json={'tiles': ['N45E006']})
+
+    assert response.status_code == 200, response.get_json()
+    assert client.get(URL).headers['X-Tile-Cache'] == 'miss'
+
+
+def test_without_local_dem_there_are_no_tiles(make_app):
+    app = make_app(ELEVATION_API_URL='', LOGIN_DISABLED=True)
+    with app.app_context():
+        assert app.test_client().get(URL).status_code == 404
@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import pytest
+
+from afpd.models.flight_procedure import NavigationType, ProcedureType
+from afpd.models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from afpd.utils.track import ARC_POINTS, TrackGenerator
+
+
+def build(headings, leg_nm=10.0, speed=None, procedure_type=ProcedureType.STAR):
+    """Legs of ``leg_nm`` flown on ``headings`` from 45N 6E"""
+    lat, lon = 45.0, 6.0
+    points = [(lat, lon)]
+    for heading in headings:
+        lat += leg_nm / 60 * math.cos(math.radians(heading))
+        lon += leg_nm / 60 * math.sin(math.radians(heading)) / math.cos(math.radians(lat))
+        points.append((lat, lon))
+    return ProcedureSnapshot(1, 'TEST', 'LFLB', procedure_type, NavigationType.RNAV, waypoints=[
+        WaypointSnapshot(i, f'WP{i}', lat, lon, i + 1, None, speed)
+        for i, (lat, lon) in enumerate(points)
+    ])
+
+
+def radius(speed, bank):
+    """PANS-OPS turn radius (NM): rate of turn for the bank angle, at most 3°/s"""
+    rate = min(3431 * math.tan(math.radians(bank)) / (math.pi * speed), 3.0)
+    return speed / (20 * math.pi * rate)
+
+
+def projected_legs(generator, procedure):
+    """Leg lengths and track change at the middle fix, in the generator's own projection"""
+    _, px, py = generator._local_xy(procedure)
+    legs = np.hypot(np.diff(px), np.diff(py))
+    headings = np.arctan2(np.diff(px), np.diff(py))
+    change = abs((headings[1] - headings[0] + math.pi) % (2 * math.pi) - math.pi)
+    return legs, change
+
+
+@pytest.mark.parametrize('turn', [20, 60, 90, 120])
+@pytest.mark.parametrize('speed', [180, 250])
+def test_fly_by_track_length_matches_the_analytic_arc(turn, speed):
+    generator = TrackGenerator()
+    procedure = build([0, turn], speed=speed)
+    legs, change = projected_legs(generator, procedure)
+    r = radius(speed, generator.bank_angle['STAR'])
+
+    track = generator.build(procedure)
+
+    # Both legs cut short by the anticipation distance, joined by an arc
+    anticipation = r * math.tan(change / 2)
+    assert track.turns[0]['radius'] == pytest.approx(r)
+    assert track.turns[0]['anticipation'] == pytest.approx(anticipation)
+    # The arc is drawn as a polyline of ARC_POINTS vertices; its chords
+    # approach r * change as vertices are added
+    chords = ARC_POINTS - 1
+    arc = 2 * r * chords * math.sin(change / (2 * chords))
+    assert arc == pytest.approx(r * change, rel=2e-3)
+    assert track.length == pytest.approx(legs.sum() - 2 * anticipation + arc, rel=1e-9)
+    # The fix is abeam the middle of the arc
+    assert track.waypoint_distances[1] == pytest.approx(legs[0] - anticipation + arc / 2, rel=1e-9)
+
+
+def test_middle_of_the_fly_by_arc_passes_inside_the_fix():
+    generator = TrackGenerator()
+    procedure = build([0, 90], speed=250)
+    _, change = projected_legs(generator, procedure)
+    r = radius(250, generator.bank_angle['STAR'])
+
+    track = generator.build(procedure)
+    _, px, py = generator._local_xy(procedure)
+    vertex = track.waypoint_distances[1] == track.distances
+    miss = math.hypot(track.x[vertex][0] - px[1], track.y[vertex][0] - py[1])
+
+    assert miss == pytest.approx(r * (1 / math.cos(change / 2) - 1), rel=1e-6)
+
+
+def test_straight_track_has_no_turn_to_fly():
+    procedure = build([0, 0])
+    track = TrackGenerator().build(procedure)
+    legs, _ = projected_legs(TrackGenerator(), procedure)
+
+    assert track.turns[0]['anticipation'] == pytest.approx(0.0, abs=1e-12)
+    assert track.length == pytest.approx(legs.sum())
+    assert track.leg_distances == pytest.approx(legs.tolist())
+
+
+def test_turns_that_do_not_fit_are_tightened():
+    # 1 NM legs cannot hold the anticipation of two 90° turns at 250 kt
+    generator = TrackGenerator()
+    track = generator.build(build([0, 90, 180], leg_nm=1.0, speed=250))
+    r = radius(250, generator.bank_angle['STAR'])
+
+    assert all(turn['reduced'] for turn in track.turns)
+    assert all(turn['radius'] < r for turn in track.turns)
+    assert track.leg_required[1] > track.leg_lengths[1]
@@ -0,0 +1,190 @@
+import math
+
+import pytest
+
+from afpd.models.flight_procedure import NavigationType, ProcedureType
+from afpd.models.snapshot import ProcedureSnapshot, WaypointSnapshot
+from afpd.utils.synthetic import PROCEDURE_SHAPES, procedure_payload
+from afpd.validation.icao_validator import ICAOValidator
+from afpd.validation.rules import RULES, compile_rules
+
+
+def build(procedure_type, legs, altitudes=None, fly_over=(), sequences=None):
+    """Snapshot starting at 45N 6E and flying ``legs`` of (heading, NM); waypoints are WP0, WP1, ..."""
+    lat, lon = 45.0, 6.0
+    points = [(lat, lon)]
+    for heading, length in legs:
+        lat += length / 60 * math.cos(math.radians(heading))
+        lon += length / 60 * math.sin(math.radians(heading)) / math.cos(math.radians(lat))
+        points.append((lat, lon))
+    altitudes = altitudes or [None] * len(points)
+    sequences = sequences or range(1, len(points) + 1)
+    return ProcedureSnapshot(1, 'TEST', 'LFLB', procedure_type, NavigationType.RNAV, waypoints=[
+        WaypointSnapshot(i, f'WP{i}', lat, lon, sequence, altitude, None, i in fly_over)
+        for i, ((lat, lon), altitude, sequence) in enumerate(zip(points, altitudes, sequences))
+    ])
+
+
+def baseline_messages(validator, procedure):
+    """The checks as the validator wrote them before they became rules, in the same order"""
+    violations = {'critical': [], 'warnings': []}
+    waypoints = procedure.waypoints
+    legs = list(zip(waypoints, waypoints[1:]))
+
+    for current, next_wp in legs:
+        if current.sequence >= next_wp.sequence:
+            violations['critical'].append(f'Invalid waypoint sequence between {current.name} and {next_wp.name}')
+        lat1, lon1 = math.radians(current.latitude), math.radians(current.longitude)
+        lat2, lon2 = math.radians(next_wp.latitude), math.radians(next_wp.longitude)
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        distance = 3440 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        if distance < 2:
+            violations['warnings'].append(
+                f'Waypoints {current.name} and {next_wp.name} are too close ({distance:.1f} NM)'
+            )
+
+    def bearing(wp1, wp2):
+        lat1, lon1 = math.radians(wp1.latitude), math.radians(wp1.longitude)
+        lat2, lon2 = math.radians(wp2.latitude), math.radians(wp2.longitude)
+        return math.atan2(math.sin(lon2 - lon1) * math.cos(lat2),
+                          math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1))
+
+    max_angle = validator.max_turn_angle[procedure.procedure_type]
+    for wp1, wp2, wp3 in zip(waypoints, waypoints[1:], waypoints[2:]):
+        angle = math.degrees(abs(bearing(wp2, wp3) - bearing(wp1, wp2)))
+        angle = min(angle, 360 - angle)
+        if angle > max_angle:
+            violations['critical'].append(
+                f'Turn angle between {wp2.name} exceeds maximum ({angle:.1f}° > {max_angle}°)'
+            )
+
+    track = validator.track_generator.build(procedure)
+    for i, (length, required) in enumerate(zip(track.leg_lengths, track.leg_required)):
+        if required > length:
+            violations['warnings'].append(
+                f'Leg {waypoints[i].name}-{waypoints[i + 1].name} ({length:.1f} NM) is shorter '
+                f'than the turns at its ends need ({required:.1f} NM)'
+            )
+    for turn in track.turns:
+        if not turn['feasible']:
+            violations['critical'].append(
+                f"Fly-over turn at {turn['waypoint_name']} cannot reach the next waypoint "
+                f"(turn radius {turn['radius']:.1f} NM)"
+            )
+
+    max_gradient = validator.max_gradient[procedure.procedure_type]
+    for (current, next_wp), distance in zip(legs, track.leg_distances):
+        if current.altitude_constraint and next_wp.altitude_constraint:
+            gradient = abs(next_wp.altitude_constraint - current.altitude_constraint) / (distance * 6076) * 100
+            if gradient > max_gradient:
+                violations['critical'].append(
+                    f'Gradient between {current.name} and {next_wp.name} '
+                    f'exceeds maximum ({gradient:.1f}% > {max_gradient}%)'
+                )
+    return violations
+
+
+# One procedure per rule that breaks it, with the message the rule must produce
+CASES = {
+    'waypoint_sequence': (
+        build(ProcedureType.APPROACH, [(0, 5), (0, 5)], sequences=[1, 3, 2]),
+        'critical', 'Invalid waypoint sequence between WP1 and WP2'
+    ),
+    'leg_distance': (
+        build(ProcedureType.APPROACH, [(0, 5), (0, 1.5)]),
+        'warnings', 'Waypoints WP1 and WP2 are too close (1.5 NM)'
+    ),
+    'turn_angle': (
+        build(ProcedureType.STAR, [(0, 8), (100, 8)]),
+        'critical', 'Turn angle between WP1 exceeds maximum (99.9° > 90°)'
+    ),
+    'turn_leg_length': (
+        build(ProcedureType.SID, [(0, 5), (80, 2.5), (0, 5)]),
+        'warnings', 'Leg WP1-WP2 (2.5 NM) is shorter than the turns at its ends need (5.7 NM)'
+    ),
+    'fly_over_turn': (
+        build(ProcedureType.SID, [(0, 5), (110, 3), (110, 5)], fly_over={1}),
+        'critical', 'Fly-over turn at WP1 cannot reach the next waypoint (turn radius 3.4 NM)'
+    ),
+    'gradient': (
+        build(ProcedureType.APPROACH, [(0, 5), (0, 5)], altitudes=[6000, 3000, 2500]),
+        'critical', 'Gradient between WP0 and WP1 exceeds maximum (9.9% > 5.2%)'
+    ),
+}
+
+
+@pytest.fixture(scope='module')
+def validator():
+    return ICAOValidator()
+
+
+def test_every_rule_has_a_case():
+    assert set(CASES) == set(RULES)
+
+
+@pytest.mark.parametrize('rule', list(CASES))
+def test_rule_reports_baseline_message(validator, rule):
+    procedure, severity, message = CASES[rule]
+    result = validator.validate_procedure(procedure)
+
+    assert message in result[severity]
+    assert result == baseline_messages(validator, procedure)
+
+
+@pytest.mark.parametrize('rule', list(CASES))
+def test_rule_alone_reports_only_its_message(rule):
+    procedure, severity, message = CASES[rule]
+    validator = ICAOValidator(disabled_rules=set(RULES) - {rule})
+    result = validator.validate_procedure(procedure)
+
+    assert result[severity] == [message]
+    assert sum(len(messages) for messages in result.values()) == 1
+
+
+@pytest.mark.parametrize('shape', list(PROCEDURE_SHAPES))
+def test_valid_procedures_match_baseline(validator, shape):
+    procedure = ProcedureSnapshot.from_dict(procedure_payload(shape, seed=3))
+    result = validator.validate_procedure(procedure)
+
+    assert result == {'critical': [], 'warnings': []}
+    assert result == baseline_messages(validator, procedure)
+
+
+def test_several_violations_keep_baseline_order(validator):
+    procedure = build(ProcedureType.STAR, [(0, 1.5), (100, 6), (-20, 4)], altitudes=[9000, None, 9000, 3000],
+                      sequences=[1, 2, 2, 4], fly_over={2})
+    result = validator.validate_procedure(procedure)
+
+    assert len(result['critical']) + len(result['warnings']) > 3
+    assert result == baseline_messages(validator, procedure)
+
+
+def test_disabled_rule_is_skipped():
+    procedure, _, message = CASES['turn_angle']
+    result = ICAOValidator(disabled_rules=['turn_angle']).validate_procedure(procedure)
+
+    assert message not in result['critical']
+
+
+def test_severity_override_moves_message():
+    procedure, _, message = CASES['gradient']
+    result = ICAOValidator(rule_severity={'gradient': 'warning'}).validate_procedure(procedure)
+
+    assert message in result['warnings']
+    assert message not in result['critical']
+
+
+def test_too_few_waypoints(validator):
+    result = validator.validate_procedure(build(ProcedureType.SID, []))
+
+    assert result == {'critical': ['Procedure must have at least 2 waypoints'], 'warnings': []}
+
+
+@pytest.mark.parametrize('disabled, severity', [
+    (['no_such_rule'], None),
+    ((), {'no_such_rule': 'warning'}),
+    ((), {'gradient': 'fatal'}),
+])
+def test_compile_rules_rejects_unknown_settings(disabled, severity):
+    with pytest.raises(ValueError):
+        compile_rules(disabled, severity)
@@ -0,0 +1,71 @@
+import pytest
+
+from afpd.models.snapshot import ProcedureSnapshot
+from afpd.utils.synthetic import PROCEDURE_SHAPES, StubTerrainAnalyzer, procedure_payload
+from afpd.utils.vertical_profile import VerticalProfileOptimizer
+from afpd.validation.icao_validator import ICAOValidator
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return StubTerrainAnalyzer()
+
+
+@pytest.fixture(scope='module')
+def validator():
+    return ICAOValidator()
+
+
+@pytest.fixture(scope='module')
+def optimizer(analyzer, validator):
+    return VerticalProfileOptimizer(analyzer, validator)
+
+
+def with_altitudes(payload, altitudes):
+    for waypoint, altitude in zip(payload['waypoints'], altitudes):
+        waypoint['altitude_constraint'] = altitude
+    return ProcedureSnapshot.from_dict(payload)
+
+
+def suggested(result):
+    return [s['suggested_altitude'] for s in result['suggestions']]
+
+
+@pytest.mark.parametrize('round_to', [0, 100, 500])
+@pytest.mark.parametrize('shape', sorted(PROCEDURE_SHAPES))
+def test_suggested_profile_validates_and_clears_terrain(optimizer, analyzer, validator, shape, round_to):
+    payload = procedure_payload(shape, seed=3)
+    result = optimizer.suggest(ProcedureSnapshot.from_dict(payload), round_to=round_to)
+    assert result['status'] == 'success'
+    assert result['feasible']
+
+    altitudes = suggested(result)
+    if round_to:
+        assert all(altitude % round_to == 0 for altitude in altitudes)
+    procedure = with_altitudes(payload, altitudes)
+    violations = validator.validate_procedure(procedure)
+    assert not [message for message in violations['critical'] if 'Gradient' in message]
+    analysis = analyzer.analyze_procedure(procedure)['analysis']
+    assert analysis['violations'] == [] and analysis['warnings'] == []
+
+
+def test_terrain_limited_waypoints_sit_on_their_floor(optimizer):
+    result = optimizer.suggest(ProcedureSnapshot.from_dict(procedure_payload('sid')), round_to=0)
+
+    for suggestion in result['suggestions']:
+        assert suggestion['suggested_altitude'] >= suggestion['terrain_floor']
+        if suggestion['limited_by'] == 'terrain':
+            assert suggestion['suggested_altitude'] == pytest.approx(suggestion['terrain_floor'])
+
+
+def test_minimum_and_maximum_altitudes(optimizer):
+    payload = procedure_payload('short_approach')
+    payload['minimum_altitude'] = 20000
+    result = optimizer.suggest(ProcedureSnapshot.from_dict(payload))
+
+    assert set(suggested(result)) == {20000.0}
+    assert {s['limited_by'] for s in result['suggestions']} == {'minimum_altitude'}
+
+    payload['minimum_altitude'] = None
+    payload['maximum_altitude'] = 1000
+    assert not optimizer.suggest(ProcedureSnapshot.from_dict(payload))['feasible']